@@ -1,19 +1,41 @@
-# ETL Meta DLT Pipeline
+# Log Meta DLT Pipeline
 #
-# Pipe ETL Meta Data to Delta Lake Table
+# Stream Log Meta Data from the Stage Delta Table to Delta Lake Table
+#
+# The Change Data Feed of the stage table is read as a stream, so each pipeline update
+# only processes the commits made since the previous update. The stage task replaces the
+# partitions of its window on every run; rewritten rows arrive as a delete and an insert
+# of the same commit, and are applied to the target by the stage key, inserts last.
 
-from spark_solutions.common import spark_config
+from pyspark.sql import functions as F
 
-import datetime
 import dlt
 import os
 
 # ENV Variables
 INPUT_DIR = os.getenv('INPUT_DIR')
 
+# Stage Key, the GROUP BY columns of the stage task
+KEYS = [
+    'etl_id', 'msg_id', 'level', 'timestamp', 'name', 'log_message'
+]
+
 # COMMAND ----------
 
-@dlt.create_table(
+@dlt.view(comment='Datasim Log Meta Data Changes')
+def stage__log_meta__changes():
+    return (
+        spark.readStream
+            .format('delta')
+            .option('readChangeFeed', 'true')
+            .load(f'{INPUT_DIR}/stage/log_meta')
+            .where("_change_type != 'update_preimage'")
+    )
+
+# COMMAND ----------
+
+dlt.create_streaming_table(
+    name='stage__log_meta',
     comment='Datasim Log Meta Data',
     table_properties={
         'myCompanyPipeline.quality': 'bronze',
@@ -21,12 +43,12 @@ INPUT_DIR = os.getenv('INPUT_DIR')
     },
     partition_cols=['year', 'month', 'day']
 )
-def stage__log_meta(d0=datetime.datetime.today(), d1=datetime.datetime.today() - datetime.timedelta(1)):
-    sc = spark_config()
-    delta_paths = [
-        f'{INPUT_DIR}/stage/log_meta/year={d0.year}/month={d0.month:02d}/day={d0.day:02d}',
-        f'{INPUT_DIR}/stage/log_meta/year={d1.year}/month={d1.month:02d}/day={d1.day:02d}'
-    ]
-    return (
-        sc.read.parquet(*delta_paths)
-    )
\ No newline at end of file
+
+dlt.apply_changes(
+    target='stage__log_meta',
+    source='stage__log_meta__changes',
+    keys=KEYS,
+    sequence_by=F.struct('_commit_version', (F.col('_change_type') != 'delete').alias('_upsert')),
+    apply_as_deletes=F.expr("_change_type = 'delete'"),
+    except_column_list=['_change_type', '_commit_version', '_commit_timestamp']
+)
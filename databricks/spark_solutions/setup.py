@@ -30,11 +30,25 @@ LOCAL_REQUIREMENTS = [
     "azure-identity==1.15.0"
 ]
 
+# packages for the Spark-free readers of the output tables
+READER_REQUIREMENTS = [
+    "pyarrow>=14",
+]
+
+# packages for the embedded local execution backend of small windows
+LOCAL_BACKEND_REQUIREMENTS = [
+    "duckdb>=1.1",
+    "sqlglot>=25",
+    "deltalake>=0.18",
+    "pyarrow>=14",
+]
+
 TEST_REQUIREMENTS = [
     # development & testing tools
     "pytest",
     "coverage[toml]",
     "pytest-cov",
+    "pytest-xdist",
     "dbx>=0.8",
     "google-cloud-secret-manager==2.16.4",
 ]
@@ -42,9 +56,10 @@ TEST_REQUIREMENTS = [
 setup(
     name="spark_solutions",
     packages=find_packages(exclude=["tests", "tests.*"]),
+    package_data={"spark_solutions": ["conf/*.yml", "conf/tasks/*.yml", "conf/io/*.yml"]},
     setup_requires=["setuptools","wheel"],
     install_requires=PACKAGE_REQUIREMENTS,
-    extras_require={"local": LOCAL_REQUIREMENTS, "test": TEST_REQUIREMENTS},
+    extras_require={"local": LOCAL_REQUIREMENTS, "reader": READER_REQUIREMENTS, "local_backend": LOCAL_BACKEND_REQUIREMENTS, "test": TEST_REQUIREMENTS},
     entry_points = {
         "console_scripts": [
             "stage_buffer_meta = spark_solutions.tasks.stage.buffer_meta:entrypoint",
@@ -53,7 +68,20 @@ setup(
             "stage_lib_server_game = spark_solutions.tasks.stage.lib_server_game:entrypoint",
             "stage_lib_server_lobby = spark_solutions.tasks.stage.lib_server_lobby:entrypoint",
             "output_game_metrics = spark_solutions.tasks.output.game_metrics:entrypoint",
-            "output_message_flow = spark_solutions.tasks.output.message_flow:entrypoint"
+            "output_message_flow = spark_solutions.tasks.output.message_flow:entrypoint",
+            "output_game_metrics_incremental = spark_solutions.tasks.output.game_metrics:incremental_entrypoint",
+            "output_message_flow_incremental = spark_solutions.tasks.output.message_flow:incremental_entrypoint",
+            "output_game_metrics_preview = spark_solutions.tasks.output.game_metrics:preview_entrypoint",
+            "output_message_flow_preview = spark_solutions.tasks.output.message_flow:preview_entrypoint",
+            "output_message_latency = spark_solutions.tasks.output.message_latency:entrypoint",
+            "output_user_day_rollup = spark_solutions.tasks.output.user_day_rollup:entrypoint",
+            "output_pipeline = spark_solutions.tasks.output.pipeline:entrypoint",
+            "backfill = spark_solutions.tasks.backfill:entrypoint",
+            "delta_maintenance = spark_solutions.tasks.maintenance:entrypoint",
+            "validate_raw = spark_solutions.common.raw_validator:entrypoint",
+            "warm_spark_artifacts = spark_solutions.common.spark_artifacts:entrypoint",
+            "profile_diff = spark_solutions.common.spark_profile:diff_entrypoint",
+            "io_benchmark = spark_solutions.common.spark_io:entrypoint"
     ]},
     version=__version__,
     description="Data Simulator Spark ETL Examples",
@@ -0,0 +1,824 @@
+""" Local Execution Backend
+
+Runs the stage and output task SQL on an embedded DuckDB engine instead of Spark.
+
+Most daily windows are a few megabytes, where starting a JVM and a SparkSession costs far
+more than the query. When EXECUTION_BACKEND opts in, the task entry points run the same
+TRANSFORM_SQL in process:
+
+- Raw `standard` day directories are read with DuckDB's Parquet reader, and stage or
+  output Delta tables with the Arrow `DeltaReader`, pruned to the window.
+- The Spark SQL is translated to DuckDB with sqlglot; INPUT_FILE_NAME() becomes the file
+  name column of the Parquet reader.
+- Results are conformed to the Spark types of the existing table and written with
+  `deltalake`, replacing the same partitions as the Spark loads: the stage window with
+  `replaceWhere`, and the days present in the result for outputs.
+- Stage EXPECTATIONS are evaluated like `ExpectationSuite`, quarantining failing rows and
+  appending the results to `dq_meta`.
+
+EXECUTION_BACKEND defaults to 'spark'. 'local' forces the local backend, and 'auto' picks it
+when its packages are installed and the input of the window is below LOCAL_BACKEND_MAX_BYTES.
+No SparkSession or JVM is started then. The local backend mirrors the Spark loads rather than
+sharing them, so it is meant for development and small deployments that opt in. The Arrow
+readers, `fsspec` and the RAW ledger are imported by the functions using them, so the Spark
+tasks importing `select_backend` don't depend on pyarrow.
+"""
+
+from spark_solutions.readers.bloom_index import BLOOM_INDEX_FPP, BloomFilter, index_path
+from spark_solutions.readers.token_dictionary import TOKEN_COLUMNS, TOKEN_DICTIONARY_TABLE, TokenCollisionError
+from spark_solutions.readers.etl_manifest import candidate_files, late_files, manifest_path
+from spark_solutions.common.spark_quality import DQ_ENABLED, DataQualityError
+from spark_solutions.common.spark_misc import CHANGE_DATA_FEED_ENABLED, date_partition_filter, date_range
+from spark_solutions.common.spark_bloom import BLOOM_INDEX_ENABLED
+from spark_solutions.common.spark_manifest import ETL_MANIFEST_ENABLED, late_dates
+from spark_solutions.common.spark_preview import PREVIEW_META_TABLE, PREVIEW_SAMPLE_RATE, estimate_sql, log_estimates, sample_predicate, weighted_sql
+from urllib.parse import unquote
+
+import datetime
+import logging
+import time
+import uuid
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+EXECUTION_BACKEND=os.getenv('EXECUTION_BACKEND', 'spark').lower()
+LOCAL_BACKEND_MAX_BYTES=int(os.getenv('LOCAL_BACKEND_MAX_BYTES', str(256 * 1024**2)))
+LOCAL_BACKEND_THREADS=int(os.getenv('LOCAL_BACKEND_THREADS', str(os.cpu_count() or 4)))
+
+assert(EXECUTION_BACKEND in ('auto', 'spark', 'local'))
+
+PARTITION_COLUMNS = ['year', 'month', 'day']
+INPUT_FILE_COLUMN = '_input_file_name'
+
+def available():
+    """
+    Whether the packages of the local backend are installed.
+
+    Returns:
+    - bool: True if duckdb, sqlglot, deltalake and pyarrow can be imported.
+    """
+    try:
+        import duckdb, sqlglot, deltalake, pyarrow
+        return True
+    except ImportError:
+        return False
+
+def translate(sql):
+    """
+    Translates Spark SQL to DuckDB SQL.
+
+    INPUT_FILE_NAME() is replaced by the file name column of the raw Parquet reader,
+    UNIX_TIMESTAMP(x) by the epoch seconds of x cast to a timestamp, as the stage tables
+    hold timestamps as either strings or timestamps, and hexadecimal CONV(x, 16, 10) by
+    a cast of the hexadecimal literal.
+
+    Parameters:
+    - sql (str): The Spark SQL query.
+
+    Returns:
+    - str: The DuckDB SQL query.
+    """
+    import sqlglot
+    from sqlglot import exp
+
+    default_format = sqlglot.parse_one('UNIX_TIMESTAMP(x)', read='spark').args.get('format')
+
+    def rewrite(node):
+        if isinstance(node, exp.Anonymous) and node.name.upper() == 'INPUT_FILE_NAME':
+            return exp.column(INPUT_FILE_COLUMN)
+        if isinstance(node, exp.Anonymous) and node.name.upper() == 'CONV' and [e.sql() for e in node.expressions[1:]] == ['16', '10']:
+            return exp.cast(exp.cast(exp.DPipe(this=exp.Literal.string('0x'), expression=node.expressions[0]), 'BIGINT'), 'VARCHAR')
+        if isinstance(node, exp.StrToUnix) and node.args.get('format') == default_format:
+            return exp.cast(exp.func('EPOCH', exp.cast(node.this, 'TIMESTAMP')), 'BIGINT')
+        return node
+
+    return sqlglot.parse_one(sql, read='spark').transform(rewrite).sql('duckdb')
+
+def _day_dirs(path, d0, d1):
+    """Returns the raw day directories of a date range."""
+    return [f'{path}/{d.year}/{d.month:02d}/{d.day:02d}' for d in date_range(d0, d1)]
+
+def _raw_files(fs, path, d0, d1):
+    """Returns the data files, with their sizes, of the raw day directories of a date range."""
+    files = {}
+    for p in _day_dirs(path, d0, d1):
+        if not fs.exists(p):
+            continue
+        for f, info in fs.find(p, detail=True).items():
+            if not os.path.basename(f).startswith(('_', '.')):
+                files[fs.unstrip_protocol(f) if '://' in path else f] = info.get('size') or 0
+
+    return files
+
+def _delta_files(path, d0, d1, storage_options=None):
+    """Returns the add actions of a Delta table within a date range, or None if it doesn't exist."""
+    from spark_solutions.readers.delta_reader import DeltaReader
+    import fsspec
+
+    fs, root = fsspec.core.url_to_fs(path, **(storage_options or {}))
+    if not fs.exists(f'{root.rstrip("/")}/_delta_log'):
+        return None
+
+    return DeltaReader(path, storage_options, refresh_seconds=0).files(d0, d1)
+
+def input_bytes(raw_paths=(), delta_paths=(), d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), storage_options=None):
+    """
+    Measures the input of a window from storage listings and Delta logs, without reading data.
+
+    Parameters:
+    - raw_paths (list): The raw table paths, with one directory per day.
+    - delta_paths (list): The partitioned Delta table paths.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    - storage_options (dict): The fsspec storage options (default: None).
+
+    Returns:
+    - int: The bytes of the files read by the window.
+    """
+    import fsspec
+
+    total = 0
+    for path in raw_paths:
+        fs, _ = fsspec.core.url_to_fs(path, **(storage_options or {}))
+        total += sum(_raw_files(fs, path, d0, d1).values())
+
+    for path in delta_paths:
+        total += sum(add.get('size') or 0 for add in _delta_files(path, d0, d1, storage_options) or [])
+
+    return total
+
+def select_backend(raw_paths=(), delta_paths=(), d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), backend=EXECUTION_BACKEND, max_bytes=LOCAL_BACKEND_MAX_BYTES):
+    """
+    Selects the execution backend of a task window.
+
+    Parameters:
+    - raw_paths (list): The raw table paths read by the task.
+    - delta_paths (list): The Delta table paths read by the task.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    - backend (str): 'auto', 'spark' or 'local' (default: EXECUTION_BACKEND).
+    - max_bytes (int): The largest input run locally in 'auto' mode (default: LOCAL_BACKEND_MAX_BYTES).
+
+    Returns:
+    - str: 'spark' or 'local'.
+    """
+    if backend == 'spark':
+        return 'spark'
+
+    if not available():
+        if backend == 'local':
+            raise ImportError('EXECUTION_BACKEND is local but duckdb, sqlglot or deltalake is not installed')
+        return 'spark'
+
+    if backend == 'local':
+        return 'local'
+
+    try:
+        size = input_bytes(raw_paths, delta_paths, d0, d1)
+    except Exception as exc:
+        logger.warning(f'Execution Backend | Measuring Input Failed {exc}, Using Spark')
+        return 'spark'
+
+    selected = 'local' if size <= max_bytes else 'spark'
+    logger.info(f'Execution Backend | {size} Input Bytes | Threshold {max_bytes} | Using {selected}')
+    return selected
+
+def _arrow(relation):
+    """Returns the result of a DuckDB relation as an Arrow table."""
+    fetch = getattr(relation, 'to_arrow_table', None) or relation.fetch_arrow_table
+    return fetch()
+
+def _spark_types(table, types=None):
+    """
+    Conforms an Arrow table to the types Spark writes, or to the types of an existing table.
+
+    DuckDB sums are DECIMAL(38, 0), date parts BIGINT and timestamps timezone naive,
+    whereas the Spark tables hold LONG, INT and UTC timestamps.
+
+    Parameters:
+    - table (pyarrow.Table): The result.
+    - types (dict): The Delta type names of the existing table columns (default: None).
+
+    Returns:
+    - pyarrow.Table: The conformed table, in the column order of the existing table.
+    """
+    from spark_solutions.readers.delta_reader import _ARROW_TYPES
+    import pyarrow as pa
+
+    fields = []
+    for field in table.schema:
+        t = field.type
+        if types and types.get(field.name) in _ARROW_TYPES:
+            t = _ARROW_TYPES[types[field.name]]
+        elif pa.types.is_decimal(t) and t.scale == 0:
+            t = pa.int64()
+        elif pa.types.is_timestamp(t):
+            t = pa.timestamp('us', tz='UTC')
+        elif pa.types.is_large_string(t):
+            t = pa.string()
+        elif field.name in PARTITION_COLUMNS and pa.types.is_integer(t):
+            t = pa.int32()
+        fields.append(pa.field(field.name, t))
+
+    table = table.cast(pa.schema(fields))
+    if types and set(types) == set(table.column_names):
+        table = table.select(list(types))
+
+    return table
+
+class LocalBackend():
+    """
+    Runs task SQL on an embedded DuckDB connection over the Parquet & Delta layouts.
+
+    Attributes:
+    - con (duckdb.DuckDBPyConnection): The DuckDB connection holding the extracted tables.
+    - storage_options (dict): The storage options of fsspec and deltalake.
+
+    Methods:
+    - extract_raw(self, path, d0, d1): Registers the raw day directories of a window.
+    - extract_delta(self, path, d0, d1): Registers the partitions of a Delta table within a window.
+    - transform(self, sql): Runs Spark SQL over the registered tables.
+    - load(self, table, path, predicate): Replaces the partitions of a predicate in a Delta table.
+    - enable_change_data_feed(self, path): Enables the Change Data Feed of a Delta table.
+    - run_stage(...): Extracts, transforms, checks and loads a stage table.
+    - run_output(...): Extracts, transforms and loads an output table.
+    """
+
+    def __init__(self, storage_options=None, threads=LOCAL_BACKEND_THREADS):
+        """
+        Initializes the backend.
+
+        Parameters:
+        - storage_options (dict): The storage options of fsspec and deltalake (default: None).
+        - threads (int): The DuckDB threads (default: LOCAL_BACKEND_THREADS).
+        """
+        import duckdb
+
+        self.con = duckdb.connect()
+        self.con.execute(f'SET threads TO {int(threads)}')
+        self.con.execute("SET TimeZone = 'UTC'")
+        self.storage_options = storage_options
+
+    def extract_raw(self, path, d0, d1, files=None):
+        """
+        Registers the raw Parquet day directories of a window as a view named after the table.
+
+        Parameters:
+        - path (str): The raw table path.
+        - d0 (datetime.date): The end date of the date range.
+        - d1 (datetime.date): The start date of the date range.
+        - files (iterable): The data files of the window, e.g. from the RAW ledger (default: None, the day directories are listed).
+
+        Returns:
+        - bool: Whether any file was found.
+        """
+        import fsspec
+
+        fs, _ = fsspec.core.url_to_fs(path, **(self.storage_options or {}))
+        if '://' in path:
+            self.con.register_filesystem(fs)
+
+        files = sorted(files if files is not None else _raw_files(fs, path, d0, d1))
+        if not files:
+            logger.warning(f'Local Backend | No Files in {path} for {d1} - {d0}')
+            return False
+
+        name = os.path.split(path)[-1]
+        logger.info(f'Local Backend | Registering Table {name} | {len(files)} Files')
+        listing = ', '.join("'" + f.replace("'", "''") + "'" for f in files)
+        self.con.execute(f"CREATE OR REPLACE VIEW {name} AS SELECT * FROM read_parquet([{listing}], filename='{INPUT_FILE_COLUMN}', union_by_name=true)")
+        return True
+
+    def extract_delta(self, path, d0, d1, name=None):
+        """
+        Registers the partitions of a Delta table within a window, read with the Arrow DeltaReader.
+
+        Parameters:
+        - path (str): The Delta table path.
+        - d0 (datetime.date): The end date of the date range.
+        - d1 (datetime.date): The start date of the date range.
+        - name (str): The registered name (default: the table directory name).
+
+        Returns:
+        - pyarrow.Table or None: The extracted rows, or None if the table doesn't exist.
+        """
+        from spark_solutions.readers.delta_reader import DeltaReader
+
+        if _delta_files(path, d0, d1, self.storage_options) is None:
+            logger.warning(f'Local Backend | Delta Table {path} Not Found')
+            return None
+
+        table = DeltaReader(path, self.storage_options, refresh_seconds=0).read(d0, d1)
+        name = name or os.path.split(path)[-1]
+        logger.info(f'Local Backend | Registering Table {name} | {table.num_rows} Rows')
+        self.con.register(name, table)
+        return table
+
+    def transform(self, sql):
+        """
+        Runs a Spark SQL query over the registered tables.
+
+        Parameters:
+        - sql (str): The Spark SQL query.
+
+        Returns:
+        - pyarrow.Table: The result, without the raw file name column.
+        """
+        table = _arrow(self.con.sql(translate(sql)))
+        if INPUT_FILE_COLUMN in table.column_names:
+            table = table.drop_columns([INPUT_FILE_COLUMN])
+
+        return table
+
+    def _types(self, path):
+        """Returns the Delta type names of an existing table, or None."""
+        from spark_solutions.readers.delta_reader import DeltaReader
+
+        if _delta_files(path, None, None, self.storage_options) is None:
+            return None
+
+        return DeltaReader(path, self.storage_options, refresh_seconds=0).snapshot().types()
+
+    def load(self, table, path, predicate=None, mode='overwrite'):
+        """
+        Writes an Arrow table to a Delta table partitioned by `year`/`month`/`day`.
+
+        Parameters:
+        - table (pyarrow.Table): The rows to write.
+        - path (str): The Delta table path.
+        - predicate (str): The partitions replaced by an overwrite (default: None, the whole table).
+        - mode (str): 'overwrite' or 'append' (default: 'overwrite').
+        """
+        from deltalake import write_deltalake
+
+        types = self._types(path)
+        table = _spark_types(table, types)
+        partition_by = PARTITION_COLUMNS if set(PARTITION_COLUMNS).issubset(table.column_names) else None
+        kwargs = {'predicate': predicate} if types is not None and predicate and mode == 'overwrite' else {}
+        if types is not None:
+            kwargs['schema_mode'] = 'merge'
+
+        logger.info(f'Local Backend | Writing {table.num_rows} Rows to {path}')
+        write_deltalake(path, table, partition_by=partition_by, mode=mode, storage_options=self.storage_options, **kwargs)
+
+    def enable_change_data_feed(self, path):
+        """
+        Enables the Change Data Feed of a Delta table, like `spark_misc.enable_change_data_feed`.
+
+        Parameters:
+        - path (str): The Delta table path.
+        """
+        from deltalake import DeltaTable
+
+        if not CHANGE_DATA_FEED_ENABLED or self._types(path) is None:
+            return
+
+        dt = DeltaTable(path, storage_options=self.storage_options)
+        if dt.metadata().configuration.get('delta.enableChangeDataFeed') != 'true':
+            logger.info(f'Local Backend | Enabling Change Data Feed on {path}')
+            dt.alter.set_table_properties({'delta.enableChangeDataFeed': 'true'})
+
+    def build_bloom_index(self, table_name, columns, base_dir, d0, d1, fpp=BLOOM_INDEX_FPP):
+        """
+        Builds the Bloom filters of the data files of a stage table's window, like `spark_bloom.build_bloom_index`.
+
+        Parameters:
+        - table_name (str): The stage table name.
+        - columns (list): The indexed columns.
+        - base_dir (str): The stage directory.
+        - d0 (datetime.date): The end date of the date range.
+        - d1 (datetime.date): The start date of the date range.
+        - fpp (float): The false positive probability of the filters (default: BLOOM_INDEX_FPP).
+        """
+        import pyarrow as pa
+
+        path = os.path.join(base_dir, table_name)
+        files = _delta_files(path, d0, d1, self.storage_options)
+        if not BLOOM_INDEX_ENABLED or not columns or files is None:
+            return
+
+        records = []
+        for add in files:
+            file = unquote(add['path'])
+            values = self.con.execute(f"SELECT {', '.join(columns)} FROM read_parquet(?)", [f'{path.rstrip("/")}/{file}']).fetchall()
+            year, month, day = (add['partitionValues'].get(c) for c in PARTITION_COLUMNS)
+            for i, column in enumerate(columns):
+                present = [v[i] for v in values if v[i] is not None]
+                bloom = BloomFilter.for_capacity(len(present), fpp)
+                for v in present:
+                    bloom.add(v)
+                records.append({
+                    'table_name': table_name, 'column_name': column, 'path': file, 'num_rows': len(present),
+                    'num_bits': bloom.num_bits, 'num_hashes': bloom.num_hashes, 'bits': bytes(bloom.bits),
+                    'year': year, 'month': month, 'day': day
+                })
+
+        if records:
+            logger.info(f'Local Backend | Building {table_name} Bloom Index on {columns} | {len(files)} Files')
+            predicate = f"table_name = '{table_name}' AND ({date_partition_filter(date_range(d0, d1))})"
+            schema = pa.schema([
+                ('table_name', pa.string()), ('column_name', pa.string()), ('path', pa.string()), ('num_rows', pa.int64()),
+                ('num_bits', pa.int64()), ('num_hashes', pa.int32()), ('bits', pa.binary()),
+                ('year', pa.string()), ('month', pa.string()), ('day', pa.string())
+            ])
+            self.load(pa.Table.from_pylist(records, schema=schema), index_path(path), predicate)
+
+    def build_etl_manifest(self, table_name, base_dir, d0, d1):
+        """
+        Builds the manifest rows of the data files of a stage table's window, like `spark_manifest.build_etl_manifest`.
+
+        Parameters:
+        - table_name (str): The stage table name.
+        - base_dir (str): The stage directory.
+        - d0 (datetime.date): The end date of the date range.
+        - d1 (datetime.date): The start date of the date range.
+        """
+        import pyarrow as pa
+
+        path = os.path.join(base_dir, table_name)
+        files = _delta_files(path, d0, d1, self.storage_options)
+        if not ETL_MANIFEST_ENABLED or files is None:
+            return
+
+        records = []
+        for add in files:
+            file = unquote(add['path'])
+            names = self.con.execute('SELECT name FROM parquet_schema(?)', [f'{path.rstrip("/")}/{file}']).fetchall()
+            if ('etl_id',) not in names:
+                return
+
+            msg_id = 'CAST(msg_id AS VARCHAR)' if ('msg_id',) in names else 'CAST(NULL AS VARCHAR)'
+            year, month, day = (add['partitionValues'].get(c) for c in PARTITION_COLUMNS)
+            for etl_id, num_rows, min_msg_id, max_msg_id in self.con.execute(
+                f'SELECT etl_id, COUNT(*), MIN({msg_id}), MAX({msg_id}) FROM read_parquet(?) GROUP BY etl_id', [f'{path.rstrip("/")}/{file}']
+            ).fetchall():
+                records.append({
+                    'table_name': table_name, 'etl_id': etl_id, 'path': file, 'num_rows': num_rows,
+                    'min_msg_id': min_msg_id, 'max_msg_id': max_msg_id, 'year': year, 'month': month, 'day': day
+                })
+
+        if records:
+            logger.info(f'Local Backend | Building {table_name} ETL Manifest | {len(files)} Files')
+            predicate = f"table_name = '{table_name}' AND ({date_partition_filter(date_range(d0, d1))})"
+            schema = pa.schema([
+                ('table_name', pa.string()), ('etl_id', pa.string()), ('path', pa.string()), ('num_rows', pa.int64()),
+                ('min_msg_id', pa.string()), ('max_msg_id', pa.string()),
+                ('year', pa.string()), ('month', pa.string()), ('day', pa.string())
+            ])
+            self.load(pa.Table.from_pylist(records, schema=schema), manifest_path(path), predicate)
+
+    def update_token_dictionary(self, table_name, columns, base_dir, d0, d1):
+        """
+        Merges the new tokens of a stage table's window into the token dictionary, like `spark_dictionary.update_token_dictionary`.
+
+        Parameters:
+        - table_name (str): The stage table name.
+        - columns (list): The token columns of the table, keys of TOKEN_COLUMNS.
+        - base_dir (str): The stage directory.
+        - d0 (datetime.date): The end date of the date range.
+        - d1 (datetime.date): The start date of the date range.
+
+        Raises:
+        - TokenCollisionError: If a token's id is taken by another token.
+        """
+        from deltalake import DeltaTable
+
+        if not columns or self.extract_delta(os.path.join(base_dir, table_name), d0, d1, name='_tokens_staged') is None:
+            return
+
+        union = ' UNION ALL '.join(
+            f"SELECT '{TOKEN_COLUMNS[c][1]}' token_type, {c} token, {TOKEN_COLUMNS[c][0]} token_id, year, month, day FROM _tokens_staged"
+            for c in columns
+        )
+        tokens = self.transform(f"""
+            SELECT token_type, token, token_id, CURRENT_TIMESTAMP() first_seen,
+                   MIN(STRUCT(year, month, day)).year year,
+                   MIN(STRUCT(year, month, day)).month month,
+                   MIN(STRUCT(year, month, day)).day day
+            FROM ({union})
+            WHERE token IS NOT NULL
+            GROUP BY token_type, token, token_id
+        """)
+
+        path = os.path.join(base_dir, TOKEN_DICTIONARY_TABLE)
+        known = self._types(path) is not None
+        self.con.register('_tokens_new', tokens)
+        if known:
+            self.con.register('_token_dictionary', DeltaTable(path, storage_options=self.storage_options).to_pyarrow_table(columns=['token_type', 'token_id', 'token']))
+
+        collisions = self.con.execute(f"""
+            SELECT COUNT(*) FROM (
+                SELECT token_type, token_id FROM (
+                    SELECT token_type, token_id, token FROM _tokens_new
+                    {'UNION SELECT token_type, token_id, token FROM _token_dictionary' if known else ''}
+                ) t
+                GROUP BY token_type, token_id
+                HAVING COUNT(*) > 1
+            ) c
+        """).fetchone()[0]
+        if collisions:
+            raise TokenCollisionError(f'{collisions} {table_name} Token Ids Shared by Several Tokens')
+
+        if not known:
+            self.load(tokens, path, mode='append')
+            return
+
+        logger.info(f'Local Backend | Updating Token Dictionary from {table_name} {columns} | {tokens.num_rows} Tokens')
+        DeltaTable(path, storage_options=self.storage_options) \
+            .merge(_spark_types(tokens, self._types(path)), 't.token_type = s.token_type AND t.token_id = s.token_id', source_alias='s', target_alias='t') \
+            .when_not_matched_insert_all() \
+            .execute()
+
+    def _check(self, table_name, staged, expectations, base_dir, d0, d1):
+        """
+        Evaluates stage expectations, mirroring `ExpectationSuite`.
+
+        Parameters:
+        - table_name (str): The stage table name.
+        - staged (pyarrow.Table): The staged rows.
+        - expectations (list): The Expectation objects.
+        - base_dir (str): The stage directory holding the referenced, quarantine and `dq_meta` tables.
+        - d0 (datetime.date): The end date of the stage window.
+        - d1 (datetime.date): The start date of the stage window.
+
+        Returns:
+        - tuple: The rows to write, the quarantined rows and the expectation results.
+        """
+        import pyarrow as pa
+
+        self.con.register('_dq_staged', staged)
+        joins, evaluable = [], []
+        for i, e in enumerate(expectations):
+            if e.reference is None:
+                evaluable.append((e, e.condition))
+                continue
+
+            column, table, ref_column = e.reference
+            if self.extract_delta(os.path.join(base_dir, table), d0, d1, name=f'_dq_ref_table_{i}') is None:
+                logger.warning(f'Data Quality | {table_name} | Skipping {e.name}, {table} Not Readable')
+                continue
+
+            joins.append(f'LEFT JOIN (SELECT DISTINCT {ref_column} AS _dq_ref_{i} FROM _dq_ref_table_{i}) r{i} ON s.{column} = r{i}._dq_ref_{i}')
+            evaluable.append((e, f'{column} IS NULL OR _dq_ref_{i} IS NOT NULL'))
+
+        columns = ', '.join(f's."{c}"' for c in staged.column_names)
+        flags = ', '.join(f'NOT COALESCE({translate(cond)}, FALSE) AS _dq_{i}' for i, (_, cond) in enumerate(evaluable))
+        failures = ', '.join(f"CASE WHEN _dq_{i} THEN '{e.name}' END" for i, (e, _) in enumerate(evaluable))
+        quarantine = ' OR '.join([f'_dq_{i}' for i, (e, _) in enumerate(evaluable) if e.quarantine] or ['FALSE'])
+        flagged = _arrow(self.con.sql(f"""
+            SELECT *, LIST_FILTER([{failures}], x -> x IS NOT NULL) _dq_failures, {quarantine} _dq_quarantine
+            FROM (SELECT {columns}, {flags} FROM _dq_staged s {' '.join(joins)})
+        """))
+        self.con.register('_dq_flagged', flagged)
+
+        names = ', '.join(f'"{c}"' for c in staged.column_names)
+        valid = _arrow(self.con.sql(f'SELECT {names} FROM _dq_flagged WHERE NOT _dq_quarantine'))
+        quarantined = _arrow(self.con.sql(f'SELECT {names}, _dq_failures, CURRENT_TIMESTAMP _dq_timestamp FROM _dq_flagged WHERE _dq_quarantine'))
+        counts = self.con.sql(f"SELECT COUNT(*), {', '.join(f'SUM(_dq_{i}::BIGINT)' for i in range(len(evaluable)))} FROM _dq_flagged").fetchone()
+
+        rows = counts[0] or 0
+        now = datetime.datetime.now(datetime.timezone.utc)
+        results = []
+        for i, (e, cond) in enumerate(evaluable):
+            failed = counts[i + 1] or 0
+            rate = failed / rows if rows else 0.0
+            results.append({
+                'table': table_name,
+                'expectation': e.name,
+                'condition': cond,
+                'rows': rows,
+                'failed_rows': failed,
+                'failure_rate': rate,
+                'max_failure_rate': float(e.max_failure_rate),
+                'passed': rate <= e.max_failure_rate,
+                'quarantine': e.quarantine,
+                'action': e.action,
+                'timestamp': now,
+                'year': f'{now.year}',
+                'month': f'{now.month:02d}',
+                'day': f'{now.day:02d}'
+            })
+
+        return valid, quarantined, pa.Table.from_pylist(results) if results else None
+
+    def run_stage(self, table_name, sql, expectations, input_path, base_dir, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), dq_enabled=DQ_ENABLED, index_columns=(), token_columns=(), raw_ledger=None):
+        """
+        Extracts, transforms, checks and loads a stage table, like the Spark stage tasks.
+
+        Parameters:
+        - table_name (str): The stage table name.
+        - sql (str): The task's TRANSFORM_SQL.
+        - expectations (list): The task's EXPECTATIONS.
+        - input_path (str): The raw table path.
+        - base_dir (str): The stage directory.
+        - d0 (datetime.date): The end date of the date range (default: today's date).
+        - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+        - dq_enabled (bool): Whether expectations are evaluated (default: DQ_ENABLED).
+        - index_columns (list): The columns of the table's Bloom index (default: (), none).
+        - token_columns (list): The token columns merged into the token dictionary (default: (), none).
+        - raw_ledger (bool): Whether the RAW files are read from the RAW ledger, narrowing the window to the days with new files (default: None, RAW_LEDGER_ENABLED).
+
+        Raises:
+        - DataQualityError: If an expectation with the 'fail' action isn't met.
+        """
+        from spark_solutions.common.raw_ledger import RAW_LEDGER_ENABLED, RAW_LEDGER_TABLE, RawLedger
+
+        t0, run_id = time.perf_counter(), str(uuid.uuid4())
+        ledger, files = None, None
+        if RAW_LEDGER_ENABLED if raw_ledger is None else raw_ledger:
+            ledger = RawLedger(table_name, input_path, base_dir, lambda t: self.load(t, os.path.join(base_dir, RAW_LEDGER_TABLE), mode='append'), self.storage_options)
+            window = ledger.pending(d0, d1)
+            if window is None:
+                return
+            d0, d1, files = window
+
+        self.extract_raw(input_path, d0, d1, files=ledger.sizes(files) if ledger else None)
+        staged = self.transform(sql)
+
+        predicate = date_partition_filter(date_range(d0, d1))
+        if not (dq_enabled and expectations):
+            self.load(staged, os.path.join(base_dir, table_name), predicate)
+            self.enable_change_data_feed(os.path.join(base_dir, table_name))
+            self.build_bloom_index(table_name, index_columns, base_dir, d0, d1)
+            self.update_token_dictionary(table_name, token_columns, base_dir, d0, d1)
+            self.build_etl_manifest(table_name, base_dir, d0, d1)
+            if ledger:
+                ledger.mark_processed(files, run_id)
+            logger.info(f'Local Backend | {table_name} | {staged.num_rows} Rows in {time.perf_counter() - t0:.2f}s')
+            return
+
+        valid, quarantined, results = self._check(table_name, staged, expectations, base_dir, d0, d1)
+        logger.info(f'ETL Pipeline | Load | Quarantining {quarantined.num_rows} {table_name} Rows Locally')
+        self.load(quarantined, os.path.join(base_dir, 'quarantine', table_name), predicate)
+
+        failed = []
+        if results is not None:
+            for r in results.to_pylist():
+                log = logger.info if r['passed'] else logger.warning
+                log(f'Data Quality | {table_name} | {r["expectation"]} | {r["failed_rows"]}/{r["rows"]} Failed ({r["failure_rate"]:.4%} <= {r["max_failure_rate"]:.4%}) | {"PASSED" if r["passed"] else "FAILED"}')
+                if not r['passed'] and r['action'] == 'fail':
+                    failed.append(r['expectation'])
+
+            self.load(results, os.path.join(base_dir, 'dq_meta'), mode='append')
+
+        # A failing expectation raises before the window is replaced
+        if failed:
+            raise DataQualityError(f'{table_name} failed expectations {failed}')
+
+        self.load(valid, os.path.join(base_dir, table_name), predicate)
+        self.enable_change_data_feed(os.path.join(base_dir, table_name))
+        self.build_bloom_index(table_name, index_columns, base_dir, d0, d1)
+        self.update_token_dictionary(table_name, token_columns, base_dir, d0, d1)
+        self.build_etl_manifest(table_name, base_dir, d0, d1)
+
+        logger.info(f'Local Backend | {table_name} | {valid.num_rows} Rows in {time.perf_counter() - t0:.2f}s')
+        if ledger:
+            ledger.mark_processed(files, run_id)
+
+    def run_output(self, table_name, sql, input_dir, input_tables, output_path, keys, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1)):
+        """
+        Extracts, transforms and loads an output table, like the Spark output tasks.
+
+        The days of the window are replaced and rows falling on other days are merged by key,
+        like `spark_misc.load_window`.
+
+        Parameters:
+        - table_name (str): The output table name.
+        - sql (str): The task's TRANSFORM_SQL.
+        - input_dir (str): The directory of the input Delta tables.
+        - input_tables (list): The task's INPUT_TABLES.
+        - output_path (str): The output table path.
+        - keys (list): The task's OUTPUT_KEYS.
+        - d0 (datetime.date): The end date of the date range (default: today's date).
+        - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+        """
+        t0 = time.perf_counter()
+        tables = {table: self.extract_delta(os.path.join(input_dir, table), d0, d1) for table in input_tables}
+        self._extract_late(input_dir, tables, d0, d1)
+
+        result = self.transform(sql)
+        self._load_window(result, output_path, keys, d0, d1)
+
+        logger.info(f'Local Backend | {table_name} | {result.num_rows} Rows in {time.perf_counter() - t0:.2f}s')
+
+    def _extract_late(self, input_dir, tables, d0, d1):
+        """
+        Adds the rows of the window's ETL runs that landed outside it, like `spark_manifest.extract_manifest_tables`.
+
+        Parameters:
+        - input_dir (str): The stage directory of the input Delta tables.
+        - tables (dict): The registered window rows of each input table, None if missing.
+        - d0 (datetime.date): The end date of the date range.
+        - d1 (datetime.date): The start date of the date range.
+        """
+        from spark_solutions.readers.delta_reader import DeltaReader
+        import pyarrow as pa
+
+        etl_path = os.path.join(input_dir, 'etl_meta')
+        dates = late_dates(d0, d1)
+        if not ETL_MANIFEST_ENABLED or not dates or self._types(etl_path) is None or self._types(manifest_path(etl_path)) is None:
+            return
+
+        etl_ids = sorted(set(DeltaReader(etl_path, self.storage_options, refresh_seconds=0).read(d0, d1, columns=['etl_id']).column('etl_id').to_pylist()) - {None})
+        manifest = DeltaReader(manifest_path(etl_path), self.storage_options, refresh_seconds=0)
+        rows = manifest.read(max(dates), min(dates), filters=[('etl_id', 'in', etl_ids)]).to_pylist() if etl_ids else []
+        window = {(f'{d.year}', f'{d.month:02d}', f'{d.day:02d}') for d in date_range(d0, d1)}
+
+        for table, window_rows in tables.items():
+            late = late_files([r for r in rows if r['table_name'] == table], window)
+            if table == 'etl_meta' or window_rows is None or not late:
+                continue
+
+            days = set(late.values())
+            indexed = [r['path'] for r in manifest.read(max(dates), min(dates), filters=[('table_name', '=', table)]).to_pylist() if (r['year'], r['month'], r['day']) in days]
+            reader = DeltaReader(os.path.join(input_dir, table), self.storage_options, refresh_seconds=0)
+            paths = [add['path'] for add in reader.files() if tuple(add['partitionValues'].get(c) for c in PARTITION_COLUMNS) in days]
+
+            candidates = candidate_files(paths, late, indexed)
+            logger.info(f'Local Backend | {table} | {len(candidates)} Late Files in {len(days)} Partitions')
+            if candidates:
+                late_rows = reader.read(filters=[('etl_id', 'in', etl_ids)], paths=candidates)
+                self.con.register(table, pa.concat_tables([window_rows, late_rows.select(window_rows.column_names)]))
+
+    def _load_window(self, result, output_path, keys, d0, d1):
+        """Replaces the window's days of an output result and merges its rows of other days by key."""
+        from deltalake import DeltaTable
+
+        self.con.register('_result', result)
+        window = date_partition_filter(date_range(d0, d1))
+        self.load(self.transform(f'SELECT * FROM _result WHERE {window}'), output_path, window)
+
+        late = self.transform(f"""
+            SELECT {', '.join(f'`{c}`' for c in result.column_names)} FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY {', '.join(keys)} ORDER BY year, month, day) _n
+                FROM _result
+                WHERE NOT COALESCE({window}, FALSE)
+            ) WHERE _n = 1
+        """)
+        if not late.num_rows:
+            return
+
+        days = {(r['year'], r['month'], r['day']) for r in late.select(PARTITION_COLUMNS).to_pylist()}
+        partitions = [date_partition_filter([datetime.date(int(y), int(m), int(d)) for y, m, d in days if y is not None], alias='t')]
+        if any(y is None for y, _, _ in days):
+            partitions.append('t.year IS NULL')
+
+        logger.info(f'Local Backend | Merging Rows of {len(days)} Days Outside the Window into {output_path}')
+        DeltaTable(output_path, storage_options=self.storage_options) \
+            .merge(_spark_types(late, self._types(output_path)), ' AND '.join([f't.{k} = s.{k}' for k in keys] + ['(' + ' OR '.join(p for p in partitions if p) + ')']), source_alias='s', target_alias='t') \
+            .when_matched_update_all() \
+            .when_not_matched_insert_all() \
+            .execute()
+
+    def _load_days(self, result, output_path):
+        """Replaces the days present in an output result, like Spark's dynamic partition overwrite."""
+        self.con.register('_result', result)
+        days = self.con.sql('SELECT DISTINCT year, month, day FROM _result WHERE year IS NOT NULL').fetchall()
+        if days:
+            predicate = date_partition_filter([datetime.date(int(y), int(m), int(d)) for y, m, d in days])
+            self.load(result, output_path, predicate)
+
+    def run_preview(self, table_name, sql, input_dir, input_tables, sampled, key, metrics, output_dir, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), rate=PREVIEW_SAMPLE_RATE):
+        """
+        Runs an output task over a sample of its keys, like `spark_preview`.
+
+        Parameters:
+        - table_name (str): The output table name.
+        - sql (str): The task's TRANSFORM_SQL.
+        - input_dir (str): The directory of the input Delta tables.
+        - input_tables (list): The task's INPUT_TABLES.
+        - sampled (dict): The key column of each sampled table; other tables are read whole.
+        - key (str): The sampled key column of the output.
+        - metrics (list): The additive metric columns.
+        - output_dir (str): The directory of the output tables.
+        - d0 (datetime.date): The end date of the date range (default: today's date).
+        - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+        - rate (float): The sample rate (default: PREVIEW_SAMPLE_RATE).
+
+        Returns:
+        - list: The estimate rows, as dictionaries.
+        """
+        import pyarrow as pa
+
+        t0 = time.perf_counter()
+        for table in input_tables:
+            if table not in sampled:
+                self.extract_delta(os.path.join(input_dir, table), d0, d1)
+            elif self.extract_delta(os.path.join(input_dir, table), d0, d1, name=f'_sampled_{table}') is not None:
+                self.con.execute(f'CREATE OR REPLACE VIEW {table} AS SELECT * FROM _sampled_{table} WHERE {translate(sample_predicate(sampled[table], rate))}')
+
+        self.con.register('_preview', self.transform(sql))
+        result = self.transform(weighted_sql('_preview', rate))
+        self._load_days(result, os.path.join(output_dir, f'{table_name}_preview'))
+
+        estimates = self.transform(estimate_sql('_preview', table_name, key, metrics, rate))
+        estimates = estimates.append_column('timestamp', pa.array([datetime.datetime.now(datetime.timezone.utc)] * estimates.num_rows, pa.timestamp('us', tz='UTC')))
+        if estimates.num_rows:
+            self.load(estimates, os.path.join(output_dir, PREVIEW_META_TABLE), mode='append')
+
+        rows = estimates.to_pylist()
+        log_estimates(rows)
+        logger.info(f'Local Backend | {table_name} Preview | {result.num_rows} Rows in {time.perf_counter() - t0:.2f}s')
+        return rows
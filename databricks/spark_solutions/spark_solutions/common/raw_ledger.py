@@ -0,0 +1,254 @@
+""" RAW File Ledger
+
+Persistent manifest of the landed RAW files and of the runs that processed them.
+
+Stage extracts used to list the day directories of their window on every run: Spark's
+file index, the local backend and the input sizing each list the same prefixes, one
+charged call per directory page on S3/GCS/ADLS. The `raw_ledger` Delta table next to the
+stage tables records every landed file once, with its size and row count from the
+Parquet footer, and every run that processed it:
+
+    table_name | path | size | num_rows | event ('landed' or 'processed') | run_id | timestamp | year | month | day
+
+Stage entry points read their file list from the ledger. Day directories of the last
+RAW_LEDGER_OPEN_DAYS days may still receive files and are listed (not recursively) for
+new files; older days already in the ledger are sealed and never listed again.
+
+Stage tables replace whole day partitions, so a run can't skip single files. A run
+narrows its window to the days holding files not processed yet, reads every file of
+those days from the ledger, and is skipped when nothing new landed. A file rewritten in
+place lands again with its new size. The ledger is append-only, so concurrent stage
+tasks never conflict on it.
+"""
+
+from spark_solutions.common.spark_misc import date_range
+from spark_solutions.readers.delta_reader import DeltaReader
+from concurrent.futures import ThreadPoolExecutor
+
+import pyarrow.parquet as pq
+import pyarrow as pa
+import datetime
+import logging
+import fsspec
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+RAW_LEDGER_ENABLED=os.getenv('RAW_LEDGER_ENABLED', 'true').lower() == 'true'
+RAW_LEDGER_OPEN_DAYS=int(os.getenv('RAW_LEDGER_OPEN_DAYS', '2'))
+RAW_LEDGER_THREADS=int(os.getenv('RAW_LEDGER_THREADS', '16'))
+
+RAW_LEDGER_TABLE = 'raw_ledger'
+
+RAW_LEDGER_SCHEMA = pa.schema([
+    ('table_name', pa.string()),
+    ('path', pa.string()),
+    ('size', pa.int64()),
+    ('num_rows', pa.int64()),
+    ('event', pa.string()),
+    ('run_id', pa.string()),
+    ('timestamp', pa.timestamp('us', tz='UTC')),
+    ('year', pa.string()),
+    ('month', pa.string()),
+    ('day', pa.string())
+])
+
+RAW_LEDGER_DDL = 'table_name STRING, path STRING, size BIGINT, num_rows BIGINT, event STRING, run_id STRING, timestamp TIMESTAMP, year STRING, month STRING, day STRING'
+
+class RawLedger():
+    """
+    The ledger of the landed files of a RAW table.
+
+    Attributes:
+    - table_name (str): The RAW table name.
+    - path (str): The RAW table path, with one directory per day.
+    - ledger_path (str): The `raw_ledger` table path.
+    - append (callable): Appends a pyarrow.Table of RAW_LEDGER_SCHEMA rows to the ledger.
+
+    Methods:
+    - files(self, d0, d1): Returns the landed files of a window, recording new ones.
+    - pending(self, d0, d1): Returns the window of the days with unprocessed files and their files.
+    - sizes(files): Returns the sizes of landed files by path.
+    - mark_processed(self, files, run_id): Records the files processed by a run.
+    """
+
+    def __init__(self, table_name, path, base_dir, append, storage_options=None, open_days=RAW_LEDGER_OPEN_DAYS):
+        """
+        Initializes the ledger.
+
+        Parameters:
+        - table_name (str): The RAW table name.
+        - path (str): The RAW table path.
+        - base_dir (str): The stage directory holding the ledger.
+        - append (callable): Appends a pyarrow.Table of RAW_LEDGER_SCHEMA rows to the ledger.
+        - storage_options (dict): The fsspec storage options (default: None).
+        - open_days (int): The days still listed for new files (default: RAW_LEDGER_OPEN_DAYS).
+        """
+        self.table_name = table_name
+        self.path = path.rstrip('/')
+        self.ledger_path = os.path.join(base_dir, RAW_LEDGER_TABLE)
+        self.append = append
+        self.storage_options = storage_options
+        self.open_days = open_days
+
+    def _read(self, d0, d1):
+        """Returns the ledger rows of the table within a window."""
+        try:
+            reader = DeltaReader(self.ledger_path, self.storage_options, refresh_seconds=0)
+            return reader.read(d0, d1, filters=[('table_name', '=', self.table_name)]).to_pylist()
+        except FileNotFoundError:
+            return []
+
+    def _list(self, fs, d):
+        """Returns the data files, with their sizes, of a day directory, without recursing."""
+        day = f'{self.path}/{d.year}/{d.month:02d}/{d.day:02d}'
+        try:
+            entries = fs.ls(day, detail=True)
+        except FileNotFoundError:
+            return {}
+
+        return {
+            fs.unstrip_protocol(e['name']) if '://' in self.path else e['name']: e.get('size') or 0
+            for e in entries
+            if e.get('type') == 'file' and not os.path.basename(e['name']).startswith(('_', '.'))
+        }
+
+    def files(self, d0, d1):
+        """
+        Returns the landed files of a window, recording the new files of its open days.
+
+        Parameters:
+        - d0 (datetime.date): The end date of the date range.
+        - d1 (datetime.date): The start date of the date range.
+
+        Returns:
+        - list: The latest 'landed' row of each file still in storage, with `processed` set if a run processed it.
+        """
+        rows = self._read(d0, d1)
+        landed, processed = {}, set()
+        for r in sorted(rows, key=lambda r: r['timestamp']):
+            if r['event'] == 'landed':
+                landed[r['path']] = r
+            else:
+                processed.add((r['path'], r['size']))
+
+        fs = None
+        known_days = {(r['year'], r['month'], r['day']) for r in landed.values()}
+        sealed = datetime.date.today() - datetime.timedelta(self.open_days)
+        new, listed, present = {}, set(), set()
+        for d in date_range(d0, d1):
+            key = (f'{d.year}', f'{d.month:02d}', f'{d.day:02d}')
+            if d < sealed and key in known_days:
+                continue
+
+            fs = fs or fsspec.core.url_to_fs(self.path, **(self.storage_options or {}))[0]
+            listed.add(key)
+            for f, size in self._list(fs, d).items():
+                present.add(f)
+                if f not in landed or landed[f]['size'] != size:
+                    new[f] = (size, d)
+
+        if new:
+            logger.info(f'Raw Ledger | {self.table_name} | Recording {len(new)} Landed Files')
+            with ThreadPoolExecutor(RAW_LEDGER_THREADS) as pool:
+                counts = list(pool.map(lambda f: pq.ParquetFile(fs.open(f)).metadata.num_rows, list(new)))
+
+            now = datetime.datetime.now(datetime.timezone.utc)
+            records = [{
+                'table_name': self.table_name, 'path': f, 'size': size, 'num_rows': n, 'event': 'landed',
+                'run_id': None, 'timestamp': now, 'year': f'{d.year}', 'month': f'{d.month:02d}', 'day': f'{d.day:02d}'
+            } for (f, (size, d)), n in zip(new.items(), counts)]
+            self.append(pa.Table.from_pylist(records, schema=RAW_LEDGER_SCHEMA))
+            landed.update({r['path']: r for r in records})
+
+        return [
+            dict(r, processed=(p, r['size']) in processed) for p, r in sorted(landed.items())
+            if (r['year'], r['month'], r['day']) not in listed or p in present
+        ]
+
+    def pending(self, d0, d1):
+        """
+        Returns the narrowest window holding the days with files not processed yet.
+
+        Parameters:
+        - d0 (datetime.date): The end date of the date range.
+        - d1 (datetime.date): The start date of the date range.
+
+        Returns:
+        - tuple or None: The end date, start date and landed files of the narrowed window, or None if every file was processed.
+        """
+        files = self.files(d0, d1)
+        days = sorted({datetime.date(int(f['year']), int(f['month']), int(f['day'])) for f in files if not f['processed']})
+        if not days:
+            logger.info(f'Raw Ledger | {self.table_name} | No New Files for {d1} - {d0}')
+            return None
+
+        files = [f for f in files if days[0] <= datetime.date(int(f['year']), int(f['month']), int(f['day'])) <= days[-1]]
+        logger.info(f'Raw Ledger | {self.table_name} | {sum(not f["processed"] for f in files)}/{len(files)} Files to Process for {days[0]} - {days[-1]}')
+        return days[-1], days[0], files
+
+    @staticmethod
+    def sizes(files):
+        """
+        Returns the sizes of landed files by path, as read by `extract_tables`.
+
+        Parameters:
+        - files (list): The landed files returned by `files` or `pending`.
+
+        Returns:
+        - dict: The bytes of each file path.
+        """
+        return {f['path']: f['size'] for f in files}
+
+    def mark_processed(self, files, run_id):
+        """
+        Records the files processed by a run.
+
+        Parameters:
+        - files (list): The landed files returned by `files` or `pending`.
+        - run_id (str): The run identifier.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        records = [dict({k: f[k] for k in RAW_LEDGER_SCHEMA.names}, event='processed', run_id=run_id, timestamp=now) for f in files if not f['processed']]
+        if records:
+            self.append(pa.Table.from_pylist(records, schema=RAW_LEDGER_SCHEMA))
+
+def spark_ledger(sc, table_name, path, base_dir):
+    """
+    Returns the ledger of a RAW table appended to by a Spark session.
+
+    Parameters:
+    - sc (SparkSession): The SparkSession object.
+    - table_name (str): The RAW table name.
+    - path (str): The RAW table path.
+    - base_dir (str): The stage directory holding the ledger.
+
+    Returns:
+    - RawLedger or None: The ledger, or None if RAW_LEDGER_ENABLED is off.
+    """
+    if not RAW_LEDGER_ENABLED:
+        return None
+
+    return RawLedger(table_name, path, base_dir, spark_append(sc, os.path.join(base_dir, RAW_LEDGER_TABLE)))
+
+def spark_append(sc, ledger_path):
+    """
+    Returns the ledger writer of a Spark session.
+
+    Parameters:
+    - sc (SparkSession): The SparkSession object.
+    - ledger_path (str): The `raw_ledger` table path.
+
+    Returns:
+    - callable: Appends a pyarrow.Table to the ledger.
+    """
+    def append(table):
+        sc.createDataFrame(table.to_pylist(), schema=RAW_LEDGER_DDL) \
+            .write \
+            .format('delta') \
+            .partitionBy('year', 'month', 'day') \
+            .mode('append') \
+            .save(ledger_path)
+
+    return append
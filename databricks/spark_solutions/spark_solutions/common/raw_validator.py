@@ -0,0 +1,389 @@
+""" RAW Landing Zone Validator
+
+Validates the gzipped JSON array files landed in the Data Lake's RAW Landing Zone
+against the expected schema of each table.
+
+Files are parsed incrementally, one row at a time, so memory is bounded by the
+read chunk size rather than the file size. Files are spread across a process pool
+and the detected timestamp format of each column is cached, so only the first
+value of a column pays for trying every format.
+
+Usage:
+    validate_raw --raw-dir $RAW_DIR --tables lib_server_game log_meta --date 2024-01-31
+"""
+
+from spark_solutions.loggers.default import base_handler
+from spark_solutions.loggers import log_level
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List
+
+import argparse
+import datetime
+import logging
+import fsspec
+import json
+import io
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+RAW_DIR = os.getenv('RAW_DIR')
+RAW_VALIDATOR_PROCESSES = int(os.getenv('RAW_VALIDATOR_PROCESSES', os.cpu_count() or 1))
+RAW_VALIDATOR_CHUNK_SIZE = int(os.getenv('RAW_VALIDATOR_CHUNK_SIZE', 1 << 20))
+RAW_VALIDATOR_MAX_VIOLATIONS = int(os.getenv('RAW_VALIDATOR_MAX_VIOLATIONS', '100'))
+RAW_VALIDATOR_MAX_ROW_SIZE = int(os.getenv('RAW_VALIDATOR_MAX_ROW_SIZE', 1 << 26))
+
+TIMESTAMP_FORMATS = ['%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d']
+
+RAW_SCHEMAS = {
+    'buffer_meta': {
+        'etl_id': str,
+        'msg_id': str,
+        'checksum': str,
+        'headers': str,
+        'key': str,
+        'offset': int,
+        'partition': int,
+        'serialized_key_size': int,
+        'serialized_value_size': int,
+        'timestamp': datetime.datetime,
+        'timestamp_type': int,
+        'topic': str,
+        '_is_protocol': bool
+    },
+    'etl_meta': {
+        'etl_id': str,
+        'service': str,
+        'mode': str,
+        'timestamp_start': datetime.datetime,
+        'timestamp_end': datetime.datetime
+    },
+    'log_meta': {
+        'etl_id': str,
+        'msg_id': str,
+        'level': str,
+        'timestamp': datetime.datetime,
+        'name': str,
+        'log_message': str
+    },
+    'lib_server_game': {
+        'etl_id': str,
+        'msg_id': str,
+        'timestamp': datetime.datetime,
+        'game_token': str,
+        'user_token': str,
+        'action': str,
+        'enemy_token': str,
+        'enemy_damage': int,
+        'enemy_health_prior': int,
+        'enemy_health_post': int
+    },
+    'lib_server_lobby': {
+        'etl_id': str,
+        'msg_id': str,
+        'timestamp': datetime.datetime,
+        'game_token': str,
+        'user_token': str,
+        'superhero_id': int,
+        'superhero_attack': int,
+        'superhero_health': int
+    }
+}
+
+@dataclass
+class FileReport:
+    """
+    Validation result of a single RAW file.
+    """
+
+    path: str
+    table: str
+    rows: int = 0
+    violation_count: int = 0
+    violations: List[Dict] = field(default_factory=list)
+    error: str = None
+
+    @property
+    def valid(self) -> bool:
+        return self.violation_count == 0 and self.error is None
+
+class TimestampParser():
+    """
+    Parses timestamp strings, caching the matching format per column.
+
+    Attributes:
+    - formats (list): Candidate `strptime` formats, in order of preference.
+    """
+
+    def __init__(self, formats=TIMESTAMP_FORMATS):
+        """
+        Initializes the parser.
+
+        Parameters:
+        - formats (list): Candidate `strptime` formats (default: TIMESTAMP_FORMATS).
+        """
+        self.formats = formats
+        self._cache = {}
+
+    def parse(self, column: str, value: str) -> datetime.datetime:
+        """
+        Parses a timestamp string with the cached format of the column.
+
+        The remaining formats are only tried if the cached format doesn't match,
+        in which case the matching format replaces the cached one.
+
+        Parameters:
+        - column (str): The column the value belongs to.
+        - value (str): The string representation of the datetime.
+
+        Returns:
+        - datetime.datetime: The parsed datetime object.
+
+        Raises:
+        - ValueError: If the value cannot be parsed with any of the formats.
+        """
+        cached = self._cache.get(column)
+        if cached:
+            try:
+                return datetime.datetime.strptime(value, cached)
+            except ValueError:
+                pass
+
+        for fmt in self.formats:
+            if fmt == cached:
+                continue
+            try:
+                dt = datetime.datetime.strptime(value, fmt)
+                self._cache[column] = fmt
+                return dt
+            except ValueError:
+                continue
+
+        raise ValueError(f'Unrecognized timestamp {value!r}')
+
+def iter_json_array(f, chunk_size: int=RAW_VALIDATOR_CHUNK_SIZE) -> Iterator:
+    """
+    Incrementally yields the elements of a JSON array.
+
+    Only the current read chunk and the element being decoded are held in memory;
+    an element that can't be decoded within RAW_VALIDATOR_MAX_ROW_SIZE characters
+    is reported as malformed.
+
+    Parameters:
+    - f: Binary file object positioned at the start of the JSON array.
+    - chunk_size (int): Number of characters read per chunk (default: RAW_VALIDATOR_CHUNK_SIZE).
+
+    Yields:
+    - The decoded array elements.
+
+    Raises:
+    - ValueError: If the content is not a well formed JSON array.
+    """
+    reader = io.TextIOWrapper(f, encoding='utf-8')
+    decoder = json.JSONDecoder()
+    buf, pos, eof, started = '', 0, False, False
+
+    while True:
+        while pos < len(buf) and (buf[pos] in ' \t\r\n' or (started and buf[pos] == ',')):
+            pos += 1
+
+        if pos >= len(buf):
+            if eof:
+                raise ValueError('Unexpected end of JSON array')
+            chunk = reader.read(chunk_size)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+
+        if not started:
+            if buf[pos] != '[':
+                raise ValueError('RAW file is not a JSON array')
+            started, pos = True, pos + 1
+            continue
+
+        if buf[pos] == ']':
+            return
+
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof or len(buf) - pos > RAW_VALIDATOR_MAX_ROW_SIZE:
+                raise
+            end = len(buf)
+
+        if end >= len(buf) and not eof:
+            # The element may continue in the next chunk
+            chunk = reader.read(chunk_size)
+            eof = not chunk
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+
+        pos = end
+        yield obj
+
+def validate_row(row: Dict, schema: Dict, parser: TimestampParser) -> List[Dict]:
+    """
+    Validates a row against the table schema.
+
+    A column is required to be present; falsy values aren't type checked.
+    Timestamp columns must be strings matching one of the timestamp formats.
+
+    Parameters:
+    - row (dict): The decoded row.
+    - schema (dict): Column name to expected type.
+    - parser (TimestampParser): The timestamp parser of the file.
+
+    Returns:
+    - list: The violations found in the row.
+    """
+    if not isinstance(row, dict):
+        return [{'column': None, 'error': f'Row is a {type(row).__name__}, expected an object'}]
+
+    violations = []
+    for column, obj_type in schema.items():
+        if column not in row:
+            violations.append({'column': column, 'error': 'Missing column'})
+            continue
+
+        value = row[column]
+        if not value:
+            continue
+
+        if obj_type is datetime.datetime:
+            try:
+                parser.parse(column, value)
+            except (ValueError, TypeError):
+                violations.append({'column': column, 'error': f'Invalid timestamp {value!r}'})
+        elif not isinstance(value, obj_type):
+            violations.append({'column': column, 'error': f'Expected {obj_type.__name__}, got {type(value).__name__}'})
+
+    return violations
+
+def validate_file(path: str, table: str, max_violations: int=RAW_VALIDATOR_MAX_VIOLATIONS, chunk_size: int=RAW_VALIDATOR_CHUNK_SIZE) -> FileReport:
+    """
+    Validates a single gzipped RAW file.
+
+    Parameters:
+    - path (str): The path or URL of the RAW file.
+    - table (str): The RAW table name, a key of RAW_SCHEMAS.
+    - max_violations (int): Maximum number of violations kept in the report (default: RAW_VALIDATOR_MAX_VIOLATIONS).
+    - chunk_size (int): Number of characters read per chunk (default: RAW_VALIDATOR_CHUNK_SIZE).
+
+    Returns:
+    - FileReport: The validation result of the file.
+    """
+    schema = RAW_SCHEMAS[table]
+    parser = TimestampParser()
+    report = FileReport(path=path, table=table)
+
+    try:
+        with fsspec.open(path, 'rb', compression='gzip') as f:
+            for row in iter_json_array(f, chunk_size):
+                for v in validate_row(row, schema, parser):
+                    report.violation_count += 1
+                    if len(report.violations) < max_violations:
+                        report.violations.append(dict(row=report.rows, **v))
+                report.rows += 1
+    except (ValueError, OSError, EOFError) as exc:
+        report.error = f'{type(exc).__name__}: {exc}'
+
+    return report
+
+def _validate_task(args) -> FileReport:
+    return validate_file(*args)
+
+def list_raw_files(raw_dir: str, table: str, dates: List[datetime.date]) -> List[str]:
+    """
+    Lists the RAW files of a table for the given days, largest first.
+
+    Parameters:
+    - raw_dir (str): The RAW directory containing the `raw/<table>/YYYY/MM/DD` folders.
+    - table (str): The RAW table name.
+    - dates (list): The days to list.
+
+    Returns:
+    - list: The file paths, sorted by descending size to balance the process pool.
+    """
+    files = []
+    for d in dates:
+        folder = f'{raw_dir}/raw/{table}/{d.year}/{d.month:02d}/{d.day:02d}'
+        fs, fs_path = fsspec.core.url_to_fs(folder)
+        if not fs.exists(fs_path):
+            logger.warning(f'RAW Folder Not Found {folder}')
+            continue
+
+        protocol = fs.protocol[0] if isinstance(fs.protocol, (list, tuple)) else fs.protocol
+        for info in fs.ls(fs_path, detail=True):
+            if info['type'] == 'file':
+                name = info['name'] if protocol == 'file' else f'{protocol}://{info["name"]}'
+                files.append((info.get('size') or 0, name))
+
+    return [name for _, name in sorted(files, reverse=True)]
+
+def validate_tables(raw_dir: str, tables: List[str], dates: List[datetime.date], processes: int=RAW_VALIDATOR_PROCESSES, max_violations: int=RAW_VALIDATOR_MAX_VIOLATIONS) -> List[FileReport]:
+    """
+    Validates the RAW files of several tables and days across a process pool.
+
+    Parameters:
+    - raw_dir (str): The RAW directory.
+    - tables (list): The RAW table names.
+    - dates (list): The days to validate.
+    - processes (int): Number of worker processes (default: RAW_VALIDATOR_PROCESSES).
+    - max_violations (int): Maximum number of violations kept per file (default: RAW_VALIDATOR_MAX_VIOLATIONS).
+
+    Returns:
+    - list: One FileReport per file.
+    """
+    tasks = [
+        (path, table, max_violations)
+        for table in tables
+        for path in list_raw_files(raw_dir, table, dates)
+    ]
+    logger.info(f'Validating {len(tasks)} RAW Files with {processes} Processes')
+    if processes <= 1 or len(tasks) <= 1:
+        return [_validate_task(t) for t in tasks]
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(_validate_task, tasks, chunksize=max(1, len(tasks) // (processes * 4))))
+
+def entrypoint(argv=None):
+    """
+    Command line entry point validating a range of RAW days.
+
+    Parameters:
+    - argv (list): Command line arguments (default: sys.argv).
+
+    Returns:
+    - int: 0 if every file is valid, else 1.
+    """
+    today = datetime.date.today()
+    ap = argparse.ArgumentParser(description='Validate RAW Landing Zone files')
+    ap.add_argument('--raw-dir', default=RAW_DIR, help='RAW directory (default: $RAW_DIR)')
+    ap.add_argument('--tables', nargs='+', default=list(RAW_SCHEMAS), choices=list(RAW_SCHEMAS))
+    ap.add_argument('--date', nargs='+', type=datetime.date.fromisoformat, default=[today, today - datetime.timedelta(1)])
+    ap.add_argument('--processes', type=int, default=RAW_VALIDATOR_PROCESSES)
+    ap.add_argument('--max-violations', type=int, default=RAW_VALIDATOR_MAX_VIOLATIONS)
+    args = ap.parse_args(argv)
+    assert(not args.raw_dir is None and args.raw_dir != '')
+
+    py4j_logger = logging.getLogger('py4j')
+    py4j_logger.setLevel(log_level(LOG_LEVEL))
+    if base_handler not in py4j_logger.handlers:
+        py4j_logger.addHandler(base_handler)
+
+    reports = validate_tables(args.raw_dir, args.tables, args.date, args.processes, args.max_violations)
+    for r in reports:
+        if r.valid:
+            logger.info(f'RAW Validation | {r.table} | {r.path} | {r.rows} Rows OK')
+        else:
+            logger.error(f'RAW Validation | {r.table} | {r.path} | {r.rows} Rows | {r.violation_count} Violations | {r.error or r.violations[:5]}')
+
+    invalid = [r for r in reports if not r.valid]
+    logger.info(f'RAW Validation | {len(reports)} Files | {sum(r.rows for r in reports)} Rows | {len(invalid)} Invalid Files')
+    return 1 if invalid else 0
+
+if __name__ == '__main__':
+    raise SystemExit(entrypoint())
@@ -0,0 +1,185 @@
+""" Spark Artifact Cache
+
+Pre-resolved JARs of the Spark sessions, so session startup does no network resolution.
+
+`SparkConfig` asks for the Maven packages of its cloud provider (hadoop-aws, hadoop-azure,
+...) and the Delta Lake package of the installed `delta-spark`, plus JAR URLs such as the
+GCS connector. Resolving and downloading them on every cold start is slow and fails on
+air-gapped runners. The `warm_spark_artifacts` entry point resolves them once, with their
+transitive dependencies, into SPARK_ARTIFACT_CACHE_DIR under a fingerprint of the
+coordinates, JAR URLs, repository and Spark version:
+
+    SPARK_ARTIFACT_CACHE_DIR/<fingerprint>/manifest.json
+    SPARK_ARTIFACT_CACHE_DIR/<fingerprint>/jars/*.jar
+
+When the cache of its fingerprint is warm, `SparkConfig` sets `spark.jars` to the cached
+JARs instead of `spark.jars.packages`. With SPARK_OFFLINE a missing cache is an error
+rather than a fallback to resolution, so an offline run never reaches the network.
+Changing a coordinate changes the fingerprint, so a stale cache is never used.
+"""
+
+from pathlib import Path
+
+import urllib.request
+import importlib.metadata
+import datetime
+import hashlib
+import logging
+import shutil
+import glob
+import json
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+CLOUD_PROVIDER=os.getenv('CLOUD_PROVIDER', 'LOCAL')
+SPARK_ARTIFACT_CACHE_DIR=os.getenv('SPARK_ARTIFACT_CACHE_DIR', os.path.join(Path.home(), '.cache', 'spark_solutions', 'artifacts'))
+SPARK_OFFLINE=os.getenv('SPARK_OFFLINE', 'false').lower() == 'true'
+
+def delta_coordinate():
+    """
+    Returns the Maven coordinate of the Delta Lake package added by `configure_spark_with_delta_pip`.
+
+    Returns:
+    - str: The coordinate of the installed `delta-spark` version.
+    """
+    import pyspark
+
+    version = importlib.metadata.version('delta_spark')
+    major = int(version.split('.')[0])
+    if major < 3:
+        return f'io.delta:delta-core_2.12:{version}'
+    if major < 4:
+        return f'io.delta:delta-spark_2.12:{version}'
+
+    spark_major_minor = '.'.join(pyspark.__version__.split('.')[:2])
+    return f'io.delta:delta-spark_{spark_major_minor}_2.13:{version}'
+
+def fingerprint(packages, jar_urls, repository):
+    """
+    Returns the fingerprint of a set of artifacts.
+
+    Parameters:
+    - packages (list): The Maven coordinates.
+    - jar_urls (list): The JAR URLs.
+    - repository (str): The Maven repository URL.
+
+    Returns:
+    - str: The first 16 hexadecimal digits of the SHA-256 of the artifacts and Spark version.
+    """
+    import pyspark
+
+    key = json.dumps({
+        'packages': sorted(packages),
+        'jar_urls': sorted(jar_urls),
+        'repository': repository,
+        'spark': pyspark.__version__
+    }, sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+def cached_jars(packages, jar_urls, repository, cache_dir=SPARK_ARTIFACT_CACHE_DIR, offline=SPARK_OFFLINE):
+    """
+    Returns the cached JARs of a set of artifacts.
+
+    Parameters:
+    - packages (list): The Maven coordinates.
+    - jar_urls (list): The JAR URLs.
+    - repository (str): The Maven repository URL.
+    - cache_dir (str): The artifact cache directory (default: SPARK_ARTIFACT_CACHE_DIR).
+    - offline (bool): Whether a missing cache is an error (default: SPARK_OFFLINE).
+
+    Returns:
+    - list: The JAR paths, or None if the cache isn't warm.
+
+    Raises:
+    - FileNotFoundError: If offline and the cache isn't warm.
+    """
+    key = fingerprint(packages, jar_urls, repository)
+    manifest = os.path.join(cache_dir, key, 'manifest.json')
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            jars = [os.path.join(cache_dir, key, 'jars', j) for j in json.load(f)['jars']]
+        if all(os.path.exists(j) for j in jars):
+            logger.info(f'Spark Artifacts | Using Cache {key} | {len(jars)} JARs')
+            return jars
+
+    if offline:
+        raise FileNotFoundError(f'Spark artifact cache {key} not found in {cache_dir}, run `warm_spark_artifacts` with network access first')
+
+    logger.info(f'Spark Artifacts | Cache {key} Not Warm | Resolving Packages')
+    return None
+
+def warm(packages, jar_urls, repository, cache_dir=SPARK_ARTIFACT_CACHE_DIR):
+    """
+    Resolves and downloads a set of artifacts into the cache.
+
+    Maven packages are resolved with their transitive dependencies by Spark's own Ivy
+    resolution, in a throwaway local session; JAR URLs are downloaded as is.
+
+    Parameters:
+    - packages (list): The Maven coordinates.
+    - jar_urls (list): The JAR URLs.
+    - repository (str): The Maven repository URL.
+    - cache_dir (str): The artifact cache directory (default: SPARK_ARTIFACT_CACHE_DIR).
+
+    Returns:
+    - list: The cached JAR paths.
+    """
+    jars = cached_jars(packages, jar_urls, repository, cache_dir, offline=False)
+    if jars is not None:
+        return jars
+
+    from pyspark.sql import SparkSession
+
+    key = fingerprint(packages, jar_urls, repository)
+    staging = os.path.join(cache_dir, f'{key}.tmp')
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(os.path.join(staging, 'jars'))
+
+    if packages:
+        logger.info(f'Spark Artifacts | Resolving {len(packages)} Packages from {repository}')
+        sc = SparkSession.builder \
+            .master('local[1]') \
+            .appName('warm_spark_artifacts') \
+            .config('spark.jars.repositories', repository) \
+            .config('spark.jars.packages', ','.join(packages)) \
+            .config('spark.jars.ivy', os.path.join(staging, 'ivy')) \
+            .getOrCreate()
+        sc.stop()
+
+        for jar in glob.glob(os.path.join(staging, 'ivy', 'jars', '*.jar')):
+            shutil.copy(jar, os.path.join(staging, 'jars'))
+        shutil.rmtree(os.path.join(staging, 'ivy'))
+
+    for url in jar_urls:
+        logger.info(f'Spark Artifacts | Downloading {url}')
+        urllib.request.urlretrieve(url, os.path.join(staging, 'jars', url.rstrip('/').rsplit('/', 1)[-1]))
+
+    with open(os.path.join(staging, 'manifest.json'), 'w') as f:
+        json.dump({
+            'fingerprint': key,
+            'packages': sorted(packages),
+            'jar_urls': sorted(jar_urls),
+            'repository': repository,
+            'jars': sorted(os.listdir(os.path.join(staging, 'jars'))),
+            'timestamp': datetime.datetime.utcnow().isoformat()
+        }, f, indent=2)
+
+    shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+    os.replace(staging, os.path.join(cache_dir, key))
+    return cached_jars(packages, jar_urls, repository, cache_dir, offline=True)
+
+def entrypoint():
+    """
+    Entry point warming the artifact cache of the configured cloud provider.
+    """
+    from spark_solutions.common.spark_config import SparkConfig
+
+    packages = [delta_coordinate()] + SparkConfig.PROVIDER_MAVEN_COORDINATES.get(CLOUD_PROVIDER, [])
+    jar_urls = SparkConfig.PROVIDER_JAR_URLS.get(CLOUD_PROVIDER, [])
+    jars = warm(packages, jar_urls, SparkConfig.JARS_REPOSITORY)
+    logger.info(f'Spark Artifacts | {CLOUD_PROVIDER} Cache Warm | {len(jars)} JARs')
+
+if __name__ == '__main__':
+    entrypoint()
@@ -0,0 +1,167 @@
+""" Stage Bloom Indexes
+
+Builds the per-file Bloom filters of the stage tables and prunes reads with them.
+
+Stage loads call `build_bloom_index` after their write: the rows of the loaded window
+are read back with their data file, and one filter per file and indexed column is built
+on the executors and written to the `bloom_index` table next to the stage tables,
+replacing the table's filters of the window. See `spark_solutions.readers.bloom_index`
+for the filters and the Spark-free tracing API.
+
+`prefilter` reads only the files of a table whose filter may hold one of a set of keys,
+e.g. the messages recomputed by an incremental `message_flow` run, before joining them.
+"""
+
+from spark_solutions.common.spark_misc import date_partition_filter, date_range, read_partitioned_table
+from spark_solutions.readers.bloom_index import BLOOM_INDEX_FPP, BloomFilter, candidate_paths, index_path
+from pyspark.sql.types import StructType, StructField, StringType, LongType, IntegerType, BinaryType
+from pyspark.errors.exceptions import captured
+from pyspark.sql import functions as F
+
+import datetime
+import logging
+import re
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+BLOOM_INDEX_ENABLED=os.getenv('BLOOM_INDEX_ENABLED', 'true').lower() == 'true'
+BLOOM_PREFILTER_MAX_KEYS=int(os.getenv('BLOOM_PREFILTER_MAX_KEYS', '100000'))
+
+BLOOM_INDEX_SCHEMA = StructType([
+    StructField('table_name', StringType()),
+    StructField('column_name', StringType()),
+    StructField('path', StringType()),
+    StructField('num_rows', LongType()),
+    StructField('num_bits', LongType()),
+    StructField('num_hashes', IntegerType()),
+    StructField('bits', BinaryType()),
+    StructField('year', StringType()),
+    StructField('month', StringType()),
+    StructField('day', StringType())
+])
+
+# Data file path relative to the table, as in its Delta add action
+FILE_PATTERN = r'(year=([^/]+)/month=([^/]+)/day=([^/]+)/[^/]+)$'
+
+def build_bloom_index(sc, table_name, columns, base_dir, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), fpp=BLOOM_INDEX_FPP):
+    """
+    Builds the Bloom filters of the data files of a stage table's window.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    - table_name (str): The stage table name.
+    - columns (list): The indexed columns.
+    - base_dir (str): The stage directory.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    - fpp (float): The false positive probability of the filters (default: BLOOM_INDEX_FPP).
+    """
+    if not BLOOM_INDEX_ENABLED or not columns:
+        return
+
+    logger.info(f'ETL Pipeline | Load | Building {table_name} Bloom Index on {columns}')
+    path = os.path.join(base_dir, table_name)
+    df = read_partitioned_table(sc, path, d0, d1) \
+        .withColumn('_path', F.regexp_extract(F.input_file_name(), FILE_PATTERN, 1))
+
+    records = []
+    for column in columns:
+        pairs = df.where(F.col(column).isNotNull()).select('_path', F.col(column).cast('string'))
+        counts = dict(pairs.groupBy('_path').count().collect())
+
+        filters = pairs.rdd \
+            .map(lambda r: (r[0], r)) \
+            .combineByKey(
+                lambda r: BloomFilter.for_capacity(counts[r[0]], fpp).add(r[1]),
+                lambda b, r: b.add(r[1]),
+                lambda a, b: a.update(b)
+            )
+
+        for file, bloom in filters.collect():
+            year, month, day = re.search(FILE_PATTERN, file).groups()[1:]
+            records.append({
+                'table_name': table_name,
+                'column_name': column,
+                'path': file,
+                'num_rows': counts[file],
+                'num_bits': bloom.num_bits,
+                'num_hashes': bloom.num_hashes,
+                'bits': bytes(bloom.bits),
+                'year': year,
+                'month': month,
+                'day': day
+            })
+
+    sc.createDataFrame(records, schema=BLOOM_INDEX_SCHEMA) \
+        .write \
+        .format('delta') \
+        .partitionBy('year', 'month', 'day') \
+        .mode('overwrite') \
+        .option('replaceWhere', f"table_name = '{table_name}' AND ({date_partition_filter(date_range(d0, d1))})") \
+        .save(index_path(path))
+
+def read_files(df, paths, predicate):
+    """
+    Filters the read of a Delta table to the rows of some of its data files.
+
+    Files are matched on `_metadata.file_path`, so the rows still come from the table
+    snapshot, with its deletion vectors and column mapping, and the other files are
+    pruned from the scan.
+
+    Parameters:
+    - df (DataFrame): The Delta table read.
+    - paths (iterable): The data file paths, relative to the table.
+    - predicate (str): The partition predicate of the read.
+
+    Returns:
+    - DataFrame: The rows of the files within the partitions.
+    """
+    return df \
+        .where(predicate) \
+        .where(F.regexp_extract(F.col('_metadata.file_path'), FILE_PATTERN, 1).isin(list(paths)))
+
+def prefilter(sc, path, column, keys, predicate, max_keys=BLOOM_PREFILTER_MAX_KEYS):
+    """
+    Reads the partitions of a stage table from the files whose Bloom filter may hold a key.
+
+    Rows aren't filtered on the keys; without an index, or with more than `max_keys` keys,
+    every file of the partitions is read.
+
+    Parameters:
+    - sc (SparkSession): The SparkSession object.
+    - path (str): The stage table path.
+    - column (str): The indexed column.
+    - keys (DataFrame): The keys, in its first column.
+    - predicate (str): The partition predicate of the read.
+    - max_keys (int): The most keys collected to test the filters (default: BLOOM_PREFILTER_MAX_KEYS).
+
+    Returns:
+    - DataFrame: The rows of the candidate files within the partitions.
+    """
+    df = sc.read.format('delta').load(path)
+    if not BLOOM_INDEX_ENABLED:
+        return df.where(predicate)
+
+    values = [r[0] for r in keys.limit(max_keys + 1).collect()]
+    if len(values) > max_keys:
+        return df.where(predicate)
+
+    try:
+        index = sc.read.format('delta').load(index_path(path)) \
+            .where((F.col('table_name') == os.path.basename(path.rstrip('/'))) & (F.col('column_name') == column)) \
+            .where(predicate) \
+            .collect()
+    except captured.AnalysisException:
+        return df.where(predicate)
+
+    matches = [re.search(FILE_PATTERN, f) for f in df.where(predicate).inputFiles()]
+    files = [match.group(1) for match in matches if match]
+
+    candidates = candidate_paths(index, files, [str(v) for v in values if v is not None])
+    logger.info(f'ETL Pipeline | Extract | {path} | {len(candidates)}/{len(files)} Bloom Candidate Files')
+    if not candidates:
+        return df.where('FALSE')
+
+    return read_files(df, candidates, predicate)
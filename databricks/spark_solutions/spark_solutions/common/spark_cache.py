@@ -0,0 +1,179 @@
+""" Driver DataFrame Cache
+
+Caches the DataFrames of repeated table reads within a driver.
+
+Tasks running back to back in the same driver (e.g. `output_game_metrics` and
+`output_message_flow`) read the same stage tables for the same date window. The
+first read persists the DataFrame at the configured storage level; later reads of
+the same table, format and window are served from the cache. Entries are evicted
+least recently used first when their estimated size exceeds the memory budget.
+"""
+
+from pyspark import StorageLevel
+from collections import OrderedDict
+
+import threading
+import logging
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+DF_CACHE_ENABLED=os.getenv('DF_CACHE_ENABLED', 'true').lower() == 'true'
+DF_CACHE_BUDGET_BYTES=int(os.getenv('DF_CACHE_BUDGET_BYTES', 2 * 1024**3))
+DF_CACHE_STORAGE_LEVEL=os.getenv('DF_CACHE_STORAGE_LEVEL', 'MEMORY_AND_DISK')
+
+def estimate_size(df):
+    """
+    Estimates the size of a DataFrame from its optimized plan statistics.
+
+    Once a persisted DataFrame is materialized the statistics reflect the cached size,
+    before that the estimated size of the source, e.g. the bytes of the add files a
+    Delta scan keeps after partition pruning.
+
+    Parameters:
+    - df (DataFrame): The DataFrame.
+
+    Returns:
+    - int: The estimated size in bytes.
+    """
+    try:
+        return int(df._jdf.queryExecution().optimizedPlan().stats().sizeInBytes().toString())
+    except Exception:
+        return 0
+
+class TableCache():
+    """
+    LRU cache of persisted DataFrames with a memory budget.
+
+    Entries are keyed by (path, format, d0, d1) and the SparkSession that read them, as
+    a DataFrame registers its Spark table in its own session. Entries are bound to the
+    SparkContext that created them; a new SparkContext clears the cache.
+
+    Attributes:
+    - budget_bytes (int): The estimated size budget of all cached entries.
+    - storage_level (StorageLevel): The storage level entries are persisted at.
+    - hits (int): Number of reads served from the cache.
+    - misses (int): Number of reads loaded from storage.
+    - evictions (int): Number of entries evicted to respect the budget.
+    - bypasses (int): Number of reads too large to be cached.
+
+    Methods:
+    - get_or_load(self, sc, key, loader): Returns the cached DataFrame of key, loading it on a miss.
+    - invalidate(self, path=None): Unpersists the entries of a path, or all entries.
+    - stats(self): Returns the cache counters.
+    """
+
+    def __init__(self, budget_bytes=DF_CACHE_BUDGET_BYTES, storage_level=DF_CACHE_STORAGE_LEVEL, enabled=DF_CACHE_ENABLED):
+        """
+        Initializes the cache.
+
+        Parameters:
+        - budget_bytes (int): The size budget in bytes (default: DF_CACHE_BUDGET_BYTES).
+        - storage_level (str): The StorageLevel name (default: DF_CACHE_STORAGE_LEVEL).
+        - enabled (bool): Whether reads are cached (default: DF_CACHE_ENABLED).
+        """
+        self.budget_bytes = budget_bytes
+        self.storage_level = getattr(StorageLevel, storage_level)
+        self.enabled = enabled
+        self.hits = self.misses = self.evictions = self.bypasses = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._context_id = None
+
+    def _bind(self, sc):
+        """Clears the cache if the SparkContext changed."""
+        context_id = sc.sparkContext.applicationId
+        if self._context_id != context_id:
+            self._entries.clear()
+            self._context_id = context_id
+
+    def _evict(self, incoming_bytes):
+        """
+        Evicts least recently used entries until the incoming entry fits in the budget.
+
+        Parameters:
+        - incoming_bytes (int): The estimated size of the incoming entry.
+        """
+        sizes = {k: estimate_size(df) for k, df in self._entries.items()}
+        total = sum(sizes.values())
+        while self._entries and total + incoming_bytes > self.budget_bytes:
+            key, df = self._entries.popitem(last=False)
+            total -= sizes[key]
+            df.unpersist()
+            self.evictions += 1
+            logger.info(f'DataFrame Cache | Evicted {key} ({sizes[key]} Bytes)')
+
+    def get_or_load(self, sc, key, loader):
+        """
+        Returns the cached DataFrame of key, loading it on a miss.
+
+        Parameters:
+        - sc (SparkSession): The SparkSession object.
+        - key (tuple): The cache key, starting with the table path.
+        - loader (callable): Returns the DataFrame to cache, or None.
+
+        Returns:
+        - DataFrame or None: The (cached) DataFrame.
+        """
+        if not self.enabled:
+            return loader()
+
+        key = (*key, sc)
+        with self._lock:
+            self._bind(sc)
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                logger.info(f'DataFrame Cache | Hit {key}')
+                return self._entries[key]
+
+            self.misses += 1
+            df = loader()
+            if df is None:
+                return None
+
+            size = estimate_size(df)
+            if size > self.budget_bytes:
+                self.bypasses += 1
+                logger.info(f'DataFrame Cache | Bypassing {key} ({size} Bytes > {self.budget_bytes} Budget)')
+                return df
+
+            self._evict(size)
+            df = df.persist(self.storage_level)
+            self._entries[key] = df
+            logger.info(f'DataFrame Cache | Cached {key} ({size} Bytes)')
+            return df
+
+    def invalidate(self, path=None):
+        """
+        Unpersists the entries of a path, or all entries.
+
+        Tasks writing a table should invalidate it so later reads see the new data.
+
+        Parameters:
+        - path (str): The table path (default: None, every entry).
+        """
+        with self._lock:
+            for key in [k for k in self._entries if path is None or k[0] == path]:
+                self._entries.pop(key).unpersist()
+
+    def stats(self):
+        """
+        Returns the cache counters.
+
+        Returns:
+        - dict: Hits, misses, evictions, bypasses, entries and estimated cached bytes.
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'bypasses': self.bypasses,
+                'entries': len(self._entries),
+                'bytes': sum(estimate_size(df) for df in self._entries.values())
+            }
+
+table_cache = TableCache()
@@ -1,3 +1,8 @@
+from spark_solutions.common.spark_tuning import SparkTuning, activate
+from spark_solutions.common.spark_metrics import RunMetrics
+from spark_solutions.common.spark_artifacts import cached_jars, delta_coordinate
+from spark_solutions.common.spark_profile import PROFILE_ENABLED, DriverProfile
+from spark_solutions.common.spark_io import SparkIO
 from spark_solutions.loggers.log4j import inject_logging
 from pyspark.errors.exceptions import base
 from py4j.protocol import Py4JJavaError
@@ -29,20 +34,25 @@ class SparkConfig():
     - JARS_REPOSITORY (str): The repository URL for JAR packages.
     - JAR_URLS (list): List of URLs for additional JARs.
     - MAVEN_COORDINATES (list): List of Maven coordinates for additional dependencies.
+    - PROVIDER_JAR_URLS (dict): The JAR URLs of each cloud provider.
+    - PROVIDER_MAVEN_COORDINATES (dict): The Maven coordinates of each cloud provider.
 
     Methods:
-    - __init__(self, app_name, warehouse_dir=None): Initializes the SparkConfig object.
+    - __init__(self, app_name, warehouse_dir=None, profile=None): Initializes the SparkConfig object.
     - get_sparkContext(self): Retrieves the SparkContext object.
+    - get_runMetrics(self): Retrieves the RunMetrics collector for this run.
+    - get_isolatedSparkContext(self): Clones the SparkSession with isolated Spark tables.
     - config_spark_session_gcp(self, GOOGLE_PROJECT_ID): Configures Spark session for GCP.
     - config_spark_session_aws(self): Configures Spark session for AWS.
     - config_spark_session_azure(self, AZURE_TENANT_ID): Configures Spark session for Azure.
     - _config_spark_session(self): Configures the Spark session.
     - _config_spark_builder_library(self, _builder): Configures libraries for Spark session.
     - _config_spark_builder_warehouse(self, _builder): Configures warehouse directory for Spark session.
-    - _config_spark_builder_extra(self, _builder): Adds extra configurations to the Spark session builder.
+    - _config_spark_builder_extra(self, _builder): Adds the tuning & I/O profiles to the Spark session builder, and the event log of a profiled run.
     - _config_spark(self, _builder): Configures Spark session with Delta Lake.
     - _config_spark_logging(self, sc): Configures Spark logging.
-    - _config_spark_extra(self, sc): Adds extra configurations to the Spark session.
+    - _config_spark_extra(self, sc): Adds extra configurations and the I/O profile to the Spark session.
+    - _config_spark_metrics(self, sc): Registers the run metrics listener.
     """
 
     # ENV Variables
@@ -52,17 +62,38 @@ class SparkConfig():
     JARS_REPOSITORY=os.getenv('JARS_REPOSITORY', 'https://maven-central.storage-download.googleapis.com/maven2/')
     JAR_URLS=[]
     MAVEN_COORDINATES=[]
+    PROVIDER_JAR_URLS={
+        'GCP': ['https://github.com/GoogleCloudDataproc/hadoop-connectors/releases/download/v2.2.17/gcs-connector-hadoop3-2.2.17-shaded.jar']
+    }
+    PROVIDER_MAVEN_COORDINATES={
+        'AWS': [
+            'org.apache.hadoop:hadoop-aws:3.3.4',
+            'com.amazonaws:aws-java-sdk:1.12.552'
+        ],
+        'AZURE': [
+            'org.apache.hadoop:hadoop-azure-datalake:3.3.3',
+            'org.apache.hadoop:hadoop-common:3.3.3',
+            'org.apache.hadoop:hadoop-azure:3.3.3'
+        ]
+    }
 
-    def __init__(self, app_name, warehouse_dir=None) -> SparkSession:
+    def __init__(self, app_name, warehouse_dir=None, profile=None) -> SparkSession:
         """
         Initializes the SparkConfig object.
 
         Parameters:
         - app_name (str): The name of the Spark application.
         - warehouse_dir (str): The directory for Spark warehouse.
+        - profile (str): The tuning profile in `spark_solutions/conf/tasks` (default: app_name).
+
+        With PROFILE_ENABLED the driver is profiled from here on, see `spark_profile`.
         """
+        self.driver_profile = DriverProfile(app_name).start() if PROFILE_ENABLED else None
         self.app_name = app_name
         self.warehouse_dir=warehouse_dir
+        self.artifact_jars = None
+        self.tuning = SparkTuning(profile or app_name)
+        self.io = SparkIO(CLOUD_PROVIDER)
 
         if CLOUD_PROVIDER == 'GCP':
             self.sc = self.config_spark_session_gcp()
@@ -72,6 +103,7 @@ class SparkConfig():
             self.sc = self.config_spark_session_aws()
     
         self.sc = self._config_spark_session()
+        self.run_metrics = self._config_spark_metrics(self.sc)
     
     def get_sparkContext(self):
         """
@@ -82,6 +114,29 @@ class SparkConfig():
         """
         return self.sc
     
+    def get_runMetrics(self):
+        """
+        Retrieves the RunMetrics collector for this run.
+
+        Returns:
+        - RunMetrics: The RunMetrics object timing the ETL phases.
+        """
+        return self.run_metrics
+
+    def get_isolatedSparkContext(self):
+        """
+        Clones the SparkSession with isolated Spark tables.
+
+        The clone shares the SparkContext and copies the runtime properties (credentials,
+        tuning) of the configured session, while temporary views registered in the clone
+        don't collide with other sessions. Tasks running concurrently in one driver, such
+        as backfill chunks, each use their own clone.
+
+        Returns:
+        - SparkSession: The cloned SparkSession object.
+        """
+        return SparkSession(self.sc.sparkContext, self.sc._jsparkSession.cloneSession())
+    
     def config_spark_session_gcp(self, GOOGLE_PROJECT_ID=os.getenv('GOOGLE_PROJECT_ID', None)):
         """
         Configures Spark session for Google Cloud Platform (GCP).
@@ -94,7 +149,7 @@ class SparkConfig():
         - SparkSession: The configured SparkSession object.
         """
         assert(not GOOGLE_PROJECT_ID is None)
-        self.JAR_URLS = ['https://github.com/GoogleCloudDataproc/hadoop-connectors/releases/download/v2.2.17/gcs-connector-hadoop3-2.2.17-shaded.jar']
+        self.JAR_URLS = self.PROVIDER_JAR_URLS['GCP']
     
         sc = self._config_spark_session()
         try:
@@ -123,10 +178,7 @@ class SparkConfig():
         Returns:
         - SparkSession: The configured SparkSession object.
         """
-        self.MAVEN_COORDINATES = [
-            'org.apache.hadoop:hadoop-aws:3.3.4',
-            'com.amazonaws:aws-java-sdk:1.12.552'
-        ]
+        self.MAVEN_COORDINATES = self.PROVIDER_MAVEN_COORDINATES['AWS']
 
         sc = self._config_spark_session()
         try:
@@ -155,11 +207,7 @@ class SparkConfig():
         - SparkSession: The configured SparkSession object.
         """
         assert(not AZURE_TENANT_ID is None)
-        self.MAVEN_COORDINATES = [
-            'org.apache.hadoop:hadoop-azure-datalake:3.3.3',
-            'org.apache.hadoop:hadoop-common:3.3.3',
-            'org.apache.hadoop:hadoop-azure:3.3.3'
-        ]
+        self.MAVEN_COORDINATES = self.PROVIDER_MAVEN_COORDINATES['AZURE']
 
         sc = self._config_spark_session()
         try:
@@ -205,6 +253,9 @@ class SparkConfig():
         """
         Configures libraries for Spark session.
 
+        When the artifact cache of the packages and JAR URLs is warm, the cached JARs are
+        used and nothing is resolved over the network, see `spark_artifacts`.
+
         Parameters:
         - _builder: The SparkSession builder object.
 
@@ -215,6 +266,14 @@ class SparkConfig():
             if SparkSession.active():
                 return _builder
         except base.PySparkRuntimeError:
+            self.artifact_jars = cached_jars([delta_coordinate()] + self.MAVEN_COORDINATES, self.JAR_URLS, self.JARS_REPOSITORY)
+            if self.artifact_jars is not None:
+                logger.info('Configuring Spark Cluster JARs from the Artifact Cache')
+                return _builder \
+                    .config('spark.jars', ','.join(self.artifact_jars)) \
+                    .config('spark.sql.extensions', 'io.delta.sql.DeltaSparkSessionExtension') \
+                    .config('spark.sql.catalog.spark_catalog', 'org.apache.spark.sql.delta.catalog.DeltaCatalog')
+
             logger.info('Configuring Spark Cluster Repositories & JAR Packages')
             _builder = _builder \
                 .config('spark.jars.repository', self.JARS_REPOSITORY) \
@@ -229,6 +288,9 @@ class SparkConfig():
         """
         Configures warehouse directory for Spark session.
 
+        The `warehouse_dir` of the SparkConfig takes precedence over WAREHOUSE_DIR, so test
+        workers each get their own warehouse.
+
         Parameters:
         - _builder: The SparkSession builder object.
 
@@ -239,9 +301,11 @@ class SparkConfig():
             if SparkSession.active():
                 return _builder
         except base.PySparkRuntimeError:
-            if self.WAREHOUSE_DIR:
+            warehouse_dir = self.warehouse_dir or self.WAREHOUSE_DIR
+            if warehouse_dir:
                 _builder = _builder \
-                    .config('spark.hive.metastore.warehouse.dir', Path(self.WAREHOUSE_DIR).as_uri())
+                    .config('spark.hive.metastore.warehouse.dir', Path(warehouse_dir).as_uri()) \
+                    .config('spark.sql.warehouse.dir', Path(warehouse_dir).as_uri())
         
         return _builder
     
@@ -255,18 +319,34 @@ class SparkConfig():
         Returns:
         - SparkSession.Builder: The configured SparkSession builder object.
         """
-        return _builder.config('spark.sql.parquet.datetimeRebaseModeInRead', 'CORRECTED')
+        _builder = _builder.config('spark.sql.parquet.datetimeRebaseModeInRead', 'CORRECTED')
+        try:
+            if SparkSession.active():
+                return _builder
+        except base.PySparkRuntimeError:
+            logger.info('Configuring Spark Tuning Profile Static Properties')
+            _builder = self.tuning.config_builder(_builder)
+            _builder = self.io.config_builder(_builder)
+            if self.driver_profile:
+                _builder = self.driver_profile.config_builder(_builder)
+
+        return _builder
     
     def _config_spark(self, _builder):
         """
         Configures Spark session with Delta Lake.
 
+        The Delta Lake package is only added when the JARs don't come from the artifact cache.
+
         Parameters:
         - _builder: The SparkSession builder object.
 
         Returns:
         - SparkSession: The configured SparkSession object.
         """
+        if self.artifact_jars is not None:
+            return _builder.getOrCreate()
+
         return configure_spark_with_delta_pip(_builder, extra_packages=self.MAVEN_COORDINATES) \
             .getOrCreate()
     
@@ -284,13 +364,37 @@ class SparkConfig():
         """
         Adds extra configurations to the Spark session.
 
+        Applies the runtime properties of the task's tuning profile; properties left unset are
+        sized as the task extracts its hot paths. The connector properties of the cloud
+        provider's I/O profile are set on the Hadoop configuration, see `spark_io`.
+
         Parameters:
         - sc: The SparkContext object.
 
         Returns:
         - SparkContext: The configured SparkContext object.
         """
-        sc.conf.set('spark.sql.sources.patitionOverwriteMethod', 'dynamic')
+        sc.conf.set('spark.sql.sources.partitionOverwriteMode', 'dynamic')
         sc._jsc.hadoopConfiguration().set('mapreduce.input.fileinputformat.input.dir.recursive', 'true')
 
+        self.tuning.config_session(sc)
+        self.io.config_session(sc)
+        activate(self.tuning)
+
         return sc
+    
+    def _config_spark_metrics(self, sc):
+        """
+        Registers the run metrics listener.
+
+        This is called once per SparkConfig, after the session has been fully configured,
+        so the listener only observes the ETL phases of this run. A profiled run writes its
+        profiling bundle when the RunMetrics context exits.
+
+        Parameters:
+        - sc: The SparkContext object.
+
+        Returns:
+        - RunMetrics: The RunMetrics object timing the ETL phases.
+        """
+        return RunMetrics(sc, profile=self.driver_profile)
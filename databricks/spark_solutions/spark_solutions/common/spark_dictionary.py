@@ -0,0 +1,91 @@
+""" Stage Token Dictionary
+
+Maintains the `token_dictionary` of the surrogate ids carried by the stage tables.
+
+Ids are derived from the tokens, see `spark_solutions.readers.token_dictionary`, so stage
+rows get their ids without a lookup. After a stage load, the tokens of the loaded window
+missing from the dictionary are MERGEd into it, partitioned by the day they were first
+seen; tokens already known are left untouched, so reruns don't grow the dictionary. A
+token whose id is taken by another token, in the window or in the dictionary, fails the
+load with a `TokenCollisionError`: the dictionary side is checked by the MERGE itself,
+which raises on a matched row with another token, so the dictionary is joined once.
+"""
+
+from spark_solutions.common.spark_misc import is_conflict, read_partitioned_table
+from spark_solutions.readers.token_dictionary import TOKEN_COLUMNS, TOKEN_DICTIONARY_TABLE, TokenCollisionError
+from pyspark.sql import functions as F
+from delta import DeltaTable
+from functools import reduce
+
+import datetime
+import logging
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+COLLISION_MESSAGE = 'Token Id Collision'
+
+def update_token_dictionary(sc, table_name, columns, base_dir, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1)):
+    """
+    Merges the new tokens of a stage table's window into the token dictionary.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    - table_name (str): The stage table name.
+    - columns (list): The token columns of the table, keys of TOKEN_COLUMNS.
+    - base_dir (str): The stage directory.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+
+    Raises:
+    - TokenCollisionError: If a token's id is taken by another token.
+    """
+    logger.info(f'ETL Pipeline | Load | Updating Token Dictionary from {table_name} {columns}')
+    df = read_partitioned_table(sc, os.path.join(base_dir, table_name), d0, d1)
+    tokens = reduce(lambda a, b: a.unionByName(b), [
+        df.select(
+            F.lit(TOKEN_COLUMNS[c][1]).alias('token_type'),
+            F.col(c).alias('token'),
+            F.col(TOKEN_COLUMNS[c][0]).alias('token_id'),
+            'year', 'month', 'day'
+        ) for c in columns
+    ]) \
+        .where(F.col('token').isNotNull()) \
+        .groupBy('token_type', 'token', 'token_id') \
+        .agg(F.min(F.struct('year', 'month', 'day')).alias('_first')) \
+        .select('token_type', 'token', 'token_id', F.current_timestamp().alias('first_seen'), '_first.*')
+
+    tokens.persist()
+    try:
+        _merge_tokens(sc, table_name, tokens, os.path.join(base_dir, TOKEN_DICTIONARY_TABLE))
+    finally:
+        tokens.unpersist()
+
+def _merge_tokens(sc, table_name, tokens, path):
+    collisions = tokens.groupBy('token_type', 'token_id').agg(F.count(F.lit(1)).alias('tokens')).where('tokens > 1').count()
+    if collisions:
+        raise TokenCollisionError(f'{collisions} {table_name} Token Ids Shared by Several Tokens')
+
+    if not DeltaTable.isDeltaTable(sc, path):
+        tokens.write \
+            .format('delta') \
+            .partitionBy('year', 'month', 'day') \
+            .mode('append') \
+            .save(path)
+        return
+
+    collision = F.raise_error(F.concat_ws(' ', F.lit(COLLISION_MESSAGE), 's.token_type', F.col('s.token_id').cast('string'), 's.token', 't.token'))
+    for attempt in range(3):
+        try:
+            DeltaTable.forPath(sc, path).alias('t') \
+                .merge(tokens.alias('s'), 't.token_type = s.token_type AND t.token_id = s.token_id') \
+                .whenMatchedUpdate(condition='t.token <> s.token', set={'token': collision}) \
+                .whenNotMatchedInsertAll() \
+                .execute()
+            return
+        except Exception as exc:
+            if COLLISION_MESSAGE in str(exc):
+                raise TokenCollisionError(f'{table_name} Tokens Collide With Dictionary Ids') from exc
+            if not is_conflict(exc) or attempt == 2:
+                raise
+            logger.warning(f'ETL Pipeline | Load | Token Dictionary Conflict | Attempt {attempt + 1}')
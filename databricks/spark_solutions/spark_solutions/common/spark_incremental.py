@@ -0,0 +1,452 @@
+""" Incremental Output Framework
+
+Recomputes only the output keys affected by new stage table commits.
+
+The output tasks recompute their whole window on every run, although a run usually only
+follows a few late messages. Stage tables have their Change Data Feed enabled, so an
+incremental run:
+
+- Reads the changes of each source stage table committed since the version recorded in
+  the `incremental_meta` state table. Stage loads MERGE their window, so the change feed
+  only holds the rows they added or removed. A delete and an insert of identical rows,
+  e.g. of a window rewritten by the local backend, cancel out; only net changes are kept.
+- Maps the changed rows to the affected output keys, e.g. the `game_token`s of changed
+  games, with a query per source over its `<table>__changes` view.
+- Recomputes the task's TRANSFORM_SQL over the input rows of those keys only, read from
+  the days of the changes and their neighbouring days, widened until no key has rows on
+  the edge of the days read. A key spanning more than INCREMENTAL_MAX_KEY_DAYS further
+  days makes the run fall back to the window run over the days of the changes.
+- MERGEs the result into the output table, replacing every row of an affected key within
+  the days read in one commit, then records the processed versions.
+
+Replacing whole keys keeps the MERGE idempotent, so a run failing before its versions are
+recorded is simply reprocessed. Without recorded versions the task's window run is used to
+bootstrap. Versions are only recorded once the days of their changes were recomputed: a
+change feed cleaned up since the recorded version fails the run until the task is
+backfilled and its versions cleared.
+
+Tables derived by day from an output table, e.g. the rollup of `game_metrics`, use
+`recompute_dates` to recompute the days the output's MERGEs wrote outside their window.
+"""
+
+from spark_solutions.common.spark_misc import date_partition_filter, date_range, schema_auto_merge
+from spark_solutions.common.spark_bloom import prefilter
+from pyspark.sql.types import StructType, StructField, StringType, LongType, TimestampType
+from pyspark.errors.exceptions import captured
+from pyspark.sql import functions as F
+from delta import DeltaTable
+
+import datetime
+import logging
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+CLOUD_PROVIDER=os.getenv('CLOUD_PROVIDER', 'LOCAL')
+INCREMENTAL_META_DIR=os.getenv('INCREMENTAL_META_DIR', os.getenv('RUN_META_DIR', os.getenv('STAGE_DIR')))
+INCREMENTAL_MAX_KEY_DAYS=int(os.getenv('INCREMENTAL_MAX_KEY_DAYS', '7'))
+
+assert(not INCREMENTAL_META_DIR is None and INCREMENTAL_META_DIR != '')
+
+INCREMENTAL_META_SCHEMA = StructType([
+    StructField('task', StringType()),
+    StructField('source', StringType()),
+    StructField('start_version', LongType()),
+    StructField('end_version', LongType()),
+    StructField('changes', LongType()),
+    StructField('keys', LongType()),
+    StructField('app_id', StringType()),
+    StructField('timestamp', TimestampType()),
+    StructField('year', StringType()),
+    StructField('month', StringType()),
+    StructField('day', StringType())
+])
+
+# Change Data Feed metadata columns, left out of the content of a changed row
+CHANGE_COLUMNS = ['_change_type', '_commit_version', '_commit_timestamp']
+
+def date_windows(dates):
+    """
+    Returns the contiguous windows covering a set of dates.
+
+    Parameters:
+    - dates (iterable): The dates.
+
+    Returns:
+    - list: The (end date, start date) of each window, in ascending order.
+    """
+    windows = []
+    for d in sorted(set(dates)):
+        if windows and windows[-1][0] + datetime.timedelta(1) == d:
+            windows[-1] = (d, windows[-1][1])
+        else:
+            windows.append((d, d))
+
+    return windows
+
+def affected_dates(partitions, margin_days=1):
+    """
+    Returns the dates of partitions, widened by a margin of days.
+
+    Output rows are partitioned by their event time, which may fall on the day before or
+    after the stage partition their rows landed in.
+
+    Parameters:
+    - partitions (list): The (year, month, day) partition values, as strings or integers.
+    - margin_days (int): The days added before and after each date (default: 1).
+
+    Returns:
+    - list: The sorted dates.
+    """
+    dates = set()
+    for year, month, day in partitions:
+        if year is None or month is None or day is None:
+            continue
+        d = datetime.date(int(year), int(month), int(day))
+        dates.update(d + datetime.timedelta(x) for x in range(-margin_days, margin_days + 1))
+
+    return sorted(dates)
+
+class IncrementalOutput():
+    """
+    Maintains an output table incrementally from the Change Data Feed of its stage tables.
+
+    Attributes:
+    - sc (SparkSession): The SparkSession object.
+    - task (str): The output task name recorded in the state table.
+    - key (str): The output key column replaced by the MERGE.
+    - sources (dict): The query of the affected keys of each source stage table, reading `{changes}`.
+    - filters (dict): The key column of each input table restricted to the affected keys.
+    - input_dir (str): The directory of the stage tables.
+    - input_tables (list): The input tables of the task's TRANSFORM_SQL.
+    - output_path (str): The output table path.
+    - state_path (str): The path of the `incremental_meta` state table.
+
+    Methods:
+    - last_versions(self): Returns the last processed version of each source.
+    - current_versions(self): Returns the latest version of each source.
+    - run(self, sql, versions, d0, d1): Recomputes and merges the keys changed since the last run, or returns the windows to rerun.
+    - recompute_dates(self, end, d0, d1): Returns the window and the days the sources changed since the last run.
+    - commit(self, start, end, changes, keys): Records the processed versions.
+    """
+
+    def __init__(self, sc, task, key, sources, filters, input_dir, input_tables, output_path, blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
+        """
+        Initializes the incremental output.
+
+        Parameters:
+        - sc (SparkSession): The SparkSession object.
+        - task (str): The output task name.
+        - key (str): The output key column.
+        - sources (dict): The affected keys query of each source stage table.
+        - filters (dict): The key column of each input table restricted to the affected keys.
+        - input_dir (str): The directory of the stage tables.
+        - input_tables (list): The input tables of the task's TRANSFORM_SQL.
+        - output_path (str): The output table path.
+        - blob_prefix (str): The prefix to be appended to the state table path (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
+        """
+        self.sc = sc
+        self.task = task
+        self.key = key
+        self.sources = sources
+        self.filters = filters
+        self.input_dir = input_dir
+        self.input_tables = input_tables
+        self.output_path = output_path
+        self.state_path = os.path.join(INCREMENTAL_META_DIR, blob_prefix, 'incremental_meta')
+
+    def last_versions(self):
+        """
+        Returns the last processed version of each source.
+
+        Returns:
+        - dict: The version of each source with a recorded run.
+        """
+        try:
+            df = self.sc.read.format('delta').load(self.state_path)
+        except captured.AnalysisException:
+            return {}
+
+        rows = df \
+            .where(F.col('task') == self.task) \
+            .groupBy('source') \
+            .agg(F.max('end_version').alias('version')) \
+            .collect()
+
+        return {r.source: r.version for r in rows}
+
+    def current_versions(self):
+        """
+        Returns the latest version of each source.
+
+        Returns:
+        - dict: The latest commit version of each source stage table.
+        """
+        return {
+            source: DeltaTable.forPath(self.sc, os.path.join(self.input_dir, source)).history(1).first().version
+            for source in self.sources
+        }
+
+    def recompute_dates(self, end, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1)):
+        """
+        Returns the days a table derived by day from the sources recomputes: its window and the days the sources changed.
+
+        Only the partition columns of the change feeds since the recorded versions are read.
+        Without recorded versions only the window is recomputed; the returned start versions
+        are then empty.
+
+        Parameters:
+        - end (dict): The latest version of each source, see `current_versions`.
+        - d0 (datetime.date): The end date of the window (default: today's date).
+        - d1 (datetime.date): The start date of the window (default: yesterday's date).
+
+        Returns:
+        - tuple: The first version read of each source, and the sorted days to recompute.
+
+        Raises:
+        - Exception: If the change feed since a recorded version isn't readable, e.g. once vacuumed.
+        """
+        dates = set(date_range(d0, d1))
+        last = self.last_versions()
+        if set(last) != set(self.sources):
+            logger.info(f'ETL Pipeline | Incremental | {self.task} Has No Recorded Versions')
+            return {}, sorted(dates)
+
+        start = {source: last[source] + 1 for source in self.sources}
+        for source in self.sources:
+            if start[source] > end[source]:
+                continue
+
+            try:
+                partitions = self.sc.read \
+                    .format('delta') \
+                    .option('readChangeFeed', 'true') \
+                    .option('startingVersion', start[source]) \
+                    .option('endingVersion', end[source]) \
+                    .load(os.path.join(self.input_dir, source)) \
+                    .select('year', 'month', 'day') \
+                    .distinct() \
+                    .collect()
+            except Exception:
+                logger.error(f'ETL Pipeline | Incremental | {self.task} | {source} Change Data Feed Not Readable from Version {start[source]}, Backfill the Task and Clear Its Versions')
+                raise
+            dates.update(affected_dates([tuple(r) for r in partitions], margin_days=0))
+
+        logger.info(f'ETL Pipeline | Incremental | {self.task} | Recomputing {len(dates)} Days')
+        return start, sorted(dates)
+
+    def _changes(self, source, start, end):
+        """
+        Registers the net changes of a source between two versions as the `<source>__changes` view.
+
+        Rows are grouped on their content, and those deleted and inserted as often, e.g. the
+        unchanged rows of a partition rewritten by the local backend, are left out.
+
+        Parameters:
+        - source (str): The source stage table.
+        - start (int): The first version read.
+        - end (int): The last version read.
+
+        Returns:
+        - DataFrame: The changed rows.
+        """
+        df = self.sc.read \
+            .format('delta') \
+            .option('readChangeFeed', 'true') \
+            .option('startingVersion', start) \
+            .option('endingVersion', end) \
+            .load(os.path.join(self.input_dir, source))
+
+        inserted = F.col('_change_type').isin('insert', 'update_postimage').cast('long')
+        df = df \
+            .groupBy(*[c for c in df.columns if c not in CHANGE_COLUMNS]) \
+            .agg(F.sum(2 * inserted - 1).alias('_net')) \
+            .where(F.col('_net') != 0)
+
+        df.createOrReplaceTempView(f'{source}__changes')
+        return df
+
+    def _inputs(self, predicate, keys=None):
+        """
+        Registers the input tables restricted to the affected days, and keys where filtered.
+
+        Filtered tables are only read from the files whose Bloom filter may hold an
+        affected key, see `spark_bloom.prefilter`.
+
+        Parameters:
+        - predicate (str): The partition predicate of the affected days.
+        - keys (DataFrame): The affected keys, or None before they are known.
+        """
+        for table in self.input_tables:
+            path = os.path.join(self.input_dir, table)
+            if keys is not None and table in self.filters:
+                column = self.filters[table]
+                df = prefilter(self.sc, path, column, keys, predicate) \
+                    .join(F.broadcast(keys.withColumnRenamed(self.key, column)), column, 'left_semi')
+            else:
+                df = self.sc.read.format('delta').load(path).where(predicate)
+            df.createOrReplaceTempView(table)
+
+    def _extent(self, keys, dates, max_days=INCREMENTAL_MAX_KEY_DAYS):
+        """
+        Registers the input tables of the affected keys over days widened to hold all their rows.
+
+        The days are widened around every day of a key's rows whose neighbouring day isn't read,
+        until the filtered input tables have no rows on the edge of the days read.
+
+        Parameters:
+        - keys (DataFrame): The affected keys.
+        - dates (list): The affected days.
+        - max_days (int): The most days the affected days are widened by (default: INCREMENTAL_MAX_KEY_DAYS).
+
+        Returns:
+        - list or None: The days read, or None if a key still has rows on their edge.
+        """
+        dates = set(dates)
+        for _ in range(max_days + 1):
+            self._inputs(date_partition_filter(dates) or 'FALSE', keys)
+
+            partitions = set()
+            for table in self.filters:
+                if table in self.input_tables:
+                    partitions.update(tuple(r) for r in self.sc.table(table).select('year', 'month', 'day').distinct().collect())
+
+            one_day = datetime.timedelta(1)
+            edges = [d for d in affected_dates(partitions, margin_days=0) if d - one_day not in dates or d + one_day not in dates]
+            if not edges:
+                return sorted(dates)
+
+            dates.update(affected_dates([(d.year, d.month, d.day) for d in edges]))
+
+        return None
+
+    def _merge(self, df, keys, predicate):
+        """
+        Replaces the output rows of the affected keys in one MERGE.
+
+        The source holds a delete marker per affected key and the recomputed rows, so keys
+        with several rows, or no row left, are replaced as a whole.
+
+        Parameters:
+        - df (DataFrame): The recomputed rows.
+        - keys (DataFrame): The affected keys.
+        - predicate (str): The partition predicate of the target rows of the affected keys.
+        """
+        columns = df.columns
+        source = df.withColumn('_action', F.lit('insert')) \
+            .unionByName(keys.withColumn('_action', F.lit('delete')), allowMissingColumns=True)
+
+        # Output columns added since the table was created are added by the merge
+        with schema_auto_merge(self.sc):
+            DeltaTable.forPath(self.sc, self.output_path).alias('t') \
+                .merge(source.alias('s'), f"s._action = 'delete' AND t.{self.key} = s.{self.key} AND ({predicate})") \
+                .whenMatchedDelete() \
+                .whenNotMatchedInsert(condition="s._action = 'insert'", values={c: f's.`{c}`' for c in columns}) \
+                .execute()
+
+    def commit(self, start, end, changes=None, keys=None):
+        """
+        Appends the processed versions of the sources to the `incremental_meta` state table.
+
+        Parameters:
+        - start (dict): The first version read of each source.
+        - end (dict): The last version processed of each source.
+        - changes (dict): The changed rows of each source (default: None).
+        - keys (int): The affected keys (default: None).
+        """
+        now = datetime.datetime.utcnow()
+        records = [{
+            'task': self.task,
+            'source': source,
+            'start_version': start.get(source),
+            'end_version': version,
+            'changes': (changes or {}).get(source),
+            'keys': keys,
+            'app_id': self.sc.sparkContext.applicationId,
+            'timestamp': now,
+            'year': f'{now.year}',
+            'month': f'{now.month:02d}',
+            'day': f'{now.day:02d}'
+        } for source, version in end.items()]
+
+        logger.info(f'ETL Pipeline | Load | Recording {self.task} Source Versions {end}')
+        self.sc.createDataFrame(records, schema=INCREMENTAL_META_SCHEMA) \
+            .write \
+            .format('delta') \
+            .partitionBy('year', 'month', 'day') \
+            .mode('append') \
+            .save(self.state_path)
+
+    def run(self, sql, versions=None, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1)):
+        """
+        Recomputes and merges the output keys changed since the last run.
+
+        When the changes can't be merged by key, the windows of the task's window run covering
+        them are returned instead; the versions are recorded by `commit(start, versions)` once
+        the caller reran them.
+
+        Parameters:
+        - sql (str): The task's TRANSFORM_SQL.
+        - versions (dict): The latest version of each source (default: the current versions).
+        - d0 (datetime.date): The end date of the bootstrap window (default: today's date).
+        - d1 (datetime.date): The start date of the bootstrap window (default: yesterday's date).
+
+        Returns:
+        - tuple or None: None if the changes were merged, else the first version read of each
+          source ({} when bootstrapping) and the (end date, start date) windows to rerun.
+
+        Raises:
+        - Exception: If the change feed since a recorded version isn't readable, e.g. once vacuumed.
+        """
+        last = self.last_versions()
+        if set(last) != set(self.sources) or not DeltaTable.isDeltaTable(self.sc, self.output_path):
+            logger.info(f'ETL Pipeline | Incremental | {self.task} Has No Recorded Versions')
+            return {}, [(d0, d1)]
+
+        end = versions or self.current_versions()
+        start = {source: last[source] + 1 for source in self.sources}
+        pending = [source for source in self.sources if start[source] <= end[source]]
+        if not pending:
+            logger.info(f'ETL Pipeline | Incremental | {self.task} Is Up To Date')
+            return None
+
+        try:
+            changes = {source: self._changes(source, start[source], end[source]).persist() for source in pending}
+            counts = {source: df.count() for source, df in changes.items()}
+        except Exception:
+            logger.error(f'ETL Pipeline | Incremental | {self.task} Change Data Feed Not Readable from Versions {start}, Backfill the Task and Clear Its Versions')
+            raise
+
+        keys = None
+        try:
+            partitions = set()
+            for df in changes.values():
+                partitions.update(tuple(r) for r in df.select('year', 'month', 'day').distinct().collect())
+            predicate = date_partition_filter(affected_dates(partitions)) or 'FALSE'
+            logger.info(f'ETL Pipeline | Incremental | {self.task} | {counts} Changed Rows | {len(partitions)} Partitions')
+
+            self._inputs(predicate)
+            queries = [self.sources[source].format(changes=f'{source}__changes') for source in pending]
+            keys = self.sc.sql(' UNION '.join(queries)).where(F.col(self.key).isNotNull()).distinct().persist()
+            n_keys = keys.count()
+
+            if n_keys:
+                dates = self._extent(keys, affected_dates(partitions))
+                if dates is None:
+                    windows = date_windows(affected_dates(partitions))
+                    logger.warning(f'ETL Pipeline | Incremental | {self.task} | Keys Span More Than {INCREMENTAL_MAX_KEY_DAYS} Days Beyond the Changes, Rerunning {len(windows)} Windows')
+                    return start, windows
+
+                df = self.sc.sql(sql)
+                self._merge(df, keys, date_partition_filter(dates, alias='t'))
+
+            self.commit(start, end, counts, n_keys)
+            logger.info(f'ETL Pipeline | Incremental | {self.task} | {n_keys} Keys Recomputed')
+        finally:
+            if keys is not None:
+                keys.unpersist()
+            for df in changes.values():
+                df.unpersist()
+
+        return None
@@ -0,0 +1,215 @@
+""" Object Store I/O Profiles
+
+Per cloud provider tuning of the object-store connectors, loaded from `conf/io/<provider>.yml`,
+shipped in the package as `spark_solutions/conf/io`.
+
+A profile holds Spark properties under `spark`, e.g. speculative execution of stragglers,
+and connector properties under `hadoop`: upload buffering, connection pools, retries
+and read-ahead of S3A, ABFS or the GCS connector. Profiles are merged over
+`conf/io/default.yml` and applied by `SparkConfig` for its CLOUD_PROVIDER.
+
+Example `conf/io/aws.yml`:
+    hadoop:
+      fs.s3a.fast.upload.buffer: disk
+      fs.s3a.connection.maximum: 200
+
+`io_benchmark` measures the AWS profile against the S3A defaults on an S3-compatible
+endpoint, e.g. a local MinIO with a `benchmark` bucket:
+
+    docker run -p 9000:9000 minio/minio server /data
+    mc alias set local http://localhost:9000 minioadmin minioadmin && mc mb local/benchmark
+    IO_BENCHMARK_ENDPOINT=http://localhost:9000 IO_BENCHMARK_BUCKET=benchmark io_benchmark
+"""
+
+from spark_solutions.common.spark_tuning import _load_yaml
+from pathlib import Path
+
+import importlib.resources
+import statistics
+import argparse
+import logging
+import time
+import json
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+CLOUD_PROVIDER=os.getenv('CLOUD_PROVIDER', 'LOCAL')
+SPARK_IO_PROFILE_ENABLED=os.getenv('SPARK_IO_PROFILE_ENABLED', 'true').lower() == 'true'
+IO_CONF_DIR=os.getenv('IO_CONF_DIR', str(importlib.resources.files('spark_solutions') / 'conf' / 'io'))
+IO_BENCHMARK_ENDPOINT=os.getenv('IO_BENCHMARK_ENDPOINT', 'http://localhost:9000')
+IO_BENCHMARK_BUCKET=os.getenv('IO_BENCHMARK_BUCKET', 'benchmark')
+IO_BENCHMARK_ACCESS_KEY=os.getenv('IO_BENCHMARK_ACCESS_KEY', 'minioadmin')
+IO_BENCHMARK_SECRET_KEY=os.getenv('IO_BENCHMARK_SECRET_KEY', 'minioadmin')
+
+class SparkIO():
+    """
+    Applies the object-store I/O profile of a cloud provider.
+
+    Attributes:
+    - provider (str): The cloud provider (AWS, AZURE, GCP or LOCAL).
+    - spark (dict): The Spark properties of the profile.
+    - hadoop (dict): The connector properties of the profile.
+
+    Methods:
+    - properties(self): Returns the builder properties of the profile.
+    - config_builder(self, _builder): Adds the profile to the SparkSession builder.
+    - config_session(self, sc): Sets the connector properties on the running session.
+    """
+
+    def __init__(self, provider=CLOUD_PROVIDER, conf_dir=IO_CONF_DIR, enabled=SPARK_IO_PROFILE_ENABLED):
+        """
+        Loads the provider profile merged over the default profile.
+
+        Parameters:
+        - provider (str): The cloud provider (default: CLOUD_PROVIDER).
+        - conf_dir (str): The directory of the profiles (default: IO_CONF_DIR).
+        - enabled (bool): Whether the profile is applied; LOCAL never applies one (default: SPARK_IO_PROFILE_ENABLED).
+        """
+        self.provider = provider
+        self.enabled = enabled and provider != 'LOCAL'
+        self.spark, self.hadoop = {}, {}
+        if not self.enabled:
+            return
+
+        default = _load_yaml(Path(conf_dir) / 'default.yml')
+        profile = _load_yaml(Path(conf_dir) / f'{provider.lower()}.yml')
+        self.spark = {**(default.get('spark') or {}), **(profile.get('spark') or {})}
+        self.hadoop = {**(default.get('hadoop') or {}), **(profile.get('hadoop') or {})}
+
+    @staticmethod
+    def _value(v):
+        return str(v).lower() if isinstance(v, bool) else str(v)
+
+    def properties(self):
+        """
+        Returns the builder properties of the profile, the connector ones prefixed with `spark.hadoop.`.
+
+        Returns:
+        - dict: The property values, as strings.
+        """
+        return {
+            **{k: self._value(v) for k, v in self.spark.items() if v is not None},
+            **{f'spark.hadoop.{k}': self._value(v) for k, v in self.hadoop.items() if v is not None}
+        }
+
+    def config_builder(self, _builder):
+        """
+        Adds the profile to the SparkSession builder.
+
+        Parameters:
+        - _builder: The SparkSession builder object.
+
+        Returns:
+        - SparkSession.Builder: The configured SparkSession builder object.
+        """
+        for k, v in self.properties().items():
+            _builder = _builder.config(k, v)
+
+        return _builder
+
+    def config_session(self, sc):
+        """
+        Sets the connector properties on the Hadoop configuration of the running session.
+
+        File systems already opened keep their properties, so this is applied before the
+        first read or write.
+
+        Parameters:
+        - sc: The SparkSession object.
+        """
+        if not self.enabled:
+            return
+
+        logger.info(f'Applying Object Store I/O Profile {self.provider}')
+        for k, v in self.hadoop.items():
+            if v is not None:
+                sc._jsc.hadoopConfiguration().set(k, self._value(v))
+
+def benchmark(sc, path, hadoop=None, rows=10000000, files=16, repeat=3):
+    """
+    Times Delta writes and reads of an object-store path with connector properties.
+
+    The properties are set for the session's queries with the file system cache
+    disabled, so each variant opens its own connector.
+
+    Parameters:
+    - sc: The SparkSession object.
+    - path (str): The benchmark table path, e.g. `s3a://benchmark/profile`.
+    - hadoop (dict): The connector properties (default: None, the connector defaults).
+    - rows (int): The rows written (default: 10000000).
+    - files (int): The files written (default: 16).
+    - repeat (int): The timed runs of each operation (default: 3).
+
+    Returns:
+    - dict: The median seconds of `write`, `scan` & `select`, and the rows and bytes per run.
+    """
+    scheme = path.split('://', 1)[0]
+    sc.conf.set(f'fs.{scheme}.impl.disable.cache', 'true')
+    for k, v in (hadoop or {}).items():
+        sc.conf.set(k, SparkIO._value(v))
+
+    df = sc.range(rows, numPartitions=files) \
+        .selectExpr('id', 'CAST(id % 1000 AS STRING) game_token', 'SHA2(CAST(id AS STRING), 256) payload', 'RAND() * 100 damage')
+
+    timings = {'write': [], 'scan': [], 'select': []}
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        df.write.format('delta').mode('overwrite').save(path)
+        timings['write'].append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        sc.read.format('delta').load(path).selectExpr('COUNT(*)', 'MAX(LENGTH(payload))').collect()
+        timings['scan'].append(time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        sc.read.format('delta').load(path).where("game_token = '7'").selectExpr('SUM(damage)').collect()
+        timings['select'].append(time.perf_counter() - t0)
+
+    size = sc.sql(f'DESCRIBE DETAIL delta.`{path}`').first()['sizeInBytes']
+    for k in (hadoop or {}):
+        sc.conf.unset(k)
+
+    return {**{k: statistics.median(v) for k, v in timings.items()}, 'rows': rows, 'bytes': size}
+
+def entrypoint(argv=None):
+    """
+    Entry point benchmarking the AWS I/O profile against the S3A defaults on an S3-compatible endpoint.
+
+    Parameters:
+    - argv (list): The command line arguments (default: None, sys.argv).
+    """
+    from spark_solutions.common.spark_config import SparkConfig
+    from pyspark.sql import SparkSession
+    from delta import configure_spark_with_delta_pip
+
+    parser = argparse.ArgumentParser(description='Benchmark the AWS I/O profile against the S3A defaults.')
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--files', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    _builder = SparkSession.builder \
+        .master(SparkConfig.SPARK_MASTER) \
+        .appName('io_benchmark') \
+        .config('spark.sql.extensions', 'io.delta.sql.DeltaSparkSessionExtension') \
+        .config('spark.sql.catalog.spark_catalog', 'org.apache.spark.sql.delta.catalog.DeltaCatalog') \
+        .config('spark.hadoop.fs.s3a.endpoint', IO_BENCHMARK_ENDPOINT) \
+        .config('spark.hadoop.fs.s3a.path.style.access', 'true') \
+        .config('spark.hadoop.fs.s3a.connection.ssl.enabled', str(IO_BENCHMARK_ENDPOINT.startswith('https')).lower()) \
+        .config('spark.hadoop.fs.s3a.access.key', IO_BENCHMARK_ACCESS_KEY) \
+        .config('spark.hadoop.fs.s3a.secret.key', IO_BENCHMARK_SECRET_KEY) \
+        .config('spark.hadoop.fs.s3a.aws.credentials.provider', 'org.apache.hadoop.fs.s3a.SimpleAWSCredentialsProvider')
+    sc = configure_spark_with_delta_pip(_builder, extra_packages=SparkConfig.PROVIDER_MAVEN_COORDINATES['AWS']).getOrCreate()
+
+    profile = SparkIO('AWS', enabled=True)
+    results = {}
+    for variant, hadoop in (('default', None), ('aws', profile.hadoop)):
+        results[variant] = benchmark(sc, f's3a://{IO_BENCHMARK_BUCKET}/io_benchmark/{variant}', hadoop, args.rows, args.files, args.repeat)
+        logger.info(f'I/O Benchmark | {variant} | ' + ' | '.join(f'{k} {results[variant][k]:.2f}s' for k in ('write', 'scan', 'select')))
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    entrypoint()
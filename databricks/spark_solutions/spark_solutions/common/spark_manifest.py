@@ -0,0 +1,150 @@
+""" Stage ETL Manifest
+
+Builds the `etl_manifest` of the stage tables and reads the late batches of the output windows with it.
+
+Stage loads call `build_etl_manifest` after their write: the rows of the loaded window are
+read back with their data file and grouped by file and `etl_id`, replacing the table's
+manifest rows of the window. See `spark_solutions.readers.etl_manifest` for the manifest
+and the Spark-free lookups.
+
+`extract_manifest_tables` registers the input tables of an output task over its window,
+plus the rows of the batches of the `etl_meta` window that landed outside it, up to
+ETL_MANIFEST_LATE_DAYS days before or after it. The output loads MERGE those rows by key,
+see `spark_misc.load_window`.
+"""
+
+from spark_solutions.common.spark_bloom import FILE_PATTERN, read_files
+from spark_solutions.common.spark_misc import date_partition_filter, date_range, extract_partitioned_tables, read_partitioned_table
+from spark_solutions.readers.etl_manifest import candidate_files, late_files, manifest_path
+from pyspark.sql.types import StructType, StructField, StringType, LongType
+from pyspark.errors.exceptions import captured
+from pyspark.sql import functions as F
+
+import datetime
+import logging
+import re
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+ETL_MANIFEST_ENABLED=os.getenv('ETL_MANIFEST_ENABLED', 'true').lower() == 'true'
+ETL_MANIFEST_LATE_DAYS=int(os.getenv('ETL_MANIFEST_LATE_DAYS', '7'))
+
+ETL_MANIFEST_SCHEMA = StructType([
+    StructField('table_name', StringType()),
+    StructField('etl_id', StringType()),
+    StructField('path', StringType()),
+    StructField('num_rows', LongType()),
+    StructField('min_msg_id', StringType()),
+    StructField('max_msg_id', StringType()),
+    StructField('year', StringType()),
+    StructField('month', StringType()),
+    StructField('day', StringType())
+])
+
+def late_dates(d0, d1, days=ETL_MANIFEST_LATE_DAYS):
+    """
+    Returns the dates searched for the late rows of a window.
+
+    Parameters:
+    - d0 (datetime.date): The end date of the window.
+    - d1 (datetime.date): The start date of the window.
+    - days (int): The days searched before and after the window (default: ETL_MANIFEST_LATE_DAYS).
+
+    Returns:
+    - list: The dates within `days` of the window, outside it.
+    """
+    window = set(date_range(d0, d1))
+    return [d for d in date_range(d0 + datetime.timedelta(days), d1 - datetime.timedelta(days)) if d not in window]
+
+def build_etl_manifest(sc, table_name, base_dir, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1)):
+    """
+    Builds the manifest rows of the data files of a stage table's window.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    - table_name (str): The stage table name, with an `etl_id` column.
+    - base_dir (str): The stage directory.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    """
+    if not ETL_MANIFEST_ENABLED:
+        return
+
+    logger.info(f'ETL Pipeline | Load | Building {table_name} ETL Manifest')
+    path = os.path.join(base_dir, table_name)
+    df = read_partitioned_table(sc, path, d0, d1)
+    msg_id = F.col('msg_id').cast('string') if 'msg_id' in df.columns else F.lit(None).cast('string')
+
+    df \
+        .withColumn('path', F.regexp_extract(F.input_file_name(), FILE_PATTERN, 1)) \
+        .groupBy('etl_id', 'path', 'year', 'month', 'day') \
+        .agg(F.count(F.lit(1)).alias('num_rows'), F.min(msg_id).alias('min_msg_id'), F.max(msg_id).alias('max_msg_id')) \
+        .withColumn('table_name', F.lit(table_name)) \
+        .select(*[F.col(f.name).cast(f.dataType) for f in ETL_MANIFEST_SCHEMA.fields]) \
+        .write \
+        .format('delta') \
+        .partitionBy('year', 'month', 'day') \
+        .mode('overwrite') \
+        .option('replaceWhere', f"table_name = '{table_name}' AND ({date_partition_filter(date_range(d0, d1))})") \
+        .save(manifest_path(path))
+
+def extract_manifest_tables(sc, input_dir, input_tables, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1)):
+    """
+    Extracts the input tables of an output task over its window, with the late rows of its batches.
+
+    The rows of the batches of the `etl_meta` window that landed in the partitions of
+    `late_dates` are read from the files holding them, see `readers.etl_manifest`, and added
+    to the window's rows; `etl_meta` itself is only read over the window. Without a
+    manifest only the window is read.
+
+    Parameters:
+    - sc (SparkSession): The SparkSession object.
+    - input_dir (str): The stage directory of the input Delta tables.
+    - input_tables (list): The task's INPUT_TABLES.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    """
+    for table in input_tables:
+        extract_partitioned_tables(sc, os.path.join(input_dir, table), d0, d1)
+
+    etl_meta = read_partitioned_table(sc, os.path.join(input_dir, 'etl_meta'), d0, d1)
+    dates = late_dates(d0, d1)
+    if not ETL_MANIFEST_ENABLED or etl_meta is None or not dates:
+        return
+
+    try:
+        manifest = sc.read.format('delta').load(manifest_path(os.path.join(input_dir, 'etl_meta')))
+    except captured.AnalysisException:
+        return
+
+    etl_ids = F.broadcast(etl_meta.select('etl_id').distinct())
+    window = {(f'{d.year}', f'{d.month:02d}', f'{d.day:02d}') for d in date_range(d0, d1)}
+    rows = manifest \
+        .where(F.col('table_name').isin([t for t in input_tables if t != 'etl_meta'])) \
+        .where(date_partition_filter(dates)) \
+        .join(etl_ids, 'etl_id', 'left_semi') \
+        .select('table_name', 'path', 'year', 'month', 'day') \
+        .collect()
+
+    for table in input_tables:
+        late = late_files([r.asDict() for r in rows if r['table_name'] == table], window)
+        if not late:
+            continue
+
+        path = os.path.join(input_dir, table)
+        predicate = date_partition_filter(sorted({datetime.date(int(y), int(m), int(d)) for y, m, d in late.values()}))
+        indexed = [r['path'] for r in manifest.where(F.col('table_name') == table).where(predicate).select('path').collect()]
+
+        df = sc.read.format('delta').load(path)
+        matches = [re.search(FILE_PATTERN, f) for f in df.where(predicate).inputFiles()]
+        files = [match.group(1) for match in matches if match]
+
+        candidates = candidate_files(files, late, indexed)
+        logger.info(f'ETL Pipeline | Extract | {path} | {len(candidates)} Late Files in {len(set(late.values()))} Partitions')
+        if not candidates:
+            continue
+
+        late_df = read_files(df, candidates, predicate).join(etl_ids, 'etl_id', 'left_semi')
+        sc.table(table).unionByName(late_df).createOrReplaceTempView(table)
@@ -0,0 +1,466 @@
+from pyspark.sql.types import StructType, StructField, StringType, LongType, DoubleType, TimestampType, ArrayType
+from pyspark.java_gateway import ensure_callback_server_started
+from contextlib import contextmanager
+
+import threading
+import datetime
+import logging
+import uuid
+import time
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+CLOUD_PROVIDER=os.getenv('CLOUD_PROVIDER', 'LOCAL')
+RUN_METRICS_ENABLED=os.getenv('RUN_METRICS_ENABLED', 'true').lower() == 'true'
+RUN_META_DIR=os.getenv('RUN_META_DIR', os.getenv('STAGE_DIR'))
+
+# Listener bus queue of the run metrics listener
+RUN_METRICS_QUEUE = 'runMetrics'
+
+METRIC_FIELDS = [
+    'stage_count', 'task_count',
+    'records_read', 'bytes_read',
+    'records_written', 'bytes_written',
+    'shuffle_records_read', 'shuffle_bytes_read',
+    'shuffle_records_written', 'shuffle_bytes_written',
+    'memory_bytes_spilled', 'disk_bytes_spilled',
+    'executor_run_time_ms', 'jvm_gc_time_ms',
+    'max_task_ms', 'median_task_ms'
+]
+
+_PHASE_SCHEMA = StructType(
+    [StructField('phase', StringType()), StructField('seconds', DoubleType())] +
+    [StructField(f, LongType()) for f in METRIC_FIELDS] +
+    [StructField('task_skew', DoubleType())]
+)
+
+RUN_META_SCHEMA = StructType(
+    [
+        StructField('run_id', StringType()),
+        StructField('app_name', StringType()),
+        StructField('app_id', StringType()),
+        StructField('cloud_provider', StringType()),
+        StructField('status', StringType()),
+        StructField('run_start', TimestampType()),
+        StructField('run_end', TimestampType()),
+        StructField('seconds', DoubleType())
+    ] +
+    [StructField(f, LongType()) for f in METRIC_FIELDS] +
+    [
+        StructField('task_skew', DoubleType()),
+        StructField('phases', ArrayType(_PHASE_SCHEMA)),
+        StructField('year', StringType()),
+        StructField('month', StringType()),
+        StructField('day', StringType())
+    ]
+)
+
+class _PhaseMetrics():
+    """
+    Accumulates Spark stage & task metrics attributed to a single ETL phase.
+
+    Attributes:
+    - name (str): The ETL phase name (Extract, Transform, Load).
+    - seconds (float): Wall clock time spent in the phase.
+    - totals (dict): Summed stage metrics keyed by METRIC_FIELDS.
+    - task_stats (dict): The task count, median & max task run time in milliseconds keyed by stage id.
+    """
+
+    def __init__(self, name):
+        """
+        Initializes the phase accumulator.
+
+        Parameters:
+        - name (str): The ETL phase name.
+        """
+        self.name = name
+        self.seconds = 0.0
+        self.totals = {f: 0 for f in METRIC_FIELDS}
+        self.task_stats = {}
+
+    def merge(self, other):
+        """
+        Merges another phase accumulator into this one.
+
+        Parameters:
+        - other (_PhaseMetrics): The accumulator to merge.
+        """
+        self.seconds += other.seconds
+        for f in METRIC_FIELDS:
+            self.totals[f] += other.totals[f]
+        self.task_stats.update(other.task_stats)
+
+    def task_skew(self):
+        """
+        Computes task skew as the worst max/median task duration ratio across stages.
+
+        Returns:
+        - float: The skew ratio, or 1.0 when no stage ran more than one task.
+        """
+        skew = 1.0
+        for count, median, longest in self.task_stats.values():
+            if count > 1 and median > 0:
+                skew = max(skew, longest / median)
+
+        return skew
+
+    def as_dict(self):
+        """
+        Summarises the phase as a flat dictionary.
+
+        Returns:
+        - dict: Phase metrics including task skew and duration percentiles.
+
+        The median task duration is the median of the stage medians, weighted by their task counts.
+        """
+        stats = list(self.task_stats.values())
+        totals = dict(self.totals)
+        totals['task_count'] = sum(count for count, _, _ in stats)
+        totals['max_task_ms'] = int(max((longest for _, _, longest in stats), default=0))
+        totals['median_task_ms'] = 0
+        seen = 0
+        for median, count in sorted((median, count) for count, median, _ in stats):
+            seen += count
+            if 2 * seen >= totals['task_count']:
+                totals['median_task_ms'] = int(median)
+                break
+
+        return dict(phase=self.name, seconds=self.seconds, task_skew=self.task_skew(), **totals)
+
+class RunMetricsListener():
+    """
+    Py4J implementation of `org.apache.spark.scheduler.SparkListenerInterface`.
+
+    Only stage completions are handled: the metrics are read once per stage from the
+    aggregated `StageInfo.taskMetrics()`, and the task run time quantiles from the task
+    summary of the application status store, so no task takes a Python round trip of its
+    own. Every other listener callback is a no-op. The listener runs on its own listener
+    bus queue, so events it is slow to handle never hold up or drop events of the
+    shared queue's listeners.
+
+    Py4J hands the JVM a new proxy for every call, so `removeSparkListener` can't match
+    a registered listener. A single listener is therefore registered per SparkContext,
+    see `shared_listener`, and routed to the active run.
+
+    Attributes:
+    - run_metrics (RunMetrics): The run collecting the events, None between runs.
+    """
+
+    def __init__(self, run_metrics=None):
+        """
+        Initializes the listener.
+
+        Parameters:
+        - run_metrics (RunMetrics): The run collecting the events (default: None).
+        """
+        self.run_metrics = run_metrics
+
+    def __getattr__(self, name):
+        if name.startswith('on'):
+            return lambda *args: None
+        raise AttributeError(name)
+
+    def onStageCompleted(self, stageCompleted):
+        """
+        Records the aggregated task metrics of a completed stage.
+
+        Parameters:
+        - stageCompleted (SparkListenerStageCompleted): The JVM stage completed event.
+        """
+        if not self.run_metrics:
+            return
+
+        info = stageCompleted.stageInfo()
+        m = info.taskMetrics()
+        if m is None:
+            return
+
+        self.run_metrics._record_tasks(info.stageId(), info.numTasks(), *self._task_quantiles(info))
+
+        input_metrics = m.inputMetrics()
+        output_metrics = m.outputMetrics()
+        shuffle_read = m.shuffleReadMetrics()
+        shuffle_write = m.shuffleWriteMetrics()
+        self.run_metrics._record_stage({
+            'stage_count': 1,
+            'records_read': input_metrics.recordsRead(),
+            'bytes_read': input_metrics.bytesRead(),
+            'records_written': output_metrics.recordsWritten(),
+            'bytes_written': output_metrics.bytesWritten(),
+            'shuffle_records_read': shuffle_read.recordsRead(),
+            'shuffle_bytes_read': shuffle_read.totalBytesRead(),
+            'shuffle_records_written': shuffle_write.recordsWritten(),
+            'shuffle_bytes_written': shuffle_write.bytesWritten(),
+            'memory_bytes_spilled': m.memoryBytesSpilled(),
+            'disk_bytes_spilled': m.diskBytesSpilled(),
+            'executor_run_time_ms': m.executorRunTime(),
+            'jvm_gc_time_ms': m.jvmGCTime()
+        }, {
+            'stage_id': info.stageId(),
+            'attempt': info.attemptNumber(),
+            'name': info.name(),
+            'num_tasks': info.numTasks(),
+            'duration_ms': info.completionTime().get() - info.submissionTime().get() if info.completionTime().isDefined() and info.submissionTime().isDefined() else None
+        })
+
+    def _task_quantiles(self, info):
+        """
+        Returns the median & max task run time of a stage attempt, from the task summary of the status store.
+
+        Parameters:
+        - info (StageInfo): The JVM stage info.
+
+        Returns:
+        - tuple: The median & max task run time in milliseconds, (0, 0) without a summary.
+        """
+        sc = self.run_metrics.sc.sparkContext
+        quantiles = sc._gateway.new_array(sc._gateway.jvm.double, 2)
+        quantiles[0], quantiles[1] = 0.5, 1.0
+        try:
+            summary = sc._jsc.sc().statusStore().taskSummary(info.stageId(), info.attemptNumber(), quantiles)
+        except Exception as exc:
+            logger.debug(f'No Task Summary of Stage {info.stageId()} {exc}')
+            return 0, 0
+
+        if summary.isEmpty():
+            return 0, 0
+
+        run_time = summary.get().executorRunTime()
+        return run_time.apply(0), run_time.apply(1)
+
+    class Java:
+        implements = ['org.apache.spark.scheduler.SparkListenerInterface']
+
+# The listener of each SparkContext, by application id
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+def shared_listener(sc):
+    """
+    Returns the run metrics listener of a SparkContext, registering it on first use.
+
+    Every SparkConfig of a driver, e.g. pipeline steps, backfill chunks, test sessions or
+    notebooks, shares the listener, so the listener bus calls back into Python once per
+    event however many runs the driver makes. It is added to its own RUN_METRICS_QUEUE
+    queue of the listener bus rather than the shared one.
+
+    Parameters:
+    - sc (SparkSession): The SparkSession object.
+
+    Returns:
+    - RunMetricsListener: The listener of the SparkContext.
+    """
+    app_id = sc.sparkContext.applicationId
+    with _listeners_lock:
+        if app_id not in _listeners:
+            ensure_callback_server_started(sc.sparkContext._gateway)
+            listener = RunMetricsListener()
+            sc.sparkContext._jsc.sc().listenerBus().addToQueue(listener, RUN_METRICS_QUEUE)
+            _listeners[app_id] = listener
+            logger.info(f'Registered Run Metrics Listener of {app_id}')
+
+        return _listeners[app_id]
+
+class RunMetrics():
+    """
+    Collects per run metrics for an ETL entrypoint.
+
+    Phases are timed with the `phase` context manager and any Spark stage completing
+    while a phase is active is attributed to it. When enabled, the shared
+    `RunMetricsListener` of the SparkContext is routed to the run to capture rows, bytes,
+    shuffle, spill, task skew and GC time. `save` appends one record per run to the `run_meta` Delta table.
+
+    Attributes:
+    - sc (SparkSession): The SparkSession object.
+    - run_id (str): Unique identifier of the run.
+    - enabled (bool): Whether the Spark listener is registered.
+    - profile (DriverProfile): The driver profile of a profiled run, see `spark_profile`.
+
+    Methods:
+    - phase(self, name): Context manager timing an ETL phase.
+    - stages(self): Returns the metrics of each completed stage.
+    - summary(self): Returns the run record as a dictionary.
+    - save(self, status='SUCCEEDED', blob_prefix=...): Appends the run record to `run_meta`.
+
+    Used as a context manager the run record is saved on exit, with a FAILED status
+    if the run raised, followed by the profiling bundle of a profiled run.
+    """
+
+    def __init__(self, sc, enabled=RUN_METRICS_ENABLED, profile=None):
+        """
+        Initializes the run and registers the Spark listener.
+
+        Parameters:
+        - sc (SparkSession): The SparkSession object.
+        - enabled (bool): Whether to register the Spark listener (default: RUN_METRICS_ENABLED).
+        - profile (DriverProfile): The driver profile of the run, written as a bundle on exit (default: None).
+        """
+        self.sc = sc
+        self.run_id = str(uuid.uuid4())
+        self.run_start = datetime.datetime.utcnow()
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._phases = {}
+        self._current = _PhaseMetrics('Unattributed')
+        self._stages = []
+        self._listener = None
+        self.profile = profile
+
+        if self.enabled:
+            self._register_listener()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.save(status='FAILED' if exc_type else 'SUCCEEDED')
+        except Exception as exc:
+            logger.warning(f'Unable to Save Run Meta {exc}')
+
+        if self.profile:
+            try:
+                self.profile.write(self, status='FAILED' if exc_type else 'SUCCEEDED')
+            except Exception as exc:
+                logger.warning(f'Unable to Write Profiling Bundle {exc}')
+
+        return False
+
+    def _register_listener(self):
+        """
+        Routes the shared Py4J listener of the SparkContext to this run.
+
+        A run started while another is attached takes the listener over. Failing to start
+        the callback server (e.g. restricted shared clusters) disables listener metrics
+        without failing the run.
+        """
+        try:
+            self._listener = shared_listener(self.sc)
+            if self._listener.run_metrics is not None:
+                logger.warning(f'Run Metrics Listener Taken Over from Run {self._listener.run_metrics.run_id}')
+            self._listener.run_metrics = self
+            logger.info(f'Attached Run Metrics Listener to Run {self.run_id}')
+        except Exception as exc:
+            logger.warning(f'Unable to Register Run Metrics Listener {exc}')
+            self._listener = None
+            self.enabled = False
+
+    def _unregister_listener(self):
+        """
+        Detaches the shared Py4J listener from this run, unless another run took it over.
+        """
+        if self._listener:
+            if self._listener.run_metrics is self:
+                self._listener.run_metrics = None
+            self._listener = None
+
+    def _record_tasks(self, stage_id, count, median_ms, max_ms):
+        with self._lock:
+            self._current.task_stats[stage_id] = (count, median_ms, max_ms)
+
+    def _record_stage(self, metrics, info=None):
+        with self._lock:
+            for k, v in metrics.items():
+                self._current.totals[k] += v
+            if info is not None:
+                self._stages.append(dict(info, phase=self._current.name, **metrics))
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Times an ETL phase and attributes Spark metrics to it.
+
+        Parameters:
+        - name (str): The ETL phase name (Extract, Transform, Load).
+        """
+        with self._lock:
+            previous, self._current = self._current, _PhaseMetrics(name)
+
+        t0 = time.perf_counter()
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._current.seconds = time.perf_counter() - t0
+                self._phases.setdefault(name, _PhaseMetrics(name)).merge(self._current)
+                self._current = previous
+
+            logger.info(f'ETL Pipeline | {name} | Completed in {self._phases[name].seconds:.2f}s')
+
+    def stages(self):
+        """
+        Returns the metrics of each completed stage.
+
+        Returns:
+        - list: The stage records, with `stage_id`, `attempt`, `name`, `num_tasks`, `duration_ms`, `phase` & METRIC_FIELDS totals.
+        """
+        with self._lock:
+            return [dict(s) for s in self._stages]
+
+    def summary(self, status='SUCCEEDED'):
+        """
+        Returns the run record.
+
+        Parameters:
+        - status (str): The final status of the run (default: 'SUCCEEDED').
+
+        Returns:
+        - dict: The run record matching RUN_META_SCHEMA.
+        """
+        run_end = datetime.datetime.utcnow()
+        with self._lock:
+            total = _PhaseMetrics('Total')
+            phases = [p for p in self._phases.values()] + [self._current]
+            for p in phases:
+                total.merge(p)
+            phase_records = [p.as_dict() for p in self._phases.values()]
+
+        record = total.as_dict()
+        record.pop('phase')
+        record.update({
+            'run_id': self.run_id,
+            'app_name': self.sc.sparkContext.appName,
+            'app_id': self.sc.sparkContext.applicationId,
+            'cloud_provider': CLOUD_PROVIDER,
+            'status': status,
+            'run_start': self.run_start,
+            'run_end': run_end,
+            'seconds': (run_end - self.run_start).total_seconds(),
+            'phases': phase_records,
+            'year': f'{self.run_start.year}',
+            'month': f'{self.run_start.month:02d}',
+            'day': f'{self.run_start.day:02d}'
+        })
+
+        return record
+
+    def save(self, status='SUCCEEDED', blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
+        """
+        Appends the run record to the `run_meta` Delta table next to `etl_meta`.
+
+        The listener is removed first so that the write itself isn't measured.
+
+        Parameters:
+        - status (str): The final status of the run (default: 'SUCCEEDED').
+        - blob_prefix (str): The prefix to be appended to the output directory paths (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
+
+        Returns:
+        - dict: The saved run record.
+        """
+        self._unregister_listener()
+        record = self.summary(status)
+        if not RUN_META_DIR:
+            logger.warning('RUN_META_DIR/ STAGE_DIR not set, skipping Run Meta')
+            return record
+
+        logger.info(f'ETL Pipeline | Metrics | Appending Run {self.run_id} to Run Meta Delta Table in {CLOUD_PROVIDER}')
+        self.sc.createDataFrame([record], schema=RUN_META_SCHEMA) \
+            .write \
+            .format('delta') \
+            .partitionBy('year', 'month', 'day') \
+            .mode('append') \
+            .save(os.path.join(RUN_META_DIR, blob_prefix, 'run_meta'))
+
+        return record
@@ -1,4 +1,8 @@
+from spark_solutions.common.spark_tuning import observe_input
+from spark_solutions.common.spark_cache import estimate_size, table_cache
 from pyspark.errors.exceptions import captured
+from contextlib import contextmanager
+from delta import DeltaTable
 
 import spark_solutions.common.service_account_credentials as creds
 import datetime
@@ -7,6 +11,12 @@ import os
 
 logger = logging.getLogger(f'py4j.{__name__}')
 
+# ENV Variables
+CHANGE_DATA_FEED_ENABLED=os.getenv('CHANGE_DATA_FEED_ENABLED', 'true').lower() == 'true'
+
+# Session conf letting a MERGE add the source columns missing from the target
+AUTO_MERGE_CONF = 'spark.databricks.delta.schema.autoMerge.enabled'
+
 def _read_table(sc, path, format):
     """
     Reads a table from the specified path.
@@ -30,39 +40,60 @@ def _read_table(sc, path, format):
         logger.warning(f'Reading Table Excpetion {exc}')
         return None
 
-def _extract_tables(sc, path, hot_paths, format):
+def date_range(d0, d1):
+    """
+    Returns the dates from the start date `d1` to the end date `d0`, both inclusive.
+
+    Parameters:
+    - d0 (datetime.date): The end date of the date range.
+    - d1 (datetime.date): The start date of the date range.
+
+    Returns:
+    - list: The dates of the range in ascending order.
+    """
+    return [d1 + datetime.timedelta(days=x) for x in range(0, (d0-d1).days+1)]
+
+def _extract_tables(sc, path, hot_paths, load, cache_key=None, sizes=None):
     """
-    Extracts tables from the specified paths and registers them as Spark tables.
+    Extracts a table and registers it as a Spark table.
 
-    This function iterates over the hot paths, reads tables from each path using the specified format,
-    and merges them into a single DataFrame. It then registers this DataFrame as a temporary Spark table.
+    This function loads the table with the given loader and registers the DataFrame as a
+    temporary Spark table. The hot paths are measured so the task's tuning profile can size
+    its unset properties.
+
+    With a `cache_key` the DataFrame is served from the driver's `table_cache`, so repeated
+    extracts of the same table and window within a driver read storage once. Reads relying
+    on INPUT_FILE_NAME() must not be cached.
 
     Parameters:
     - sc (SparkContext): The SparkContext object.
     - path (str): The base path containing the tables.
-    - hot_paths (list): List of paths to extract tables from.
-    - format (str): The format of the tables.
+    - hot_paths (list): List of paths the table is extracted from.
+    - load (callable): Returns the DataFrame of the hot paths, or None.
+    - cache_key (tuple): The table cache key (default: None, not cached).
+    - sizes (dict): The known bytes of hot paths (default: None, measured on storage).
 
     """
-    df = None
-    for p in hot_paths:
-        subset_df = _read_table(sc, p, format)
-        if not df and subset_df:
-            df = subset_df
-        elif subset_df:
-            df.union(subset_df)
+    observe_input(sc, hot_paths, sizes)
+
+    if cache_key:
+        df = table_cache.get_or_load(sc, cache_key, load)
+    else:
+        df = load()
 
     if df:
         logger.info(f'Registering Spark Table {os.path.split(path)[-1]}')
         df.createOrReplaceTempView(os.path.split(path)[-1])
 
-def extract_tables(sc, path, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), format='parquet'):
+def extract_tables(sc, path, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), format='parquet', files=None):
     """
     Extracts non-partitioned tables from the specified path.
 
     This function extracts non-partitioned tables from the specified path with the given date range.
-    It constructs the paths for each day within the date range based on the directory structure.
-    The tables are extracted using the _extract_tables function.
+    It constructs the paths for each day within the date range based on the directory structure,
+    reads the paths that exist and merges them into a single Spark table.
+
+    With `files`, e.g. from the RAW ledger, exactly those files are read and no directory is listed.
 
     Parameters:
     - sc (SparkContext): The SparkContext object.
@@ -70,20 +101,37 @@ def extract_tables(sc, path, d0=datetime.date.today(), d1=datetime.date.today()
     - d0 (datetime.date): The end date of the date range (default: today's date).
     - d1 (datetime.date): The start date of the date range (default: yesterday's date).
     - format (str): The format of the tables (default: 'parquet').
+    - files (dict): The data files of the date range with their sizes (default: None, the day directories are listed).
     """
+    if files is not None:
+        logger.info(f'Extracting {len(files)} Files of Non-Partioned Tables from {path}')
+        _extract_tables(sc, path, sorted(files), lambda: sc.read.format(format).load(sorted(files)) if files else None, sizes=files)
+        return
+
     logger.info(f'Extracting Non-Partioned Tables from {path}')
-    date_range = [d0 + datetime.timedelta(days=x) for x in range(0, (d0-d1).days+1)]
-    hot_paths = [f'{path}/{d.year}/{d.month:02d}/{d.day:02d}' for d in date_range]
+    hot_paths = [f'{path}/{d.year}/{d.month:02d}/{d.day:02d}' for d in date_range(d0, d1)]
 
-    _extract_tables(sc, path, hot_paths, format)
+    def load():
+        df = None
+        for p in hot_paths:
+            subset_df = _read_table(sc, p, format)
+            if df is None:
+                df = subset_df
+            elif subset_df:
+                df = df.unionByName(subset_df, allowMissingColumns=True)
 
-def extract_partitioned_tables(sc, path, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), format='delta'):
+        return df
+
+    _extract_tables(sc, path, hot_paths, load)
+
+def extract_partitioned_tables(sc, path, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), format='delta', dates=None):
     """
     Extracts partitioned tables from the specified path.
 
     This function extracts partitioned tables from the specified path with the given date range.
-    It constructs the paths for each day within the date range based on the partitioning scheme.
-    The tables are extracted using the _extract_tables function.
+    The table root is read and filtered on the `year`/`month`/`day` partitions of the range, as
+    Delta doesn't allow loading partition directories. The table is extracted through the
+    driver's table cache.
 
     Parameters:
     - sc (SparkContext): The SparkContext object.
@@ -91,10 +139,173 @@ def extract_partitioned_tables(sc, path, d0=datetime.date.today(), d1=datetime.d
     - d0 (datetime.date): The end date of the date range (default: today's date).
     - d1 (datetime.date): The start date of the date range (default: yesterday's date).
     - format (str): The format of the tables (default: 'delta').
+    - dates (list): The dates extracted instead of the date range (default: None).
+
+    Delta tables are sized from the add files of their snapshot kept by the partition
+    filter, rather than by listing the partition directories, which would count the files
+    removed but not vacuumed yet.
 
     """
     logger.info(f'Extracting Partioned Tables from {path}')
-    date_range = [d0 + datetime.timedelta(days=x) for x in range(0, (d0-d1).days+1)]
-    hot_paths = [f'{path}/year={d.year}/month={d.month:02d}/day={d.day:02d}' for d in date_range]
+    window = sorted(dates or date_range(d0, d1))
+    cache_key = (path, format, tuple(window)) if dates else (path, format, d0, d1)
+    load = lambda: read_partitioned_table(sc, path, d0, d1, format, dates)
+
+    if format != 'delta':
+        hot_paths = [f'{path}/year={d.year}/month={d.month:02d}/day={d.day:02d}' for d in window]
+        _extract_tables(sc, path, hot_paths, load, cache_key=cache_key)
+        return
+
+    df = load()
+    window_path = f'{path}#' + ','.join(d.isoformat() for d in window)
+    _extract_tables(sc, path, [window_path], lambda: df, cache_key=cache_key, sizes={window_path: estimate_size(df) if df else 0})
+
+def date_partition_filter(dates, alias=None):
+    """
+    Builds a SQL predicate selecting the `year`/`month`/`day` partitions of the given dates.
+
+    Partition values are cast to integers so the predicate matches both zero padded
+    string partitions (stage) and integer partitions (output) while remaining a
+    partition-only filter eligible for pruning.
+
+    Parameters:
+    - dates (list): The dates to select.
+    - alias (str): The table alias qualifying the partition columns, e.g. in a MERGE condition (default: None).
+
+    Returns:
+    - str: The SQL predicate.
+    """
+    p = f'{alias}.' if alias else ''
+    return ' OR '.join(
+        f'(CAST({p}year AS INT) = {d.year} AND CAST({p}month AS INT) = {d.month} AND CAST({p}day AS INT) = {d.day})'
+        for d in sorted(set(dates))
+    )
+
+def is_conflict(exc):
+    """Whether an exception is a Delta concurrent modification conflict."""
+    return 'Concurrent' in str(exc) or 'Concurrent' in type(exc).__name__
+
+def read_partitioned_table(sc, path, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), format='delta', dates=None):
+    """
+    Reads the partitions of a partitioned table within a date range.
+
+    Unlike `extract_partitioned_tables` the DataFrame is returned rather than
+    registered as a Spark table. The table root is loaded and filtered on the
+    partition columns, as Delta doesn't allow loading partition directories.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    - path (str): The base path containing the partitioned table.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    - format (str): The format of the table (default: 'delta').
+    - dates (list): The dates read instead of the date range (default: None).
+
+    Returns:
+    - DataFrame or None: The DataFrame of the date range, or None if the table cannot be read.
+    """
+    df = _read_table(sc, path, format)
+    if df is None:
+        return None
+
+    return df.where(date_partition_filter(dates or date_range(d0, d1)))
+
+def enable_change_data_feed(sc, path, enabled=CHANGE_DATA_FEED_ENABLED):
+    """
+    Enables the Change Data Feed of a Delta table, unless it is already enabled.
+
+    Streaming and incremental readers of the stage tables read their changes rather than
+    rescanning partitions. The table properties are only altered once, as altering them
+    conflicts with concurrent writes.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    - path (str): The Delta table path.
+    - enabled (bool): Whether the Change Data Feed is enabled (default: CHANGE_DATA_FEED_ENABLED).
+    """
+    if not enabled:
+        return
+
+    properties = sc.sql(f'DESCRIBE DETAIL delta.`{path}`').first().properties or {}
+    if properties.get('delta.enableChangeDataFeed') != 'true':
+        logger.info(f'Enabling Change Data Feed on {path}')
+        sc.sql(f"ALTER TABLE delta.`{path}` SET TBLPROPERTIES ('delta.enableChangeDataFeed' = 'true')")
+
+@contextmanager
+def schema_auto_merge(sc, enabled=True):
+    """
+    Enables the Delta schema auto merge of the session for the duration of a MERGE.
+
+    The previous value of the session conf is restored on exit, so other writes of the
+    session keep failing on unexpected columns.
+
+    Parameters:
+    - sc (SparkSession): The SparkSession object.
+    - enabled (bool): Whether auto merge is enabled, otherwise the conf is left as is (default: True).
+    """
+    if not enabled:
+        yield
+        return
+
+    previous = sc.conf.get(AUTO_MERGE_CONF, None)
+    sc.conf.set(AUTO_MERGE_CONF, 'true')
+    try:
+        yield
+    finally:
+        if previous is None:
+            sc.conf.unset(AUTO_MERGE_CONF)
+        else:
+            sc.conf.set(AUTO_MERGE_CONF, previous)
+
+def load_window(sc, df, path, keys, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), merge_schema=False, dates=None):
+    """
+    Loads the rows of an output window to a Delta table partitioned by event time.
+
+    Output rows are partitioned by their event time while the window selects the stage
+    partitions their rows landed in, so a row may fall on a day outside the window, e.g. a
+    message logged just before midnight that landed the next day. The partitions of the
+    window are replaced by the rows falling in them, while rows falling outside are merged
+    by key into their partitions, which keep their other rows. Reruns of a window are
+    idempotent.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    - df (DataFrame): The output rows, with `year`/`month`/`day` columns.
+    - path (str): The Delta table path.
+    - keys (list): The columns identifying an output row.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    - merge_schema (bool): Whether new columns are merged into the table schema (default: False).
+    - dates (list): The dates replaced instead of the date range (default: None).
+    """
+    window = date_partition_filter(dates or date_range(d0, d1))
+    df = df.persist()
+    try:
+        writer = df.where(window).write \
+            .format('delta') \
+            .partitionBy('year', 'month', 'day') \
+            .mode('overwrite') \
+            .option('replaceWhere', window)
+        if merge_schema:
+            writer = writer.option('mergeSchema', 'true')
+        writer.save(path)
+
+        # A MERGE fails on several source rows of a key
+        late = df.where(f'NOT COALESCE({window}, FALSE)').dropDuplicates(keys)
+        days = late.select('year', 'month', 'day').distinct().collect()
+        if not days:
+            return
+
+        partitions = [date_partition_filter([datetime.date(int(r.year), int(r.month), int(r.day)) for r in days if r.year is not None], alias='t')]
+        if any(r.year is None for r in days):
+            partitions.append('t.year IS NULL')
 
-    _extract_tables(sc, path, hot_paths, format)
\ No newline at end of file
+        logger.info(f'Merging Rows of {len(days)} Days Outside the Window into {path}')
+        with schema_auto_merge(sc, merge_schema):
+            DeltaTable.forPath(sc, path).alias('t') \
+                .merge(late.alias('s'), ' AND '.join([f't.{k} <=> s.{k}' for k in keys] + ['(' + ' OR '.join(p for p in partitions if p) + ')'])) \
+                .whenMatchedUpdateAll() \
+                .whenNotMatchedInsertAll() \
+                .execute()
+    finally:
+        df.unpersist()
@@ -0,0 +1,184 @@
+""" Output Previews
+
+Approximate runs of the output tasks over a consistent sample of their keys.
+
+A preview reads the same window as the output task but keeps only the keys whose MD5
+falls below PREVIEW_SAMPLE_RATE, e.g. the games of `game_metrics` or the messages of
+`message_flow`. Every sampled stage table is filtered on the same key, so the joins of the
+TRANSFORM_SQL see whole games or messages and the sampled rows are exact; only the keys
+are missing. The sampled rows are written with their `sample_weight` to the
+`<table>_preview` table next to the output.
+
+Additive metrics are estimated per day by scaling the sampled totals by 1 / rate. Keys
+are kept independently with probability `rate`, so the variance of an estimate is
+(1 - rate) / rate^2 times the sum of the squared totals of the sampled keys; the
+`error_bound` is PREVIEW_Z standard errors. Estimates are appended to `preview_meta`.
+
+The TRANSFORM_SQL runs once per preview: its sampled rows are cached for the preview
+write and the estimates, which are collected and written from the collected rows.
+"""
+
+from spark_solutions.common.spark_misc import extract_partitioned_tables, read_partitioned_table
+from pyspark.sql import functions as F
+
+import datetime
+import logging
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+PREVIEW_SAMPLE_RATE=float(os.getenv('PREVIEW_SAMPLE_RATE', '0.05'))
+PREVIEW_Z=float(os.getenv('PREVIEW_Z', '1.96'))
+
+assert(0 < PREVIEW_SAMPLE_RATE <= 1)
+
+PREVIEW_META_TABLE = 'preview_meta'
+
+# Hexadecimal digits of the key's MD5 compared with the rate
+SAMPLE_HEX_DIGITS = 8
+
+def sample_predicate(column, rate=PREVIEW_SAMPLE_RATE):
+    """
+    Returns the SQL predicate keeping a consistent sample of the values of a key column.
+
+    Parameters:
+    - column (str): The key column.
+    - rate (float): The fraction of the keys kept (default: PREVIEW_SAMPLE_RATE).
+
+    Returns:
+    - str: The predicate, the same for a key in every table.
+    """
+    threshold = int(rate * 16**SAMPLE_HEX_DIGITS)
+    return f'CAST(CONV(SUBSTR(MD5(CAST({column} AS STRING)), 1, {SAMPLE_HEX_DIGITS}), 16, 10) AS BIGINT) < {threshold}'
+
+def weighted_sql(view, rate=PREVIEW_SAMPLE_RATE):
+    """
+    Returns the SQL of the sampled rows of a view with their sample weight.
+
+    Parameters:
+    - view (str): The view of the sampled output rows.
+    - rate (float): The sample rate (default: PREVIEW_SAMPLE_RATE).
+
+    Returns:
+    - str: The query.
+    """
+    return f'SELECT *, CAST({1 / rate} AS DOUBLE) sample_weight FROM {view}'
+
+def estimate_sql(view, table_name, key, metrics, rate=PREVIEW_SAMPLE_RATE, z=PREVIEW_Z):
+    """
+    Returns the SQL of the daily estimates of additive metrics from sampled output rows.
+
+    Besides `metrics`, the number of rows is estimated as the 'rows' metric.
+
+    Parameters:
+    - view (str): The view of the sampled output rows.
+    - table_name (str): The output table name.
+    - key (str): The sampled key column.
+    - metrics (list): The additive metric columns.
+    - rate (float): The sample rate (default: PREVIEW_SAMPLE_RATE).
+    - z (float): The standard errors of the error bound (default: PREVIEW_Z).
+
+    Returns:
+    - str: The query of `table_name`, `metric`, `estimate`, `error_bound`, `sampled_keys` & `sample_rate` by day.
+    """
+    totals = ', '.join([f'SUM(CAST({m} AS DOUBLE)) _{m}' for m in metrics] + ['CAST(COUNT(*) AS DOUBLE) _rows'])
+    estimates = ' UNION ALL '.join(f"""
+        SELECT year, month, day, '{m}' metric,
+               SUM(_{m}) / {rate} estimate,
+               {z} * SQRT({1 - rate} * SUM(_{m} * _{m})) / {rate} error_bound,
+               COUNT(*) sampled_keys
+        FROM key_totals
+        GROUP BY year, month, day
+    """ for m in list(metrics) + ['rows'])
+
+    return f"""
+        WITH key_totals AS (
+            SELECT year, month, day, {key}, {totals}
+            FROM {view}
+            GROUP BY year, month, day, {key}
+        )
+        SELECT '{table_name}' table_name, metric, estimate, error_bound, sampled_keys,
+               CAST({rate} AS DOUBLE) sample_rate, year, month, day
+        FROM ({estimates}) estimates
+    """
+
+def log_estimates(estimates):
+    """
+    Logs preview estimates with their error bounds.
+
+    Parameters:
+    - estimates (iterable): The estimate rows, as dictionaries.
+    """
+    for e in estimates:
+        logger.info(f'ETL Pipeline | Preview | {e["table_name"]} | {e["year"]}-{e["month"]}-{e["day"]} | {e["metric"]} ~ {e["estimate"]:.1f} ± {e["error_bound"]:.1f} | {e["sampled_keys"]} Keys at {e["sample_rate"]:.2%}')
+
+def extract_sampled_tables(sc, input_dir, input_tables, sampled, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), rate=PREVIEW_SAMPLE_RATE):
+    """
+    Registers the input tables of an output task, sampled on their key where listed.
+
+    Parameters:
+    - sc (SparkSession): The SparkSession object.
+    - input_dir (str): The directory of the input Delta tables.
+    - input_tables (list): The task's INPUT_TABLES.
+    - sampled (dict): The key column of each sampled table; other tables are read whole.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    - rate (float): The sample rate (default: PREVIEW_SAMPLE_RATE).
+    """
+    for table in input_tables:
+        path = os.path.join(input_dir, table)
+        if table not in sampled:
+            extract_partitioned_tables(sc, path, d0, d1)
+            continue
+
+        logger.info(f'ETL Pipeline | Extract | Sampling {rate:.2%} of {table} on {sampled[table]}')
+        read_partitioned_table(sc, path, d0, d1) \
+            .where(sample_predicate(sampled[table], rate)) \
+            .createOrReplaceTempView(table)
+
+def load_preview(sc, view, table_name, key, metrics, output_dir, rate=PREVIEW_SAMPLE_RATE):
+    """
+    Writes the sampled rows of an output task to its preview table and their estimates to `preview_meta`.
+
+    Parameters:
+    - sc (SparkSession): The SparkSession object.
+    - view (str): The view of the sampled output rows.
+    - table_name (str): The output table name.
+    - key (str): The sampled key column.
+    - metrics (list): The additive metric columns.
+    - output_dir (str): The directory of the output tables.
+    - rate (float): The sample rate (default: PREVIEW_SAMPLE_RATE).
+
+    Returns:
+    - list: The estimate rows, as dictionaries.
+    """
+    # The sampled rows are computed once, for the preview and its estimates
+    sampled = sc.table(view).persist()
+    try:
+        sampled.createOrReplaceTempView(view)
+        sc.sql(weighted_sql(view, rate)) \
+            .write \
+            .format('delta') \
+            .partitionBy('year', 'month', 'day') \
+            .mode('overwrite') \
+            .option('partitionOverwriteMode', 'dynamic') \
+            .option('mergeSchema', 'true') \
+            .save(os.path.join(output_dir, f'{table_name}_preview'))
+
+        estimates = sc.sql(estimate_sql(view, table_name, key, metrics, rate)) \
+            .withColumn('timestamp', F.current_timestamp())
+        collected = estimates.collect()
+    finally:
+        sampled.unpersist()
+
+    sc.createDataFrame(collected, estimates.schema) \
+        .write \
+        .format('delta') \
+        .partitionBy('year', 'month', 'day') \
+        .mode('append') \
+        .save(os.path.join(output_dir, PREVIEW_META_TABLE))
+
+    rows = [r.asDict() for r in collected]
+    log_estimates(rows)
+    return rows
@@ -0,0 +1,376 @@
+""" Profiling Bundles
+
+On-demand profiling of the Spark entry points, enabled with PROFILE_ENABLED=true.
+
+Every entry point configures its session with `SparkConfig` and runs its phases in the
+`RunMetrics` context, so a profiled run needs no code change. `SparkConfig` starts a
+`DriverProfile` before the session is built and turns on the Spark event log; when the
+run exits, one `tar.gz` bundle is written to PROFILE_DIR:
+
+    manifest.json           run id, app, status, Python & Spark versions, Spark conf
+    run.json                the `run_meta` record, with the phase metrics
+    stages.json             per-stage metrics from the run metrics listener
+    driver.pstats           cProfile stats of the driver thread
+    driver_profile.txt      the PROFILE_TOP_N functions by cumulative time
+    tracemalloc.snapshot    tracemalloc snapshot of the driver
+    tracemalloc.txt         the PROFILE_TOP_N allocation sites by size
+    explain/<view>.txt      the extended EXPLAIN of each registered temporary view
+    eventlog/<file>         the Spark event log of the application
+
+The text members are stable across runs, so two bundles of a task diff cleanly:
+
+    profile_diff old.tar.gz new.tar.gz
+
+The profile only covers the driver thread running the entry point and the session
+the entry point registers its views in; views of isolated sessions, e.g. backfill
+chunks, aren't explained.
+"""
+
+from pathlib import Path
+
+import tracemalloc
+import argparse
+import platform
+import datetime
+import tempfile
+import difflib
+import logging
+import tarfile
+import cProfile
+import fsspec
+import pstats
+import json
+import io
+import os
+import re
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+PROFILE_ENABLED=os.getenv('PROFILE_ENABLED', 'false').lower() == 'true'
+PROFILE_DIR=os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'spark_profiles'))
+PROFILE_EVENT_LOG_DIR=os.getenv('PROFILE_EVENT_LOG_DIR', os.path.join(tempfile.gettempdir(), 'spark-events'))
+PROFILE_TOP_N=int(os.getenv('PROFILE_TOP_N', '100'))
+PROFILE_TRACEMALLOC_FRAMES=int(os.getenv('PROFILE_TRACEMALLOC_FRAMES', '1'))
+
+# Expression & exchange ids of Spark plans, which change from run to run
+_PLAN_IDS = re.compile(r'#\d+L?|\[id=#?\d+\]|plan_id=\d+|Subquery subquery#?\d+')
+
+# Spark properties redacted from the bundle, which is attached to tickets
+_REDACTED = re.compile(r'(?i)secret|password|token|credential|key')
+
+class DriverProfile():
+    """
+    Profiles the driver of a run with cProfile & tracemalloc.
+
+    Attributes:
+    - app_name (str): The Spark application name.
+    - profiler (cProfile.Profile): The driver thread profiler.
+
+    Methods:
+    - start(self): Starts cProfile & tracemalloc.
+    - config_builder(self, _builder): Turns on the Spark event log of a new session.
+    - stop(self): Stops profiling and returns the driver members of the bundle.
+    - write(self, run_metrics, status='SUCCEEDED', profile_dir=PROFILE_DIR): Writes the bundle of a run.
+    """
+
+    def __init__(self, app_name):
+        """
+        Initializes the profile.
+
+        Parameters:
+        - app_name (str): The Spark application name.
+        """
+        self.app_name = app_name
+        self.profiler = cProfile.Profile()
+        self._tracing = False
+
+    def start(self):
+        """
+        Starts cProfile on the current thread & tracemalloc, unless already tracing.
+
+        Returns:
+        - DriverProfile: The started profile.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            self._tracing = True
+
+        try:
+            self.profiler.enable()
+        except ValueError as exc:
+            logger.warning(f'Profiling | {self.app_name} | Unable to Start cProfile {exc}')
+        logger.info(f'Profiling | {self.app_name} | Driver Profiling Started')
+        return self
+
+    def config_builder(self, _builder):
+        """
+        Turns on the Spark event log of a new session in PROFILE_EVENT_LOG_DIR.
+
+        Parameters:
+        - _builder: The SparkSession builder object.
+
+        Returns:
+        - SparkSession.Builder: The configured SparkSession builder object.
+        """
+        if '://' not in PROFILE_EVENT_LOG_DIR:
+            os.makedirs(PROFILE_EVENT_LOG_DIR, exist_ok=True)
+
+        return _builder \
+            .config('spark.eventLog.enabled', 'true') \
+            .config('spark.eventLog.dir', PROFILE_EVENT_LOG_DIR if '://' in PROFILE_EVENT_LOG_DIR else Path(PROFILE_EVENT_LOG_DIR).as_uri())
+
+    def stop(self):
+        """
+        Stops profiling and returns the driver members of the bundle.
+
+        Returns:
+        - dict: The `driver.pstats`, `driver_profile.txt`, `tracemalloc.snapshot` & `tracemalloc.txt` contents by member name.
+        """
+        self.profiler.disable()
+        members = {}
+
+        with tempfile.TemporaryDirectory() as tmp:
+            self.profiler.dump_stats(os.path.join(tmp, 'driver.pstats'))
+            members['driver.pstats'] = Path(tmp, 'driver.pstats').read_bytes()
+
+            stream = io.StringIO()
+            pstats.Stats(os.path.join(tmp, 'driver.pstats'), stream=stream).strip_dirs().sort_stats('cumulative', 'name').print_stats(PROFILE_TOP_N)
+            members['driver_profile.txt'] = _strip_header(stream.getvalue()).encode()
+
+            if tracemalloc.is_tracing():
+                snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+                snapshot.dump(os.path.join(tmp, 'tracemalloc.snapshot'))
+                members['tracemalloc.snapshot'] = Path(tmp, 'tracemalloc.snapshot').read_bytes()
+                members['tracemalloc.txt'] = '\n'.join(str(s) for s in snapshot.statistics('lineno')[:PROFILE_TOP_N]).encode()
+
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+        return members
+
+    def write(self, run_metrics, status='SUCCEEDED', profile_dir=PROFILE_DIR):
+        """
+        Writes the profiling bundle of a run.
+
+        Parameters:
+        - run_metrics (RunMetrics): The run, with its SparkSession, record and stage metrics.
+        - status (str): The final status of the run (default: 'SUCCEEDED').
+        - profile_dir (str): The directory of the bundles (default: PROFILE_DIR).
+
+        Returns:
+        - str: The bundle path.
+        """
+        sc = run_metrics.sc
+        record = run_metrics.summary(status)
+        members = self.stop()
+        members['run.json'] = _json(record)
+        members['stages.json'] = _json(run_metrics.stages())
+        members.update(explain_views(sc))
+        members.update(event_logs(sc))
+        members['manifest.json'] = _json({
+            'app_name': self.app_name,
+            'app_id': record['app_id'],
+            'run_id': record['run_id'],
+            'status': status,
+            'run_start': record['run_start'],
+            'run_end': record['run_end'],
+            'python_version': platform.python_version(),
+            'spark_version': sc.version,
+            'spark_conf': {k: '*********(redacted)' if _REDACTED.search(k) else v for k, v in sorted(sc.sparkContext.getConf().getAll())},
+            'members': sorted(members)
+        })
+
+        path = os.path.join(profile_dir, f'{self.app_name}_{record["run_start"]:%Y%m%dT%H%M%S}_{record["run_id"][:8]}.tar.gz')
+        write_bundle(members, path)
+        logger.info(f'Profiling | {self.app_name} | Bundle of Run {record["run_id"]} Written to {path}')
+        return path
+
+def explain_views(sc):
+    """
+    Returns the extended EXPLAIN of each temporary view of a session.
+
+    Parameters:
+    - sc (SparkSession): The SparkSession object.
+
+    Returns:
+    - dict: The `explain/<view>.txt` contents by member name.
+    """
+    members = {}
+    for table in sc.catalog.listTables():
+        if not table.isTemporary:
+            continue
+
+        try:
+            plan = sc.sql(f'EXPLAIN EXTENDED TABLE `{table.name}`').first()[0]
+        except Exception as exc:
+            plan = f'Unable to Explain {table.name} {exc}'
+        members[f'explain/{table.name}.txt'] = plan.encode()
+
+    return members
+
+def event_logs(sc):
+    """
+    Returns the Spark event log files of the application, when the event log is enabled.
+
+    Parameters:
+    - sc (SparkSession): The SparkSession object.
+
+    Returns:
+    - dict: The `eventlog/<file>` contents by member name.
+    """
+    conf = sc.sparkContext.getConf()
+    if conf.get('spark.eventLog.enabled', 'false').lower() != 'true':
+        logger.warning('Profiling | Spark Event Log Disabled, Skipping Event Log')
+        return {}
+
+    app_id = sc.sparkContext.applicationId
+    members = {}
+    try:
+        fs, root = fsspec.core.url_to_fs(conf.get('spark.eventLog.dir', 'file:/tmp/spark-events'))
+        for f in fs.find(root):
+            if app_id in f:
+                with fs.open(f, 'rb') as fh:
+                    members[f'eventlog/{os.path.relpath(f, root)}'] = fh.read()
+    except Exception as exc:
+        logger.warning(f'Profiling | Unable to Read Spark Event Log {exc}')
+
+    return members
+
+def write_bundle(members, path):
+    """
+    Writes bundle members to a `tar.gz` archive, in name order.
+
+    Parameters:
+    - members (dict): The member contents by name.
+    - path (str): The archive path or URL.
+    """
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as tar:
+        for name in sorted(members):
+            info = tarfile.TarInfo(name)
+            info.size = len(members[name])
+            tar.addfile(info, io.BytesIO(members[name]))
+
+    fs, root = fsspec.core.url_to_fs(path)
+    fs.makedirs(os.path.dirname(root), exist_ok=True)
+    with fs.open(root, 'wb') as f:
+        f.write(buffer.getvalue())
+
+def read_bundle(path):
+    """
+    Reads the members of a bundle.
+
+    Parameters:
+    - path (str): The archive path or URL.
+
+    Returns:
+    - dict: The member contents by name.
+    """
+    with fsspec.open(path, 'rb') as f:
+        with tarfile.open(fileobj=io.BytesIO(f.read()), mode='r:gz') as tar:
+            return {m.name: tar.extractfile(m).read() for m in tar.getmembers() if m.isfile()}
+
+def diff_bundles(old, new, top=PROFILE_TOP_N):
+    """
+    Returns the differences of two bundles of a task.
+
+    Phase times & metrics, stage metrics grouped by phase and stage name, the driver
+    functions with the largest cumulative time change and the EXPLAIN of each view are
+    compared. Plan ids, which change from run to run, are ignored.
+
+    Parameters:
+    - old (dict): The members of the earlier bundle, see `read_bundle`.
+    - new (dict): The members of the later bundle.
+    - top (int): The driver functions reported (default: PROFILE_TOP_N).
+
+    Returns:
+    - str: The report.
+    """
+    lines = []
+    old_run, new_run = json.loads(old.get('run.json', b'{}')), json.loads(new.get('run.json', b'{}'))
+    lines.append(f'Run {old_run.get("run_id")} -> {new_run.get("run_id")}')
+    lines.append(_compare('Run', {'Total': old_run}, {'Total': new_run}))
+
+    phases = lambda run: {p['phase']: p for p in run.get('phases') or []}
+    lines.append(_compare('Phase', phases(old_run), phases(new_run)))
+
+    stages = lambda m: _group_stages(json.loads(m.get('stages.json', b'[]')))
+    lines.append(_compare('Stage', stages(old), stages(new)))
+
+    lines.append(_diff_functions(old, new, top))
+
+    for name in sorted(n for n in set(old) | set(new) if n.startswith('explain/')):
+        a, b = [_PLAN_IDS.sub('#', m.get(name, b'').decode()).splitlines() for m in (old, new)]
+        diff = list(difflib.unified_diff(a, b, f'old/{name}', f'new/{name}', lineterm='', n=1))
+        if diff:
+            lines += diff
+
+    return '\n'.join(l for l in lines if l)
+
+def diff_entrypoint(argv=None):
+    """
+    Entry point printing the differences of two profiling bundles.
+
+    Parameters:
+    - argv (list): The command line arguments (default: None, sys.argv).
+    """
+    parser = argparse.ArgumentParser(description='Diff two profiling bundles of a task.')
+    parser.add_argument('old', help='The earlier bundle.')
+    parser.add_argument('new', help='The later bundle.')
+    parser.add_argument('--top', type=int, default=PROFILE_TOP_N, help='The driver functions reported.')
+    args = parser.parse_args(argv)
+
+    print(diff_bundles(read_bundle(args.old), read_bundle(args.new), args.top))
+
+def _group_stages(stages):
+    """Sums the stage metrics by phase and stage name, so reruns with new stage ids compare."""
+    groups = {}
+    for s in stages:
+        group = groups.setdefault(f'{s.get("phase")} | {s.get("name")}', {})
+        for k, v in s.items():
+            if isinstance(v, (int, float)) and not isinstance(v, bool) and k not in ('stage_id', 'attempt'):
+                group[k] = group.get(k, 0) + v
+
+    return groups
+
+def _compare(label, old, new):
+    """Returns the changed numeric metrics of matching keys, and the added or removed keys."""
+    lines = []
+    for key in sorted(set(old) | set(new)):
+        if key not in old or key not in new:
+            lines.append(f'{label} {key} | {"Added" if key in new else "Removed"}')
+            continue
+
+        for metric, b in sorted(new[key].items()):
+            a = old[key].get(metric)
+            if isinstance(a, (int, float)) and isinstance(b, (int, float)) and not isinstance(b, bool) and a != b:
+                change = f' ({(b - a) / a:+.1%})' if a else ''
+                lines.append(f'{label} {key} | {metric} {a:g} -> {b:g}{change}')
+
+    return '\n'.join(lines)
+
+def _diff_functions(old, new, top):
+    """Returns the driver functions with the largest change of cumulative time."""
+    if 'driver.pstats' not in old or 'driver.pstats' not in new:
+        return ''
+
+    def cumulative(data):
+        with tempfile.TemporaryDirectory() as tmp:
+            Path(tmp, 'driver.pstats').write_bytes(data)
+            stats = pstats.Stats(os.path.join(tmp, 'driver.pstats')).strip_dirs().stats
+
+        return {f'{f}:{l}({n})': v[3] for (f, l, n), v in stats.items()}
+
+    a, b = cumulative(old['driver.pstats']), cumulative(new['driver.pstats'])
+    changes = sorted(set(a) | set(b), key=lambda k: -abs(b.get(k, 0) - a.get(k, 0)))[:top]
+    return '\n'.join(f'Driver {k} | cumtime {a.get(k, 0):.3f}s -> {b.get(k, 0):.3f}s' for k in changes if a.get(k, 0) != b.get(k, 0))
+
+def _strip_header(report):
+    """Drops the timestamped file header of a pstats report."""
+    return report[report.find('\n', report.find('driver.pstats')) + 1:] if 'driver.pstats' in report else report
+
+def _json(value):
+    """Returns stable JSON bytes of a bundle member."""
+    return json.dumps(value, indent=2, sort_keys=True, default=lambda v: v.isoformat() if isinstance(v, (datetime.date, datetime.datetime)) else str(v)).encode()
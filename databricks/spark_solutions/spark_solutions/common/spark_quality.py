@@ -0,0 +1,370 @@
+""" Stage Data Quality Expectations
+
+Declarative expectations evaluated while a stage table is written.
+
+Each expectation is a SQL condition every valid row satisfies, with a tolerated
+failure rate. Row failures are flagged in a single projection over the staged
+DataFrame, which is persisted so the metrics, the quarantine write and the stage
+write share one scan. Expectation metrics are aggregated from the persisted rows
+before the stage write, so an expectation with the 'fail' action raises before
+any row of the window is replaced.
+
+Example:
+    EXPECTATIONS = [
+        not_null('game_token'),
+        in_range('enemy_health_post', min_value=0),
+        references('msg_id', 'buffer_meta', quarantine=False),
+        duplicates(max_duplicate_ratio=0.01)
+    ]
+"""
+
+from spark_solutions.common.spark_misc import date_partition_filter, date_range, read_partitioned_table
+from pyspark.sql import functions as F
+from pyspark import StorageLevel
+
+import datetime
+import logging
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+CLOUD_PROVIDER=os.getenv('CLOUD_PROVIDER', 'LOCAL')
+DQ_ENABLED=os.getenv('DQ_ENABLED', 'true').lower() == 'true'
+
+class DataQualityError(Exception):
+    """Raised when an expectation with the 'fail' action isn't met."""
+
+class Expectation():
+    """
+    A declarative expectation over the rows of a table.
+
+    Attributes:
+    - name (str): The expectation name reported in metrics and quarantine rows.
+    - condition (str): SQL boolean expression satisfied by valid rows; NULL counts as a failure.
+    - max_failure_rate (float): Tolerated ratio of failing rows.
+    - quarantine (bool): Whether failing rows are routed to the quarantine table.
+    - action (str): 'warn' to log, or 'fail' to raise DataQualityError, when the expectation isn't met.
+    - reference (tuple): Optional (column, table, ref_column) lookup joined before evaluation.
+    """
+
+    def __init__(self, name, condition, max_failure_rate=0.0, quarantine=True, action='warn', reference=None):
+        """
+        Initializes the expectation.
+
+        Parameters:
+        - name (str): The expectation name.
+        - condition (str): SQL boolean expression satisfied by valid rows.
+        - max_failure_rate (float): Tolerated ratio of failing rows (default: 0.0).
+        - quarantine (bool): Whether failing rows are quarantined (default: True).
+        - action (str): 'warn' or 'fail' (default: 'warn').
+        - reference (tuple): Optional (column, table, ref_column) lookup (default: None).
+        """
+        assert(action in ('warn', 'fail'))
+        self.name = name
+        self.condition = condition
+        self.max_failure_rate = max_failure_rate
+        self.quarantine = quarantine
+        self.action = action
+        self.reference = reference
+
+def expect(name, condition, **kwargs):
+    """
+    Expects rows to satisfy a SQL condition.
+
+    Parameters:
+    - name (str): The expectation name.
+    - condition (str): SQL boolean expression satisfied by valid rows.
+
+    Returns:
+    - Expectation: The expectation.
+    """
+    return Expectation(name, condition, **kwargs)
+
+def not_null(column, max_null_rate=0.0, **kwargs):
+    """
+    Expects a column to be populated, tolerating a rate of nulls.
+
+    Parameters:
+    - column (str): The column name.
+    - max_null_rate (float): Tolerated ratio of null values (default: 0.0).
+
+    Returns:
+    - Expectation: The expectation.
+    """
+    return Expectation(f'not_null__{column}', f'{column} IS NOT NULL', max_failure_rate=max_null_rate, **kwargs)
+
+def in_range(column, min_value=None, max_value=None, **kwargs):
+    """
+    Expects a column to be within an inclusive range. Nulls aren't range checked.
+
+    Parameters:
+    - column (str): The column name.
+    - min_value: Inclusive lower bound, unbounded if None.
+    - max_value: Inclusive upper bound, unbounded if None.
+
+    Returns:
+    - Expectation: The expectation.
+    """
+    bounds = [f'{column} >= {min_value}' if min_value is not None else None,
+              f'{column} <= {max_value}' if max_value is not None else None]
+    condition = ' AND '.join(b for b in bounds if b)
+    return Expectation(f'in_range__{column}', f'{column} IS NULL OR ({condition})', **kwargs)
+
+def conforms(column, data_type, **kwargs):
+    """
+    Expects the values of a column to be castable to a data type. Nulls conform.
+
+    Parameters:
+    - column (str): The column name.
+    - data_type (str): The Spark SQL data type, e.g. 'TIMESTAMP' or 'INT'.
+
+    Returns:
+    - Expectation: The expectation.
+    """
+    return Expectation(f'conforms__{column}', f'{column} IS NULL OR TRY_CAST({column} AS {data_type}) IS NOT NULL', **kwargs)
+
+def references(column, table, ref_column=None, **kwargs):
+    """
+    Expects the values of a column to exist in another stage table within the same window.
+
+    Parameters:
+    - column (str): The column name.
+    - table (str): The referenced stage table name.
+    - ref_column (str): The referenced column (default: same as column).
+
+    Returns:
+    - Expectation: The expectation.
+    """
+    ref_column = ref_column or column
+    return Expectation(f'references__{column}__{table}', None, reference=(column, table, ref_column), **kwargs)
+
+def duplicates(max_duplicate_ratio=0.0, **kwargs):
+    """
+    Expects the ratio of rows landed more than once (`distinct_count` > 1) to stay below a threshold.
+
+    Duplicated rows are already collapsed by the stage query, so they aren't quarantined by default.
+
+    Parameters:
+    - max_duplicate_ratio (float): Tolerated ratio of duplicated rows (default: 0.0).
+
+    Returns:
+    - Expectation: The expectation.
+    """
+    kwargs.setdefault('quarantine', False)
+    return Expectation('duplicates', 'distinct_count <= 1', max_failure_rate=max_duplicate_ratio, **kwargs)
+
+class ExpectationSuite():
+    """
+    Evaluates the expectations of a stage table alongside its write.
+
+    Attributes:
+    - sc (SparkSession): The SparkSession object.
+    - table (str): The stage table name.
+    - expectations (list): The Expectation objects.
+    - base_dir (str): The stage directory holding the referenced, quarantine and `dq_meta` tables.
+    - results (list): The expectation results once `evaluate` has run.
+
+    Methods:
+    - apply(self, df): Flags failing rows and returns the DataFrame of valid rows to write.
+    - evaluate(self): Writes quarantined rows and `dq_meta`, then evaluates the expectations.
+    - finalize(self): Releases the persisted rows once the stage write has run.
+    """
+
+    def __init__(self, sc, table, expectations, base_dir, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), enabled=DQ_ENABLED):
+        """
+        Initializes the suite.
+
+        Parameters:
+        - sc (SparkSession): The SparkSession object.
+        - table (str): The stage table name.
+        - expectations (list): The Expectation objects.
+        - base_dir (str): The stage directory.
+        - d0 (datetime.date): The end date of the stage window (default: today's date).
+        - d1 (datetime.date): The start date of the stage window (default: yesterday's date).
+        - enabled (bool): Whether expectations are evaluated (default: DQ_ENABLED).
+        """
+        self.sc = sc
+        self.table = table
+        self.expectations = expectations if enabled else []
+        self.base_dir = base_dir
+        self.d0, self.d1 = d0, d1
+        self.results = []
+        self._evaluable = []
+        self._flagged = None
+
+    def _join_references(self, df):
+        """
+        Left joins the distinct referenced keys of each reference expectation.
+
+        Expectations whose referenced table can't be read are skipped.
+
+        Parameters:
+        - df (DataFrame): The staged DataFrame.
+
+        Returns:
+        - tuple: The joined DataFrame and the evaluable expectations with their conditions.
+        """
+        evaluable = []
+        for i, e in enumerate(self.expectations):
+            if e.reference is None:
+                evaluable.append((e, e.condition))
+                continue
+
+            column, table, ref_column = e.reference
+            ref_df = read_partitioned_table(self.sc, os.path.join(self.base_dir, table), self.d0, self.d1)
+            if ref_df is None:
+                logger.warning(f'Data Quality | {self.table} | Skipping {e.name}, {table} Not Readable')
+                continue
+
+            key = f'_dq_ref_{i}'
+            ref_df = ref_df.select(F.col(ref_column).alias(key)).distinct()
+            df = df.join(ref_df, df[column] == ref_df[key], 'left')
+            evaluable.append((e, f'{column} IS NULL OR {key} IS NOT NULL'))
+
+        return df, evaluable
+
+    def apply(self, df):
+        """
+        Flags failing rows and returns the DataFrame of valid rows to write.
+
+        The flagged DataFrame is persisted so the metrics and quarantine write of `evaluate`
+        and the stage write don't rescan the source.
+
+        Parameters:
+        - df (DataFrame): The staged DataFrame.
+
+        Returns:
+        - DataFrame: The rows not quarantined, with the source columns only.
+        """
+        if not self.expectations:
+            return df
+
+        columns = df.columns
+        df, evaluable = self._join_references(df)
+        self._evaluable = evaluable
+
+        flags = [F.expr(f'NOT COALESCE({cond}, FALSE)').alias(f'_dq_{i}') for i, (_, cond) in enumerate(evaluable)]
+        df = df.select(*columns, *flags)
+
+        failures = F.array(*[F.when(F.col(f'_dq_{i}'), F.lit(e.name)) for i, (e, _) in enumerate(evaluable)])
+        quarantined = [F.col(f'_dq_{i}') for i, (e, _) in enumerate(evaluable) if e.quarantine]
+        quarantine = F.lit(False)
+        for q in quarantined:
+            quarantine = quarantine | q
+
+        self._flagged = df \
+            .withColumn('_dq_failures', F.filter(failures, lambda x: x.isNotNull())) \
+            .withColumn('_dq_quarantine', quarantine) \
+            .persist(StorageLevel.MEMORY_AND_DISK)
+
+        return self._flagged.where(~F.col('_dq_quarantine')).select(*columns)
+
+    def _metrics(self):
+        """
+        Aggregates the expectation metrics of the persisted flagged rows.
+
+        Returns:
+        - dict: The `rows`, `quarantined` and per expectation `_dq_<i>` failure counts.
+        """
+        return self._flagged.agg(
+            F.count(F.lit(1)).alias('rows'),
+            F.sum(F.col('_dq_quarantine').cast('long')).alias('quarantined'),
+            *[F.sum(F.col(f'_dq_{i}').cast('long')).alias(f'_dq_{i}') for i in range(len(self._evaluable))]
+        ).first().asDict()
+
+    def evaluate(self):
+        """
+        Writes quarantined rows and `dq_meta`, then evaluates the expectations.
+
+        Must be called before the DataFrame returned by `apply` is written: the metrics
+        aggregation populates the persisted rows the stage write then reads. The
+        quarantine partitions of the stage window are replaced like the stage table, so
+        they always hold the rows rejected from the latest run of that window. The
+        persisted rows are released when an expectation fails, otherwise by `finalize`.
+
+        Returns:
+        - list: One result dictionary per evaluated expectation.
+
+        Raises:
+        - DataQualityError: If an expectation with the 'fail' action isn't met.
+        """
+        if self._flagged is None:
+            return []
+
+        try:
+            metrics = self._metrics()
+            rows = metrics.get('rows') or 0
+            quarantined = metrics.get('quarantined') or 0
+
+            logger.info(f'ETL Pipeline | Load | Quarantining {quarantined} {self.table} Rows in {CLOUD_PROVIDER}')
+            q_df = self._flagged \
+                .where(F.col('_dq_quarantine')) \
+                .drop(*[c for c in self._flagged.columns if c.startswith('_dq_') and c != '_dq_failures']) \
+                .withColumn('_dq_timestamp', F.current_timestamp())
+            writer = q_df.write.format('delta').mode('overwrite')
+            if {'year', 'month', 'day'}.issubset(q_df.columns):
+                writer = writer \
+                    .partitionBy('year', 'month', 'day') \
+                    .option('replaceWhere', date_partition_filter(date_range(self.d0, self.d1))) \
+                    .option('mergeSchema', 'true')
+            else:
+                writer = writer \
+                    .option('partitionOverwriteMode', 'static') \
+                    .option('overwriteSchema', 'true')
+            writer.save(os.path.join(self.base_dir, 'quarantine', self.table))
+
+            now = datetime.datetime.utcnow()
+            for i, (e, cond) in enumerate(self._evaluable):
+                failed = metrics.get(f'_dq_{i}') or 0
+                rate = failed / rows if rows else 0.0
+                self.results.append({
+                    'table': self.table,
+                    'expectation': e.name,
+                    'condition': cond,
+                    'rows': rows,
+                    'failed_rows': failed,
+                    'failure_rate': rate,
+                    'max_failure_rate': float(e.max_failure_rate),
+                    'passed': rate <= e.max_failure_rate,
+                    'quarantine': e.quarantine,
+                    'action': e.action,
+                    'timestamp': now,
+                    'year': f'{now.year}',
+                    'month': f'{now.month:02d}',
+                    'day': f'{now.day:02d}'
+                })
+
+            for r in self.results:
+                log = logger.info if r['passed'] else logger.warning
+                log(f'Data Quality | {self.table} | {r["expectation"]} | {r["failed_rows"]}/{r["rows"]} Failed ({r["failure_rate"]:.4%} <= {r["max_failure_rate"]:.4%}) | {"PASSED" if r["passed"] else "FAILED"}')
+
+            if self.results:
+                self.sc.createDataFrame(self.results) \
+                    .write \
+                    .format('delta') \
+                    .partitionBy('year', 'month', 'day') \
+                    .mode('append') \
+                    .save(os.path.join(self.base_dir, 'dq_meta'))
+        except Exception:
+            self.finalize()
+            raise
+
+        failed = [r['expectation'] for r in self.results if not r['passed'] and r['action'] == 'fail']
+        if failed:
+            self.finalize()
+            raise DataQualityError(f'{self.table} failed expectations {failed}')
+
+        return self.results
+
+    def finalize(self):
+        """
+        Releases the persisted rows once the stage write has run.
+
+        Returns:
+        - list: The expectation results of `evaluate`.
+        """
+        if self._flagged is not None:
+            self._flagged.unpersist()
+
+        return self.results
@@ -0,0 +1,112 @@
+""" Stage Table Loads
+
+The write and post-load steps shared by the stage tasks.
+
+`load_stage` writes the staged view of a table over the partitions of its window,
+then runs `post_load`, the single hook doing the work that follows every stage write.
+An existing table is updated with a MERGE inserting the new rows of the window and
+deleting its rows no longer staged, so its Change Data Feed holds the rows a run actually
+changed rather than a delete and an insert of every row of the window.
+
+
+- the Change Data Feed of the table is enabled for its streaming and incremental readers,
+- the persisted rows its expectations were evaluated on before the write are released,
+- the new tokens of its token columns are merged into the token dictionary,
+- the Bloom filters of its index columns and its ETL manifest are rebuilt,
+- and any table specific hooks, e.g. the reach sketches of the Server Lobby, are run.
+
+Example:
+    load_stage(sc, 'lib_server_game', EXPECTATIONS, os.path.join(OUTPUT_DIR, blob_prefix), d0, d1, token_columns=TOKEN_COLUMNS)
+"""
+
+from spark_solutions.common.spark_misc import date_partition_filter, date_range, enable_change_data_feed, schema_auto_merge
+from spark_solutions.common.spark_dictionary import update_token_dictionary
+from spark_solutions.common.spark_manifest import build_etl_manifest
+from spark_solutions.common.spark_quality import ExpectationSuite
+from spark_solutions.common.spark_bloom import build_bloom_index
+from delta import DeltaTable
+
+import datetime
+import logging
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+def post_load(sc, table_name, base_dir, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), dq=None, token_columns=None, index_columns=None, hooks=()):
+    """
+    Runs the post-load steps of a stage table once its window has been written.
+
+    Parameters:
+    - sc (SparkSession): The SparkSession object.
+    - table_name (str): The stage table name.
+    - base_dir (str): The stage directory.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    - dq (ExpectationSuite): The suite evaluated on the written rows (default: None).
+    - token_columns (list): The token columns merged into the token dictionary (default: None).
+    - index_columns (list): The columns with Bloom filters (default: None).
+    - hooks (tuple): Callables run last with (sc, d0, d1) (default: ()).
+    """
+    enable_change_data_feed(sc, os.path.join(base_dir, table_name))
+    if dq is not None:
+        dq.finalize()
+
+    if token_columns:
+        update_token_dictionary(sc, table_name, token_columns, base_dir, d0, d1)
+    if index_columns:
+        build_bloom_index(sc, table_name, index_columns, base_dir, d0, d1)
+    build_etl_manifest(sc, table_name, base_dir, d0, d1)
+
+    for hook in hooks:
+        hook(sc, d0, d1)
+
+def load_stage(sc, table_name, expectations, base_dir, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), merge_schema=False, **kwargs):
+    """
+    Loads the `stage__<table_name>` view over the partitions of the date range, then runs `post_load`.
+
+    Rows failing the expectations are routed to the quarantine table, and an expectation with
+    the 'fail' action raises before the write. Only the partitions of the date range are
+    replaced, so reruns are idempotent and the history outside the range is kept. Stage rows
+    are unique on all their columns, so an existing table MERGEs them on every column: rows
+    already written are left untouched, new rows inserted and rows no longer staged deleted.
+
+    Parameters:
+    - sc (SparkSession): The SparkSession object.
+    - table_name (str): The stage table name.
+    - expectations (list): The Expectation objects of the table.
+    - base_dir (str): The stage directory.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    - merge_schema (bool): Whether new columns are merged into the table schema (default: False).
+    - **kwargs: The token_columns, index_columns and hooks of `post_load`.
+
+    Raises:
+    - DataQualityError: If an expectation with the 'fail' action isn't met.
+    """
+    dq = ExpectationSuite(sc, table_name, expectations, base_dir, d0, d1)
+    df = dq.apply(sc.table(f'stage__{table_name}'))
+    dq.evaluate()
+
+    path = os.path.join(base_dir, table_name)
+    if DeltaTable.isDeltaTable(sc, path):
+        target = DeltaTable.forPath(sc, path)
+        columns = [c for c in df.columns if c in target.toDF().columns]
+        window = date_partition_filter(date_range(d0, d1), alias='t')
+        logger.info(f'ETL Pipeline | Load | Merging the Window of {table_name} into {path}')
+        with schema_auto_merge(sc, merge_schema):
+            target.alias('t') \
+                .merge(df.alias('s'), ' AND '.join([f't.`{c}` <=> s.`{c}`' for c in columns] + [f'({window})'])) \
+                .whenNotMatchedInsertAll() \
+                .whenNotMatchedBySourceDelete(condition=window) \
+                .execute()
+    else:
+        writer = df.write \
+            .format('delta') \
+            .partitionBy('year', 'month', 'day') \
+            .mode('overwrite') \
+            .option('replaceWhere', date_partition_filter(date_range(d0, d1)))
+        if merge_schema:
+            writer = writer.option('mergeSchema', 'true')
+        writer.save(path)
+
+    post_load(sc, table_name, base_dir, d0, d1, dq=dq, **kwargs)
@@ -0,0 +1,288 @@
+""" Spark Tuning Profiles
+
+Per task Spark tuning profiles loaded from `conf/tasks/<profile>.yml`, shipped in the
+package as `spark_solutions/conf/tasks`.
+
+A profile holds Spark properties under `spark` and sizing parameters under
+`sizing`, merged over `conf/tasks/default.yml`. Properties left unset (`auto`
+or null) are sized from the measured input bytes of the extracted hot paths,
+so a small local day and a large cluster backfill both get sensible shuffle
+partitions, split sizes and broadcast thresholds without code changes.
+
+Example `conf/tasks/output_game_metrics.yml`:
+    spark:
+      spark.sql.shuffle.partitions: auto
+      spark.sql.autoBroadcastJoinThreshold: 52428800
+    sizing:
+      target_partition_bytes: 134217728
+"""
+
+from pathlib import Path
+
+import importlib.resources
+import threading
+import logging
+import yaml
+import math
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+SPARK_TUNING_ENABLED=os.getenv('SPARK_TUNING_ENABLED', 'true').lower() == 'true'
+TASK_CONF_DIR=os.getenv('TASK_CONF_DIR', str(importlib.resources.files('spark_solutions') / 'conf' / 'tasks'))
+
+MB = 1024**2
+
+# Properties only honoured when the SparkSession is created
+STATIC_PROPERTIES = [
+    'spark.driver.memory',
+    'spark.driver.maxResultSize',
+    'spark.executor.memory',
+    'spark.executor.cores',
+    'spark.executor.instances',
+    'spark.memory.fraction',
+    'spark.memory.offHeap.enabled',
+    'spark.memory.offHeap.size'
+]
+
+# Properties sized from the measured input when unset
+SIZED_PROPERTIES = [
+    'spark.sql.shuffle.partitions',
+    'spark.sql.files.maxPartitionBytes',
+    'spark.sql.autoBroadcastJoinThreshold',
+    'spark.sql.adaptive.advisoryPartitionSizeInBytes'
+]
+
+DEFAULT_SIZING = {
+    'target_partition_bytes': 128 * MB,
+    'min_partition_bytes': 4 * MB,
+    'shuffle_expansion': 1.0,
+    'max_shuffle_partitions': 20000,
+    'min_broadcast_bytes': 10 * MB,
+    'max_broadcast_bytes': 100 * MB,
+    'broadcast_ratio': 0.05
+}
+
+def _load_yaml(path):
+    """
+    Loads a YAML profile, returning an empty profile with a warning if the file doesn't exist.
+
+    Parameters:
+    - path (Path): The profile path.
+
+    Returns:
+    - dict: The profile.
+    """
+    if not path.exists():
+        logger.warning(f'Profile {path} Not Found, Using Defaults')
+        return {}
+
+    with open(path, 'r') as f:
+        return yaml.safe_load(f) or {}
+
+class SparkTuning():
+    """
+    Applies a task's Spark tuning profile and sizes unset properties from its input.
+
+    Input is measured per SparkSession, so isolated sessions running concurrently
+    (e.g. backfill chunks) are each sized from their own hot paths.
+
+    Attributes:
+    - profile (str): The profile name.
+    - spark (dict): The Spark properties of the profile; None marks a sized property.
+    - sizing (dict): The sizing parameters.
+
+    Methods:
+    - config_builder(self, _builder): Adds the static properties to the SparkSession builder.
+    - config_session(self, sc): Sets the runtime properties, sizing unset ones from the input.
+    - input_bytes(self, sc): Returns the measured input bytes of a SparkSession.
+    - observe_input(self, sc, paths): Measures the bytes of extracted paths and re-sizes.
+    - sized_properties(self, input_bytes, parallelism): Computes the sized property values.
+    """
+
+    def __init__(self, profile, conf_dir=TASK_CONF_DIR, enabled=SPARK_TUNING_ENABLED):
+        """
+        Loads the profile merged over the default profile.
+
+        Parameters:
+        - profile (str): The profile name, i.e. the task entry point name.
+        - conf_dir (str): The directory of the profiles (default: TASK_CONF_DIR).
+        - enabled (bool): Whether the profile is applied (default: SPARK_TUNING_ENABLED).
+        """
+        self.profile = profile
+        self.enabled = enabled
+        self._measured = {}
+        self._input_bytes = {}
+        self._lock = threading.Lock()
+
+        default = _load_yaml(Path(conf_dir) / 'default.yml')
+        task = _load_yaml(Path(conf_dir) / f'{profile}.yml')
+
+        spark = {**(default.get('spark') or {}), **(task.get('spark') or {})}
+        self.spark = {k: (None if v in (None, 'auto') else v) for k, v in spark.items()}
+        for k in SIZED_PROPERTIES:
+            self.spark.setdefault(k, None)
+
+        self.sizing = {**DEFAULT_SIZING, **(default.get('sizing') or {}), **(task.get('sizing') or {})}
+
+    @staticmethod
+    def _value(v):
+        return str(v).lower() if isinstance(v, bool) else str(v)
+
+    def config_builder(self, _builder):
+        """
+        Adds the static properties of the profile to the SparkSession builder.
+
+        Parameters:
+        - _builder: The SparkSession builder object.
+
+        Returns:
+        - SparkSession.Builder: The configured SparkSession builder object.
+        """
+        if not self.enabled:
+            return _builder
+
+        for k, v in self.spark.items():
+            if k in STATIC_PROPERTIES and v is not None:
+                _builder = _builder.config(k, self._value(v))
+
+        return _builder
+
+    def config_session(self, sc):
+        """
+        Sets the runtime properties of the profile, sizing unset ones from the measured input.
+
+        Parameters:
+        - sc: The SparkSession object.
+        """
+        if not self.enabled:
+            return
+
+        logger.info(f'Applying Spark Tuning Profile {self.profile}')
+        for k, v in self.spark.items():
+            if k not in STATIC_PROPERTIES and v is not None:
+                sc.conf.set(k, self._value(v))
+
+        self._config_sized(sc)
+
+    def input_bytes(self, sc):
+        """
+        Returns the measured input bytes of a SparkSession.
+
+        Parameters:
+        - sc: The SparkSession object.
+
+        Returns:
+        - int: The measured input bytes of the extracted hot paths.
+        """
+        return self._input_bytes.get(sc, 0)
+
+    def _config_sized(self, sc):
+        """Sets the unset sized properties from the measured input bytes."""
+        input_bytes = self.input_bytes(sc)
+        sized = self.sized_properties(input_bytes, sc.sparkContext.defaultParallelism)
+        for k, v in sized.items():
+            if self.spark.get(k) is None:
+                sc.conf.set(k, str(v))
+
+        logger.info(f'Spark Tuning | {self.profile} | {input_bytes} Input Bytes | {sized}')
+
+    def sized_properties(self, input_bytes, parallelism):
+        """
+        Computes the sized property values for an input size.
+
+        - Shuffle partitions: one per target partition of (expanded) input, at least the parallelism.
+        - Max partition bytes: the input split evenly over the parallelism, between the minimum and target partition bytes.
+        - Broadcast threshold: a ratio of the input, between the minimum and maximum broadcast bytes.
+
+        Parameters:
+        - input_bytes (int): The measured input bytes.
+        - parallelism (int): The default parallelism of the SparkContext.
+
+        Returns:
+        - dict: The sized Spark properties.
+        """
+        s = self.sizing
+        parallelism = max(1, parallelism)
+        target = int(s['target_partition_bytes'])
+
+        shuffle_partitions = math.ceil(input_bytes * float(s['shuffle_expansion']) / target)
+        shuffle_partitions = min(max(shuffle_partitions, parallelism), int(s['max_shuffle_partitions']))
+
+        max_partition_bytes = min(max(math.ceil(input_bytes / parallelism), int(s['min_partition_bytes'])), target)
+
+        broadcast = int(input_bytes * float(s['broadcast_ratio']))
+        broadcast = min(max(broadcast, int(s['min_broadcast_bytes'])), int(s['max_broadcast_bytes']))
+
+        return {
+            'spark.sql.shuffle.partitions': shuffle_partitions,
+            'spark.sql.files.maxPartitionBytes': max_partition_bytes,
+            'spark.sql.autoBroadcastJoinThreshold': broadcast,
+            'spark.sql.adaptive.advisoryPartitionSizeInBytes': target
+        }
+
+    def observe_input(self, sc, paths, sizes=None):
+        """
+        Measures the bytes of extracted paths and re-sizes the unset properties.
+
+        Paths already measured, or that don't exist, are skipped. Paths with a known size
+        aren't measured on storage; only the RAW day directories read without the RAW
+        ledger are summed from a listing.
+
+        Parameters:
+        - sc: The SparkSession object.
+        - paths (list): The extracted hot paths.
+        - sizes (dict): The known bytes of paths, e.g. from the RAW ledger or a Delta snapshot (default: None).
+        """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            measured = self._measured.setdefault(sc, set())
+            paths = [p for p in paths if p not in measured]
+            measured.update(paths)
+
+        sizes = sizes or {}
+        hadoop_conf = sc._jsc.hadoopConfiguration()
+        for p in paths:
+            if p in sizes:
+                with self._lock:
+                    self._input_bytes[sc] = self._input_bytes.get(sc, 0) + sizes[p]
+                continue
+
+            try:
+                jpath = sc._jvm.org.apache.hadoop.fs.Path(p)
+                fs = jpath.getFileSystem(hadoop_conf)
+                if fs.exists(jpath):
+                    length = fs.getContentSummary(jpath).getLength()
+                    with self._lock:
+                        self._input_bytes[sc] = self._input_bytes.get(sc, 0) + length
+            except Exception as exc:
+                logger.warning(f'Unable to Measure Input {p} {exc}')
+
+        self._config_sized(sc)
+
+_active = None
+
+def activate(tuning):
+    """
+    Sets the tuning profile of the running task.
+
+    Parameters:
+    - tuning (SparkTuning): The tuning profile.
+    """
+    global _active
+    _active = tuning
+
+def observe_input(sc, paths, sizes=None):
+    """
+    Measures extracted paths with the tuning profile of the running task, if any.
+
+    Parameters:
+    - sc: The SparkSession object.
+    - paths (list): The extracted hot paths.
+    - sizes (dict): The known bytes of paths (default: None).
+    """
+    if _active is not None:
+        _active.observe_input(sc, paths, sizes)
@@ -3,11 +3,20 @@ from spark_solutions.loggers import log_level
 from logging import Handler, LogRecord
 from pyspark.sql import SparkSession
 
+import threading
 import logging
+import atexit
+import queue
 import os
 
 # Environment Variables
 LOG_LEVEL=os.getenv('LOG_LEVEL', 'INFO')
+LOG4J_QUEUE_SIZE=int(os.getenv('LOG4J_QUEUE_SIZE', '10000'))
+LOG4J_DROP_POLICY=os.getenv('LOG4J_DROP_POLICY', 'drop_new')
+LOG4J_FLUSH_TIMEOUT=float(os.getenv('LOG4J_FLUSH_TIMEOUT', '5'))
+
+_STOP = object()
+_PY4J_LOGGERS = ('py4j.java_gateway', 'py4j.clientserver')
 
 class Log4JProxyHandler(Handler):
     """
@@ -16,52 +25,144 @@ class Log4JProxyHandler(Handler):
     This handler forwards log messages to log4j for logging within the Spark context.
     It extends the `Handler` class from the `logging` module.
 
+    Records are rendered on the calling thread and put on a bounded queue; a daemon
+    thread drains the queue and makes the py4j calls, so logging never blocks on the
+    JVM. JVM logger handles are cached per logger name. When the queue is full the
+    drop policy decides whether the new record ('drop_new') or the oldest queued
+    record ('drop_oldest') is discarded. Records of py4j's own gateway loggers and
+    records logged on the forwarding thread are skipped, since forwarding them would
+    log again and feed back on itself at DEBUG.
+
     Attributes:
     - Logger: The log4j logger obtained from the SparkSession.
     - app_name: The name of the Spark application.
+    - dropped (int): The number of records discarded by the drop policy.
 
     Methods:
-    - __init__(self, spark_session): Initializes the handler with a log4j logger.
-    - emit(self, record): Emits a log message.
-    - close(self): Closes the logger.
+    - __init__(self, spark_session, queue_size, drop_policy): Initializes the handler with a log4j logger.
+    - emit(self, record): Queues a log message.
+    - flush(self, timeout): Waits for queued messages to be forwarded.
+    - close(self): Flushes and stops the forwarding thread.
     """
 
-    def __init__(self, spark_session: SparkSession):
+    def __init__(self, spark_session: SparkSession, queue_size: int=LOG4J_QUEUE_SIZE, drop_policy: str=LOG4J_DROP_POLICY):
         """
         Initialise handler with a log4j logger.
 
         Parameters:
         - spark_session (SparkSession): The SparkSession object.
+        - queue_size (int): Maximum number of queued records (default: LOG4J_QUEUE_SIZE).
+        - drop_policy (str): 'drop_new' or 'drop_oldest' (default: LOG4J_DROP_POLICY).
         """
+        assert(drop_policy in ('drop_new', 'drop_oldest'))
         Handler.__init__(self)
         self.Logger = spark_session._jvm.org.apache.log4j.Logger
         self.app_name = spark_session.sparkContext.appName
+        self.jvm = spark_session._jvm
+        self.drop_policy = drop_policy
+        self.dropped = 0
+
+        self._loggers = {}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self._forward, name='log4j-proxy-handler', daemon=True)
+        self._thread.start()
+
+    def _get_logger(self, name: str):
+        """
+        Returns the cached log4j logger for the given name.
+
+        Parameters:
+        - name (str): The logger name.
+        """
+        logger = self._loggers.get(name)
+        if logger is None:
+            logger = self._loggers[name] = self.Logger.getLogger(name)
+
+        return logger
+
+    def _forward(self):
+        """Drains the queue and forwards each record to log4j."""
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+
+                name, levelno, msg = item
+                logger = self._get_logger(name)
+                if levelno >= logging.CRITICAL:
+                    # Fatal and critical seem about the same.
+                    logger.fatal(msg)
+                elif levelno >= logging.ERROR:
+                    logger.error(msg)
+                elif levelno >= logging.WARNING:
+                    logger.warn(msg)
+                elif levelno >= logging.INFO:
+                    logger.info(msg)
+                elif levelno >= logging.DEBUG:
+                    logger.debug(msg)
+            except Exception:
+                # The JVM may already be gone during interpreter shutdown
+                pass
+            finally:
+                self._queue.task_done()
 
     def emit(self, record: LogRecord):
         """
-        Emit a log message.
+        Queue a log message to be forwarded to log4j.
 
         Parameters:
         - record (LogRecord): The log record to be emitted.
         """
-        logger = self.Logger.getLogger(record.name)
-        if record.levelno >= logging.CRITICAL:
-            # Fatal and critical seem about the same.
-            logger.fatal(record.getMessage())
-        elif record.levelno >= logging.ERROR:
-            logger.error(record.getMessage())
-        elif record.levelno >= logging.WARNING:
-            logger.warn(record.getMessage())
-        elif record.levelno >= logging.INFO:
-            logger.info(record.getMessage())
-        elif record.levelno >= logging.DEBUG:
-            logger.debug(record.getMessage())
-        else:
-            pass
+        if record.levelno < logging.DEBUG:
+            return
+
+        # The py4j calls of the forwarding thread log on the py4j gateway loggers
+        if record.thread == self._thread.ident or record.name.startswith(_PY4J_LOGGERS):
+            return
+
+        try:
+            item = (record.name, record.levelno, record.getMessage())
+        except Exception:
+            self.handleError(record)
+            return
+
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            if self.drop_policy == 'drop_oldest':
+                try:
+                    self._queue.get_nowait()
+                    self._queue.task_done()
+                    self._queue.put_nowait(item)
+                except (queue.Empty, queue.Full):
+                    pass
+
+    def flush(self, timeout: float=LOG4J_FLUSH_TIMEOUT):
+        """
+        Waits for queued messages to be forwarded to log4j.
+
+        Parameters:
+        - timeout (float): Maximum number of seconds to wait (default: LOG4J_FLUSH_TIMEOUT).
+        """
+        if not self._thread.is_alive():
+            return
+
+        done = threading.Thread(target=self._queue.join, daemon=True)
+        done.start()
+        done.join(timeout)
 
     def close(self):
-        """Close the logger."""
-        pass
+        """Flush queued messages and stop the forwarding thread."""
+        if self._thread.is_alive():
+            self.flush()
+            try:
+                self._queue.put(_STOP, timeout=LOG4J_FLUSH_TIMEOUT)
+            except queue.Full:
+                pass
+
+        Handler.close(self)
 
 def inject_logging(sc):
     """
@@ -71,15 +172,27 @@ def inject_logging(sc):
     It sets up a custom handler (`Log4JProxyHandler`) to forward log messages to log4j.
     Additionally, it sets the logging level for the Py4J logger.
 
+    Injection is idempotent; the base handler is only attached once and the proxy
+    handler is only replaced when the SparkSession points to a different JVM.
+
     Parameters:
     - sc (SparkContext): The SparkContext object.
     """
     logger = logging.getLogger('py4j')
     logger.setLevel(log_level(LOG_LEVEL))
+    logger.propagate = False
+
+    if base_handler not in logger.handlers:
+        logger.addHandler(base_handler)
+
+    for handler in [h for h in logger.handlers if isinstance(h, Log4JProxyHandler)]:
+        if handler.jvm is sc._jvm:
+            return
+
+        logger.removeHandler(handler)
+        handler.close()
 
     py4j_handler = Log4JProxyHandler(sc)
     py4j_handler.setLevel(log_level(LOG_LEVEL))
-
-    logger.addHandler(base_handler)
     logger.addHandler(py4j_handler)
-    logger.propagate = False
\ No newline at end of file
+    atexit.register(py4j_handler.close)
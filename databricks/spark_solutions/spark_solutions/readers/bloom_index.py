@@ -0,0 +1,207 @@
+""" Bloom Indexes
+
+Per-file Bloom filters of the `msg_id` and `etl_id` columns of the stage tables.
+
+`msg_id` and `etl_id` are random, so the min/max statistics of a file don't prune it and
+looking up one message means opening every file of its days. Stage loads write one Bloom
+filter per data file and indexed column to the `bloom_index` table next to the stage
+tables, so a lookup only opens the files whose filter may hold the value. Files without a
+filter, e.g. compacted since their load, are always opened, so lookups never miss rows.
+
+A value is hashed with MD5; the two halves of the digest derive the `num_hashes` bit
+positions of the filter (double hashing), so filters built by Spark and read here agree.
+
+This module doesn't import pyspark.
+
+Example:
+    from spark_solutions.readers.bloom_index import trace
+
+    rows = trace(msg_id, d0, d1)
+    rows['buffer_meta'].to_pylist()
+"""
+
+from urllib.parse import unquote
+
+import hashlib
+import logging
+import math
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+CLOUD_PROVIDER=os.getenv('CLOUD_PROVIDER', 'LOCAL')
+STAGE_DIR = os.getenv('STAGE_DIR')
+BLOOM_INDEX_FPP=float(os.getenv('BLOOM_INDEX_FPP', '0.01'))
+
+BLOOM_INDEX_TABLE = 'bloom_index'
+
+class BloomFilter():
+    """
+    A Bloom filter over the string values of a column.
+
+    Attributes:
+    - num_bits (int): The number of bits, a multiple of 8.
+    - num_hashes (int): The number of bit positions per value.
+    - bits (bytearray): The bit array.
+
+    Methods:
+    - for_capacity(cls, n, fpp): Returns an empty filter sized for n values.
+    - add(self, value): Adds a value.
+    - update(self, other): Adds the values of a filter of the same size.
+    """
+
+    def __init__(self, num_bits, num_hashes, bits=None):
+        """
+        Initializes the filter.
+
+        Parameters:
+        - num_bits (int): The number of bits, rounded up to a multiple of 8.
+        - num_hashes (int): The number of bit positions per value.
+        - bits (bytes): The bit array of an existing filter (default: None, empty).
+        """
+        self.num_bits = max(8, -(-num_bits // 8) * 8)
+        self.num_hashes = num_hashes
+        self.bits = bytearray(bits) if bits is not None else bytearray(self.num_bits // 8)
+        assert(len(self.bits) * 8 == self.num_bits)
+
+    @classmethod
+    def for_capacity(cls, n, fpp=BLOOM_INDEX_FPP):
+        """
+        Returns an empty filter sized for a number of values and false positive probability.
+
+        Parameters:
+        - n (int): The expected number of distinct values.
+        - fpp (float): The false positive probability (default: BLOOM_INDEX_FPP).
+
+        Returns:
+        - BloomFilter: The empty filter.
+        """
+        assert(0 < fpp < 1)
+        n = max(n, 1)
+        num_bits = int(math.ceil(-n * math.log(fpp) / math.log(2)**2))
+        return cls(num_bits, max(1, int(round(num_bits / n * math.log(2)))))
+
+    def _positions(self, value):
+        """Returns the bit positions of a value."""
+        digest = hashlib.md5(str(value).encode('utf-8')).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, value):
+        """
+        Adds a value.
+
+        Parameters:
+        - value: The value, hashed as a string.
+
+        Returns:
+        - BloomFilter: The filter.
+        """
+        for p in self._positions(value):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        return self
+
+    def update(self, other):
+        """
+        Adds the values of a filter of the same size.
+
+        Parameters:
+        - other (BloomFilter): The filter.
+
+        Returns:
+        - BloomFilter: The filter.
+        """
+        assert(other.num_bits == self.num_bits and other.num_hashes == self.num_hashes)
+        self.bits = bytearray(a | b for a, b in zip(self.bits, other.bits))
+        return self
+
+    def __contains__(self, value):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(value))
+
+def index_path(table_path):
+    """
+    Returns the path of the Bloom index of a table, stored next to the table.
+
+    Parameters:
+    - table_path (str): The table path.
+
+    Returns:
+    - str: The `bloom_index` table path.
+    """
+    return os.path.join(os.path.dirname(table_path.rstrip('/')), BLOOM_INDEX_TABLE)
+
+def candidate_paths(index_rows, paths, values):
+    """
+    Returns the data files that may hold any of the values.
+
+    Parameters:
+    - index_rows (iterable): The `bloom_index` rows of one table and column, with `path`, `num_bits`, `num_hashes` & `bits`.
+    - paths (iterable): The data file paths of the table snapshot, relative to the table.
+    - values (iterable): The looked up values.
+
+    Returns:
+    - list: The paths whose filter may hold a value, or without a filter.
+    """
+    filters = {unquote(r['path']): BloomFilter(r['num_bits'], r['num_hashes'], r['bits']) for r in index_rows}
+    values = list(values)
+    return [p for p in paths if unquote(p) not in filters or any(v in filters[unquote(p)] for v in values)]
+
+def read_indexed(table, column, values, d0=None, d1=None, columns=None, stage_dir=STAGE_DIR, blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else '', storage_options=None):
+    """
+    Reads the rows of a stage table holding any of the values of an indexed column.
+
+    Parameters:
+    - table (str): The stage table, e.g. 'log_meta'.
+    - column (str): The indexed column, 'msg_id' or 'etl_id'.
+    - values (iterable): The looked up values.
+    - d0 (datetime.date): The end date of the date range (default: None, unbounded).
+    - d1 (datetime.date): The start date of the date range (default: None, unbounded).
+    - columns (list): The columns to return (default: None, all).
+    - stage_dir (str): The stage directory (default: STAGE_DIR).
+    - blob_prefix (str): The prefix to be appended to the stage directory paths (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
+    - storage_options (dict): The fsspec storage options (default: None).
+
+    Returns:
+    - pyarrow.Table: The matching rows.
+    """
+    from spark_solutions.readers.delta_reader import get_reader
+
+    assert(not stage_dir is None and stage_dir != '')
+    values = sorted(set(values))
+    path = os.path.join(stage_dir, blob_prefix, table)
+    reader = get_reader(path, storage_options)
+    files = [add['path'] for add in reader.files(d0, d1)]
+
+    index = get_reader(index_path(path), storage_options)
+    try:
+        rows = index.read(d0, d1, filters=[('table_name', '=', table), ('column_name', '=', column)]).to_pylist()
+    except FileNotFoundError:
+        rows = []
+
+    paths = candidate_paths(rows, files, values) if values else []
+    logger.info(f'Bloom Index | {table}.{column} | {len(paths)}/{len(files)} Candidate Files')
+    return reader.read(d0, d1, filters=[(column, 'in', values)], columns=columns, paths=paths)
+
+def trace(msg_id, d0=None, d1=None, **kwargs):
+    """
+    Traces a message from its log through the buffer to its ETL run.
+
+    Parameters:
+    - msg_id (str): The message id.
+    - d0 (datetime.date): The end date of the date range (default: None, unbounded).
+    - d1 (datetime.date): The start date of the date range (default: None, unbounded).
+    - kwargs: The remaining arguments of `read_indexed`.
+
+    Returns:
+    - dict: The `log_meta`, `buffer_meta` and `etl_meta` rows of the message.
+    """
+    rows = {
+        'log_meta': read_indexed('log_meta', 'msg_id', [msg_id], d0, d1, **kwargs),
+        'buffer_meta': read_indexed('buffer_meta', 'msg_id', [msg_id], d0, d1, **kwargs)
+    }
+
+    etl_ids = {e for t in rows.values() for e in t.column('etl_id').to_pylist() if e is not None}
+    rows['etl_meta'] = read_indexed('etl_meta', 'etl_id', etl_ids, d0, d1, **kwargs)
+    return rows
@@ -0,0 +1,539 @@
+""" Delta Reader
+
+Spark-free reader of the Delta output tables with Arrow.
+
+Dashboards and services reading `game_metrics` or `message_flow` don't need a JVM. The
+table snapshot is replayed from the Delta transaction log (last checkpoint plus the
+later JSON commits) and cached per table, so refreshing it only reads the new commits.
+Files are pruned on their partition values (`year`/`month`/`day`) and on the min/max
+statistics of the filtered columns before any data file is opened; the remaining files
+are read in parallel with pyarrow. Results are cached keyed by the table version, so
+repeated slices of an unchanged table are served from memory.
+
+Only plain Parquet tables are read: tables whose protocol requires a reader feature other
+than SUPPORTED_READER_FEATURES, e.g. deletion vectors or column mapping, raise
+`UnsupportedTableError` rather than return deleted rows or physical column names.
+
+This module doesn't import pyspark.
+
+Example:
+    from spark_solutions.readers.delta_reader import read_output
+    from spark_solutions.readers.token_dictionary import token_id
+
+    df = read_output('game_metrics', d0, d1, filters=[('user_id', '=', token_id(token))]).to_pandas()
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from urllib.parse import unquote
+
+import pyarrow.parquet as pq
+import pyarrow.compute as pc
+import pyarrow as pa
+import threading
+import datetime
+import logging
+import fsspec
+import json
+import time
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+CLOUD_PROVIDER=os.getenv('CLOUD_PROVIDER', 'LOCAL')
+OUTPUT_DIR = os.getenv('OUTPUT_DIR')
+DELTA_READER_CACHE_SIZE=int(os.getenv('DELTA_READER_CACHE_SIZE', '128'))
+DELTA_READER_REFRESH_SECONDS=float(os.getenv('DELTA_READER_REFRESH_SECONDS', '30'))
+DELTA_READER_THREADS=int(os.getenv('DELTA_READER_THREADS', '8'))
+
+PARTITION_COLUMNS = ('year', 'month', 'day')
+
+# Reader features not changing how the Parquet files of a snapshot are read
+SUPPORTED_READER_FEATURES = {'timestampNtz', 'vacuumProtocolCheck'}
+
+_ARROW_TYPES = {
+    'string': pa.string(),
+    'long': pa.int64(),
+    'integer': pa.int32(),
+    'short': pa.int16(),
+    'byte': pa.int8(),
+    'double': pa.float64(),
+    'float': pa.float32(),
+    'boolean': pa.bool_(),
+    'date': pa.date32(),
+    'timestamp': pa.timestamp('us', tz='UTC')
+}
+
+_COMPARE = {
+    '=': lambda lo, hi, v: lo <= v <= hi,
+    '==': lambda lo, hi, v: lo <= v <= hi,
+    '<': lambda lo, hi, v: lo < v,
+    '<=': lambda lo, hi, v: lo <= v,
+    '>': lambda lo, hi, v: hi > v,
+    '>=': lambda lo, hi, v: hi >= v,
+    'in': lambda lo, hi, v: any(lo <= x <= hi for x in v)
+}
+
+class UnsupportedTableError(Exception):
+    """Raised when a table requires a Delta reader feature the reader doesn't implement."""
+
+def _partition_value(value, type_name):
+    """
+    Converts a partition value of the transaction log to its Python value.
+
+    Parameters:
+    - value (str): The partition value, None for null partitions.
+    - type_name (str): The Delta type of the partition column.
+
+    Returns:
+    - The partition value as int, float, date or str.
+    """
+    if value is None:
+        return None
+    if type_name in ('long', 'integer', 'short', 'byte'):
+        return int(value)
+    if type_name in ('double', 'float'):
+        return float(value)
+    if type_name == 'date':
+        return datetime.date.fromisoformat(value)
+
+    return value
+
+def _stats_match(stats, filters):
+    """
+    Whether a file may hold rows matching the filters, from its min/max statistics.
+
+    Files without statistics, or with statistics of a type not comparable to the filter
+    value, are kept.
+
+    Parameters:
+    - stats (dict): The parsed `stats` of the add action.
+    - filters (list): The (column, op, value) filters on data columns.
+
+    Returns:
+    - bool: False if the file can be skipped.
+    """
+    if not stats:
+        return True
+
+    min_values, max_values = stats.get('minValues', {}), stats.get('maxValues', {})
+    for column, op, value in filters:
+        if column not in min_values or column not in max_values:
+            continue
+        try:
+            if not _COMPARE[op](min_values[column], max_values[column], value):
+                return False
+        except TypeError:
+            continue
+
+    return True
+
+def _row_filter(filters):
+    """
+    Builds the Arrow row filter expression of the filters.
+
+    Parameters:
+    - filters (list): The (column, op, value) filters.
+
+    Returns:
+    - pyarrow.compute.Expression or None: The conjunction of the filters.
+    """
+    expression = None
+    for column, op, value in filters:
+        field = pc.field(column)
+        e = {
+            '=': lambda: field == value,
+            '==': lambda: field == value,
+            '<': lambda: field < value,
+            '<=': lambda: field <= value,
+            '>': lambda: field > value,
+            '>=': lambda: field >= value,
+            'in': lambda: field.isin(list(value))
+        }[op]()
+        expression = e if expression is None else expression & e
+
+    return expression
+
+class DeltaSnapshot():
+    """
+    The active files & metadata of a Delta table at a version.
+
+    Attributes:
+    - version (int): The table version.
+    - files (dict): The add actions of the active files keyed by their path.
+    - schema (dict): The Delta schema of the table.
+    - partition_columns (list): The partition columns of the table.
+    - configuration (dict): The table properties.
+    - protocol (dict): The protocol action of the table.
+    """
+
+    def __init__(self):
+        self.version = -1
+        self.files = {}
+        self.schema = {'fields': []}
+        self.partition_columns = []
+        self.configuration = {}
+        self.protocol = {}
+
+    def apply(self, action):
+        """
+        Applies a transaction log action to the snapshot.
+
+        Parameters:
+        - action (dict): The action, e.g. {'add': {...}}.
+        """
+        if action.get('add'):
+            add = action['add']
+            self.files[add['path']] = add
+        elif action.get('remove'):
+            self.files.pop(action['remove']['path'], None)
+        elif action.get('metaData'):
+            meta = action['metaData']
+            self.schema = json.loads(meta['schemaString'])
+            self.partition_columns = list(meta.get('partitionColumns') or [])
+            self.configuration = dict(meta.get('configuration') or {})
+        elif action.get('protocol'):
+            self.protocol = action['protocol']
+
+    def check(self, path):
+        """
+        Verifies the snapshot can be read from its Parquet files alone.
+
+        Parameters:
+        - path (str): The table path, for the error message.
+
+        Raises:
+        - UnsupportedTableError: If the protocol requires an unsupported reader feature, column mapping is enabled, or a file has a deletion vector.
+        """
+        version = self.protocol.get('minReaderVersion') or 1
+        features = set(self.protocol.get('readerFeatures') or [])
+        if version > 3:
+            raise UnsupportedTableError(f'{path} Requires Delta Reader Version {version}')
+        if version == 3 and features - SUPPORTED_READER_FEATURES:
+            raise UnsupportedTableError(f'{path} Requires Unsupported Delta Reader Features {sorted(features - SUPPORTED_READER_FEATURES)}')
+        if self.configuration.get('delta.columnMapping.mode', 'none') != 'none':
+            raise UnsupportedTableError(f'{path} Uses Column Mapping')
+        if any(add.get('deletionVector') for add in self.files.values()):
+            raise UnsupportedTableError(f'{path} Has Deletion Vectors')
+
+    def copy(self):
+        """Returns a copy of the snapshot, to be updated while readers use the original."""
+        snapshot = DeltaSnapshot()
+        snapshot.version = self.version
+        snapshot.files = dict(self.files)
+        snapshot.schema = self.schema
+        snapshot.partition_columns = self.partition_columns
+        snapshot.configuration = self.configuration
+        snapshot.protocol = self.protocol
+        return snapshot
+
+    def types(self):
+        """
+        Returns the Delta type names of the columns.
+
+        Returns:
+        - dict: The type name of each column, complex types as 'complex'.
+        """
+        return {f['name']: f['type'] if isinstance(f['type'], str) else 'complex' for f in self.schema['fields']}
+
+class DeltaReader():
+    """
+    Reads a Delta table with Arrow, pruning files with the transaction log.
+
+    Attributes:
+    - path (str): The table path.
+    - fs (fsspec.AbstractFileSystem): The filesystem of the table.
+    - refresh_seconds (float): The minimum seconds between checks for new versions.
+
+    Methods:
+    - snapshot(self): Returns the latest snapshot, replaying only new commits.
+    - files(self, d0, d1, filters): Returns the pruned add actions of a date range.
+    - read(self, d0, d1, filters, columns): Reads a date range as an Arrow table.
+    """
+
+    def __init__(self, path, storage_options=None, refresh_seconds=DELTA_READER_REFRESH_SECONDS, cache_size=DELTA_READER_CACHE_SIZE):
+        """
+        Initializes the reader.
+
+        Parameters:
+        - path (str): The table path or URL.
+        - storage_options (dict): The fsspec storage options (default: None).
+        - refresh_seconds (float): The minimum seconds between checks for new versions (default: DELTA_READER_REFRESH_SECONDS).
+        - cache_size (int): The maximum number of cached results (default: DELTA_READER_CACHE_SIZE).
+        """
+        self.fs, self._root = fsspec.core.url_to_fs(path, **(storage_options or {}))
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.cache_size = cache_size
+
+        self._log = f'{self._root.rstrip("/")}/_delta_log'
+        self._snapshot = None
+        self._checked = 0.0
+        self._results = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _read_json(self, version):
+        """Returns the actions of a JSON commit."""
+        with self.fs.open(f'{self._log}/{version:020d}.json', 'r') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _read_checkpoint(self, version, parts=None):
+        """Returns the actions of a (multi-part) checkpoint."""
+        if parts:
+            paths = [f'{self._log}/{version:020d}.checkpoint.{i:010d}.{parts:010d}.parquet' for i in range(1, parts + 1)]
+        else:
+            paths = [f'{self._log}/{version:020d}.checkpoint.parquet']
+
+        actions = []
+        for p in paths:
+            with self.fs.open(p, 'rb') as f:
+                table = pq.read_table(f)
+
+            columns = [c for c in ('protocol', 'metaData', 'add', 'remove') if c in table.column_names]
+            for row in table.select(columns).to_pylist():
+                add, meta = row.get('add'), row.get('metaData')
+                if add and isinstance(add.get('partitionValues'), list):
+                    add['partitionValues'] = dict(add['partitionValues'])
+                if meta and isinstance(meta.get('configuration'), list):
+                    meta['configuration'] = dict(meta['configuration'])
+                actions.append(row)
+
+        return actions
+
+    def _last_checkpoint(self):
+        """Returns the `_last_checkpoint` record, or None."""
+        try:
+            with self.fs.open(f'{self._log}/_last_checkpoint', 'r') as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
+
+    def _commit_versions(self, after):
+        """Returns the versions of the JSON commits after a version."""
+        versions = []
+        for p in self.fs.ls(self._log, detail=False):
+            name = p.rstrip('/').rsplit('/', 1)[-1]
+            if name.endswith('.json') and name[:-5].isdigit() and int(name[:-5]) > after:
+                versions.append(int(name[:-5]))
+
+        return sorted(versions)
+
+    def snapshot(self):
+        """
+        Returns the latest snapshot of the table.
+
+        New versions are checked at most every `refresh_seconds`. A cached snapshot is
+        brought up to date with the new JSON commits only; without a cached snapshot the
+        last checkpoint is replayed first.
+
+        Returns:
+        - DeltaSnapshot: The latest snapshot.
+
+        Raises:
+        - UnsupportedTableError: If the table requires a reader feature the reader doesn't implement, see `DeltaSnapshot.check`.
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._snapshot is not None and now - self._checked < self.refresh_seconds:
+                return self._snapshot
+
+            snapshot = self._snapshot
+            if snapshot is None:
+                snapshot = DeltaSnapshot()
+                checkpoint = self._last_checkpoint()
+                if checkpoint:
+                    for action in self._read_checkpoint(checkpoint['version'], checkpoint.get('parts')):
+                        snapshot.apply(action)
+                    snapshot.version = checkpoint['version']
+
+            versions = self._commit_versions(snapshot.version)
+            if versions and snapshot is self._snapshot:
+                snapshot = snapshot.copy()
+
+            for version in versions:
+                for action in self._read_json(version):
+                    snapshot.apply(action)
+                snapshot.version = version
+
+            if snapshot.version < 0:
+                raise FileNotFoundError(f'No Delta table at {self.path}')
+            snapshot.check(self.path)
+
+            self._snapshot = snapshot
+            self._checked = now
+            return snapshot
+
+    def files(self, d0=None, d1=None, filters=None, paths=None):
+        """
+        Returns the add actions of the files that may hold rows of a date range & filters.
+
+        Parameters:
+        - d0 (datetime.date): The end date of the date range (default: None, unbounded).
+        - d1 (datetime.date): The start date of the date range (default: None, unbounded).
+        - filters (list): The (column, op, value) filters (default: None).
+        - paths (iterable): The file paths the read is restricted to, e.g. by a Bloom index (default: None, all).
+
+        Returns:
+        - list: The add actions of the files to read.
+        """
+        snapshot = self.snapshot()
+        types = snapshot.types()
+        filters = filters or []
+        partition_filters = [f for f in filters if f[0] in snapshot.partition_columns]
+        data_filters = [f for f in filters if f[0] not in snapshot.partition_columns]
+
+        dates = None
+        if d0 is not None or d1 is not None:
+            assert(set(PARTITION_COLUMNS).issubset(snapshot.partition_columns))
+            d1 = d1 or d0
+            d0 = d0 or d1
+            dates = {(d.year, d.month, d.day) for d in (d1 + datetime.timedelta(x) for x in range((d0-d1).days+1))}
+
+        paths = {unquote(p) for p in paths} if paths is not None else None
+
+        selected = []
+        for add in snapshot.files.values():
+            if paths is not None and unquote(add['path']) not in paths:
+                continue
+            values = {k: _partition_value(v, types.get(k)) for k, v in add['partitionValues'].items()}
+            if dates is not None and tuple(int(values[c]) for c in PARTITION_COLUMNS) not in dates:
+                continue
+            if partition_filters and not _stats_match({'minValues': values, 'maxValues': values}, partition_filters):
+                continue
+            if data_filters and not _stats_match(json.loads(add.get('stats') or '{}'), data_filters):
+                continue
+            selected.append(add)
+
+        return selected
+
+    def _read_file(self, add, types, columns, partitions, row_filter):
+        """
+        Reads a data file, adding its partition values as columns.
+
+        Parameters:
+        - add (dict): The add action of the file.
+        - types (dict): The Delta type names of the columns.
+        - columns (list): The data columns to read, None for all.
+        - partitions (list): The partition columns to add.
+        - row_filter (pyarrow.compute.Expression): The data row filter, or None.
+
+        Returns:
+        - pyarrow.Table: The rows of the file.
+        """
+        path = unquote(add['path'])
+        if '://' not in path:
+            path = f'{self._root.rstrip("/")}/{path}'
+
+        with self.fs.open(path, 'rb') as f:
+            table = pq.read_table(f, columns=columns, filters=row_filter)
+
+        for k in partitions:
+            value = _partition_value(add['partitionValues'].get(k), types.get(k))
+            table = table.append_column(k, pa.array([value] * table.num_rows, _ARROW_TYPES.get(types.get(k), pa.string())))
+
+        return table
+
+    def read(self, d0=None, d1=None, filters=None, columns=None, paths=None):
+        """
+        Reads the rows of a date range & filters as an Arrow table.
+
+        Results are cached keyed by the table version and arguments.
+
+        Parameters:
+        - d0 (datetime.date): The end date of the date range (default: None, unbounded).
+        - d1 (datetime.date): The start date of the date range (default: None, unbounded).
+        - filters (list): The (column, op, value) filters, ANDed; ops are =, <, <=, >, >= & in (default: None).
+        - columns (list): The columns to return (default: None, all).
+        - paths (iterable): The file paths the read is restricted to (default: None, all).
+
+        Returns:
+        - pyarrow.Table: The matching rows.
+        """
+        snapshot = self.snapshot()
+        filters = [(c, op, tuple(v) if op == 'in' else v) for c, op, v in (filters or [])]
+        paths = tuple(sorted(paths)) if paths is not None else None
+        key = (snapshot.version, d0, d1, tuple(filters), tuple(columns) if columns else None, paths)
+
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+
+        t0 = time.perf_counter()
+        types = snapshot.types()
+        files = self.files(d0, d1, filters, paths)
+        data_columns = [c for c in columns if c not in snapshot.partition_columns] if columns else None
+        data_filters = [f for f in filters if f[0] not in snapshot.partition_columns]
+        partition_filters = [f for f in filters if f[0] in snapshot.partition_columns]
+        partitions = [c for c in snapshot.partition_columns if not columns or c in columns or c in {f[0] for f in partition_filters}]
+        row_filter = _row_filter(data_filters)
+
+        with ThreadPoolExecutor(max_workers=DELTA_READER_THREADS) as executor:
+            tables = list(executor.map(lambda add: self._read_file(add, types, data_columns, partitions, row_filter), files))
+
+        if tables:
+            table = pa.concat_tables(tables, promote_options='default')
+            if partition_filters:
+                table = table.filter(_row_filter(partition_filters))
+            if columns:
+                table = table.select(columns)
+        else:
+            table = self._empty(snapshot, columns)
+
+        logger.info(f'Delta Reader | {self.path} | Version {snapshot.version} | {len(files)}/{len(snapshot.files)} Files | {table.num_rows} Rows in {time.perf_counter() - t0:.3f}s')
+
+        with self._lock:
+            self._results[key] = table
+            while len(self._results) > self.cache_size:
+                self._results.popitem(last=False)
+
+        return table
+
+    @staticmethod
+    def _empty(snapshot, columns):
+        """Returns an empty table with the schema of the snapshot."""
+        types = snapshot.types()
+        names = columns or [f['name'] for f in snapshot.schema['fields']]
+        return pa.table({n: pa.array([], _ARROW_TYPES.get(types.get(n), pa.string())) for n in names})
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+def get_reader(path, storage_options=None):
+    """
+    Returns the cached reader of a table path.
+
+    Parameters:
+    - path (str): The table path or URL.
+    - storage_options (dict): The fsspec storage options (default: None).
+
+    Returns:
+    - DeltaReader: The reader of the table.
+    """
+    with _readers_lock:
+        if path not in _readers:
+            _readers[path] = DeltaReader(path, storage_options)
+
+        return _readers[path]
+
+def read_output(table, d0=None, d1=None, filters=None, columns=None, output_dir=OUTPUT_DIR, blob_prefix='output' if CLOUD_PROVIDER!='AZURE' else '', storage_options=None):
+    """
+    Reads a slice of an output table, e.g. one user's or one day's `game_metrics`.
+
+    Parameters:
+    - table (str): The output table, e.g. 'game_metrics' or 'message_flow'.
+    - d0 (datetime.date): The end date of the date range (default: None, unbounded).
+    - d1 (datetime.date): The start date of the date range (default: None, unbounded).
+    - filters (list): The (column, op, value) filters, e.g. [('user_id', '=', token_id(token))] (default: None).
+    - columns (list): The columns to return (default: None, all).
+    - output_dir (str): The output directory (default: OUTPUT_DIR).
+    - blob_prefix (str): The prefix to be appended to the output directory paths (default: 'output' if CLOUD_PROVIDER is not 'AZURE', else '').
+    - storage_options (dict): The fsspec storage options (default: None).
+
+    Returns:
+    - pyarrow.Table: The matching rows.
+    """
+    assert(not output_dir is None and output_dir != '')
+    reader = get_reader(os.path.join(output_dir, blob_prefix, table), storage_options)
+    return reader.read(d0, d1, filters, columns)
@@ -0,0 +1,102 @@
+""" ETL Manifest
+
+Maps the ETL runs (`etl_id`) and message ranges of the stage tables to their partitions and files.
+
+Stage tables are partitioned by the day their RAW files landed, and the output tasks read
+a fixed window of days. A message landed by a late run of the ETL service sits in a later
+partition than the rest of its batch, or a batch referenced by `etl_meta` lands partly
+outside the window, and the window misses it. Stage loads write one `etl_manifest` row
+per data file and `etl_id` of the loaded window, with its row count and `msg_id` range,
+to the table next to the stage tables. The output tasks look up the batches of the
+`etl_meta` window in the manifest and also read the files holding them outside the
+window, rather than widening the window.
+
+Files without a manifest row in a looked up partition, e.g. compacted since their load,
+are always read, so late rows are never missed.
+
+This module doesn't import pyspark.
+
+Example:
+    from spark_solutions.readers.etl_manifest import locate
+
+    rows = locate('log_meta', msg_id=msg_id)
+"""
+
+from urllib.parse import unquote
+
+import os
+
+# ENV Variables
+CLOUD_PROVIDER=os.getenv('CLOUD_PROVIDER', 'LOCAL')
+STAGE_DIR = os.getenv('STAGE_DIR')
+
+ETL_MANIFEST_TABLE = 'etl_manifest'
+
+def manifest_path(table_path):
+    """
+    Returns the path of the ETL manifest of a table, stored next to the table.
+
+    Parameters:
+    - table_path (str): The table path.
+
+    Returns:
+    - str: The `etl_manifest` table path.
+    """
+    return os.path.join(os.path.dirname(table_path.rstrip('/')), ETL_MANIFEST_TABLE)
+
+def late_files(rows, window):
+    """
+    Returns the files of a table holding the looked up batches outside the window.
+
+    Parameters:
+    - rows (iterable): The `etl_manifest` rows of the table and batches, with `path`, `year`, `month` & `day`.
+    - window (set): The (year, month, day) partition values of the window, as strings.
+
+    Returns:
+    - dict: The partition values of each file, by path relative to the table.
+    """
+    return {unquote(r['path']): (r['year'], r['month'], r['day']) for r in rows if (r['year'], r['month'], r['day']) not in window}
+
+def candidate_files(paths, late, indexed):
+    """
+    Returns the data files to read for the late batches.
+
+    Parameters:
+    - paths (iterable): The data file paths of the late partitions in the table snapshot, relative to the table.
+    - late (iterable): The paths of the files holding the late batches.
+    - indexed (iterable): The paths of the late partitions with a manifest row.
+
+    Returns:
+    - list: The paths holding a late batch, or without a manifest row.
+    """
+    late, indexed = {unquote(p) for p in late}, {unquote(p) for p in indexed}
+    return [p for p in paths if unquote(p) in late or unquote(p) not in indexed]
+
+def locate(table, etl_ids=None, msg_id=None, stage_dir=STAGE_DIR, blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else '', storage_options=None):
+    """
+    Returns the partitions and files of a stage table holding ETL runs or a message.
+
+    A message is located by the `msg_id` ranges of the files, which may hold it.
+
+    Parameters:
+    - table (str): The stage table, e.g. 'log_meta'.
+    - etl_ids (iterable): The ETL run ids (default: None, any).
+    - msg_id (str): The message id (default: None, any).
+    - stage_dir (str): The stage directory (default: STAGE_DIR).
+    - blob_prefix (str): The prefix to be appended to the stage directory paths (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
+    - storage_options (dict): The fsspec storage options (default: None).
+
+    Returns:
+    - list: The manifest rows, with `etl_id`, `path`, `num_rows`, `year`, `month` & `day`.
+    """
+    from spark_solutions.readers.delta_reader import read_output
+
+    assert(not stage_dir is None and stage_dir != '')
+    filters = [('table_name', '=', table)]
+    if etl_ids is not None:
+        filters.append(('etl_id', 'in', sorted(set(etl_ids))))
+    if msg_id is not None:
+        filters += [('min_msg_id', '<=', msg_id), ('max_msg_id', '>=', msg_id)]
+
+    return read_output(ETL_MANIFEST_TABLE, filters=filters, columns=['etl_id', 'path', 'num_rows', 'year', 'month', 'day'],
+                       output_dir=stage_dir, blob_prefix=blob_prefix, storage_options=storage_options).to_pylist()
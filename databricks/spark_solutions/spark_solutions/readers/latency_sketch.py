@@ -0,0 +1,159 @@
+""" Latency Sketches
+
+Mergeable quantile sketches of the `message_latency` output.
+
+Each row of `message_latency` summarizes the latencies of one hop, minute or hour and
+ETL service/mode as a log-bucketed sketch (DDSketch): a latency v > 0 is counted in bucket
+ceil(log(v) / log(gamma)), with gamma = (1 + alpha) / (1 - alpha), and latencies <= 0 are
+counted apart. Sketches merge by adding their bucket counts, and any quantile estimated
+from a merged sketch is within a relative error of alpha of the exact quantile.
+
+This module doesn't import pyspark, so dashboards answer p50, p99 and p999 over any
+window by merging the few hundred sketch rows read with the Arrow `DeltaReader`.
+
+Example:
+    from spark_solutions.readers.latency_sketch import read_quantiles
+
+    rows = read_quantiles(d0, d1, group_by=('hop', 'etl_service'))
+"""
+
+from collections import Counter
+
+import math
+
+QUANTILES = (0.5, 0.99, 0.999)
+
+def log_gamma(alpha):
+    """
+    Returns the logarithm of the bucket growth factor of a relative accuracy.
+
+    Parameters:
+    - alpha (float): The relative accuracy, e.g. 0.01.
+
+    Returns:
+    - float: log((1 + alpha) / (1 - alpha)).
+    """
+    assert(0 < alpha < 1)
+    return math.log((1 + alpha) / (1 - alpha))
+
+def bucket(value, alpha):
+    """
+    Returns the bucket of a latency, or None for latencies <= 0.
+
+    Parameters:
+    - value (float): The latency.
+    - alpha (float): The relative accuracy.
+
+    Returns:
+    - int or None: The bucket index.
+    """
+    if value is None or value <= 0:
+        return None
+
+    return int(math.ceil(math.log(value) / log_gamma(alpha)))
+
+def merge(sketches):
+    """
+    Merges sketches of the same relative accuracy.
+
+    Parameters:
+    - sketches (iterable): The sketch rows, with `alpha`, `count`, `zero_count`, `min_ms`, `max_ms`, `sum_ms` & `buckets`.
+
+    Returns:
+    - dict: The merged sketch, or None if there are no sketches.
+    """
+    merged = None
+    for s in sketches:
+        buckets = s['buckets'] or {}
+        items = buckets.items() if isinstance(buckets, dict) else buckets
+        if merged is None:
+            merged = {'alpha': s['alpha'], 'count': 0, 'zero_count': 0, 'min_ms': s['min_ms'], 'max_ms': s['max_ms'], 'sum_ms': 0.0, 'buckets': Counter()}
+        assert(s['alpha'] == merged['alpha'])
+
+        merged['count'] += s['count']
+        merged['zero_count'] += s['zero_count']
+        merged['min_ms'] = min(merged['min_ms'], s['min_ms'])
+        merged['max_ms'] = max(merged['max_ms'], s['max_ms'])
+        merged['sum_ms'] += s['sum_ms']
+        for k, n in items:
+            merged['buckets'][k] += n
+
+    return merged
+
+def quantile(sketch, q):
+    """
+    Estimates a quantile of a sketch.
+
+    Parameters:
+    - sketch (dict): The sketch, see `merge`.
+    - q (float): The quantile, between 0 and 1.
+
+    Returns:
+    - float or None: The estimated latency, or None for an empty sketch.
+    """
+    if not sketch or not sketch['count']:
+        return None
+
+    rank = q * (sketch['count'] - 1)
+    if rank < sketch['zero_count']:
+        return min(sketch['min_ms'], 0.0)
+
+    seen = sketch['zero_count']
+    gamma = math.exp(log_gamma(sketch['alpha']))
+    for k in sorted(sketch['buckets']):
+        seen += sketch['buckets'][k]
+        if seen > rank:
+            value = 2 * gamma**k / (gamma + 1)
+            return max(sketch['min_ms'], min(sketch['max_ms'], value))
+
+    return sketch['max_ms']
+
+def summarize(sketches, quantiles=QUANTILES, group_by=('hop',)):
+    """
+    Merges sketch rows by group and estimates their quantiles.
+
+    Parameters:
+    - sketches (iterable): The sketch rows.
+    - quantiles (tuple): The quantiles to estimate (default: QUANTILES).
+    - group_by (tuple): The grouping columns (default: ('hop',)).
+
+    Returns:
+    - list: One dictionary per group with its columns, `count`, `mean_ms` and `p<quantile>` estimates.
+    """
+    groups = {}
+    for s in sketches:
+        groups.setdefault(tuple(s[c] for c in group_by), []).append(s)
+
+    rows = []
+    for key, group in sorted(groups.items(), key=lambda g: tuple(str(k) for k in g[0])):
+        sketch = merge(group)
+        row = dict(zip(group_by, key))
+        row['count'] = sketch['count']
+        row['mean_ms'] = sketch['sum_ms'] / sketch['count'] if sketch['count'] else None
+        for q in quantiles:
+            row[f'p{q * 100:g}'.replace('.', '')] = quantile(sketch, q)
+        rows.append(row)
+
+    return rows
+
+def read_quantiles(d0=None, d1=None, quantiles=QUANTILES, grain='hour', group_by=('hop',), filters=None, **kwargs):
+    """
+    Reads the sketches of a window from `message_latency` and estimates their quantiles.
+
+    Parameters:
+    - d0 (datetime.date): The end date of the date range (default: None, unbounded).
+    - d1 (datetime.date): The start date of the date range (default: None, unbounded).
+    - quantiles (tuple): The quantiles to estimate (default: QUANTILES).
+    - grain (str): 'minute' or 'hour' sketches; hours merge 60 times fewer rows (default: 'hour').
+    - group_by (tuple): The grouping columns, e.g. ('hop', 'etl_service', 'window_start') (default: ('hop',)).
+    - filters (list): Additional (column, op, value) filters (default: None).
+    - kwargs: The remaining arguments of `read_output`.
+
+    Returns:
+    - list: One dictionary per group, see `summarize`.
+    """
+    from spark_solutions.readers.delta_reader import read_output
+
+    filters = [('grain', '=', grain)] + list(filters or [])
+    table = read_output('message_latency', d0, d1, filters=filters, **kwargs)
+    return summarize(table.to_pylist(), quantiles, group_by)
@@ -0,0 +1,93 @@
+""" Token Dictionary
+
+Compact 64-bit surrogate ids of the `game_token`, `user_token` and `enemy_token` strings.
+
+The tokens are long strings repeated in every game and lobby row and are the join and
+group keys of the game outputs. Stage tables carry an id per token next to it, derived
+from the token itself: the first 60 bits of its MD5 digest, so Spark, the local backend
+and this module agree without a lookup, and concurrent stage jobs need no coordination.
+Users and enemies share the 'user' id space, games have their own. Two tokens of a space
+sharing an id fail their stage load with a `TokenCollisionError`, so they're never merged.
+
+Stage loads merge the new tokens of their window into the `token_dictionary` table next
+to the stage tables, which translates ids back to tokens.
+
+This module doesn't import pyspark.
+
+Example:
+    from spark_solutions.readers.token_dictionary import read_tokens
+
+    tokens = read_tokens(df['user_id'].unique(), 'user')
+"""
+
+import hashlib
+import os
+
+# ENV Variables
+CLOUD_PROVIDER=os.getenv('CLOUD_PROVIDER', 'LOCAL')
+STAGE_DIR = os.getenv('STAGE_DIR')
+
+TOKEN_DICTIONARY_TABLE = 'token_dictionary'
+
+# Token columns, with their id column and id space
+TOKEN_COLUMNS = {
+    'game_token': ('game_id', 'game'),
+    'user_token': ('user_id', 'user'),
+    'enemy_token': ('enemy_id', 'user')
+}
+
+ID_HEX_DIGITS = 15
+
+class TokenCollisionError(Exception):
+    """Raised when two tokens of an id space share an id."""
+
+def token_id_sql(column):
+    """
+    Returns the Spark SQL expression of the id of a token column.
+
+    Parameters:
+    - column (str): The token column.
+
+    Returns:
+    - str: The id expression, NULL for NULL tokens.
+    """
+    return f'CAST(CONV(SUBSTR(MD5(CAST({column} AS STRING)), 1, {ID_HEX_DIGITS}), 16, 10) AS BIGINT)'
+
+def token_id(token):
+    """
+    Returns the id of a token, as computed by `token_id_sql`.
+
+    Parameters:
+    - token (str): The token.
+
+    Returns:
+    - int or None: The id, None for a None token.
+    """
+    if token is None:
+        return None
+
+    return int(hashlib.md5(str(token).encode('utf-8')).hexdigest()[:ID_HEX_DIGITS], 16)
+
+def read_tokens(ids, token_type, stage_dir=STAGE_DIR, blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else '', storage_options=None):
+    """
+    Translates ids back to their tokens.
+
+    Parameters:
+    - ids (iterable): The ids.
+    - token_type (str): The id space, 'game' or 'user'.
+    - stage_dir (str): The stage directory (default: STAGE_DIR).
+    - blob_prefix (str): The prefix to be appended to the stage directory paths (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
+    - storage_options (dict): The fsspec storage options (default: None).
+
+    Returns:
+    - dict: The token of each known id.
+    """
+    from spark_solutions.readers.delta_reader import read_output
+
+    ids = sorted({int(i) for i in ids if i is not None})
+    if not ids:
+        return {}
+
+    table = read_output(TOKEN_DICTIONARY_TABLE, filters=[('token_type', '=', token_type), ('token_id', 'in', ids)],
+                        columns=['token_id', 'token'], output_dir=stage_dir, blob_prefix=blob_prefix, storage_options=storage_options)
+    return dict(zip(table.column('token_id').to_pylist(), table.column('token').to_pylist()))
@@ -0,0 +1,294 @@
+""" Backfill Scheduler
+
+Reprocesses a historical date range of a task in chunks.
+
+The range is split into chunks of consecutive days, which run concurrently in isolated
+SparkSessions sharing the driver's SparkContext, at most `parallelism` at a time. Each
+chunk runs the task's Extract, Transform & Load for its own window; loads only replace
+the partitions of their window, so a chunk can be rerun safely. Completed chunks are
+appended to the `backfill_meta` Delta table, and days already backfilled for the task
+are skipped, so an interrupted backfill resumes where it stopped.
+
+Example:
+    backfill --task stage_buffer_meta --start 2024-01-01 --end 2024-03-31 --chunk-days 7 --parallelism 4
+"""
+
+from spark_solutions.common.spark_quality import DataQualityError
+from spark_solutions.common.spark_config import SparkConfig
+from spark_solutions.common.spark_cache import table_cache
+from spark_solutions.common.spark_misc import date_range
+from pyspark.sql.types import StructType, StructField, StringType, LongType, DoubleType, DateType, TimestampType
+from pyspark.errors.exceptions import captured
+from pyspark.sql import functions as F
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import threading
+import importlib
+import argparse
+import datetime
+import logging
+import time
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+CLOUD_PROVIDER=os.getenv('CLOUD_PROVIDER', 'LOCAL')
+BACKFILL_META_DIR=os.getenv('BACKFILL_META_DIR', os.getenv('RUN_META_DIR', os.getenv('STAGE_DIR')))
+BACKFILL_CHUNK_DAYS=int(os.getenv('BACKFILL_CHUNK_DAYS', '7'))
+BACKFILL_PARALLELISM=int(os.getenv('BACKFILL_PARALLELISM', '2'))
+BACKFILL_MAX_ATTEMPTS=int(os.getenv('BACKFILL_MAX_ATTEMPTS', '3'))
+
+assert(not BACKFILL_META_DIR is None and BACKFILL_META_DIR != '')
+
+TASKS = {
+    'stage_buffer_meta': 'spark_solutions.tasks.stage.buffer_meta',
+    'stage_etl_meta': 'spark_solutions.tasks.stage.etl_meta',
+    'stage_log_meta': 'spark_solutions.tasks.stage.log_meta',
+    'stage_lib_server_game': 'spark_solutions.tasks.stage.lib_server_game',
+    'stage_lib_server_lobby': 'spark_solutions.tasks.stage.lib_server_lobby',
+    'output_game_metrics': 'spark_solutions.tasks.output.game_metrics',
+    'output_message_flow': 'spark_solutions.tasks.output.message_flow',
+    'output_message_latency': 'spark_solutions.tasks.output.message_latency',
+    'output_user_day_rollup': 'spark_solutions.tasks.output.user_day_rollup'
+}
+
+BACKFILL_META_SCHEMA = StructType([
+    StructField('task', StringType()),
+    StructField('chunk_start', DateType()),
+    StructField('chunk_end', DateType()),
+    StructField('status', StringType()),
+    StructField('attempts', LongType()),
+    StructField('seconds', DoubleType()),
+    StructField('error', StringType()),
+    StructField('app_id', StringType()),
+    StructField('timestamp', TimestampType()),
+    StructField('year', StringType()),
+    StructField('month', StringType()),
+    StructField('day', StringType())
+])
+
+def plan_chunks(dates, chunk_days=BACKFILL_CHUNK_DAYS):
+    """
+    Groups dates into chunks of consecutive days.
+
+    Gaps, such as days already backfilled, always start a new chunk.
+
+    Parameters:
+    - dates (list): The dates to backfill.
+    - chunk_days (int): The maximum number of days of a chunk (default: BACKFILL_CHUNK_DAYS).
+
+    Returns:
+    - list: The (start date, end date) tuples of the chunks, oldest first.
+    """
+    assert(chunk_days > 0)
+    chunks = []
+    for d in sorted(set(dates)):
+        if chunks and (d - chunks[-1][1]).days == 1 and (d - chunks[-1][0]).days < chunk_days:
+            chunks[-1] = (chunks[-1][0], d)
+        else:
+            chunks.append((d, d))
+
+    return chunks
+
+class Backfill():
+    """
+    Runs a task over a historical date range in concurrent chunks.
+
+    Attributes:
+    - config (SparkConfig): The SparkConfig of the driver.
+    - sc (SparkSession): The SparkSession of the driver, reading and writing the checkpoint.
+    - task (str): The task name, a key of TASKS.
+    - path (str): The path of the `backfill_meta` checkpoint table.
+    - results (list): The checkpoint records of the chunks run.
+
+    Methods:
+    - completed_dates(self, d0, d1): Returns the days of a range already backfilled.
+    - run(self, d0, d1, chunk_days, parallelism, restart): Backfills a date range.
+    """
+
+    def __init__(self, config, task, blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
+        """
+        Initializes the backfill.
+
+        Parameters:
+        - config (SparkConfig): The SparkConfig of the driver.
+        - task (str): The task name, a key of TASKS.
+        - blob_prefix (str): The prefix to be appended to the checkpoint table path (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
+        """
+        assert(task in TASKS)
+        self.config = config
+        self.sc = config.get_sparkContext()
+        self.task = task
+        self.path = os.path.join(BACKFILL_META_DIR, blob_prefix, 'backfill_meta')
+        self.results = []
+
+        self._module = importlib.import_module(TASKS[task])
+        self._lock = threading.Lock()
+
+    def completed_dates(self, d0, d1):
+        """
+        Returns the days of a range already backfilled for the task.
+
+        Parameters:
+        - d0 (datetime.date): The end date of the range.
+        - d1 (datetime.date): The start date of the range.
+
+        Returns:
+        - set: The dates covered by succeeded chunks.
+        """
+        try:
+            df = self.sc.read.format('delta').load(self.path)
+        except captured.AnalysisException:
+            return set()
+
+        rows = df \
+            .where((F.col('task') == self.task) & (F.col('status') == 'SUCCEEDED')) \
+            .where((F.col('chunk_end') >= F.lit(d1)) & (F.col('chunk_start') <= F.lit(d0))) \
+            .select('chunk_start', 'chunk_end') \
+            .collect()
+
+        return {d for r in rows for d in date_range(r.chunk_end, r.chunk_start)}
+
+    def _checkpoint(self, chunk, status, attempts, seconds, error=None):
+        """
+        Appends the record of a chunk to the `backfill_meta` Delta table.
+
+        Appends are serialized so concurrent chunks don't race to create the table.
+
+        Parameters:
+        - chunk (tuple): The (start date, end date) of the chunk.
+        - status (str): 'SUCCEEDED' or 'FAILED'.
+        - attempts (int): The number of attempts made.
+        - seconds (float): The duration of the last attempt.
+        - error (str): The error of the last attempt (default: None).
+
+        Returns:
+        - dict: The checkpoint record.
+        """
+        now = datetime.datetime.utcnow()
+        record = {
+            'task': self.task,
+            'chunk_start': chunk[0],
+            'chunk_end': chunk[1],
+            'status': status,
+            'attempts': attempts,
+            'seconds': seconds,
+            'error': error,
+            'app_id': self.sc.sparkContext.applicationId,
+            'timestamp': now,
+            'year': f'{now.year}',
+            'month': f'{now.month:02d}',
+            'day': f'{now.day:02d}'
+        }
+
+        with self._lock:
+            self.sc.createDataFrame([record], schema=BACKFILL_META_SCHEMA) \
+                .write \
+                .format('delta') \
+                .partitionBy('year', 'month', 'day') \
+                .mode('append') \
+                .save(self.path)
+            self.results.append(record)
+
+        return record
+
+    def _run_chunk(self, chunk):
+        """
+        Runs the task for the window of a chunk in an isolated SparkSession.
+
+        Failed attempts are retried with a linear backoff, except for failed data quality
+        expectations, which a retry wouldn't change.
+
+        Parameters:
+        - chunk (tuple): The (start date, end date) of the chunk.
+
+        Returns:
+        - dict: The checkpoint record of the chunk.
+        """
+        d1, d0 = chunk
+        for attempt in range(1, BACKFILL_MAX_ATTEMPTS + 1):
+            t0 = time.perf_counter()
+            try:
+                sc = self.config.get_isolatedSparkContext()
+                sc.sparkContext.setJobGroup(f'{self.task}:{d1}:{d0}', f'Backfill {self.task} {d1} - {d0}')
+
+                logger.info(f'Backfill | {self.task} | {d1} - {d0} | Attempt {attempt}')
+                self._module._extract(sc, d0=d0, d1=d1)
+                self._module._transform(sc)
+                self._module._load(sc, d0=d0, d1=d1)
+
+                return self._checkpoint(chunk, 'SUCCEEDED', attempt, time.perf_counter() - t0)
+            except Exception as exc:
+                logger.warning(f'Backfill | {self.task} | {d1} - {d0} | Attempt {attempt} Failed {exc}')
+                if attempt == BACKFILL_MAX_ATTEMPTS or isinstance(exc, DataQualityError):
+                    return self._checkpoint(chunk, 'FAILED', attempt, time.perf_counter() - t0, str(exc)[:4096])
+
+                time.sleep(attempt * 10)
+
+    def run(self, d0, d1, chunk_days=BACKFILL_CHUNK_DAYS, parallelism=BACKFILL_PARALLELISM, restart=False):
+        """
+        Backfills a date range, skipping the days already backfilled.
+
+        Parameters:
+        - d0 (datetime.date): The end date of the range.
+        - d1 (datetime.date): The start date of the range.
+        - chunk_days (int): The maximum number of days of a chunk (default: BACKFILL_CHUNK_DAYS).
+        - parallelism (int): The maximum number of concurrent chunks (default: BACKFILL_PARALLELISM).
+        - restart (bool): Whether days already backfilled are reprocessed (default: False).
+
+        Returns:
+        - list: The checkpoint records of the chunks run.
+
+        Raises:
+        - RuntimeError: If a chunk failed; rerunning the backfill resumes from the failed chunks.
+        """
+        assert(d1 <= d0)
+        dates = date_range(d0, d1)
+        completed = set() if restart else self.completed_dates(d0, d1)
+        chunks = plan_chunks([d for d in dates if d not in completed], chunk_days)
+        logger.info(f'Backfill | {self.task} | {d1} - {d0} | {len(completed)} Days Completed | {len(chunks)} Chunks Pending')
+
+        with ThreadPoolExecutor(max_workers=max(1, parallelism), thread_name_prefix='backfill') as executor:
+            futures = [executor.submit(self._run_chunk, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                r = future.result()
+                logger.info(f'Backfill | {self.task} | {r["chunk_start"]} - {r["chunk_end"]} | {r["status"]} in {r["seconds"]:.1f}s')
+
+        failed = [(r['chunk_start'], r['chunk_end']) for r in self.results if r['status'] != 'SUCCEEDED']
+        if failed:
+            raise RuntimeError(f'Backfill {self.task} failed chunks {failed}')
+
+        return self.results
+
+def _date(value):
+    """Parses an ISO date argument."""
+    return datetime.date.fromisoformat(value)
+
+def entrypoint(argv=None):
+    """
+    Entry point for backfilling a task over a historical date range.
+
+    Parameters:
+    - argv (list): The command line arguments (default: sys.argv).
+    """
+    parser = argparse.ArgumentParser(description='Backfill a task over a historical date range.')
+    parser.add_argument('--task', required=True, choices=sorted(TASKS))
+    parser.add_argument('--start', required=True, type=_date, help='First date of the range (YYYY-MM-DD).')
+    parser.add_argument('--end', type=_date, default=datetime.date.today() - datetime.timedelta(1), help='Last date of the range (default: yesterday).')
+    parser.add_argument('--chunk-days', type=int, default=BACKFILL_CHUNK_DAYS)
+    parser.add_argument('--parallelism', type=int, default=BACKFILL_PARALLELISM)
+    parser.add_argument('--restart', action='store_true', help='Reprocess days already backfilled.')
+    args = parser.parse_args(argv)
+
+    config = SparkConfig(app_name=f'backfill_{args.task}', profile=args.task)
+
+    # Chunk windows are read once, caching them would only evict each other
+    table_cache.enabled = False
+
+    with config.get_runMetrics() as run_metrics:
+        with run_metrics.phase('Backfill'):
+            Backfill(config, args.task).run(args.end, args.start, args.chunk_days, args.parallelism, args.restart)
+
+if __name__ == '__main__':
+    entrypoint()
@@ -0,0 +1,327 @@
+""" Delta Table Maintenance
+
+Compacts, vacuums and tunes the transaction log of the stage and output Delta tables.
+
+Daily partition overwrites and run metadata appends leave many small files and long
+transaction logs behind. For every table in `spark_solutions/conf/maintenance.yml` this task:
+
+- Compacts the partitions of the recent days to the target file size, leaving out the
+  days still overwritten by the daily ETL window. Compaction doesn't change data, so
+  readers are unaffected; a write conflicting with a concurrent ETL task is retried once,
+  then skipped until the next run.
+- Vacuums files unreferenced for longer than the retention window, which Delta refuses
+  below a week, so concurrent readers and writers keep their snapshot files.
+- Sets the log checkpoint interval and log retention of the table, only when they differ.
+
+File counts, bytes and the scan time of the compacted window are measured before and
+after and appended to the `maintenance_meta` Delta table next to `run_meta`.
+"""
+
+from spark_solutions.common.spark_config import SparkConfig
+from spark_solutions.common.spark_misc import date_partition_filter, date_range, is_conflict
+from pyspark.sql.types import StructType, StructField, StringType, LongType, DoubleType, TimestampType
+from pyspark.errors.exceptions import captured
+from delta import DeltaTable
+
+import importlib.resources
+import argparse
+import datetime
+import logging
+import yaml
+import time
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+CLOUD_PROVIDER=os.getenv('CLOUD_PROVIDER', 'LOCAL')
+STAGE_DIR = os.getenv('STAGE_DIR')
+OUTPUT_DIR = os.getenv('OUTPUT_DIR')
+MAINTENANCE_CONF=os.getenv('MAINTENANCE_CONF', str(importlib.resources.files('spark_solutions') / 'conf' / 'maintenance.yml'))
+MAINTENANCE_META_DIR=os.getenv('MAINTENANCE_META_DIR', os.getenv('RUN_META_DIR', STAGE_DIR))
+
+assert(not STAGE_DIR is None and STAGE_DIR != '')
+assert(not OUTPUT_DIR is None and OUTPUT_DIR != '')
+
+DEFAULTS = {
+    'target_file_bytes': 128 * 1024**2,
+    'recent_days': 7,
+    'skip_days': 2,
+    'retention_hours': 168,
+    'checkpoint_interval': 10,
+    'log_retention': 'interval 30 days'
+}
+
+MAINTENANCE_META_SCHEMA = StructType([
+    StructField('table', StringType()),
+    StructField('path', StringType()),
+    StructField('window_start', StringType()),
+    StructField('window_end', StringType()),
+    StructField('status', StringType()),
+    StructField('window_files_before', LongType()),
+    StructField('window_files_after', LongType()),
+    StructField('table_files_before', LongType()),
+    StructField('table_files_after', LongType()),
+    StructField('table_bytes_before', LongType()),
+    StructField('table_bytes_after', LongType()),
+    StructField('scan_seconds_before', DoubleType()),
+    StructField('scan_seconds_after', DoubleType()),
+    StructField('seconds', DoubleType()),
+    StructField('timestamp', TimestampType()),
+    StructField('year', StringType()),
+    StructField('month', StringType()),
+    StructField('day', StringType())
+])
+
+def load_tables(conf_path=MAINTENANCE_CONF, blob_prefixes=None):
+    """
+    Loads the maintained tables and their options from the maintenance configuration.
+
+    Parameters:
+    - conf_path (str): The maintenance configuration path (default: MAINTENANCE_CONF).
+    - blob_prefixes (dict): The blob prefix of the stage and output directories (default: 'standard' & 'output' if CLOUD_PROVIDER is not 'AZURE', else '').
+
+    Returns:
+    - dict: The options of each table, with its `path`, keyed by `<stage|output>/<table>`.
+
+    Raises:
+    - FileNotFoundError: If the maintenance configuration doesn't exist.
+    """
+    if not os.path.exists(conf_path):
+        raise FileNotFoundError(f'Maintenance Configuration {conf_path} Not Found, Set MAINTENANCE_CONF to its Path')
+
+    if blob_prefixes is None:
+        blob_prefixes = {
+            'stage': 'standard' if CLOUD_PROVIDER!='AZURE' else '',
+            'output': 'output' if CLOUD_PROVIDER!='AZURE' else ''
+        }
+
+    with open(conf_path, 'r') as f:
+        conf = yaml.safe_load(f) or {}
+
+    defaults = {**DEFAULTS, **(conf.get('defaults') or {})}
+    tables = {}
+    for layer, base_dir in (('stage', STAGE_DIR), ('output', OUTPUT_DIR)):
+        for table, options in (conf.get(layer) or {}).items():
+            tables[f'{layer}/{table}'] = {
+                **defaults,
+                **(options or {}),
+                'path': os.path.join(base_dir, blob_prefixes[layer], table)
+            }
+
+    return tables
+
+def _detail(sc, path):
+    """
+    Describes a Delta table.
+
+    Parameters:
+    - sc (SparkSession): The SparkSession object.
+    - path (str): The table path.
+
+    Returns:
+    - Row or None: The DESCRIBE DETAIL row, or None if the path isn't a Delta table.
+    """
+    try:
+        return sc.sql(f'DESCRIBE DETAIL delta.`{path}`').first()
+    except captured.AnalysisException as exc:
+        logger.warning(f'Describing Table Exception {exc}')
+        return None
+
+def _window_files(sc, path, predicate):
+    """Returns the number of files read by a scan of the window."""
+    return len(sc.read.format('delta').load(path).where(predicate).inputFiles())
+
+def _scan_seconds(sc, path, predicate):
+    """Returns the seconds taken by a full scan of the window."""
+    t0 = time.perf_counter()
+    sc.read.format('delta').load(path).where(predicate).write.format('noop').mode('overwrite').save()
+    return time.perf_counter() - t0
+
+def _compact(sc, path, predicate, target_file_bytes):
+    """
+    Compacts the files of the window to the target file size.
+
+    Files smaller than the target are bin-packed; a conflicting concurrent write is retried once.
+
+    Parameters:
+    - sc (SparkSession): The SparkSession object.
+    - path (str): The table path.
+    - predicate (str): The partition predicate of the window.
+    - target_file_bytes (int): The target file size.
+
+    Returns:
+    - str: 'COMPACTED' or 'CONFLICT'.
+    """
+    sc.conf.set('spark.databricks.delta.optimize.maxFileSize', str(target_file_bytes))
+    sc.conf.set('spark.databricks.delta.optimize.minFileSize', str(target_file_bytes))
+
+    for attempt in range(2):
+        try:
+            DeltaTable.forPath(sc, path).optimize().where(predicate).executeCompaction()
+            return 'COMPACTED'
+        except Exception as exc:
+            if not is_conflict(exc):
+                raise
+            logger.warning(f'Delta Maintenance | Compaction Conflict {path} | Attempt {attempt + 1}')
+
+    return 'CONFLICT'
+
+def _config_log(sc, path, detail, checkpoint_interval, log_retention):
+    """
+    Sets the log checkpoint interval and log retention of a table when they differ.
+
+    Changing table properties conflicts with concurrent writes, so nothing is committed
+    once the table is configured.
+
+    Parameters:
+    - sc (SparkSession): The SparkSession object.
+    - path (str): The table path.
+    - detail (Row): The DESCRIBE DETAIL row of the table.
+    - checkpoint_interval (int): The commits between log checkpoints.
+    - log_retention (str): The log retention interval.
+    """
+    expected = {
+        'delta.checkpointInterval': str(checkpoint_interval),
+        'delta.logRetentionDuration': str(log_retention)
+    }
+    current = detail.properties or {}
+    changed = {k: v for k, v in expected.items() if current.get(k) != v}
+    if not changed:
+        return
+
+    logger.info(f'Delta Maintenance | Setting {changed} on {path}')
+    props = ', '.join(f"'{k}' = '{v}'" for k, v in changed.items())
+    sc.sql(f'ALTER TABLE delta.`{path}` SET TBLPROPERTIES ({props})')
+
+def maintain_table(sc, table, options, today=None, vacuum=True):
+    """
+    Compacts, vacuums and configures the transaction log of a table.
+
+    Parameters:
+    - sc (SparkSession): The SparkSession object.
+    - table (str): The table name.
+    - options (dict): The table options and path, see `load_tables`.
+    - today (datetime.date): The current date (default: today's date).
+    - vacuum (bool): Whether unreferenced files are vacuumed (default: True).
+
+    Returns:
+    - dict or None: The maintenance record, or None if the table doesn't exist.
+    """
+    path = options['path']
+    detail = _detail(sc, path)
+    if detail is None:
+        return None
+
+    t0 = time.perf_counter()
+    today = today or datetime.date.today()
+    d0 = today - datetime.timedelta(int(options['skip_days']))
+    d1 = d0 - datetime.timedelta(int(options['recent_days']) - 1)
+    predicate = date_partition_filter(date_range(d0, d1))
+    partitioned = {'year', 'month', 'day'}.issubset(detail.partitionColumns or [])
+
+    record = {
+        'table': table,
+        'path': path,
+        'window_start': str(d1),
+        'window_end': str(d0),
+        'status': 'SKIPPED',
+        'table_files_before': detail.numFiles,
+        'table_bytes_before': detail.sizeInBytes
+    }
+
+    if partitioned:
+        record['window_files_before'] = _window_files(sc, path, predicate)
+        record['scan_seconds_before'] = _scan_seconds(sc, path, predicate)
+        if record['window_files_before'] > 1:
+            record['status'] = _compact(sc, path, predicate, int(options['target_file_bytes']))
+        record['window_files_after'] = _window_files(sc, path, predicate)
+        record['scan_seconds_after'] = _scan_seconds(sc, path, predicate)
+
+    if vacuum:
+        DeltaTable.forPath(sc, path).vacuum(float(options['retention_hours']))
+
+    _config_log(sc, path, detail, options['checkpoint_interval'], options['log_retention'])
+
+    detail = _detail(sc, path)
+    now = datetime.datetime.utcnow()
+    record.update({
+        'table_files_after': detail.numFiles,
+        'table_bytes_after': detail.sizeInBytes,
+        'seconds': time.perf_counter() - t0,
+        'timestamp': now,
+        'year': f'{now.year}',
+        'month': f'{now.month:02d}',
+        'day': f'{now.day:02d}'
+    })
+
+    logger.info(
+        f'Delta Maintenance | {table} | {record["status"]} | '
+        f'Window Files {record.get("window_files_before")} -> {record.get("window_files_after")} | '
+        f'Table Files {record["table_files_before"]} -> {record["table_files_after"]} | '
+        f'Scan {record.get("scan_seconds_before") or 0:.2f}s -> {record.get("scan_seconds_after") or 0:.2f}s'
+    )
+    return record
+
+def _save(sc, records, blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
+    """
+    Appends the maintenance records to the `maintenance_meta` Delta table.
+
+    Parameters:
+    - sc (SparkSession): The SparkSession object.
+    - records (list): The maintenance records.
+    - blob_prefix (str): The prefix to be appended to the output directory paths (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
+    """
+    if not records:
+        return
+
+    logger.info(f'ETL Pipeline | Load | Appending {len(records)} Records to Maintenance Meta Delta Table in {CLOUD_PROVIDER}')
+    sc.createDataFrame(records, schema=MAINTENANCE_META_SCHEMA) \
+        .write \
+        .format('delta') \
+        .partitionBy('year', 'month', 'day') \
+        .mode('append') \
+        .save(os.path.join(MAINTENANCE_META_DIR, blob_prefix, 'maintenance_meta'))
+
+def entrypoint(argv=None):
+    """
+    Entry point for the Delta table maintenance.
+
+    Tables failing maintenance are logged and the remaining tables are still maintained;
+    the task fails once every table has been visited.
+
+    Parameters:
+    - argv (list): The command line arguments (default: sys.argv).
+    """
+    parser = argparse.ArgumentParser(description='Compact, vacuum and configure the stage and output Delta tables.')
+    parser.add_argument('--tables', nargs='*', help='Tables to maintain, e.g. stage/buffer_meta (default: all).')
+    parser.add_argument('--no-vacuum', action='store_true', help='Skip vacuuming unreferenced files.')
+    args = parser.parse_args(argv)
+
+    config = SparkConfig(app_name='delta_maintenance')
+    sc = config.get_sparkContext()
+
+    tables = load_tables()
+    records, failed = [], []
+    with config.get_runMetrics() as run_metrics:
+        with run_metrics.phase('Maintenance'):
+            for table, options in tables.items():
+                if args.tables and table not in args.tables:
+                    continue
+
+                try:
+                    record = maintain_table(sc, table, options, vacuum=not args.no_vacuum)
+                    if record:
+                        records.append(record)
+                except Exception as exc:
+                    logger.error(f'Delta Maintenance | {table} | Failed {exc}')
+                    failed.append(table)
+
+        with run_metrics.phase('Load'):
+            _save(sc, records)
+
+    if failed:
+        raise RuntimeError(f'Delta maintenance failed for {failed}')
+
+if __name__ == '__main__':
+    entrypoint()
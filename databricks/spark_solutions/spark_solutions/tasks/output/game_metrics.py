@@ -4,7 +4,9 @@ Output asset to model the engagement metrics by user within the
 Super Hero Data Sim application.
 
 Time of use is described as the time users are in game, alive, and
-not waiting in lobby. Users waiting in lobby aren't tracked.
+not waiting in lobby. Users waiting in lobby aren't tracked. A user is
+alive from the start of the game until the first event bringing their
+health to 0, their `death_time`, or until the end of the game.
 
 Damage Dealt/ Damage Received
 
@@ -12,11 +14,30 @@ Game Turns
 
 Wins/Losses
 
+Games and users are joined and grouped on the surrogate ids of their
+tokens, see `spark_solutions.readers.token_dictionary`. Stage partitions
+loaded before the ids were added have NULL ids, which are derived from
+their tokens. Only the ids are kept: readers look a token up by its
+`token_id` and translate ids back with `read_tokens`. Incremental runs
+restrict the stage rows on their `game_id`, so partitions loaded before
+the ids are only recomputed by the window run.
+
+`lib_server_game` is read in a single pass: the game end is a window over
+the game's events, and each event is counted once for its attacker and
+once for its enemy, so the per-user metrics are grouped by game without
+self-joins and the events are shuffled once, by game.
+
 """
 
 from spark_solutions.common.spark_config import SparkConfig
-from spark_solutions.common.spark_misc import extract_partitioned_tables
+from spark_solutions.common.local_backend import LocalBackend, select_backend
+from spark_solutions.common.spark_incremental import IncrementalOutput
+from spark_solutions.common.spark_preview import extract_sampled_tables, load_preview
+from spark_solutions.common.spark_manifest import extract_manifest_tables
+from spark_solutions.common.spark_misc import enable_change_data_feed, load_window
+from spark_solutions.readers.token_dictionary import token_id_sql
 
+import datetime
 import logging
 import os
 
@@ -30,21 +51,119 @@ OUTPUT_DIR = os.getenv('OUTPUT_DIR')
 assert(not INPUT_DIR is None and INPUT_DIR != '')
 assert(not OUTPUT_DIR is None and OUTPUT_DIR != '')
 
-def _extract(sc, blob_prefix='stage' if CLOUD_PROVIDER!='AZURE' else ''):
+# Extracted Tables
+INPUT_TABLES = [
+    'log_meta',
+    'lib_server_lobby',
+    'lib_server_game'
+]
+
+# Incremental Sources, the query of the games affected by the changes of each stage table
+INCREMENTAL_KEY = 'game_id'
+INCREMENTAL_SOURCES = {
+    'lib_server_lobby': f"SELECT COALESCE(game_id, {token_id_sql('game_token')}) game_id FROM {{changes}}",
+    'lib_server_game': f"SELECT COALESCE(game_id, {token_id_sql('game_token')}) game_id FROM {{changes}}"
+}
+
+# Input tables restricted to the affected games when recomputed incrementally
+INCREMENTAL_FILTERS = {
+    'lib_server_lobby': 'game_id',
+    'lib_server_game': 'game_id'
+}
+
+# Preview Metrics, the additive columns estimated from the games sampled on INCREMENTAL_KEY
+PREVIEW_METRICS = ['time_of_use_seconds', 'turns', 'damage_dealt', 'damage_received', 'win', 'loss']
+
+# Output Keys, identifying the rows merged into days outside the window
+OUTPUT_KEYS = ['game_id', 'user_id']
+
+# Transform SQL
+TRANSFORM_SQL = f"""
+    WITH games AS (
+        SELECT COALESCE(game_id, {token_id_sql('game_token')}) game_id,
+               COALESCE(user_id, {token_id_sql('user_token')}) user_id,
+               COALESCE(enemy_id, {token_id_sql('enemy_token')}) enemy_id,
+               timestamp, enemy_damage, enemy_health_post
+        FROM lib_server_game
+    ),
+    lobby AS (
+        SELECT COALESCE(user_id, {token_id_sql('user_token')}) user_id,
+               superhero_id,
+               COALESCE(game_id, {token_id_sql('game_token')}) game_id,
+               timestamp
+        FROM lib_server_lobby
+    ),
+    game_events AS (
+        SELECT game_id, user_id, enemy_id, timestamp, enemy_damage, enemy_health_post,
+               MAX(timestamp) OVER (PARTITION BY game_id) end_time
+        FROM games
+    ),
+    user_game AS (
+        SELECT game_id,
+               CASE WHEN roles.role = 0 THEN user_id ELSE enemy_id END user_id,
+               MAX(end_time) end_time,
+               SUM(1 - roles.role) turns,
+               SUM(CASE WHEN roles.role = 0 THEN enemy_damage ELSE 0 END) damage_dealt,
+               SUM(CASE WHEN roles.role = 1 THEN enemy_damage ELSE 0 END) damage_received,
+               MIN(CASE WHEN roles.role = 1 AND enemy_health_post = 0 THEN timestamp END) death_time,
+               MIN(CASE WHEN roles.role = 1 THEN enemy_health_post END) health
+        FROM game_events
+        CROSS JOIN (SELECT 0 role UNION ALL SELECT 1 role) roles
+        GROUP BY game_id, CASE WHEN roles.role = 0 THEN user_id ELSE enemy_id END
+    ),
+    user_time AS (
+        SELECT lobby.user_id,
+               lobby.superhero_id,
+               lobby.game_id,
+               MIN(lobby.timestamp) OVER (PARTITION BY lobby.game_id) start_time,
+               MAX(user_game.end_time) OVER (PARTITION BY lobby.game_id) end_time,
+               user_game.death_time,
+               user_game.turns,
+               user_game.damage_dealt,
+               user_game.damage_received,
+               user_game.health
+        FROM lobby
+        LEFT JOIN user_game ON
+            lobby.game_id = user_game.game_id AND
+            lobby.user_id = user_game.user_id
+    )
+    SELECT YEAR(start_time) year,
+           MONTH(start_time) month,
+           DAYOFMONTH(start_time) day,
+           user_id,
+           superhero_id,
+           game_id,
+           start_time,
+           end_time,
+           death_time,
+           UNIX_TIMESTAMP(COALESCE(death_time, end_time)) - UNIX_TIMESTAMP(start_time) time_of_use_seconds,
+           IFNULL(turns, 0) turns,
+           IFNULL(damage_dealt, 0) damage_dealt,
+           IFNULL(damage_received, 0) damage_received,
+           CASE WHEN health > 0 THEN 1 ELSE 0 END AS win,
+           CASE WHEN health = 0 THEN 1 ELSE 0 END AS loss
+    FROM user_time
+    WHERE NOT end_time IS NULL
+"""
+
+def _extract(sc, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), blob_prefix='stage' if CLOUD_PROVIDER!='AZURE' else ''):
     """
     Extracts partitioned tables from the specified input directories based on the cloud provider.
 
     This function performs the extraction stage of the ETL pipeline by extracting partitioned tables
     from the specified input directories. The extraction process varies based on the cloud provider.
 
+    Rows of the window's ETL runs that landed outside the window are added from the files
+    holding them, see `extract_manifest_tables`.
+
     Parameters:
     - sc (SparkContext): The SparkContext object.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
     - blob_prefix (str): The prefix to be appended to input directory paths (default: 'stage' if CLOUD_PROVIDER is not 'AZURE', else '').
     """
     logger.info(f'ETL Pipeline | Extract | Extracting Partitioned Tables from {CLOUD_PROVIDER}')
-    extract_partitioned_tables(sc, os.path.join(INPUT_DIR, blob_prefix, 'log_meta'))
-    extract_partitioned_tables(sc, os.path.join(INPUT_DIR, blob_prefix, 'lib_server_lobby'))
-    extract_partitioned_tables(sc, os.path.join(INPUT_DIR, blob_prefix, 'lib_server_game'))
+    extract_manifest_tables(sc, os.path.join(INPUT_DIR, blob_prefix), INPUT_TABLES, d0, d1)
 
 def _transform(sc):
     """
@@ -58,85 +177,31 @@ def _transform(sc):
     - sc (SparkContext): The SparkContext object.
     """
     logger.info(f'ETL Pipeline | Transform | Creating Game Metrics Table')
-    rs = sc.sql("""
-        WITH lobby_time AS (
-            SELECT game_token, MIN(timestamp) start_time
-            FROM lib_server_lobby
-            GROUP BY game_token
-        ),
-        game_time AS (
-            SELECT game_time.game_token, lobby_time.start_time, game_time.end_time,
-                   UNIX_TIMESTAMP(game_time.end_time) - UNIX_TIMESTAMP(lobby_time.start_time) time_of_use_seconds,
-                   YEAR(lobby_time.start_time) year,
-                   MONTH(lobby_time.start_time) month,
-                   DAYOFMONTH(lobby_time.start_time) day
-            FROM (
-                SELECT game_token, MAX(timestamp) end_time
-                FROM lib_server_game
-                GROUP BY game_token
-            ) game_time
-            LEFT JOIN lobby_time ON
-                game_time.game_token = lobby_time.game_token
-        ),
-        game_damage_dealt AS (
-            SELECT game_token, user_token, 
-                   COUNT(*) turns, 
-                   SUM(enemy_damage) damage_dealt
-            FROM lib_server_game
-            GROUP BY game_token, user_token
-        ),
-        game_damage_received AS (
-            SELECT game_token, enemy_token user_token, 
-                   SUM(enemy_damage) damage_received,
-                   CASE WHEN MIN(enemy_health_post) > 0 THEN 1 ELSE 0 END AS win,
-                   CASE WHEN MIN(enemy_health_post) = 0 THEN 1 ELSE 0 END AS loss
-            FROM lib_server_game
-            GROUP BY game_token, enemy_token
-        )
-        SELECT game_time.year, game_time.month, game_time.day,
-               lib_server_lobby.user_token,
-               lib_server_lobby.superhero_id,
-               lib_server_lobby.game_token,
-               game_time.start_time,
-               game_time.end_time,
-               game_time.time_of_use_seconds,
-               IFNULL(game_damage_dealt.turns, 0) turns, 
-               IFNULL(game_damage_dealt.damage_dealt, 0) damage_dealt,
-               IFNULL(game_damage_received.damage_received, 0) damage_received, 
-               IFNULL(game_damage_received.win, 0) win, 
-               IFNULL(game_damage_received.loss, 0) loss
-        FROM lib_server_lobby
-        LEFT JOIN game_time ON
-            lib_server_lobby.game_token = game_time.game_token
-        LEFT JOIN game_damage_dealt ON
-            lib_server_lobby.game_token = game_damage_dealt.game_token AND
-            lib_server_lobby.user_token = game_damage_dealt.user_token
-        LEFT JOIN game_damage_received ON
-            lib_server_lobby.game_token = game_damage_received.game_token AND
-            lib_server_lobby.user_token = game_damage_received.user_token
-        WHERE NOT game_time.time_of_use_seconds IS NULL
-    """)
+    rs = sc.sql(TRANSFORM_SQL)
 
     rs.createOrReplaceTempView('output__game_metrics')
 
-def _load(sc, blob_prefix='output' if CLOUD_PROVIDER!='AZURE' else ''):
+def _load(sc, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), blob_prefix='output' if CLOUD_PROVIDER!='AZURE' else ''):
     """
     Loads game metrics to Delta tables in the specified output directory based on the cloud provider.
 
     This function performs the load stage of the ETL pipeline by loading game metrics data into Delta tables
     located in the specified output directory. The loading process varies based on the cloud provider.
 
+    The partitions of the date range are replaced and rows falling on other days are merged
+    by OUTPUT_KEYS, so the history of the table is preserved, see `load_window`. The Change
+    Data Feed of the table tells the `user_day_rollup` which days were written.
+
     Parameters:
     - sc (SparkContext): The SparkContext object.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
     - blob_prefix (str): The prefix to be appended to the output directory paths (default: 'output' if CLOUD_PROVIDER is not 'AZURE', else '').
     """
     logger.info(f'ETL Pipeline | Load | Loading Game Metrics to Delta Tables in {CLOUD_PROVIDER}')
-    df = sc.table('output__game_metrics')
-    df.write \
-        .format('delta') \
-        .partitionBy('year', 'month', 'day') \
-        .mode('overwrite') \
-        .save(os.path.join(OUTPUT_DIR, blob_prefix, 'game_metrics'))
+    path = os.path.join(OUTPUT_DIR, blob_prefix, 'game_metrics')
+    load_window(sc, sc.table('output__game_metrics'), path, OUTPUT_KEYS, d0, d1, merge_schema=True)
+    enable_change_data_feed(sc, path)
 
 def entrypoint():
     """
@@ -145,13 +210,88 @@ def entrypoint():
     This function serves as the entry point for the ETL (Extract, Transform, Load) pipeline.
     It initializes a SparkContext using the configured SparkConfig, performs extraction,
     transformation, and loading stages of the pipeline, and manages the overall execution flow.
+
+    Small windows run on the embedded local backend when EXECUTION_BACKEND opts in, see `select_backend`.
     """
-    sc = SparkConfig(app_name='output_game_metrics') \
-        .get_sparkContext()
+    input_dir = os.path.join(INPUT_DIR, 'stage' if CLOUD_PROVIDER!='AZURE' else '')
+    if select_backend(delta_paths=[os.path.join(input_dir, t) for t in INPUT_TABLES]) == 'local':
+        output_path = os.path.join(OUTPUT_DIR, 'output' if CLOUD_PROVIDER!='AZURE' else '', 'game_metrics')
+        LocalBackend().run_output('game_metrics', TRANSFORM_SQL, input_dir, INPUT_TABLES, output_path, OUTPUT_KEYS)
+        return
+
+    config = SparkConfig(app_name='output_game_metrics')
+    sc = config.get_sparkContext()
     
-    _extract(sc)
-    _transform(sc)
-    _load(sc)
+    with config.get_runMetrics() as run_metrics:
+        with run_metrics.phase('Extract'):
+            _extract(sc)
+        with run_metrics.phase('Transform'):
+            _transform(sc)
+        with run_metrics.phase('Load'):
+            _load(sc)
+
+def incremental_entrypoint():
+    """
+    Entry point for the incremental ETL pipeline.
+
+    Recomputes only the games changed in the stage tables since the last run and merges them
+    into the game metrics, see `IncrementalOutput`. The first run runs the window ETL pipeline,
+    and a run whose changed games span too many days reruns it over the windows of the changes,
+    before recording the versions read. A run whose changes were cleaned up from the stage
+    tables fails without recording them.
+    """
+    config = SparkConfig(app_name='output_game_metrics_incremental', profile='output_game_metrics')
+    sc = config.get_sparkContext()
+    incremental = IncrementalOutput(
+        sc, 'game_metrics', INCREMENTAL_KEY, INCREMENTAL_SOURCES, INCREMENTAL_FILTERS,
+        os.path.join(INPUT_DIR, 'stage' if CLOUD_PROVIDER!='AZURE' else ''), INPUT_TABLES,
+        os.path.join(OUTPUT_DIR, 'output' if CLOUD_PROVIDER!='AZURE' else '', 'game_metrics')
+    )
+
+    with config.get_runMetrics() as run_metrics:
+        with run_metrics.phase('Incremental'):
+            versions = incremental.current_versions()
+            fallback = incremental.run(TRANSFORM_SQL, versions)
+            if fallback is None:
+                return
+
+        start, windows = fallback
+        for d0, d1 in windows:
+            with run_metrics.phase('Extract'):
+                _extract(sc, d0, d1)
+            with run_metrics.phase('Transform'):
+                _transform(sc)
+            with run_metrics.phase('Load'):
+                _load(sc, d0, d1)
+        incremental.commit(start, versions)
+
+def preview_entrypoint():
+    """
+    Entry point for the approximate preview of the ETL pipeline.
+
+    Runs the pipeline over the games sampled by PREVIEW_SAMPLE_RATE, with the input tables
+    of INCREMENTAL_FILTERS sampled on their key, see `spark_preview`. The sampled rows are
+    written to `game_metrics_preview` and the estimates of PREVIEW_METRICS, with their error
+    bounds, to `preview_meta`.
+
+    Small windows run on the embedded local backend when EXECUTION_BACKEND opts in, see `select_backend`.
+    """
+    input_dir = os.path.join(INPUT_DIR, 'stage' if CLOUD_PROVIDER!='AZURE' else '')
+    output_dir = os.path.join(OUTPUT_DIR, 'output' if CLOUD_PROVIDER!='AZURE' else '')
+    if select_backend(delta_paths=[os.path.join(input_dir, t) for t in INPUT_TABLES]) == 'local':
+        LocalBackend().run_preview('game_metrics', TRANSFORM_SQL, input_dir, INPUT_TABLES, INCREMENTAL_FILTERS, INCREMENTAL_KEY, PREVIEW_METRICS, output_dir)
+        return
+
+    config = SparkConfig(app_name='output_game_metrics_preview', profile='output_game_metrics')
+    sc = config.get_sparkContext()
+
+    with config.get_runMetrics() as run_metrics:
+        with run_metrics.phase('Extract'):
+            extract_sampled_tables(sc, input_dir, INPUT_TABLES, INCREMENTAL_FILTERS)
+        with run_metrics.phase('Transform'):
+            _transform(sc)
+        with run_metrics.phase('Load'):
+            load_preview(sc, 'output__game_metrics', 'game_metrics', INCREMENTAL_KEY, PREVIEW_METRICS, output_dir)
 
 if __name__ == '__main__':
     entrypoint()
\ No newline at end of file
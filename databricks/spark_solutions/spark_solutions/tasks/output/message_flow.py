@@ -15,8 +15,13 @@ Models below describe the transport from application to Data Lake
 """
 
 from spark_solutions.common.spark_config import SparkConfig
-from spark_solutions.common.spark_misc import extract_partitioned_tables
+from spark_solutions.common.local_backend import LocalBackend, select_backend
+from spark_solutions.common.spark_incremental import IncrementalOutput
+from spark_solutions.common.spark_preview import extract_sampled_tables, load_preview
+from spark_solutions.common.spark_manifest import extract_manifest_tables
+from spark_solutions.common.spark_misc import enable_change_data_feed, load_window
 
+import datetime
 import logging
 import os
 
@@ -30,23 +35,73 @@ OUTPUT_DIR = os.getenv('OUTPUT_DIR')
 assert(not INPUT_DIR is None and INPUT_DIR != '')
 assert(not OUTPUT_DIR is None and OUTPUT_DIR != '')
 
-def _extract(sc, blob_prefix='stage' if CLOUD_PROVIDER!='AZURE' else ''):
+# Extracted Tables
+INPUT_TABLES = [
+    'buffer_meta',
+    'etl_meta',
+    'log_meta',
+    'lib_server_game',
+    'lib_server_lobby'
+]
+
+# Incremental Sources, the query of the messages affected by the changes of each stage table
+INCREMENTAL_KEY = 'msg_id'
+INCREMENTAL_SOURCES = {
+    'log_meta': 'SELECT msg_id FROM {changes}',
+    'buffer_meta': 'SELECT msg_id FROM {changes}',
+    'etl_meta': 'SELECT log_meta.msg_id FROM log_meta JOIN {changes} c ON log_meta.etl_id = c.etl_id'
+}
+
+# Input tables restricted to the affected messages when recomputed incrementally
+INCREMENTAL_FILTERS = {
+    'log_meta': 'msg_id',
+    'buffer_meta': 'msg_id'
+}
+
+# Preview Metrics, the additive columns estimated from the messages sampled on INCREMENTAL_KEY
+PREVIEW_METRICS = ['buffer_content_size']
+
+# Output Keys, identifying the rows merged into days outside the window
+OUTPUT_KEYS = ['msg_id']
+
+# Transform SQL
+TRANSFORM_SQL = """
+    SELECT log_meta.etl_id, log_meta.msg_id,
+           log_meta.timestamp log_timestamp,
+           buffer_meta.timestamp buffer_timestamp,
+           etl_meta.timestamp_start etl_timestamp_start,
+           etl_meta.timestamp_end etl_timestamp_end,
+           buffer_meta.serialized_value_size buffer_content_size,
+           etl_meta.service etl_service,
+           etl_meta.mode etl_mode,
+           YEAR(log_meta.timestamp) year,
+           MONTH(log_meta.timestamp) month,
+           DAYOFMONTH(log_meta.timestamp) day
+    FROM log_meta
+    LEFT JOIN buffer_meta ON
+        log_meta.msg_id = buffer_meta.msg_id
+    LEFT JOIN etl_meta ON
+        log_meta.etl_id = etl_meta.etl_id
+"""
+
+def _extract(sc, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), blob_prefix='stage' if CLOUD_PROVIDER!='AZURE' else ''):
     """
     Extracts partitioned tables from the specified input directories based on the cloud provider.
 
     This function performs the extraction stage of the ETL pipeline by extracting partitioned tables
     from the specified input directories. The extraction process varies based on the cloud provider.
 
+    Rows of the window's ETL runs that landed outside the window are added from the files
+    holding them, see `extract_manifest_tables`.
+
     Parameters:
     - sc (SparkContext): The SparkContext object.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
     - blob_prefix (str): The prefix to be appended to input directory paths (default: 'stage' if CLOUD_PROVIDER is not 'AZURE', else '').
     """
     logger.info(f'ETL Pipeline | Extract | Extracting Partitioned Tables from {CLOUD_PROVIDER}')
-    extract_partitioned_tables(sc, os.path.join(INPUT_DIR, blob_prefix, 'buffer_meta'))
-    extract_partitioned_tables(sc, os.path.join(INPUT_DIR, blob_prefix, 'etl_meta'))
-    extract_partitioned_tables(sc, os.path.join(INPUT_DIR, blob_prefix, 'log_meta'))
-    extract_partitioned_tables(sc, os.path.join(INPUT_DIR, blob_prefix, 'lib_server_game'))
-    extract_partitioned_tables(sc, os.path.join(INPUT_DIR, blob_prefix, 'lib_server_lobby'))
+    extract_manifest_tables(sc, os.path.join(INPUT_DIR, blob_prefix), INPUT_TABLES, d0, d1)
 
 def _transform(sc):
     """
@@ -60,45 +115,31 @@ def _transform(sc):
     - sc (SparkContext): The SparkContext object.
     """
     logger.info(f'ETL Pipeline | Transform | Creating Message Flow Table')
-    rs = sc.sql("""
-        SELECT log_meta.etl_id, log_meta.msg_id,
-               log_meta.timestamp log_timestamp,
-               buffer_meta.timestamp buffer_timestamp,
-               etl_meta.timestamp_start etl_timestamp_start,
-               etl_meta.timestamp_end etl_timestamp_end,
-               buffer_meta.serialized_value_size buffer_content_size,
-               etl_meta.service etl_service,
-               etl_meta.mode etl_mode,
-               YEAR(log_meta.timestamp) year,
-               MONTH(log_meta.timestamp) month,
-               DAYOFMONTH(log_meta.timestamp) day
-        FROM log_meta
-        LEFT JOIN buffer_meta ON
-            log_meta.msg_id = buffer_meta.msg_id
-        LEFT JOIN etl_meta ON
-            log_meta.etl_id = etl_meta.etl_id
-    """)
+    rs = sc.sql(TRANSFORM_SQL)
 
     rs.createOrReplaceTempView('output__message_flow')
 
-def _load(sc, blob_prefix='output' if CLOUD_PROVIDER!='AZURE' else ''):
+def _load(sc, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), blob_prefix='output' if CLOUD_PROVIDER!='AZURE' else ''):
     """
     Loads message flows to Delta tables in the specified output directory based on the cloud provider.
 
     This function performs the load stage of the ETL pipeline by loading message flow data into Delta tables
     located in the specified output directory. The loading process varies based on the cloud provider.
 
+    The partitions of the date range are replaced and rows falling on other days are merged
+    by OUTPUT_KEYS, so the history of the table is preserved, see `load_window`. The Change
+    Data Feed of the table tells the `message_latency` which days were written.
+
     Parameters:
     - sc (SparkContext): The SparkContext object.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
     - blob_prefix (str): The prefix to be appended to the output directory paths (default: 'output' if CLOUD_PROVIDER is not 'AZURE', else '').
     """
     logger.info(f'ETL Pipeline | Load | Loading Message Flows to Delta Tables in {CLOUD_PROVIDER}')
-    df = sc.table('output__message_flow')
-    df.write \
-        .format('delta') \
-        .partitionBy('year', 'month', 'day') \
-        .mode('overwrite') \
-        .save(os.path.join(OUTPUT_DIR, blob_prefix, 'message_flow'))
+    path = os.path.join(OUTPUT_DIR, blob_prefix, 'message_flow')
+    load_window(sc, sc.table('output__message_flow'), path, OUTPUT_KEYS, d0, d1)
+    enable_change_data_feed(sc, path)
 
 def entrypoint():
     """
@@ -107,13 +148,88 @@ def entrypoint():
     This function serves as the entry point for the ETL (Extract, Transform, Load) pipeline.
     It initializes a SparkContext using the configured SparkConfig, performs extraction,
     transformation, and loading stages of the pipeline for message flows, and manages the overall execution flow.
+
+    Small windows run on the embedded local backend when EXECUTION_BACKEND opts in, see `select_backend`.
     """
-    sc = SparkConfig(app_name='output_message_flow') \
-        .get_sparkContext()
+    input_dir = os.path.join(INPUT_DIR, 'stage' if CLOUD_PROVIDER!='AZURE' else '')
+    if select_backend(delta_paths=[os.path.join(input_dir, t) for t in INPUT_TABLES]) == 'local':
+        output_path = os.path.join(OUTPUT_DIR, 'output' if CLOUD_PROVIDER!='AZURE' else '', 'message_flow')
+        LocalBackend().run_output('message_flow', TRANSFORM_SQL, input_dir, INPUT_TABLES, output_path, OUTPUT_KEYS)
+        return
+
+    config = SparkConfig(app_name='output_message_flow')
+    sc = config.get_sparkContext()
     
-    _extract(sc)
-    _transform(sc)
-    _load(sc)
+    with config.get_runMetrics() as run_metrics:
+        with run_metrics.phase('Extract'):
+            _extract(sc)
+        with run_metrics.phase('Transform'):
+            _transform(sc)
+        with run_metrics.phase('Load'):
+            _load(sc)
+
+def incremental_entrypoint():
+    """
+    Entry point for the incremental ETL pipeline.
+
+    Recomputes only the messages changed in the stage tables since the last run and merges them
+    into the message flow, see `IncrementalOutput`. The first run runs the window ETL pipeline,
+    and a run whose changed messages span too many days reruns it over the windows of the changes,
+    before recording the versions read. A run whose changes were cleaned up from the stage
+    tables fails without recording them.
+    """
+    config = SparkConfig(app_name='output_message_flow_incremental', profile='output_message_flow')
+    sc = config.get_sparkContext()
+    incremental = IncrementalOutput(
+        sc, 'message_flow', INCREMENTAL_KEY, INCREMENTAL_SOURCES, INCREMENTAL_FILTERS,
+        os.path.join(INPUT_DIR, 'stage' if CLOUD_PROVIDER!='AZURE' else ''), INPUT_TABLES,
+        os.path.join(OUTPUT_DIR, 'output' if CLOUD_PROVIDER!='AZURE' else '', 'message_flow')
+    )
+
+    with config.get_runMetrics() as run_metrics:
+        with run_metrics.phase('Incremental'):
+            versions = incremental.current_versions()
+            fallback = incremental.run(TRANSFORM_SQL, versions)
+            if fallback is None:
+                return
+
+        start, windows = fallback
+        for d0, d1 in windows:
+            with run_metrics.phase('Extract'):
+                _extract(sc, d0, d1)
+            with run_metrics.phase('Transform'):
+                _transform(sc)
+            with run_metrics.phase('Load'):
+                _load(sc, d0, d1)
+        incremental.commit(start, versions)
+
+def preview_entrypoint():
+    """
+    Entry point for the approximate preview of the ETL pipeline.
+
+    Runs the pipeline over the messages sampled by PREVIEW_SAMPLE_RATE, with the input tables
+    of INCREMENTAL_FILTERS sampled on their key, see `spark_preview`. The sampled rows are
+    written to `message_flow_preview` and the estimates of PREVIEW_METRICS, with their error
+    bounds, to `preview_meta`.
+
+    Small windows run on the embedded local backend when EXECUTION_BACKEND opts in, see `select_backend`.
+    """
+    input_dir = os.path.join(INPUT_DIR, 'stage' if CLOUD_PROVIDER!='AZURE' else '')
+    output_dir = os.path.join(OUTPUT_DIR, 'output' if CLOUD_PROVIDER!='AZURE' else '')
+    if select_backend(delta_paths=[os.path.join(input_dir, t) for t in INPUT_TABLES]) == 'local':
+        LocalBackend().run_preview('message_flow', TRANSFORM_SQL, input_dir, INPUT_TABLES, INCREMENTAL_FILTERS, INCREMENTAL_KEY, PREVIEW_METRICS, output_dir)
+        return
+
+    config = SparkConfig(app_name='output_message_flow_preview', profile='output_message_flow')
+    sc = config.get_sparkContext()
+
+    with config.get_runMetrics() as run_metrics:
+        with run_metrics.phase('Extract'):
+            extract_sampled_tables(sc, input_dir, INPUT_TABLES, INCREMENTAL_FILTERS)
+        with run_metrics.phase('Transform'):
+            _transform(sc)
+        with run_metrics.phase('Load'):
+            load_preview(sc, 'output__message_flow', 'message_flow', INCREMENTAL_KEY, PREVIEW_METRICS, output_dir)
 
 if __name__ == '__main__':
     entrypoint()
\ No newline at end of file
@@ -0,0 +1,194 @@
+""" Output ETL Pipeline | Message Latency
+
+Output asset summarizing the latency of each hop of the `message_flow`
+(log → buffer, buffer → ETL and log → ETL) within the Super Hero Data Sim
+application as mergeable quantile sketches.
+
+One sketch is kept per hop, `etl_service`/`etl_mode` and minute or hour
+of the log timestamp (`grain`). Percentiles over any window are answered
+by merging its sketches, see `spark_solutions.readers.latency_sketch`,
+instead of scanning every message of `message_flow`.
+
+Each run recomputes the days of its window and the days `message_flow`
+changed since the last run, read from its Change Data Feed, e.g. the days
+its late messages and incremental runs were merged into.
+
+"""
+
+from spark_solutions.common.spark_config import SparkConfig
+from spark_solutions.common.local_backend import LocalBackend, select_backend
+from spark_solutions.common.spark_incremental import IncrementalOutput
+from spark_solutions.common.spark_misc import extract_partitioned_tables, load_window
+from spark_solutions.readers.latency_sketch import log_gamma
+
+import datetime
+import logging
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+CLOUD_PROVIDER=os.getenv('CLOUD_PROVIDER', 'LOCAL')
+OUTPUT_DIR = os.getenv('OUTPUT_DIR')
+LATENCY_SKETCH_ALPHA=float(os.getenv('LATENCY_SKETCH_ALPHA', '0.01'))
+
+assert(not OUTPUT_DIR is None and OUTPUT_DIR != '')
+
+# Extracted Tables
+INPUT_TABLES = [
+    'message_flow'
+]
+
+# Output Keys, identifying the rows merged into days outside the window
+OUTPUT_KEYS = ['grain', 'window_start', 'etl_service', 'etl_mode', 'hop']
+
+# Transform SQL
+TRANSFORM_SQL = f"""
+    WITH flows AS (
+        SELECT etl_service, etl_mode,
+               DATE_TRUNC('MINUTE', CAST(log_timestamp AS TIMESTAMP)) minute,
+               UNIX_MICROS(CAST(log_timestamp AS TIMESTAMP)) log_us,
+               UNIX_MICROS(CAST(buffer_timestamp AS TIMESTAMP)) buffer_us,
+               UNIX_MICROS(CAST(etl_timestamp_end AS TIMESTAMP)) etl_us
+        FROM message_flow
+    ),
+    latencies AS (
+        SELECT etl_service, etl_mode, minute, 'log_buffer' hop, (buffer_us - log_us) / 1000.0 latency_ms FROM flows
+        UNION ALL
+        SELECT etl_service, etl_mode, minute, 'buffer_etl' hop, (etl_us - buffer_us) / 1000.0 latency_ms FROM flows
+        UNION ALL
+        SELECT etl_service, etl_mode, minute, 'log_etl' hop, (etl_us - log_us) / 1000.0 latency_ms FROM flows
+    ),
+    grains AS (
+        SELECT 'minute' grain, minute window_start, etl_service, etl_mode, hop, latency_ms
+        FROM latencies
+        WHERE latency_ms IS NOT NULL
+        UNION ALL
+        SELECT 'hour' grain, DATE_TRUNC('HOUR', minute) window_start, etl_service, etl_mode, hop, latency_ms
+        FROM latencies
+        WHERE latency_ms IS NOT NULL
+    ),
+    buckets AS (
+        SELECT grain, window_start, etl_service, etl_mode, hop,
+               CASE WHEN latency_ms > 0 THEN CAST(CEIL(LN(latency_ms) / {log_gamma(LATENCY_SKETCH_ALPHA)!r}) AS INT) END bucket,
+               COUNT(*) n,
+               MIN(latency_ms) min_ms,
+               MAX(latency_ms) max_ms,
+               SUM(latency_ms) sum_ms
+        FROM grains
+        GROUP BY grain, window_start, etl_service, etl_mode, hop,
+                 CASE WHEN latency_ms > 0 THEN CAST(CEIL(LN(latency_ms) / {log_gamma(LATENCY_SKETCH_ALPHA)!r}) AS INT) END
+    )
+    SELECT grain, window_start, etl_service, etl_mode, hop,
+           CAST({LATENCY_SKETCH_ALPHA!r} AS DOUBLE) alpha,
+           SUM(n) count,
+           IFNULL(SUM(CASE WHEN bucket IS NULL THEN n END), 0) zero_count,
+           MIN(min_ms) min_ms,
+           MAX(max_ms) max_ms,
+           SUM(sum_ms) sum_ms,
+           MAP_FROM_ENTRIES(COLLECT_LIST(CASE WHEN bucket IS NOT NULL THEN STRUCT(bucket, n) END)) buckets,
+           YEAR(window_start) year,
+           MONTH(window_start) month,
+           DAYOFMONTH(window_start) day
+    FROM buckets
+    GROUP BY grain, window_start, etl_service, etl_mode, hop
+"""
+
+def _incremental(sc, blob_prefix='output' if CLOUD_PROVIDER!='AZURE' else ''):
+    """
+    Returns the state of the `message_flow` versions the sketches have processed.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    - blob_prefix (str): The prefix to be appended to the output directory paths (default: 'output' if CLOUD_PROVIDER is not 'AZURE', else '').
+
+    Returns:
+    - IncrementalOutput: The state of the sketches, with `message_flow` as its source.
+    """
+    input_dir = os.path.join(OUTPUT_DIR, blob_prefix)
+    return IncrementalOutput(sc, 'message_latency', None, {t: None for t in INPUT_TABLES}, {}, input_dir, INPUT_TABLES, os.path.join(input_dir, 'message_latency'))
+
+def _extract(sc, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), blob_prefix='output' if CLOUD_PROVIDER!='AZURE' else '', dates=None):
+    """
+    Extracts the message flow partitions of the current window from the output directory.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    - blob_prefix (str): The prefix to be appended to input directory paths (default: 'output' if CLOUD_PROVIDER is not 'AZURE', else '').
+    - dates (list): The days extracted instead of the date range (default: None).
+    """
+    logger.info(f'ETL Pipeline | Extract | Extracting Partitioned Tables from {CLOUD_PROVIDER}')
+    for table in INPUT_TABLES:
+        extract_partitioned_tables(sc, os.path.join(OUTPUT_DIR, blob_prefix, table), d0, d1, dates=dates)
+
+def _transform(sc):
+    """
+    Transforms message flows into latency sketches.
+
+    Buckets the latency of each hop on a logarithmic scale of relative accuracy
+    LATENCY_SKETCH_ALPHA, then counts the buckets by minute and by hour.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    """
+    logger.info(f'ETL Pipeline | Transform | Creating Message Latency Table')
+    rs = sc.sql(TRANSFORM_SQL)
+
+    rs.createOrReplaceTempView('output__message_latency')
+
+def _load(sc, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), blob_prefix='output' if CLOUD_PROVIDER!='AZURE' else '', dates=None):
+    """
+    Loads the latency sketches to Delta tables in the specified output directory based on the cloud provider.
+
+    The partitions of the date range are replaced and rows falling on other days are merged
+    by OUTPUT_KEYS, so the history of the table is preserved, see `load_window`.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    - blob_prefix (str): The prefix to be appended to the output directory paths (default: 'output' if CLOUD_PROVIDER is not 'AZURE', else '').
+    - dates (list): The days replaced instead of the date range (default: None).
+    """
+    logger.info(f'ETL Pipeline | Load | Loading Message Latency to Delta Tables in {CLOUD_PROVIDER}')
+    load_window(sc, sc.table('output__message_latency'), os.path.join(OUTPUT_DIR, blob_prefix, 'message_latency'), OUTPUT_KEYS, d0, d1, dates=dates)
+
+def entrypoint():
+    """
+    Entry point for the ETL pipeline.
+
+    This function serves as the entry point for the ETL (Extract, Transform, Load) pipeline.
+    It initializes a SparkContext using the configured SparkConfig, performs extraction,
+    transformation, and loading stages of the pipeline for message latency sketches, and manages the overall execution flow.
+
+    The days of the window and the days `message_flow` changed since the last run are
+    recomputed, and the processed `message_flow` version is recorded once they are loaded.
+
+    Small windows run on the embedded local backend when EXECUTION_BACKEND opts in, see `select_backend`.
+    """
+    input_dir = os.path.join(OUTPUT_DIR, 'output' if CLOUD_PROVIDER!='AZURE' else '')
+    if select_backend(delta_paths=[os.path.join(input_dir, t) for t in INPUT_TABLES]) == 'local':
+        output_path = os.path.join(OUTPUT_DIR, 'output' if CLOUD_PROVIDER!='AZURE' else '', 'message_latency')
+        LocalBackend().run_output('message_latency', TRANSFORM_SQL, input_dir, INPUT_TABLES, output_path, OUTPUT_KEYS)
+        return
+
+    config = SparkConfig(app_name='output_message_latency')
+    sc = config.get_sparkContext()
+
+    incremental = _incremental(sc)
+
+    with config.get_runMetrics() as run_metrics:
+        with run_metrics.phase('Extract'):
+            versions = incremental.current_versions()
+            start, dates = incremental.recompute_dates(versions)
+            _extract(sc, dates=dates)
+        with run_metrics.phase('Transform'):
+            _transform(sc)
+        with run_metrics.phase('Load'):
+            _load(sc, dates=dates)
+            incremental.commit(start, versions)
+
+if __name__ == '__main__':
+    entrypoint()
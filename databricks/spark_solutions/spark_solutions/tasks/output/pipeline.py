@@ -0,0 +1,35 @@
+""" Output ETL Pipeline | All Outputs
+
+Runs the output tasks back to back in a single driver.
+
+The output tasks share the `log_meta`, `lib_server_game` and `lib_server_lobby`
+stage tables; running them in one driver lets the driver's table cache serve the
+second task's extracts, so each stage table is read from storage once.
+
+"""
+
+from spark_solutions.common.spark_cache import table_cache
+from spark_solutions.tasks.output import game_metrics, message_flow, message_latency, user_day_rollup
+
+import logging
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+def entrypoint():
+    """
+    Entry point for the combined output ETL pipeline.
+
+    This function runs the game metrics, user day rollup, message flow and message latency entry points in sequence, then logs
+    the table cache hit and miss counters, and releases the cached stage tables.
+    """
+    game_metrics.entrypoint()
+    user_day_rollup.entrypoint()
+    message_flow.entrypoint()
+    message_latency.entrypoint()
+
+    stats = table_cache.stats()
+    logger.info(f'ETL Pipeline | Cache | {stats["hits"]} Hits | {stats["misses"]} Misses | {stats["evictions"]} Evictions | {stats["bytes"]} Bytes Cached')
+    table_cache.invalidate()
+
+if __name__ == '__main__':
+    entrypoint()
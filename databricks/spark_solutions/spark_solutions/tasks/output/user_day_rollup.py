@@ -0,0 +1,155 @@
+""" Output ETL Pipeline | User Day Rollup
+
+Output asset rolling up the engagement metrics of `game_metrics`
+by user, superhero and day within the Super Hero Data Sim application.
+
+Multi-week engagement questions (wins, damage and time of use per user
+over the last 30 days) read a few rows per user and day from this table
+instead of re-aggregating every game in `game_metrics`. Users are
+identified by their `user_id`, see `spark_solutions.readers.token_dictionary`.
+
+The rollup is maintained incrementally; each run recomputes and overwrites
+the days of its window and the days `game_metrics` changed since the last
+run, read from its Change Data Feed, e.g. the days its late rows and
+incremental runs were merged into.
+
+"""
+
+from spark_solutions.common.spark_config import SparkConfig
+from spark_solutions.common.local_backend import LocalBackend, select_backend
+from spark_solutions.common.spark_incremental import IncrementalOutput
+from spark_solutions.common.spark_misc import extract_partitioned_tables, load_window
+
+import datetime
+import logging
+import os
+
+logger = logging.getLogger(f'py4j.{__name__}')
+
+# ENV Variables
+CLOUD_PROVIDER=os.getenv('CLOUD_PROVIDER', 'LOCAL')
+OUTPUT_DIR = os.getenv('OUTPUT_DIR')
+
+assert(not OUTPUT_DIR is None and OUTPUT_DIR != '')
+
+# Extracted Tables
+INPUT_TABLES = [
+    'game_metrics'
+]
+
+# Output Keys, identifying the rows merged into days outside the window
+OUTPUT_KEYS = ['year', 'month', 'day', 'user_id', 'superhero_id']
+
+# Transform SQL
+TRANSFORM_SQL = """
+    SELECT year, month, day,
+           user_id,
+           superhero_id,
+           COUNT(DISTINCT game_id) games,
+           SUM(turns) turns,
+           SUM(damage_dealt) damage_dealt,
+           SUM(damage_received) damage_received,
+           SUM(win) wins,
+           SUM(loss) losses,
+           SUM(time_of_use_seconds) seconds_played
+    FROM game_metrics
+    GROUP BY year, month, day, user_id, superhero_id
+"""
+
+def _incremental(sc, blob_prefix='output' if CLOUD_PROVIDER!='AZURE' else ''):
+    """
+    Returns the state of the `game_metrics` versions the rollup has processed.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    - blob_prefix (str): The prefix to be appended to the output directory paths (default: 'output' if CLOUD_PROVIDER is not 'AZURE', else '').
+
+    Returns:
+    - IncrementalOutput: The state of the rollup, with `game_metrics` as its source.
+    """
+    input_dir = os.path.join(OUTPUT_DIR, blob_prefix)
+    return IncrementalOutput(sc, 'user_day_rollup', None, {t: None for t in INPUT_TABLES}, {}, input_dir, INPUT_TABLES, os.path.join(input_dir, 'user_day_rollup'))
+
+def _extract(sc, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), blob_prefix='output' if CLOUD_PROVIDER!='AZURE' else '', dates=None):
+    """
+    Extracts the game metrics partitions of the current window from the output directory.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    - blob_prefix (str): The prefix to be appended to input directory paths (default: 'output' if CLOUD_PROVIDER is not 'AZURE', else '').
+    - dates (list): The days extracted instead of the date range (default: None).
+    """
+    logger.info(f'ETL Pipeline | Extract | Extracting Partitioned Tables from {CLOUD_PROVIDER}')
+    for table in INPUT_TABLES:
+        extract_partitioned_tables(sc, os.path.join(OUTPUT_DIR, blob_prefix, table), d0, d1, dates=dates)
+
+def _transform(sc):
+    """
+    Transforms game metrics into the user day rollup.
+
+    Aggregates the per game metrics of each user by superhero and day.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    """
+    logger.info(f'ETL Pipeline | Transform | Creating User Day Rollup Table')
+    rs = sc.sql(TRANSFORM_SQL)
+
+    rs.createOrReplaceTempView('output__user_day_rollup')
+
+def _load(sc, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), blob_prefix='output' if CLOUD_PROVIDER!='AZURE' else '', dates=None):
+    """
+    Loads the user day rollup to Delta tables in the specified output directory based on the cloud provider.
+
+    The partitions of the date range are replaced and rows falling on other days are merged
+    by OUTPUT_KEYS, so the history of the table is preserved, see `load_window`.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    - blob_prefix (str): The prefix to be appended to the output directory paths (default: 'output' if CLOUD_PROVIDER is not 'AZURE', else '').
+    - dates (list): The days replaced instead of the date range (default: None).
+    """
+    logger.info(f'ETL Pipeline | Load | Loading User Day Rollup to Delta Tables in {CLOUD_PROVIDER}')
+    load_window(sc, sc.table('output__user_day_rollup'), os.path.join(OUTPUT_DIR, blob_prefix, 'user_day_rollup'), OUTPUT_KEYS, d0, d1, dates=dates)
+
+def entrypoint():
+    """
+    Entry point for the ETL pipeline.
+
+    This function serves as the entry point for the ETL (Extract, Transform, Load) pipeline.
+    It initializes a SparkContext using the configured SparkConfig, performs extraction,
+    transformation, and loading stages of the pipeline for the user day rollup, and manages the overall execution flow.
+
+    The days of the window and the days `game_metrics` changed since the last run are
+    recomputed, and the processed `game_metrics` version is recorded once they are loaded.
+
+    Small windows run on the embedded local backend when EXECUTION_BACKEND opts in, see `select_backend`.
+    """
+    input_dir = os.path.join(OUTPUT_DIR, 'output' if CLOUD_PROVIDER!='AZURE' else '')
+    if select_backend(delta_paths=[os.path.join(input_dir, t) for t in INPUT_TABLES]) == 'local':
+        output_path = os.path.join(OUTPUT_DIR, 'output' if CLOUD_PROVIDER!='AZURE' else '', 'user_day_rollup')
+        LocalBackend().run_output('user_day_rollup', TRANSFORM_SQL, input_dir, INPUT_TABLES, output_path, OUTPUT_KEYS)
+        return
+
+    config = SparkConfig(app_name='output_user_day_rollup')
+    sc = config.get_sparkContext()
+    
+    incremental = _incremental(sc)
+
+    with config.get_runMetrics() as run_metrics:
+        with run_metrics.phase('Extract'):
+            versions = incremental.current_versions()
+            start, dates = incremental.recompute_dates(versions)
+            _extract(sc, dates=dates)
+        with run_metrics.phase('Transform'):
+            _transform(sc)
+        with run_metrics.phase('Load'):
+            _load(sc, dates=dates)
+            incremental.commit(start, versions)
+
+if __name__ == '__main__':
+    entrypoint()
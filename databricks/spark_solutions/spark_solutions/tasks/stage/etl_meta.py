@@ -1,6 +1,11 @@
 from spark_solutions.common.spark_config import SparkConfig
+from spark_solutions.common.spark_stage import load_stage
+from spark_solutions.common.local_backend import LocalBackend, select_backend
+from spark_solutions.common.spark_quality import conforms, duplicates, expect, not_null
 from spark_solutions.common.spark_misc import extract_tables
+from spark_solutions.common.raw_ledger import spark_ledger
 
+import datetime
 import logging
 import os
 
@@ -14,6 +19,50 @@ OUTPUT_DIR = os.getenv('STAGE_DIR')
 assert(not INPUT_DIR is None and INPUT_DIR != '')
 assert(not OUTPUT_DIR is None and OUTPUT_DIR != '')
 
+# Data Quality Expectations
+EXPECTATIONS = [
+    not_null('etl_id'),
+    conforms('timestamp_start', 'TIMESTAMP'),
+    conforms('timestamp_end', 'TIMESTAMP'),
+    expect('etl_window', 'timestamp_end >= timestamp_start'),
+    duplicates(max_duplicate_ratio=0.01)
+]
+
+# Bloom Indexed Columns
+BLOOM_INDEX_COLUMNS = ['etl_id']
+
+# Transform SQL
+TRANSFORM_SQL = """
+    WITH unnamed_partitions AS (
+        SELECT date_array[0] year, date_array[1] month, date_array[2] day, *
+        FROM (
+            SELECT SLICE(SPLIT(INPUT_FILE_NAME(), '/'), -4, 3) date_array, *
+            FROM etl_meta
+        ) tbl
+    )
+    SELECT etl_id, service, mode, timestamp_start, timestamp_end,
+           COUNT(*) distinct_count,
+           MIN(year) year,
+           MIN(month) month,
+           MIN(day) day
+    FROM unnamed_partitions
+    GROUP BY etl_id, service, mode, timestamp_start, timestamp_end
+"""
+
+def _extract(sc, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else '', files=None):
+    """
+    Extracts the ETL Meta Logs of a date range from the standard directory based on the cloud provider.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    - blob_prefix (str): The prefix to be appended to input directory paths (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
+    - files (dict): The RAW files of the date range with their sizes, from the RAW ledger (default: None, the day directories are listed).
+    """
+    logger.info(f'ETL Pipeline | Extract | Extracting ETL Meta Logs from {CLOUD_PROVIDER}')
+    extract_tables(sc, os.path.join(INPUT_DIR, blob_prefix, 'etl_meta'), d0, d1, files=files)
+
 def _transform(sc):
     """
     Transforms data to stage the ETL Meta table.
@@ -25,43 +74,33 @@ def _transform(sc):
     - sc (SparkContext): The SparkContext object.
     """
     logger.info(f'ETL Pipeline | Transform | Staging ETL Meta Table')
-    rs = sc.sql("""
-        WITH unnamed_partitions AS (
-            SELECT date_array[0] year, date_array[1] month, date_array[2] day, *
-            FROM (
-                SELECT SLICE(SPLIT(INPUT_FILE_NAME(), '/'), -4, 3) date_array, *
-                FROM etl_meta
-            ) tbl
-        )
-        SELECT etl_id, service, mode, timestamp_start, timestamp_end,
-               COUNT(*) distinct_count,
-               MIN(year) year,
-               MIN(month) month,
-               MIN(day) day
-        FROM unnamed_partitions
-        GROUP BY etl_id, service, mode, timestamp_start, timestamp_end
-    """)
+    rs = sc.sql(TRANSFORM_SQL)
 
     rs.createOrReplaceTempView('stage__etl_meta')
 
-def _load(sc, blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
+def _load(sc, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
     """
     Loads ETL Meta logs to Delta tables in the specified output directory based on the cloud provider.
 
     This function performs the load stage of the ETL pipeline by loading ETL Meta logs into Delta tables
     located in the specified output directory. The loading process varies based on the cloud provider.
 
+    Rows failing the table's EXPECTATIONS are routed to the quarantine table, with the
+    expectation metrics of the written rows appended to `dq_meta`.
+
+    Only the partitions of the date range are replaced, so reruns are idempotent and the
+    history outside the range is kept. The Change Data Feed of the table is enabled for its
+    streaming and incremental readers, and the Bloom filters of its BLOOM_INDEX_COLUMNS and
+    its ETL manifest are rebuilt for the range.
+
     Parameters:
     - sc (SparkContext): The SparkContext object.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
     - blob_prefix (str): The prefix to be appended to the output directory paths (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
     """
     logger.info(f'ETL Pipeline | Load | Loading ETL Meta Logs to Delta Tables in {CLOUD_PROVIDER}')
-    df = sc.table('stage__etl_meta')
-    df.write \
-        .format('delta') \
-        .partitionBy('year', 'month', 'day') \
-        .mode('overwrite') \
-        .save(os.path.join(OUTPUT_DIR, blob_prefix, 'etl_meta'))
+    load_stage(sc, 'etl_meta', EXPECTATIONS, os.path.join(OUTPUT_DIR, blob_prefix), d0, d1, index_columns=BLOOM_INDEX_COLUMNS)
 
 def entrypoint(blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
     """
@@ -71,15 +110,35 @@ def entrypoint(blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
     to process ETL Meta logs. It initializes a SparkContext using the configured SparkConfig,
     performs extraction, transformation, and loading stages, and manages the overall execution flow.
 
+    Small windows run on the embedded local backend when EXECUTION_BACKEND opts in, see `select_backend`.
+
     Parameters:
     - blob_prefix (str): The prefix to be appended to the input directory paths (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
     """
-    sc = SparkConfig(app_name='stage_etl.meta') \
-        .get_sparkContext()
-
-    extract_tables(sc, os.path.join(INPUT_DIR, blob_prefix, 'etl_meta'))
-    _transform(sc)
-    _load(sc)
+    input_path = os.path.join(INPUT_DIR, blob_prefix, 'etl_meta')
+    if select_backend(raw_paths=[input_path]) == 'local':
+        LocalBackend().run_stage('etl_meta', TRANSFORM_SQL, EXPECTATIONS, input_path, os.path.join(OUTPUT_DIR, blob_prefix), index_columns=BLOOM_INDEX_COLUMNS)
+        return
+
+    config = SparkConfig(app_name='stage_etl.meta', profile='stage_etl_meta')
+    sc = config.get_sparkContext()
+    
+    d0, d1 = datetime.date.today(), datetime.date.today() - datetime.timedelta(1)
+    ledger = spark_ledger(sc, 'etl_meta', input_path, os.path.join(OUTPUT_DIR, blob_prefix))
+    window = ledger.pending(d0, d1) if ledger else (d0, d1, None)
+    if window is None:
+        return
+    d0, d1, files = window
+
+    with config.get_runMetrics() as run_metrics:
+        with run_metrics.phase('Extract'):
+            _extract(sc, d0, d1, blob_prefix, files=ledger.sizes(files) if ledger else None)
+        with run_metrics.phase('Transform'):
+            _transform(sc)
+        with run_metrics.phase('Load'):
+            _load(sc, d0, d1)
+            if ledger:
+                ledger.mark_processed(files, run_metrics.run_id)
 
 if __name__ == '__main__':
     entrypoint()
\ No newline at end of file
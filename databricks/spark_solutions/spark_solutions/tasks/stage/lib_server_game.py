@@ -1,6 +1,12 @@
 from spark_solutions.common.spark_config import SparkConfig
+from spark_solutions.common.spark_stage import load_stage
+from spark_solutions.common.local_backend import LocalBackend, select_backend
+from spark_solutions.common.spark_quality import conforms, duplicates, expect, in_range, not_null, references
 from spark_solutions.common.spark_misc import extract_tables
+from spark_solutions.common.raw_ledger import spark_ledger
+from spark_solutions.readers.token_dictionary import token_id_sql
 
+import datetime
 import logging
 import os
 
@@ -14,6 +20,63 @@ OUTPUT_DIR = os.getenv('STAGE_DIR')
 assert(not INPUT_DIR is None and INPUT_DIR != '')
 assert(not OUTPUT_DIR is None and OUTPUT_DIR != '')
 
+# Data Quality Expectations
+EXPECTATIONS = [
+    not_null('msg_id'),
+    not_null('game_token'),
+    not_null('user_token'),
+    not_null('enemy_token'),
+    conforms('timestamp', 'TIMESTAMP'),
+    in_range('enemy_damage', min_value=0),
+    in_range('enemy_health_prior', min_value=0),
+    in_range('enemy_health_post', min_value=0),
+    expect('enemy_health_decreases', 'enemy_health_post <= enemy_health_prior'),
+    references('msg_id', 'buffer_meta', max_failure_rate=0.01, quarantine=False),
+    duplicates(max_duplicate_ratio=0.01)
+]
+
+# Token Columns, carried with their surrogate ids and merged into the token dictionary
+TOKEN_COLUMNS = ['game_token', 'user_token', 'enemy_token']
+
+# Transform SQL
+TRANSFORM_SQL = f"""
+    WITH unnamed_partitions AS (
+        SELECT date_array[0] year, date_array[1] month, date_array[2] day, *
+        FROM (
+            SELECT SLICE(SPLIT(INPUT_FILE_NAME(), '/'), -4, 3) date_array, *
+            FROM lib_server_game
+        ) tbl
+    )
+    SELECT etl_id, msg_id, timestamp, game_token, user_token,
+           action, enemy_token, enemy_damage, enemy_health_prior,
+           enemy_health_post,
+           {token_id_sql('game_token')} game_id,
+           {token_id_sql('user_token')} user_id,
+           {token_id_sql('enemy_token')} enemy_id,
+           COUNT(*) distinct_count,
+           MIN(year) year,
+           MIN(month) month,
+           MIN(day) day
+    FROM unnamed_partitions
+    GROUP BY etl_id, msg_id, timestamp, game_token, user_token,
+           action, enemy_token, enemy_damage, enemy_health_prior,
+           enemy_health_post
+"""
+
+def _extract(sc, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else '', files=None):
+    """
+    Extracts the Server Game Logs of a date range from the standard directory based on the cloud provider.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    - blob_prefix (str): The prefix to be appended to input directory paths (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
+    - files (dict): The RAW files of the date range with their sizes, from the RAW ledger (default: None, the day directories are listed).
+    """
+    logger.info(f'ETL Pipeline | Extract | Extracting Server Game Logs from {CLOUD_PROVIDER}')
+    extract_tables(sc, os.path.join(INPUT_DIR, blob_prefix, 'lib_server_game'), d0, d1, files=files)
+
 def _transform(sc):
     """
     Transforms data to stage the Server Game table.
@@ -25,47 +88,33 @@ def _transform(sc):
     - sc (SparkContext): The SparkContext object.
     """
     logger.info(f'ETL Pipeline | Transform | Staging Server Game Table')
-    rs = sc.sql("""
-        WITH unnamed_partitions AS (
-            SELECT date_array[0] year, date_array[1] month, date_array[2] day, *
-            FROM (
-                SELECT SLICE(SPLIT(INPUT_FILE_NAME(), '/'), -4, 3) date_array, *
-                FROM lib_server_game
-            ) tbl
-        )
-        SELECT etl_id, msg_id, timestamp, game_token, user_token,
-               action, enemy_token, enemy_damage, enemy_health_prior,
-               enemy_health_post,
-               COUNT(*) distinct_count,
-               MIN(year) year,
-               MIN(month) month,
-               MIN(day) day
-        FROM unnamed_partitions
-        GROUP BY etl_id, msg_id, timestamp, game_token, user_token,
-               action, enemy_token, enemy_damage, enemy_health_prior,
-               enemy_health_post
-    """)
+    rs = sc.sql(TRANSFORM_SQL)
 
     rs.createOrReplaceTempView('stage__lib_server_game')
 
-def _load(sc, blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
+def _load(sc, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
     """
     Loads Server Game logs to Delta tables in the specified output directory based on the cloud provider.
 
     This function performs the load stage of the ETL pipeline by loading Server Game logs into Delta tables
     located in the specified output directory. The loading process varies based on the cloud provider.
 
+    Rows failing the table's EXPECTATIONS are routed to the quarantine table, with the
+    expectation metrics of the written rows appended to `dq_meta`.
+
+    Only the partitions of the date range are replaced, so reruns are idempotent and the
+    history outside the range is kept. The Change Data Feed of the table is enabled for its
+    streaming and incremental readers, the new tokens of the range are merged into the token
+    dictionary and the ETL manifest of the range is rebuilt.
+
     Parameters:
     - sc (SparkContext): The SparkContext object.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
     - blob_prefix (str): The prefix to be appended to the output directory paths (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
     """
     logger.info(f'ETL Pipeline | Load | Loading Server Game Logs to Delta Tables in {CLOUD_PROVIDER}')
-    df = sc.table('stage__lib_server_game')
-    df.write \
-        .format('delta') \
-        .partitionBy('year', 'month', 'day') \
-        .mode('overwrite') \
-        .save(os.path.join(OUTPUT_DIR, blob_prefix, 'lib_server_game'))
+    load_stage(sc, 'lib_server_game', EXPECTATIONS, os.path.join(OUTPUT_DIR, blob_prefix), d0, d1, merge_schema=True, token_columns=TOKEN_COLUMNS)
 
 def entrypoint(blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
     """
@@ -75,15 +124,35 @@ def entrypoint(blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
     to process Server Game logs. It initializes a SparkContext using the configured SparkConfig,
     performs extraction, transformation, and loading stages, and manages the overall execution flow.
 
+    Small windows run on the embedded local backend when EXECUTION_BACKEND opts in, see `select_backend`.
+
     Parameters:
     - blob_prefix (str): The prefix to be appended to the input directory paths (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
     """
-    sc = SparkConfig(app_name='stage_lib.servery.game') \
-        .get_sparkContext()
+    input_path = os.path.join(INPUT_DIR, blob_prefix, 'lib_server_game')
+    if select_backend(raw_paths=[input_path]) == 'local':
+        LocalBackend().run_stage('lib_server_game', TRANSFORM_SQL, EXPECTATIONS, input_path, os.path.join(OUTPUT_DIR, blob_prefix), token_columns=TOKEN_COLUMNS)
+        return
+
+    config = SparkConfig(app_name='stage_lib.servery.game', profile='stage_lib_server_game')
+    sc = config.get_sparkContext()
     
-    extract_tables(sc, os.path.join(INPUT_DIR, blob_prefix, 'lib_server_game'))
-    _transform(sc)
-    _load(sc)
+    d0, d1 = datetime.date.today(), datetime.date.today() - datetime.timedelta(1)
+    ledger = spark_ledger(sc, 'lib_server_game', input_path, os.path.join(OUTPUT_DIR, blob_prefix))
+    window = ledger.pending(d0, d1) if ledger else (d0, d1, None)
+    if window is None:
+        return
+    d0, d1, files = window
+
+    with config.get_runMetrics() as run_metrics:
+        with run_metrics.phase('Extract'):
+            _extract(sc, d0, d1, blob_prefix, files=ledger.sizes(files) if ledger else None)
+        with run_metrics.phase('Transform'):
+            _transform(sc)
+        with run_metrics.phase('Load'):
+            _load(sc, d0, d1)
+            if ledger:
+                ledger.mark_processed(files, run_metrics.run_id)
 
 if __name__ == '__main__':
     entrypoint()
\ No newline at end of file
@@ -1,6 +1,13 @@
 from spark_solutions.common.spark_config import SparkConfig
-from spark_solutions.common.spark_misc import extract_tables
+from spark_solutions.common.spark_stage import load_stage
+from spark_solutions.common.local_backend import LocalBackend, select_backend
+from spark_solutions.common.spark_quality import conforms, duplicates, in_range, not_null, references
+from spark_solutions.common.spark_misc import date_partition_filter, date_range, extract_tables, read_partitioned_table
+from spark_solutions.common.raw_ledger import spark_ledger
+from spark_solutions.readers.token_dictionary import token_id_sql
+from spark_solutions.readers.hll_sketch import HLL_PRECISION, HASH_BITS
 
+import datetime
 import logging
 import os
 
@@ -14,6 +21,96 @@ OUTPUT_DIR = os.getenv('STAGE_DIR')
 assert(not INPUT_DIR is None and INPUT_DIR != '')
 assert(not OUTPUT_DIR is None and OUTPUT_DIR != '')
 
+# Data Quality Expectations
+EXPECTATIONS = [
+    not_null('msg_id'),
+    not_null('game_token'),
+    not_null('user_token'),
+    not_null('superhero_id'),
+    conforms('timestamp', 'TIMESTAMP'),
+    in_range('superhero_attack', min_value=0),
+    in_range('superhero_health', min_value=1),
+    references('msg_id', 'buffer_meta', max_failure_rate=0.01, quarantine=False),
+    duplicates(max_duplicate_ratio=0.01)
+]
+
+# Token Columns, carried with their surrogate ids and merged into the token dictionary
+TOKEN_COLUMNS = ['game_token', 'user_token']
+
+# Transform SQL
+TRANSFORM_SQL = f"""
+    WITH unnamed_partitions AS (
+        SELECT date_array[0] year, date_array[1] month, date_array[2] day, *
+        FROM (
+            SELECT SLICE(SPLIT(INPUT_FILE_NAME(), '/'), -4, 3) date_array, *
+            FROM lib_server_lobby
+        ) tbl
+    )
+    SELECT etl_id, msg_id, game_token, user_token, timestamp,
+           superhero_id, superhero_attack, superhero_health,
+           {token_id_sql('game_token')} game_id,
+           {token_id_sql('user_token')} user_id,
+           COUNT(*) distinct_count,
+           MIN(year) year,
+           MIN(month) month,
+           MIN(day) day
+    FROM unnamed_partitions
+    GROUP BY etl_id, msg_id, game_token, user_token, timestamp,
+             superhero_id, superhero_attack, superhero_health
+"""
+
+# Reach Sketch SQL
+SKETCH_SQL = f"""
+    WITH hashes AS (
+        SELECT year, month, day, superhero_id, 'users' metric, MD5(CAST(user_token AS STRING)) hash
+        FROM reach__lib_server_lobby
+        WHERE user_token IS NOT NULL
+        UNION ALL
+        SELECT year, month, day, superhero_id, 'games' metric, MD5(CAST(game_token AS STRING)) hash
+        FROM reach__lib_server_lobby
+        WHERE game_token IS NOT NULL
+    ),
+    words AS (
+        SELECT year, month, day, superhero_id, metric,
+               CAST(CONV(SUBSTR(hash, 1, {HLL_PRECISION // 4}), 16, 10) AS INT) register,
+               CAST(CONV(SUBSTR(hash, {HLL_PRECISION // 4 + 1}, {HASH_BITS // 4}), 16, 10) AS BIGINT) w
+        FROM hashes
+    ),
+    ranks AS (
+        SELECT year, month, day, superhero_id, metric, register,
+               MAX(CASE WHEN w = 0 THEN {HASH_BITS + 1} ELSE {HASH_BITS + 1} - LENGTH(BIN(w)) END) rho
+        FROM words
+        GROUP BY year, month, day, superhero_id, metric, register
+    ),
+    sketches AS (
+        SELECT * FROM ranks
+        UNION ALL
+        SELECT year, month, day, NULL superhero_id, metric, register, MAX(rho) rho
+        FROM ranks
+        GROUP BY year, month, day, metric, register
+    )
+    SELECT superhero_id, metric,
+           {HLL_PRECISION} precision,
+           MAP_FROM_ENTRIES(COLLECT_LIST(STRUCT(register, rho))) registers,
+           year, month, day
+    FROM sketches
+    GROUP BY year, month, day, superhero_id, metric
+"""
+
+def _extract(sc, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else '', files=None):
+    """
+    Extracts the Server lobby Logs of a date range from the standard directory based on the cloud provider.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    - blob_prefix (str): The prefix to be appended to input directory paths (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
+    - files (dict): The RAW files of the date range with their sizes, from the RAW ledger (default: None, the day directories are listed).
+    """
+    logger.info(f'ETL Pipeline | Extract | Extracting Server lobby Logs from {CLOUD_PROVIDER}')
+    extract_tables(sc, os.path.join(INPUT_DIR, blob_prefix, 'lib_server_lobby'), d0, d1, files=files)
+
 def _transform(sc):
     """
     Transform stage of the ETL pipeline for staging the Server Lobby table.
@@ -26,28 +123,11 @@ def _transform(sc):
     - sc (SparkContext): The SparkContext object.
     """
     logger.info(f'ETL Pipeline | Transform | Staging Server Lobby Table')
-    rs = sc.sql("""
-        WITH unnamed_partitions AS (
-            SELECT date_array[0] year, date_array[1] month, date_array[2] day, *
-            FROM (
-                SELECT SLICE(SPLIT(INPUT_FILE_NAME(), '/'), -4, 3) date_array, *
-                FROM lib_server_lobby
-            ) tbl
-        )
-        SELECT etl_id, msg_id, game_token, user_token, timestamp,
-               superhero_id, superhero_attack, superhero_health,
-               COUNT(*) distinct_count,
-               MIN(year) year,
-               MIN(month) month,
-               MIN(day) day
-        FROM unnamed_partitions
-        GROUP BY etl_id, msg_id, game_token, user_token, timestamp,
-                 superhero_id, superhero_attack, superhero_health
-    """)
+    rs = sc.sql(TRANSFORM_SQL)
 
     rs.createOrReplaceTempView('stage__lib_server_lobby')
 
-def _load(sc, blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
+def _load(sc, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
     """
     Load stage of the ETL pipeline for loading Server Lobby logs to Delta tables.
 
@@ -55,17 +135,47 @@ def _load(sc, blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
     It reads the transformed data from the staging table, writes it to Delta format partitioned by year, month, and day,
     and saves it to the specified output directory.
 
+    Rows failing the table's EXPECTATIONS are routed to the quarantine table, with the
+    expectation metrics of the written rows appended to `dq_meta`.
+
+    Only the partitions of the date range are replaced, so reruns are idempotent and the
+    history outside the range is kept. The Change Data Feed of the table is enabled for its
+    streaming and incremental readers, the new tokens of the range are merged into the token
+    dictionary, and the ETL manifest and reach sketches of the range are rebuilt.
+
     Parameters:
     - sc (SparkContext): The SparkContext object.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
     - blob_prefix (str): The prefix to be appended to the output directory path (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
     """
     logger.info(f'ETL Pipeline | Load | Loading Server lobby Logs to Delta Tables in {CLOUD_PROVIDER}')
-    df = sc.table('stage__lib_server_lobby')
-    df.write \
+    load_stage(sc, 'lib_server_lobby', EXPECTATIONS, os.path.join(OUTPUT_DIR, blob_prefix), d0, d1, merge_schema=True, token_columns=TOKEN_COLUMNS,
+               hooks=[lambda sc, d0, d1: _load_sketches(sc, d0, d1, blob_prefix)])
+
+def _load_sketches(sc, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
+    """
+    Loads the HyperLogLog reach sketches of the loaded Server Lobby partitions.
+
+    Sketches of the distinct users and games of each day, per superhero and globally, are
+    rebuilt from the valid rows of the date range, see `spark_solutions.readers.hll_sketch`.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    - blob_prefix (str): The prefix to be appended to the output directory path (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
+    """
+    logger.info(f'ETL Pipeline | Load | Loading Reach Sketches to Delta Tables in {CLOUD_PROVIDER}')
+    read_partitioned_table(sc, os.path.join(OUTPUT_DIR, blob_prefix, 'lib_server_lobby'), d0, d1) \
+        .createOrReplaceTempView('reach__lib_server_lobby')
+
+    sc.sql(SKETCH_SQL).write \
         .format('delta') \
         .partitionBy('year', 'month', 'day') \
         .mode('overwrite') \
-        .save(os.path.join(OUTPUT_DIR, blob_prefix, 'lib_server_lobby'))
+        .option('replaceWhere', date_partition_filter(date_range(d0, d1))) \
+        .save(os.path.join(OUTPUT_DIR, blob_prefix, 'reach_sketches'))
 
 def entrypoint(blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
     """
@@ -75,15 +185,39 @@ def entrypoint(blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
     Server Lobby logs. It initializes the SparkContext, extracts data from the input directory, transforms it, and loads 
     it into Delta tables.
 
+    Small windows run on the embedded local backend when EXECUTION_BACKEND opts in, see `select_backend`.
+
     Parameters:
     - blob_prefix (str): The prefix to be appended to the input directory path (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
     """
-    sc = SparkConfig(app_name='stage_lib.servery.lobby') \
-        .get_sparkContext()
+    input_path = os.path.join(INPUT_DIR, blob_prefix, 'lib_server_lobby')
+    if select_backend(raw_paths=[input_path]) == 'local':
+        d0, d1 = datetime.date.today(), datetime.date.today() - datetime.timedelta(1)
+        backend = LocalBackend()
+        backend.run_stage('lib_server_lobby', TRANSFORM_SQL, EXPECTATIONS, input_path, os.path.join(OUTPUT_DIR, blob_prefix), d0, d1, token_columns=TOKEN_COLUMNS)
+        if backend.extract_delta(os.path.join(OUTPUT_DIR, blob_prefix, 'lib_server_lobby'), d0, d1, name='reach__lib_server_lobby') is not None:
+            backend.load(backend.transform(SKETCH_SQL), os.path.join(OUTPUT_DIR, blob_prefix, 'reach_sketches'), date_partition_filter(date_range(d0, d1)))
+        return
+
+    config = SparkConfig(app_name='stage_lib.servery.lobby', profile='stage_lib_server_lobby')
+    sc = config.get_sparkContext()
     
-    extract_tables(sc, os.path.join(INPUT_DIR, blob_prefix, 'lib_server_lobby'))
-    _transform(sc)
-    _load(sc)
+    d0, d1 = datetime.date.today(), datetime.date.today() - datetime.timedelta(1)
+    ledger = spark_ledger(sc, 'lib_server_lobby', input_path, os.path.join(OUTPUT_DIR, blob_prefix))
+    window = ledger.pending(d0, d1) if ledger else (d0, d1, None)
+    if window is None:
+        return
+    d0, d1, files = window
+
+    with config.get_runMetrics() as run_metrics:
+        with run_metrics.phase('Extract'):
+            _extract(sc, d0, d1, blob_prefix, files=ledger.sizes(files) if ledger else None)
+        with run_metrics.phase('Transform'):
+            _transform(sc)
+        with run_metrics.phase('Load'):
+            _load(sc, d0, d1)
+            if ledger:
+                ledger.mark_processed(files, run_metrics.run_id)
 
 if __name__ == '__main__':
     entrypoint()
\ No newline at end of file
@@ -1,6 +1,11 @@
 from spark_solutions.common.spark_config import SparkConfig
+from spark_solutions.common.spark_stage import load_stage
+from spark_solutions.common.local_backend import LocalBackend, select_backend
+from spark_solutions.common.spark_quality import conforms, duplicates, not_null, references
 from spark_solutions.common.spark_misc import extract_tables
+from spark_solutions.common.raw_ledger import spark_ledger
 
+import datetime
 import logging
 import os
 
@@ -14,6 +19,50 @@ OUTPUT_DIR = os.getenv('STAGE_DIR')
 assert(not INPUT_DIR is None and INPUT_DIR != '')
 assert(not OUTPUT_DIR is None and OUTPUT_DIR != '')
 
+# Data Quality Expectations
+EXPECTATIONS = [
+    not_null('etl_id'),
+    not_null('msg_id'),
+    conforms('timestamp', 'TIMESTAMP'),
+    references('msg_id', 'buffer_meta', max_failure_rate=0.01, quarantine=False),
+    duplicates(max_duplicate_ratio=0.01)
+]
+
+# Bloom Indexed Columns
+BLOOM_INDEX_COLUMNS = ['msg_id', 'etl_id']
+
+# Transform SQL
+TRANSFORM_SQL = """
+    WITH unnamed_partitions AS (
+        SELECT date_array[0] year, date_array[1] month, date_array[2] day, *
+        FROM (
+            SELECT SLICE(SPLIT(INPUT_FILE_NAME(), '/'), -4, 3) date_array, *
+            FROM log_meta
+        ) tbl
+    )
+    SELECT etl_id, msg_id, level, timestamp, name, log_message,
+           COUNT(*) distinct_count,
+           MIN(year) year,
+           MIN(month) month,
+           MIN(day) day
+    FROM unnamed_partitions
+    GROUP BY etl_id, msg_id, level, timestamp, name, log_message
+"""
+
+def _extract(sc, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else '', files=None):
+    """
+    Extracts the Log Meta of a date range from the standard directory based on the cloud provider.
+
+    Parameters:
+    - sc (SparkContext): The SparkContext object.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
+    - blob_prefix (str): The prefix to be appended to input directory paths (default: 'standard' if CLOUD_PROVIDER is not 'AZURE', else '').
+    - files (dict): The RAW files of the date range with their sizes, from the RAW ledger (default: None, the day directories are listed).
+    """
+    logger.info(f'ETL Pipeline | Extract | Extracting Log Meta from {CLOUD_PROVIDER}')
+    extract_tables(sc, os.path.join(INPUT_DIR, blob_prefix, 'log_meta'), d0, d1, files=files)
+
 def _transform(sc):
     """
     Transform function for staging Log Meta table.
@@ -25,42 +74,32 @@ def _transform(sc):
     - sc (SparkContext): The SparkContext object.
     """
     logger.info(f'ETL Pipeline | Transform | Staging Log Meta Table')
-    rs = sc.sql("""
-        WITH unnamed_partitions AS (
-            SELECT date_array[0] year, date_array[1] month, date_array[2] day, *
-            FROM (
-                SELECT SLICE(SPLIT(INPUT_FILE_NAME(), '/'), -4, 3) date_array, *
-                FROM log_meta
-            ) tbl
-        )
-        SELECT etl_id, msg_id, level, timestamp, name, log_message,
-               COUNT(*) distinct_count,
-               MIN(year) year,
-               MIN(month) month,
-               MIN(day) day
-        FROM unnamed_partitions
-        GROUP BY etl_id, msg_id, level, timestamp, name, log_message
-    """)
+    rs = sc.sql(TRANSFORM_SQL)
 
     rs.createOrReplaceTempView('stage__log_meta')
 
-def _load(sc, blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
+def _load(sc, d0=datetime.date.today(), d1=datetime.date.today() - datetime.timedelta(1), blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
     """
     Load function for loading Log Meta data into Delta Tables.
 
     This function loads the transformed Log Meta data into Delta Tables partitioned by year, month, and day.
 
+    Rows failing the table's EXPECTATIONS are routed to the quarantine table, with the
+    expectation metrics of the written rows appended to `dq_meta`.
+
+    Only the partitions of the date range are replaced, so reruns are idempotent and the
+    history outside the range is kept. The Change Data Feed of the table is enabled for its
+    streaming and incremental readers, and the Bloom filters of its BLOOM_INDEX_COLUMNS and
+    its ETL manifest are rebuilt for the range.
+
     Parameters:
     - sc (SparkContext): The SparkContext object.
+    - d0 (datetime.date): The end date of the date range (default: today's date).
+    - d1 (datetime.date): The start date of the date range (default: yesterday's date).
     - blob_prefix (str): The prefix for the output blob directory. Defaults to 'standard' if CLOUD_PROVIDER is not 'AZURE'.
     """
     logger.info(f'ETL Pipeline | Load | Loading Log Meta to Delta Tables in {CLOUD_PROVIDER}')
-    df = sc.table('stage__log_meta')
-    df.write \
-        .format('delta') \
-        .partitionBy('year', 'month', 'day') \
-        .mode('overwrite') \
-        .save(os.path.join(OUTPUT_DIR, blob_prefix, 'log_meta'))
+    load_stage(sc, 'log_meta', EXPECTATIONS, os.path.join(OUTPUT_DIR, blob_prefix), d0, d1, index_columns=BLOOM_INDEX_COLUMNS)
 
 def entrypoint(blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
     """
@@ -69,15 +108,35 @@ def entrypoint(blob_prefix='standard' if CLOUD_PROVIDER!='AZURE' else ''):
     This function initializes the Spark context, extracts Log Meta data from the specified input directory with the given blob prefix,
     transforms the data, and loads it into Delta Tables.
 
+    Small windows run on the embedded local backend when EXECUTION_BACKEND opts in, see `select_backend`.
+
     Parameters:
     - blob_prefix (str): The prefix for the input blob directory. Defaults to 'standard' if CLOUD_PROVIDER is not 'AZURE'.
     """
-    sc = SparkConfig(app_name='stage_log.meta') \
-        .get_sparkContext()
+    input_path = os.path.join(INPUT_DIR, blob_prefix, 'log_meta')
+    if select_backend(raw_paths=[input_path]) == 'local':
+        LocalBackend().run_stage('log_meta', TRANSFORM_SQL, EXPECTATIONS, input_path, os.path.join(OUTPUT_DIR, blob_prefix), index_columns=BLOOM_INDEX_COLUMNS)
+        return
+
+    config = SparkConfig(app_name='stage_log.meta', profile='stage_log_meta')
+    sc = config.get_sparkContext()
     
-    extract_tables(sc, os.path.join(INPUT_DIR, blob_prefix, 'log_meta'))
-    _transform(sc)
-    _load(sc)
+    d0, d1 = datetime.date.today(), datetime.date.today() - datetime.timedelta(1)
+    ledger = spark_ledger(sc, 'log_meta', input_path, os.path.join(OUTPUT_DIR, blob_prefix))
+    window = ledger.pending(d0, d1) if ledger else (d0, d1, None)
+    if window is None:
+        return
+    d0, d1, files = window
+
+    with config.get_runMetrics() as run_metrics:
+        with run_metrics.phase('Extract'):
+            _extract(sc, d0, d1, blob_prefix, files=ledger.sizes(files) if ledger else None)
+        with run_metrics.phase('Transform'):
+            _transform(sc)
+        with run_metrics.phase('Load'):
+            _load(sc, d0, d1)
+            if ledger:
+                ledger.mark_processed(files, run_metrics.run_id)
 
 if __name__ == '__main__':
     entrypoint()
\ No newline at end of file
@@ -1,17 +1,38 @@
-from spark_solutions.common.spark_config import SparkConfig
+from spark_solutions.common.raw_validator import RAW_SCHEMAS
 from pyspark.sql import SparkSession
 from dataclasses import dataclass
 from unittest.mock import patch
-from typing import Iterator
+from typing import TYPE_CHECKING, Iterator
 from pathlib import Path
 
 import tempfile
+import datetime
 import logging
 import shutil
 import pytest
 import sys
 import os
 
+if TYPE_CHECKING:
+    from spark_solutions.common.spark_config import SparkConfig
+
+# ENV Variables
+CLOUD_PROVIDER=os.getenv('CLOUD_PROVIDER', 'LOCAL')
+GOLDEN_FIXTURES=os.getenv('GOLDEN_FIXTURES', 'false' if os.getenv('STANDARD_DIR') else 'true').lower() == 'true'
+TEST_SHUFFLE_PARTITIONS=os.getenv('TEST_SHUFFLE_PARTITIONS', '4')
+WORKER_ID=os.getenv('PYTEST_XDIST_WORKER', 'gw0')
+WORKER_COUNT=int(os.getenv('PYTEST_XDIST_WORKER_COUNT', '1'))
+
+BLOB_PREFIX = 'standard' if CLOUD_PROVIDER != 'AZURE' else ''
+
+# Spark types of the golden RAW columns, timestamps are landed as strings
+GOLDEN_TYPES = {
+    str: 'STRING',
+    int: 'BIGINT',
+    bool: 'BOOLEAN',
+    datetime.datetime: 'STRING'
+}
+
 def is_debugging():
     return 'debugpy' in sys.modules
     
@@ -112,46 +133,173 @@ class DBUtilsFixture:
         delete_func = shutil.rmtree if recurse else os.remove
         delete_func(path)
 
-@pytest.fixture(scope='session')
-def spark() -> SparkSession:
+def golden_rows(d):
     """
-    Fixture providing a preconfigured SparkSession with Cloud Provider Support.
+    Builds the golden rows of the RAW tables for a day.
+
+    Three games of two users each, with their lobby and game messages logged, buffered
+    and processed by two ETL runs, so every stage and output task has rows to join.
+
+    Parameters:
+    - d (datetime.date): The day.
 
     Returns:
-    - SparkSession: A preconfigured SparkSession object.
+    - dict: The rows of each RAW table.
     """
-    logging.info('Configuring Spark Session for Testing Environment')
-    spark = SparkConfig(app_name='spark-solution-unit-test') \
-        .get_sparkContext()
-    
+    p = d.strftime('%Y%m%d')
+    rows = {t: [] for t in RAW_SCHEMAS}
+    for r, mode in enumerate(['batch', 'stream']):
+        rows['etl_meta'].append({'etl_id': f'etl-{p}-{r}', 'service': 'dataflow', 'mode': mode,
+                                 'timestamp_start': f'{d} 1{r}:00:00', 'timestamp_end': f'{d} 1{r}:05:00'})
+
+    messages = []
+    for g in range(3):
+        game_token = f'game-{p}-{g}'
+        users = [f'user-{g % 4}', f'user-{(g + 1) % 4}']
+        for i, user_token in enumerate(users):
+            messages.append(('lib_server_lobby', {'timestamp': f'{d} 09:{g:02d}:0{i}', 'game_token': game_token, 'user_token': user_token,
+                                                  'superhero_id': (g + i) % 3 + 1, 'superhero_attack': 10, 'superhero_health': 30}))
+        for turn, (attacker, damage, prior) in enumerate([(0, 10, 30), (1, 10, 30), (0, 20, 20)]):
+            messages.append(('lib_server_game', {'timestamp': f'{d} 09:{g:02d}:1{turn}', 'game_token': game_token, 'user_token': users[attacker],
+                                                 'action': 'attack', 'enemy_token': users[1 - attacker], 'enemy_damage': damage,
+                                                 'enemy_health_prior': prior, 'enemy_health_post': prior - damage}))
+
+    for n, (table, row) in enumerate(messages):
+        msg_id, etl_id = f'msg-{p}-{n}', f'etl-{p}-{n % 2}'
+        rows[table].append({'etl_id': etl_id, 'msg_id': msg_id, **row})
+        rows['log_meta'].append({'etl_id': etl_id, 'msg_id': msg_id, 'level': 'INFO', 'timestamp': row['timestamp'],
+                                 'name': table, 'log_message': f'{table} message'})
+        rows['buffer_meta'].append({'etl_id': etl_id, 'msg_id': msg_id, 'checksum': f'{n:08x}', 'headers': '[]', 'key': msg_id,
+                                    'offset': n, 'partition': 0, 'serialized_key_size': len(msg_id), 'serialized_value_size': 128,
+                                    'timestamp': row['timestamp'],
+                                    'timestamp_type': 0, 'topic': table, '_is_protocol': False})
+
+    return rows
+
+def pytest_configure(config):
+    """
+    Registers the test markers and points the data directories at the golden fixtures.
+
+    With GOLDEN_FIXTURES, STANDARD_DIR, STAGE_DIR and OUTPUT_DIR are set to a temporary
+    directory of the worker before any task module is imported. The `spark_solutions.common`
+    modules read their directories at import time, e.g. RUN_META_DIR, so SparkConfig is only
+    imported once they are set.
+    """
+    for marker in ('local', 'raw', 'stage', 'output', 'common'):
+        config.addinivalue_line('markers', marker)
+    for table in RAW_SCHEMAS:
+        config.addinivalue_line('markers', f'table_{table}')
+
+    if GOLDEN_FIXTURES:
+        config._golden_dir = tempfile.mkdtemp(prefix=f'spark-solutions-golden-{WORKER_ID}-')
+        for env, name in (('STANDARD_DIR', 'raw'), ('STAGE_DIR', 'stage'), ('OUTPUT_DIR', 'output')):
+            os.environ[env] = os.path.join(config._golden_dir, name)
+
+    if WORKER_COUNT > 1 and os.getenv('SPARK_MASTER') is None:
+        from spark_solutions.common.spark_config import SparkConfig
+        SparkConfig.SPARK_MASTER = f'local[{max(1, (os.cpu_count() or 1) // WORKER_COUNT)}]'
+
+def pytest_unconfigure(config):
+    """
+    Deletes the golden fixtures of the worker.
+    """
+    if getattr(config, '_golden_dir', None):
+        shutil.rmtree(config._golden_dir, ignore_errors=True)
+
+@pytest.fixture(scope='session')
+def spark_config() -> Iterator['SparkConfig']:
+    """
+    Fixture providing the warm SparkConfig of the test worker.
+
+    Each pytest-xdist worker starts one session, with its own warehouse directory, which
+    every test of the worker shares.
+
+    Yields:
+    - SparkConfig: The configured SparkConfig object.
+    """
+    from spark_solutions.common.spark_config import SparkConfig
+
+    logging.info(f'Configuring Spark Session for Testing Environment {WORKER_ID}')
+    warehouse_dir = tempfile.mkdtemp(prefix=f'spark-warehouse-{WORKER_ID}-')
+    config = SparkConfig(app_name=f'spark-solution-unit-test-{WORKER_ID}', warehouse_dir=warehouse_dir)
+    config.get_sparkContext().conf.set('spark.sql.shuffle.partitions', TEST_SHUFFLE_PARTITIONS)
+
     logging.info('Spark Session Configured')
-    yield spark
+    yield config
 
     logging.info('Shutting Down Spark Session')
     #spark.stop()
 
+    shutil.rmtree(warehouse_dir, ignore_errors=True)
+
 @pytest.fixture(scope='session')
-def spark_delta() -> SparkSession:
+def golden_standard(spark_config) -> str:
     """
-    Fixture providing a preconfigured SparkSession with Hive and Delta support.
-    After the test session, the temporary warehouse directory is deleted.
+    Fixture writing the golden RAW tables of today and yesterday to the standard directory.
 
     Returns:
-    - SparkSession: A preconfigured SparkSession object.
+    - str: The standard directory, left untouched without GOLDEN_FIXTURES.
     """
-    logging.info('Configuring Spark Session for Testing Environment')
-    warehouse_dir = tempfile.TemporaryDirectory().name
-    spark = SparkConfig(app_name='spark-solution-unit-test', warehouse_dir=warehouse_dir) \
-        .get_sparkContext()
+    INPUT_DIR = os.getenv('STANDARD_DIR')
+    if not GOLDEN_FIXTURES:
+        return INPUT_DIR
 
-    logging.info('Spark Session Configured')
-    yield spark
+    sc = spark_config.get_sparkContext()
+    for d in (datetime.date.today() - datetime.timedelta(1), datetime.date.today()):
+        for table, rows in golden_rows(d).items():
+            schema = ', '.join(f'{c} {GOLDEN_TYPES[t]}' for c, t in RAW_SCHEMAS[table].items())
+            sc.createDataFrame(rows, schema) \
+                .coalesce(1) \
+                .write \
+                .mode('overwrite') \
+                .parquet(os.path.join(INPUT_DIR, BLOB_PREFIX, table, f'{d.year}', f'{d.month:02d}', f'{d.day:02d}'))
 
-    logging.info('Shutting Down Spark Session')
-    #spark.stop()
+    return INPUT_DIR
+
+@pytest.fixture(scope='session')
+def golden_stage(spark_config, golden_standard) -> str:
+    """
+    Fixture loading the golden stage tables read by the output tasks.
+
+    Returns:
+    - str: The stage directory, left untouched without GOLDEN_FIXTURES.
+    """
+    INPUT_DIR = os.getenv('STAGE_DIR')
+    if not GOLDEN_FIXTURES:
+        return INPUT_DIR
+
+    from spark_solutions.tasks.stage import buffer_meta, etl_meta, log_meta, lib_server_game, lib_server_lobby
 
-    if Path(warehouse_dir).exists():
-        shutil.rmtree(warehouse_dir)
+    sc = spark_config.get_isolatedSparkContext()
+    for module in (buffer_meta, etl_meta, log_meta, lib_server_game, lib_server_lobby):
+        module._extract(sc)
+        module._transform(sc)
+        module._load(sc, blob_prefix='stage' if CLOUD_PROVIDER != 'AZURE' else '')
+
+    return INPUT_DIR
+
+@pytest.fixture
+def spark(spark_config, golden_standard) -> SparkSession:
+    """
+    Fixture providing the worker's warm SparkSession with Cloud Provider Support.
+
+    Each test gets a clone of the session, so the temporary views it registers don't
+    leak into other tests.
+
+    Returns:
+    - SparkSession: A preconfigured SparkSession object.
+    """
+    return spark_config.get_isolatedSparkContext()
+
+@pytest.fixture
+def spark_delta(spark) -> SparkSession:
+    """
+    Fixture providing the worker's warm SparkSession with Delta support and its isolated warehouse.
+
+    Returns:
+    - SparkSession: A preconfigured SparkSession object.
+    """
+    return spark
 
 @pytest.fixture(scope='session', autouse=True)
 def dbutils_fixture() -> Iterator[None]:
@@ -0,0 +1,182 @@
+import pytest
+
+@pytest.mark.common
+@pytest.mark.usefixtures('spark')
+def test_common_run_metrics_listener(spark):
+    """
+    Test case for verifying runs share one run metrics listener per SparkContext.
+
+    Raises:
+    - AssertionError: If a run registers another listener, or a detached run keeps receiving events.
+    """
+    from spark_solutions.common.spark_metrics import RunMetrics, shared_listener
+
+    listener = shared_listener(spark)
+    bus = spark.sparkContext._jsc.sc().listenerBus()
+
+    first = RunMetrics(spark)
+    with first.phase('Transform'):
+        spark.range(1000, numPartitions=4).selectExpr('SUM(id)').collect()
+        bus.waitUntilEmpty(10000)
+    first._unregister_listener()
+    stages = first.summary()['stage_count']
+
+    second = RunMetrics(spark)
+    assert second._listener is listener and listener.run_metrics is second
+
+    with second.phase('Transform'):
+        spark.range(1000, numPartitions=4).selectExpr('SUM(id)').collect()
+        bus.waitUntilEmpty(10000)
+    second._unregister_listener()
+
+    assert listener.run_metrics is None
+    assert stages >= 1 and first.summary()['stage_count'] == stages
+    assert second.summary()['stage_count'] >= 1
+
+@pytest.mark.common
+@pytest.mark.usefixtures('spark')
+def test_common_expectation_suite_evaluate(spark, tmp_path):
+    """
+    Test case for verifying expectation metrics are aggregated before the write, and failing expectations raise before it.
+
+    Parameters:
+    - tmp_path (pathlib.Path): The stage directory.
+
+    Raises:
+    - AssertionError: If evaluate waits on the write, its failed row counts are off, or a failing expectation doesn't raise.
+    """
+    from spark_solutions.common.spark_quality import DataQualityError, ExpectationSuite, in_range, not_null
+
+    df = spark.createDataFrame([(1, 'a'), (2, None), (-1, 'c')], 'damage INT, game_token STRING')
+    dq = ExpectationSuite(spark, 'dq_test', [not_null('game_token'), in_range('damage', min_value=0, quarantine=False)], str(tmp_path), enabled=True)
+    valid = dq.apply(df)
+
+    # Nothing consumed the returned rows yet; evaluate runs before the write
+    results = {r['expectation']: r for r in dq.evaluate()}
+
+    assert valid.count() == 2
+    assert dq.finalize() == list(results.values())
+    assert results['not_null__game_token']['failed_rows'] == 1 and results['not_null__game_token']['rows'] == 3
+    assert results['in_range__damage']['failed_rows'] == 1
+    assert spark.read.format('delta').load(str(tmp_path / 'quarantine' / 'dq_test')).count() == 1
+
+    dq = ExpectationSuite(spark, 'dq_test', [not_null('game_token', action='fail')], str(tmp_path), enabled=True)
+    dq.apply(df)
+    with pytest.raises(DataQualityError):
+        dq.evaluate()
+
+@pytest.mark.common
+@pytest.mark.usefixtures('spark')
+def test_common_incremental_output(spark, tmp_path):
+    """
+    Test case for verifying an incremental run recomputes only changed keys over all their rows.
+
+    A partition of `lib_server_game` is rewritten with one new event of a game whose lobby
+    rows are three days earlier; the unchanged game of the partition isn't recomputed.
+
+    Raises:
+    - AssertionError: If unchanged rows count as changes, the game misses its lobby rows, or its old row is kept.
+    """
+    from spark_solutions.common.spark_incremental import IncrementalOutput
+
+    spark.conf.set('spark.databricks.delta.properties.defaults.enableChangeDataFeed', 'true')
+    stage, output = str(tmp_path / 'stage'), str(tmp_path / 'output' / 'games')
+    schema = 'game_token STRING, timestamp STRING, year STRING, month STRING, day STRING'
+
+    def _write(table, rows, replace_day=None):
+        writer = spark.createDataFrame(rows, schema).write.format('delta').partitionBy('year', 'month', 'day').mode('overwrite')
+        if replace_day:
+            writer = writer.option('replaceWhere', f"year = '2024' AND month = '01' AND day = '{replace_day}'")
+        writer.save(f'{stage}/{table}')
+
+    _write('lib_server_lobby', [('g1', '2024-01-07 23:00:00', '2024', '01', '07'), ('g2', '2024-01-09 10:00:00', '2024', '01', '09')])
+    _write('lib_server_game', [('g1', '2024-01-08 01:00:00', '2024', '01', '08'), ('g1', '2024-01-09 01:00:00', '2024', '01', '09'), ('g2', '2024-01-09 10:01:00', '2024', '01', '09')])
+
+    sql = """
+        SELECT game_token, MIN(start_time) start_time, SUM(events) events,
+               YEAR(MIN(start_time)) year, MONTH(MIN(start_time)) month, DAYOFMONTH(MIN(start_time)) day
+        FROM (
+            SELECT game_token, CAST(timestamp AS TIMESTAMP) start_time, 0 events FROM lib_server_lobby
+            UNION ALL
+            SELECT game_token, CAST(NULL AS TIMESTAMP) start_time, 1 events FROM lib_server_game
+        ) t
+        GROUP BY game_token
+    """
+    for table in ('lib_server_lobby', 'lib_server_game'):
+        spark.read.format('delta').load(f'{stage}/{table}').createOrReplaceTempView(table)
+    spark.sql(sql).write.format('delta').partitionBy('year', 'month', 'day').save(output)
+
+    incremental = IncrementalOutput(
+        spark, 'games', 'game_token', {'lib_server_game': 'SELECT game_token FROM {changes}'},
+        {'lib_server_lobby': 'game_token', 'lib_server_game': 'game_token'},
+        stage, ['lib_server_lobby', 'lib_server_game'], output
+    )
+    incremental.state_path = str(tmp_path / 'incremental_meta')
+    versions = incremental.current_versions()
+    incremental.commit(versions, versions)
+
+    _write('lib_server_game', [('g1', '2024-01-09 01:00:00', '2024', '01', '09'), ('g1', '2024-01-09 02:00:00', '2024', '01', '09'), ('g2', '2024-01-09 10:01:00', '2024', '01', '09')], replace_day='09')
+    assert incremental.run(sql) is None
+
+    rows = sorted((r.game_token, str(r.start_time), r.events, r.day) for r in spark.read.format('delta').load(output).collect())
+    assert rows == [('g1', '2024-01-07 23:00:00', 3, 7), ('g2', '2024-01-09 10:00:00', 1, 9)]
+    assert spark.read.format('delta').load(incremental.state_path).where('changes IS NOT NULL').first()['keys'] == 1
+    assert spark.conf.get('spark.databricks.delta.schema.autoMerge.enabled', None) is None
+
+@pytest.mark.common
+@pytest.mark.usefixtures('spark')
+def test_common_load_window_schema_auto_merge(spark, tmp_path):
+    """
+    Test case for verifying load_window merges new columns without leaving the session's schema auto merge enabled.
+
+    Parameters:
+    - tmp_path (pathlib.Path): The output directory.
+
+    Raises:
+    - AssertionError: If the new column isn't merged, or the session conf isn't restored.
+    """
+    import datetime
+    from spark_solutions.common.spark_misc import AUTO_MERGE_CONF, load_window
+
+    path = str(tmp_path / 'game_metrics')
+    d0, d1 = datetime.date(2024, 1, 2), datetime.date(2024, 1, 1)
+    spark.createDataFrame([('g1', 2024, 1, 3)], 'game_token STRING, year INT, month INT, day INT') \
+        .write.format('delta').partitionBy('year', 'month', 'day').save(path)
+
+    df = spark.createDataFrame([('g1', 10, 2024, 1, 3), ('g2', 20, 2024, 1, 2)], 'game_token STRING, damage INT, year INT, month INT, day INT')
+    load_window(spark, df, path, ['game_token'], d0, d1, merge_schema=True)
+
+    rows = {r.game_token: r.damage for r in spark.read.format('delta').load(path).collect()}
+    assert rows == {'g1': 10, 'g2': 20}
+    assert spark.conf.get(AUTO_MERGE_CONF, None) is None
+
+@pytest.mark.common
+@pytest.mark.usefixtures('spark')
+def test_common_load_stage_changes(spark, tmp_path):
+    """
+    Test case for verifying a stage reload only writes the rows it added or removed to the Change Data Feed.
+
+    Parameters:
+    - tmp_path (pathlib.Path): The stage directory.
+
+    Raises:
+    - AssertionError: If unchanged rows of the window are deleted and inserted again, or the table misses a change.
+    """
+    import datetime
+    from delta import DeltaTable
+    from spark_solutions.common.spark_stage import load_stage
+
+    spark.conf.set('spark.databricks.delta.properties.defaults.enableChangeDataFeed', 'true')
+    d = datetime.date(2024, 1, 1)
+    schema = 'etl_id STRING, msg_id STRING, year STRING, month STRING, day STRING'
+
+    path = str(tmp_path / 'changes_test')
+    for msg_ids in (['m1', 'm2'], ['m1', 'm3']):
+        spark.createDataFrame([('e1', m, '2024', '01', '01') for m in msg_ids], schema).createOrReplaceTempView('stage__changes_test')
+        if DeltaTable.isDeltaTable(spark, path):
+            version = DeltaTable.forPath(spark, path).history(1).first().version + 1
+        load_stage(spark, 'changes_test', [], str(tmp_path), d, d)
+
+    changes = spark.read.format('delta').option('readChangeFeed', 'true').option('startingVersion', version).load(path)
+    assert sorted((r._change_type, r.msg_id) for r in changes.collect()) == [('delete', 'm2'), ('insert', 'm3')]
+    assert sorted(r.msg_id for r in spark.read.format('delta').load(path).collect()) == ['m1', 'm3']
@@ -8,7 +8,7 @@ logger = logging.getLogger(f'py4j.{__name__}')
 CLOUD_PROVIDER=os.getenv('CLOUD_PROVIDER', 'LOCAL')
 
 @pytest.mark.output
-@pytest.mark.usefixtures('spark')
+@pytest.mark.usefixtures('spark', 'golden_stage')
 def test_output_message_flow(spark):
     """
     Test case for verifying the output message flow.
@@ -28,7 +28,7 @@ def test_output_message_flow(spark):
     assert df.count() > 0
 
 @pytest.mark.output
-@pytest.mark.usefixtures('spark')
+@pytest.mark.usefixtures('spark', 'golden_stage')
 def test_output_game_metrics(spark):
     """
     Test case for verifying the output game metrics.
@@ -46,3 +46,54 @@ def test_output_game_metrics(spark):
 
     df = spark.table('output__game_metrics')
     assert df.count() > 0
+
+@pytest.mark.output
+@pytest.mark.usefixtures('spark', 'golden_stage')
+def test_output_user_day_rollup(spark):
+    """
+    Test case for verifying the output user day rollup.
+
+    This test case extracts and transforms the user day rollup data using the `_extract` and `_transform` functions
+    from the `user_day_rollup` module. It then checks that the rollup holds a single row per user, superhero and day.
+
+    Raises:
+    - AssertionError: If the DataFrame is empty or a user, superhero and day appears more than once.
+    """
+    from spark_solutions.tasks.output import user_day_rollup
+
+    user_day_rollup._extract(spark)
+    user_day_rollup._transform(spark)
+
+    df = spark.table('output__user_day_rollup')
+    assert df.count() > 0
+    assert df.count() == df.select('year', 'month', 'day', 'user_id', 'superhero_id').distinct().count()
+
+@pytest.mark.output
+@pytest.mark.usefixtures('spark')
+def test_output_load_window_across_midnight(spark, tmp_path):
+    """
+    Test case for verifying an output load keeps the earlier day of a message logged before midnight.
+
+    The message is logged at 23:59 the day before the window and lands in the window; its row
+    is merged into the earlier day instead of replacing that day's partition.
+
+    Raises:
+    - AssertionError: If the earlier day loses rows, or the late row isn't merged.
+    """
+    import datetime
+    from spark_solutions.common.spark_misc import load_window
+    from spark_solutions.tasks.output.message_flow import OUTPUT_KEYS
+
+    path = str(tmp_path / 'message_flow')
+    d0, d1 = datetime.date(2024, 1, 3), datetime.date(2024, 1, 2)
+    schema = 'msg_id STRING, log_timestamp STRING, buffer_content_size INT, year INT, month INT, day INT'
+
+    spark.createDataFrame([('m1', '2024-01-01 12:00:00', 1, 2024, 1, 1), ('m2', '2024-01-01 23:59:00', None, 2024, 1, 1)], schema) \
+        .write.format('delta').partitionBy('year', 'month', 'day').save(path)
+
+    df = spark.createDataFrame([('m2', '2024-01-01 23:59:00', 2, 2024, 1, 1), ('m3', '2024-01-02 00:01:00', 3, 2024, 1, 2)], schema)
+    load_window(spark, df, path, OUTPUT_KEYS, d0, d1)
+    load_window(spark, df, path, OUTPUT_KEYS, d0, d1)
+
+    rows = sorted((r.msg_id, r.buffer_content_size, r.day) for r in spark.read.format('delta').load(path).collect())
+    assert rows == [('m1', 1, 1), ('m2', 2, 1), ('m3', 3, 2)]
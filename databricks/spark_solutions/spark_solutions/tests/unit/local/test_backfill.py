@@ -0,0 +1,33 @@
+import datetime
+import pytest
+
+@pytest.mark.local
+def test_date_range():
+    """
+    Test case for verifying the extract date range runs from the start date to the end date.
+
+    Raises:
+    - AssertionError: If yesterday isn't covered by the default window or the range isn't inclusive.
+    """
+    from spark_solutions.common.spark_misc import date_range
+
+    today = datetime.date.today()
+    assert date_range(today, today - datetime.timedelta(1)) == [today - datetime.timedelta(1), today]
+    assert date_range(datetime.date(2024, 3, 1), datetime.date(2024, 2, 28)) == [
+        datetime.date(2024, 2, 28), datetime.date(2024, 2, 29), datetime.date(2024, 3, 1)
+    ]
+
+@pytest.mark.local
+def test_backfill_plan_chunks():
+    """
+    Test case for verifying backfill chunks are bounded and split on completed days.
+
+    Raises:
+    - AssertionError: If a chunk exceeds the chunk size or spans a gap.
+    """
+    from spark_solutions.tasks.backfill import plan_chunks
+
+    d = lambda day: datetime.date(2024, 1, day)
+    assert plan_chunks([d(x) for x in range(1, 11)], 4) == [(d(1), d(4)), (d(5), d(8)), (d(9), d(10))]
+    assert plan_chunks([d(x) for x in range(1, 11) if x not in (3, 4)], 7) == [(d(1), d(2)), (d(5), d(10))]
+    assert plan_chunks([], 7) == []
@@ -0,0 +1,28 @@
+import pytest
+
+@pytest.mark.local
+def test_bloom_index_candidate_files():
+    """
+    Test case for verifying Bloom filters never miss a value and prune most files of an absent value.
+
+    Raises:
+    - AssertionError: If a file holding a value isn't a candidate, or the false positive rate exceeds twice the target.
+    """
+    from spark_solutions.readers.bloom_index import BloomFilter, candidate_paths
+
+    files = {f'year=2024/month=01/day=01/part-{i:05d}.parquet': [f'msg-{i}-{j}' for j in range(1000)] for i in range(50)}
+    index = []
+    for path, values in files.items():
+        bloom = BloomFilter.for_capacity(len(values), 0.01)
+        for v in values:
+            bloom.add(v)
+        index.append({'path': path, 'num_bits': bloom.num_bits, 'num_hashes': bloom.num_hashes, 'bits': bytes(bloom.bits)})
+
+    for path, values in files.items():
+        assert path in candidate_paths(index, files, values[:1])
+
+    unindexed = 'year=2024/month=01/day=01/part-99999.parquet'
+    assert unindexed in candidate_paths(index, list(files) + [unindexed], ['absent'])
+
+    false_positives = sum(len(candidate_paths(index, files, [f'absent-{k}'])) for k in range(200))
+    assert false_positives / (200 * len(files)) <= 0.02
@@ -0,0 +1,100 @@
+import datetime
+import json
+import pytest
+
+def _write_table(path, days):
+    """
+    Writes a minimal partitioned Delta table, one file per day and one commit per file.
+
+    Parameters:
+    - path (Path): The table path.
+    - days (list): The (date, user tokens) of each file.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = {'type': 'struct', 'fields': [
+        {'name': 'user_token', 'type': 'string', 'nullable': True, 'metadata': {}},
+        {'name': 'turns', 'type': 'long', 'nullable': True, 'metadata': {}},
+        {'name': 'year', 'type': 'integer', 'nullable': True, 'metadata': {}},
+        {'name': 'month', 'type': 'integer', 'nullable': True, 'metadata': {}},
+        {'name': 'day', 'type': 'integer', 'nullable': True, 'metadata': {}}
+    ]}
+
+    log = path / '_delta_log'
+    log.mkdir(parents=True)
+    (log / f'{0:020d}.json').write_text(json.dumps({'metaData': {
+        'id': 'test', 'format': {'provider': 'parquet', 'options': {}},
+        'schemaString': json.dumps(schema), 'partitionColumns': ['year', 'month', 'day'], 'configuration': {}
+    }}) + '\n')
+
+    for version, (d, tokens) in enumerate(days, start=1):
+        rel = f'year={d.year}/month={d.month}/day={d.day}/part-{version}.parquet'
+        (path / rel).parent.mkdir(parents=True, exist_ok=True)
+        pq.write_table(pa.table({'user_token': tokens, 'turns': list(range(len(tokens)))}), path / rel)
+
+        stats = {'numRecords': len(tokens), 'minValues': {'user_token': min(tokens)}, 'maxValues': {'user_token': max(tokens)}}
+        add = {'path': rel, 'partitionValues': {'year': str(d.year), 'month': str(d.month), 'day': str(d.day)},
+               'size': 1, 'modificationTime': 0, 'dataChange': True, 'stats': json.dumps(stats)}
+        (log / f'{version:020d}.json').write_text(json.dumps({'add': add}) + '\n')
+
+@pytest.mark.local
+def test_delta_reader_pruning(tmp_path):
+    """
+    Test case for verifying the Delta reader prunes files on partitions & statistics and caches by version.
+
+    Raises:
+    - AssertionError: If pruned files are read, rows are missing or a new version is served from the cache.
+    """
+    from spark_solutions.readers.delta_reader import DeltaReader
+
+    d1, d0 = datetime.date(2024, 1, 1), datetime.date(2024, 1, 2)
+    _write_table(tmp_path, [(d1, ['a', 'b']), (d0, ['c', 'd'])])
+
+    reader = DeltaReader(str(tmp_path), refresh_seconds=0)
+    assert len(reader.files(d0, d0)) == 1
+    assert len(reader.files(filters=[('user_token', '=', 'c')])) == 1
+
+    table = reader.read(d0, d1, filters=[('user_token', 'in', ['a', 'd'])], columns=['user_token', 'day'])
+    assert sorted(table.column('user_token').to_pylist()) == ['a', 'd']
+    assert sorted(table.column('day').to_pylist()) == [1, 2]
+    assert reader.read(d0, d1, filters=[('user_token', 'in', ['a', 'd'])], columns=['user_token', 'day']) is table
+
+    (tmp_path / '_delta_log' / f'{3:020d}.json').write_text(json.dumps({'remove': {'path': 'year=2024/month=1/day=1/part-1.parquet', 'dataChange': True}}) + '\n')
+    assert reader.read(d0, d1, columns=['user_token']).column('user_token').to_pylist() == ['c', 'd']
+
+@pytest.mark.local
+def test_delta_reader_protocol(tmp_path):
+    """
+    Test case for verifying the Delta reader refuses tables requiring reader features it doesn't implement.
+
+    Raises:
+    - AssertionError: If a table with deletion vectors or column mapping is read, or a checkpointed plain table isn't.
+    """
+    from spark_solutions.readers.delta_reader import DeltaReader, UnsupportedTableError
+
+    d = datetime.date(2024, 1, 1)
+    _write_table(tmp_path / 'dv', [(d, ['a', 'b'])])
+    (tmp_path / 'dv' / '_delta_log' / f'{2:020d}.json').write_text(json.dumps({'protocol': {
+        'minReaderVersion': 3, 'minWriterVersion': 7, 'readerFeatures': ['deletionVectors'], 'writerFeatures': ['deletionVectors']
+    }}) + '\n')
+    with pytest.raises(UnsupportedTableError):
+        DeltaReader(str(tmp_path / 'dv'), refresh_seconds=0).read(d, d)
+
+    _write_table(tmp_path / 'cm', [(d, ['a', 'b'])])
+    (tmp_path / 'cm' / '_delta_log' / f'{2:020d}.json').write_text(json.dumps({'protocol': {'minReaderVersion': 2, 'minWriterVersion': 5}}) + '\n')
+    assert DeltaReader(str(tmp_path / 'cm'), refresh_seconds=0).read(d, d).num_rows == 2
+    meta = json.loads((tmp_path / 'cm' / '_delta_log' / f'{0:020d}.json').read_text())
+    meta['metaData']['configuration'] = {'delta.columnMapping.mode': 'name'}
+    (tmp_path / 'cm' / '_delta_log' / f'{3:020d}.json').write_text(json.dumps(meta) + '\n')
+    with pytest.raises(UnsupportedTableError):
+        DeltaReader(str(tmp_path / 'cm'), refresh_seconds=0).snapshot()
+
+    deltalake = pytest.importorskip('deltalake')
+    import pyarrow as pa
+
+    path = str(tmp_path / 'checkpointed')
+    deltalake.write_deltalake(path, pa.table({'user_token': ['a'], 'year': [2024], 'month': [1], 'day': [1]}), partition_by=['year', 'month', 'day'])
+    deltalake.DeltaTable(path).create_checkpoint()
+    snapshot = DeltaReader(path, refresh_seconds=0).snapshot()
+    assert snapshot.protocol['minReaderVersion'] == 1 and len(snapshot.files) == 1
@@ -0,0 +1,72 @@
+import datetime
+import pytest
+
+@pytest.mark.local
+def test_etl_manifest_candidate_files():
+    """
+    Test case for verifying late reads open the files of late batches and the files without a manifest row.
+
+    Raises:
+    - AssertionError: If a late or unindexed file is skipped, or an indexed file of other batches is read.
+    """
+    from spark_solutions.readers.etl_manifest import candidate_files, late_files
+
+    rows = [
+        {'path': 'year=2024/month=01/day=02/a.parquet', 'year': '2024', 'month': '01', 'day': '02'},
+        {'path': 'year=2024/month=01/day=05/b%20c.parquet', 'year': '2024', 'month': '01', 'day': '05'}
+    ]
+    late = late_files(rows, {('2024', '01', '01'), ('2024', '01', '02')})
+    assert late == {'year=2024/month=01/day=05/b c.parquet': ('2024', '01', '05')}
+
+    paths = ['year=2024/month=01/day=05/b c.parquet', 'year=2024/month=01/day=05/d.parquet', 'year=2024/month=01/day=05/compacted.parquet']
+    indexed = ['year=2024/month=01/day=05/b%20c.parquet', 'year=2024/month=01/day=05/d.parquet']
+    assert candidate_files(paths, late, indexed) == ['year=2024/month=01/day=05/b c.parquet', 'year=2024/month=01/day=05/compacted.parquet']
+
+@pytest.mark.local
+def test_etl_manifest_late_rows(tmp_path):
+    """
+    Test case for verifying output runs read the rows of their ETL runs landed within ETL_MANIFEST_LATE_DAYS of the window.
+
+    Raises:
+    - AssertionError: If a late row of a window batch is missed, or a row of another batch or beyond the late days is read.
+    """
+    pytest.importorskip('duckdb')
+    pytest.importorskip('sqlglot')
+    pytest.importorskip('deltalake')
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from spark_solutions.common.local_backend import LocalBackend
+    from spark_solutions.common.spark_manifest import late_dates
+    from spark_solutions.readers.delta_reader import DeltaReader
+
+    assert late_dates(datetime.date(2024, 1, 2), datetime.date(2024, 1, 1), 1) == [datetime.date(2023, 12, 31), datetime.date(2024, 1, 3)]
+
+    raw = {
+        ('etl_meta', 2): {'etl_id': ['e1']},
+        ('log_meta', 2): {'etl_id': ['e1'], 'msg_id': ['m1']},
+        ('log_meta', 5): {'etl_id': ['e1', 'e9'], 'msg_id': ['m2', 'm3']},
+        ('log_meta', 20): {'etl_id': ['e1'], 'msg_id': ['m4']}
+    }
+    for (table, day), columns in raw.items():
+        path = tmp_path / 'standard' / table / '2024' / '01' / f'{day:02d}'
+        path.mkdir(parents=True)
+        pq.write_table(pa.table(columns), path / 'part-0.parquet')
+
+    for (table, day), columns in raw.items():
+        sql = f"""
+            WITH unnamed_partitions AS (
+                SELECT date_array[0] year, date_array[1] month, date_array[2] day, *
+                FROM (SELECT SLICE(SPLIT(INPUT_FILE_NAME(), '/'), -4, 3) date_array, * FROM {table}) tbl
+            )
+            SELECT {', '.join(columns)}, MIN(year) year, MIN(month) month, MIN(day) day
+            FROM unnamed_partitions
+            GROUP BY {', '.join(columns)}
+        """
+        d = datetime.date(2024, 1, day)
+        LocalBackend().run_stage(table, sql, [], str(tmp_path / 'standard' / table), str(tmp_path / 'stage'), d, d)
+
+    LocalBackend().run_output('flow', 'SELECT msg_id, 2024 AS year, 1 AS month, 2 AS day FROM log_meta', str(tmp_path / 'stage'),
+                              ['etl_meta', 'log_meta'], str(tmp_path / 'output' / 'flow'), ['msg_id'], datetime.date(2024, 1, 2), datetime.date(2024, 1, 1))
+
+    rows = DeltaReader(str(tmp_path / 'output' / 'flow')).read().column('msg_id').to_pylist()
+    assert sorted(rows) == ['m1', 'm2']
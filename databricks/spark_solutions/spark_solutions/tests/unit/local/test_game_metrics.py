@@ -0,0 +1,52 @@
+import pytest
+
+@pytest.mark.local
+def test_game_metrics_time_alive():
+    """
+    Test case for verifying game metrics time users alive until their first event at 0 health.
+
+    Raises:
+    - AssertionError: If a user's death time, time of use, turns, damage or outcome is off.
+    """
+    duckdb = pytest.importorskip('duckdb')
+    pytest.importorskip('sqlglot')
+    from spark_solutions.common.local_backend import translate
+    from spark_solutions.readers.token_dictionary import token_id
+    from spark_solutions.tasks.output.game_metrics import TRANSFORM_SQL
+
+    # user-4's lobby row predates the ids, which are derived from its tokens
+    g, u1, u2, u3, u4 = (token_id(t) for t in ('game-1', 'user-1', 'user-2', 'user-3', 'user-4'))
+    con = duckdb.connect()
+    con.execute(f"""
+        CREATE TABLE lib_server_lobby AS
+        SELECT * FROM (VALUES
+            (TIMESTAMP '2024-01-02 09:00:00', 'game-1', {g}, 'user-1', {u1}, 1),
+            (TIMESTAMP '2024-01-02 09:00:05', 'game-1', {g}, 'user-2', {u2}, 2),
+            (TIMESTAMP '2024-01-02 09:00:10', 'game-1', {g}, 'user-3', {u3}, 3),
+            (TIMESTAMP '2024-01-02 09:00:20', 'game-1', NULL, 'user-4', NULL, 1)
+        ) t(timestamp, game_token, game_id, user_token, user_id, superhero_id)
+    """)
+    con.execute(f"""
+        CREATE TABLE lib_server_game AS
+        SELECT * FROM (VALUES
+            (TIMESTAMP '2024-01-02 09:01:00', 'game-1', {g}, 'user-1', {u1}, 'user-2', {u2}, 30, 0),
+            (TIMESTAMP '2024-01-02 09:01:30', 'game-1', NULL, 'user-3', NULL, 'user-1', NULL, 10, 20),
+            (TIMESTAMP '2024-01-02 09:02:00', 'game-1', {g}, 'user-1', {u1}, 'user-3', {u3}, 10, 20),
+            (TIMESTAMP '2024-01-02 09:03:00', 'game-1', {g}, 'user-3', {u3}, 'user-1', {u1}, 20, 0)
+        ) t(timestamp, game_token, game_id, user_token, user_id, enemy_token, enemy_id, enemy_damage, enemy_health_post)
+    """)
+
+    rs = con.sql(translate(TRANSFORM_SQL))
+    tokens = {u1: 'user-1', u2: 'user-2', u3: 'user-3', u4: 'user-4'}
+    rows = {tokens[r['user_id']]: r for r in (dict(zip(rs.columns, r)) for r in rs.fetchall())}
+
+    assert str(rows['user-2']['death_time']) == '2024-01-02 09:01:00'
+    assert rows['user-2']['time_of_use_seconds'] == 60
+    assert str(rows['user-1']['death_time']) == '2024-01-02 09:03:00'
+    assert rows['user-1']['time_of_use_seconds'] == 180
+    assert rows['user-1']['turns'] == 2 and rows['user-1']['damage_dealt'] == 40 and rows['user-1']['damage_received'] == 30
+    assert rows['user-3']['death_time'] is None
+    assert rows['user-3']['time_of_use_seconds'] == 180 and rows['user-3']['win'] == 1 and rows['user-3']['loss'] == 0
+    assert rows['user-4']['time_of_use_seconds'] == 180 and rows['user-4']['turns'] == 0 and rows['user-4']['win'] == 0
+    assert rows['user-4']['game_id'] == g
+    assert 'user_token' not in rs.columns and 'game_token' not in rs.columns
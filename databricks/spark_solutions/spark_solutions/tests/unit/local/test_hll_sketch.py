@@ -0,0 +1,44 @@
+import random
+import pytest
+
+@pytest.mark.local
+def test_hll_sketch_merge_accuracy():
+    """
+    Test case for verifying distinct counts of merged reach sketches stay within their error bound.
+
+    Raises:
+    - AssertionError: If a merged distinct count differs from the exact count by more than 3 standard errors.
+    """
+    from spark_solutions.readers.hll_sketch import HLL_PRECISION, distinct_counts, register
+
+    rng = random.Random(7)
+    tokens = [f'user-{rng.randint(0, 50000)}' for _ in range(100000)]
+
+    sketches = []
+    for day in range(30):
+        registers = {}
+        for token in tokens[day::30]:
+            k, rho = register(token)
+            registers[k] = max(registers.get(k, 0), rho)
+        sketches.append({'day': day, 'precision': HLL_PRECISION, 'registers': list(registers.items())})
+
+    [row] = distinct_counts(sketches)
+    exact = len(set(tokens))
+    assert abs(row['distinct_count'] - exact) <= 3 * row['error_bound'] * exact
+
+    [first] = distinct_counts(sketches[:1])
+    assert abs(first['distinct_count'] - len(set(tokens[::30]))) <= 3 * first['error_bound'] * len(set(tokens[::30]))
+
+@pytest.mark.local
+def test_hll_sketch_conv_translation():
+    """
+    Test case for verifying the hexadecimal CONV of the sketch SQL is translated for DuckDB.
+
+    Raises:
+    - AssertionError: If the translated query doesn't cast the hexadecimal literal.
+    """
+    from spark_solutions.common.local_backend import translate
+
+    sql = translate("SELECT CONV(SUBSTR(MD5(t), 1, 3), 16, 10) FROM x")
+    assert 'CONV' not in sql.upper()
+    assert "'0x' ||" in sql
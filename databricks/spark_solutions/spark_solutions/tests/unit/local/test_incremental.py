@@ -0,0 +1,44 @@
+import datetime
+import pytest
+
+@pytest.mark.local
+def test_incremental_affected_dates():
+    """
+    Test case for verifying the days of changed stage partitions are widened by the margin.
+
+    Raises:
+    - AssertionError: If a neighbouring day is missing or null partitions aren't ignored.
+    """
+    from spark_solutions.common.spark_incremental import affected_dates
+
+    dates = affected_dates({('2024', '01', '01'), ('2024', '01', '02'), (None, None, None)})
+    assert dates == [datetime.date(2023, 12, 31) + datetime.timedelta(x) for x in range(4)]
+    assert affected_dates([(2024, 3, 1)], margin_days=0) == [datetime.date(2024, 3, 1)]
+
+@pytest.mark.local
+def test_incremental_merge_predicate():
+    """
+    Test case for verifying partition predicates can be qualified for MERGE conditions.
+
+    Raises:
+    - AssertionError: If the partition columns aren't qualified by the alias.
+    """
+    from spark_solutions.common.spark_misc import date_partition_filter
+
+    predicate = date_partition_filter([datetime.date(2024, 1, 2)], alias='t')
+    assert predicate == '(CAST(t.year AS INT) = 2024 AND CAST(t.month AS INT) = 1 AND CAST(t.day AS INT) = 2)'
+
+@pytest.mark.local
+def test_incremental_date_windows():
+    """
+    Test case for verifying the days of changes are rerun as contiguous windows.
+
+    Raises:
+    - AssertionError: If a day is left out of the windows, or contiguous days are split.
+    """
+    from spark_solutions.common.spark_incremental import date_windows
+
+    d = datetime.date(2024, 1, 30)
+    windows = date_windows([d, d + datetime.timedelta(2), d + datetime.timedelta(1), d + datetime.timedelta(9)])
+    assert windows == [(datetime.date(2024, 2, 1), d), (datetime.date(2024, 2, 8), datetime.date(2024, 2, 8))]
+    assert date_windows([]) == []
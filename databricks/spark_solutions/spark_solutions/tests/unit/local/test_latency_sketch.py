@@ -0,0 +1,35 @@
+import random
+import pytest
+
+@pytest.mark.local
+def test_latency_sketch_merge_accuracy():
+    """
+    Test case for verifying quantiles of merged latency sketches stay within the relative accuracy.
+
+    Raises:
+    - AssertionError: If a merged quantile differs from the exact quantile by more than alpha.
+    """
+    from collections import Counter
+    from spark_solutions.readers.latency_sketch import bucket, summarize
+
+    alpha = 0.01
+    rng = random.Random(7)
+    values = [rng.lognormvariate(3, 1) for _ in range(20000)] + [0.0] * 10
+
+    sketches = []
+    for minute in range(20):
+        chunk = values[minute::20]
+        buckets = Counter(bucket(v, alpha) for v in chunk if v > 0)
+        sketches.append({
+            'hop': 'log_buffer', 'alpha': alpha, 'count': len(chunk),
+            'zero_count': sum(1 for v in chunk if v <= 0),
+            'min_ms': min(chunk), 'max_ms': max(chunk), 'sum_ms': sum(chunk),
+            'buckets': list(buckets.items())
+        })
+
+    [row] = summarize(sketches)
+    exact = sorted(values)
+    assert row['count'] == len(values)
+    for q, name in ((0.5, 'p50'), (0.99, 'p99'), (0.999, 'p999')):
+        expected = exact[int(q * (len(exact) - 1))]
+        assert abs(row[name] - expected) <= alpha * expected
@@ -0,0 +1,126 @@
+import datetime
+import pytest
+
+@pytest.mark.local
+def test_local_backend_translate():
+    """
+    Test case for verifying Spark SQL functions without a DuckDB equivalent are rewritten.
+
+    Raises:
+    - AssertionError: If INPUT_FILE_NAME() or UNIX_TIMESTAMP() are left in the translated SQL.
+    """
+    pytest.importorskip('duckdb')
+    pytest.importorskip('sqlglot')
+    from spark_solutions.common.local_backend import translate, INPUT_FILE_COLUMN
+
+    sql = translate("SELECT SLICE(SPLIT(INPUT_FILE_NAME(), '/'), -4, 3) d, UNIX_TIMESTAMP(t) s FROM tbl")
+    assert INPUT_FILE_COLUMN in sql
+    assert 'INPUT_FILE_NAME()' not in sql.upper()
+    assert 'CAST(EPOCH(CAST(t AS TIMESTAMP)) AS BIGINT)' in sql
+
+@pytest.mark.local
+def test_local_backend_stage(tmp_path):
+    """
+    Test case for verifying a stage table runs locally with its partitions and quarantine.
+
+    Raises:
+    - AssertionError: If partitions aren't derived from file paths, duplicates aren't collapsed, failing rows are kept, or a failed run writes.
+    """
+    pytest.importorskip('duckdb')
+    pytest.importorskip('sqlglot')
+    deltalake = pytest.importorskip('deltalake')
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from spark_solutions.common.local_backend import LocalBackend
+    from spark_solutions.common.spark_quality import DataQualityError, not_null
+
+    day = tmp_path / 'standard' / 'meta' / '2024' / '01' / '02'
+    day.mkdir(parents=True)
+    pq.write_table(pa.table({'id': ['a', 'a', None]}), day / 'part-0.parquet')
+
+    sql = """
+        WITH unnamed_partitions AS (
+            SELECT date_array[0] year, date_array[1] month, date_array[2] day, *
+            FROM (SELECT SLICE(SPLIT(INPUT_FILE_NAME(), '/'), -4, 3) date_array, * FROM meta) tbl
+        )
+        SELECT id, COUNT(*) distinct_count, MIN(year) year, MIN(month) month, MIN(day) day
+        FROM unnamed_partitions
+        GROUP BY id
+    """
+    d = datetime.date(2024, 1, 2)
+    LocalBackend().run_stage('meta', sql, [not_null('id')], str(tmp_path / 'standard' / 'meta'), str(tmp_path / 'stage'), d, d, dq_enabled=True)
+
+    rows = deltalake.DeltaTable(str(tmp_path / 'stage' / 'meta')).to_pyarrow_table().to_pylist()
+    assert rows == [{'id': 'a', 'distinct_count': 2, 'year': '2024', 'month': '01', 'day': '02'}]
+
+    quarantined = deltalake.DeltaTable(str(tmp_path / 'stage' / 'quarantine' / 'meta')).to_pyarrow_table().to_pylist()
+    assert [r['_dq_failures'] for r in quarantined] == [['not_null__id']]
+
+    # A failing expectation raises before the window is replaced
+    pq.write_table(pa.table({'id': ['b', None]}), day / 'part-1.parquet')
+    with pytest.raises(DataQualityError):
+        LocalBackend().run_stage('meta', sql, [not_null('id', action='fail')], str(tmp_path / 'standard' / 'meta'), str(tmp_path / 'stage'), d, d, dq_enabled=True, raw_ledger=False)
+    assert deltalake.DeltaTable(str(tmp_path / 'stage' / 'meta')).to_pyarrow_table().to_pylist() == rows
+
+@pytest.mark.local
+def test_local_backend_output_window(tmp_path):
+    """
+    Test case for verifying an output run keeps the rows of days outside its window.
+
+    A message logged before midnight and landed the next day falls on a day outside the
+    window; it is merged into that day rather than replacing it.
+
+    Raises:
+    - AssertionError: If the earlier day loses rows, or the late row isn't merged.
+    """
+    pytest.importorskip('duckdb')
+    pytest.importorskip('sqlglot')
+    deltalake = pytest.importorskip('deltalake')
+    import pyarrow as pa
+    from spark_solutions.common.local_backend import LocalBackend
+
+    path = str(tmp_path / 'output' / 'flow')
+    backend = LocalBackend()
+    backend.load(pa.table({'msg_id': ['m1', 'm2'], 'size': [1, 2], 'year': [2024, 2024], 'month': [1, 1], 'day': [1, 1]}), path)
+
+    result = pa.table({'msg_id': ['m2', 'm3'], 'size': [20, 3], 'year': [2024, 2024], 'month': [1, 1], 'day': [1, 2]})
+    backend._load_window(result, path, ['msg_id'], datetime.date(2024, 1, 3), datetime.date(2024, 1, 2))
+
+    rows = sorted((r['msg_id'], r['size'], r['day']) for r in deltalake.DeltaTable(path).to_pyarrow_table().to_pylist())
+    assert rows == [('m1', 1, 1), ('m2', 20, 1), ('m3', 3, 2)]
+
+@pytest.mark.local
+def test_local_backend_opt_in(tmp_path):
+    """
+    Test case for verifying small windows only run locally when the local backend is opted in.
+
+    Raises:
+    - AssertionError: If the default backend isn't Spark, or 'auto' doesn't pick the local backend for a small window.
+    """
+    pytest.importorskip('duckdb')
+    pytest.importorskip('sqlglot')
+    pytest.importorskip('deltalake')
+    from spark_solutions.common.local_backend import select_backend
+
+    assert select_backend(raw_paths=[str(tmp_path)]) == 'spark'
+    assert select_backend(raw_paths=[str(tmp_path)], backend='auto') == 'local'
+    assert select_backend(raw_paths=[str(tmp_path)], backend='auto', max_bytes=-1) == 'spark'
+
+@pytest.mark.local
+def test_local_backend_without_pyarrow():
+    """
+    Test case for verifying the Spark tasks import the local backend without pyarrow installed.
+
+    Raises:
+    - AssertionError: If the import fails without pyarrow, or the backend reports itself available.
+    """
+    import subprocess
+    import sys
+
+    code = '\n'.join([
+        'import sys',
+        "sys.modules['pyarrow'] = None",
+        'from spark_solutions.common.local_backend import available, select_backend',
+        "assert not available() and select_backend(backend='auto') == 'spark'",
+    ])
+    assert subprocess.run([sys.executable, '-c', code]).returncode == 0
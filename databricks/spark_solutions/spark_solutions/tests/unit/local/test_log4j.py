@@ -0,0 +1,46 @@
+from types import SimpleNamespace
+
+import logging
+import pytest
+
+def _session(sent):
+    """Fake SparkSession whose log4j loggers log py4j DEBUG records on every call, as the gateway does."""
+    def _logger(name):
+        def _log(level):
+            def _call(msg):
+                logging.getLogger('py4j.clientserver').debug(f'Command to send: {msg}')
+                logging.getLogger('py4j.spark_solutions.forwarder').debug(f'Forwarded {msg}')
+                sent.append((level, msg))
+            return _call
+        return SimpleNamespace(**{level: _log(level) for level in ('fatal', 'error', 'warn', 'info', 'debug')})
+
+    jvm = SimpleNamespace(org=SimpleNamespace(apache=SimpleNamespace(log4j=SimpleNamespace(Logger=SimpleNamespace(getLogger=_logger)))))
+    return SimpleNamespace(_jvm=jvm, sparkContext=SimpleNamespace(appName='test'))
+
+@pytest.mark.local
+def test_log4j_skips_forwarder_records():
+    """
+    Test case for verifying the log4j handler skips py4j gateway records and records of its forwarding thread.
+
+    Raises:
+    - AssertionError: If a record logged while forwarding is queued again.
+    """
+    pytest.importorskip('pyspark')
+    from spark_solutions.loggers.log4j import Log4JProxyHandler
+
+    sent = []
+    handler = Log4JProxyHandler(_session(sent))
+    logger = logging.getLogger('py4j')
+    level = logger.level
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(handler)
+    try:
+        logging.getLogger('py4j.spark_solutions.test').info('hello')
+        logging.getLogger('py4j.java_gateway').debug('Answer received')
+        handler.flush()
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+        handler.close()
+
+    assert sent == [('info', 'hello')]
@@ -0,0 +1,37 @@
+import pytest
+
+@pytest.mark.local
+def test_maintenance_tables(tmp_path):
+    """
+    Test case for verifying maintained tables are merged over the defaults and resolved to their directory.
+
+    Raises:
+    - AssertionError: If table options don't override the defaults or paths aren't resolved per layer.
+    """
+    from spark_solutions.tasks import maintenance
+
+    conf = tmp_path / 'maintenance.yml'
+    conf.write_text('defaults:\n  recent_days: 3\nstage:\n  buffer_meta:\n  run_meta:\n    skip_days: 0\noutput:\n  game_metrics:\n')
+
+    tables = maintenance.load_tables(str(conf), {'stage': 'standard', 'output': 'output'})
+    assert sorted(tables) == ['output/game_metrics', 'stage/buffer_meta', 'stage/run_meta']
+    assert tables['stage/buffer_meta']['recent_days'] == 3
+    assert tables['stage/buffer_meta']['skip_days'] == maintenance.DEFAULTS['skip_days']
+    assert tables['stage/run_meta']['skip_days'] == 0
+    assert tables['output/game_metrics']['path'].endswith('output/game_metrics')
+
+@pytest.mark.local
+def test_maintenance_packaged_conf(tmp_path):
+    """
+    Test case for verifying the maintenance configuration ships with the package.
+
+    Raises:
+    - AssertionError: If the packaged configuration isn't loaded, or a missing one isn't reported.
+    """
+    from spark_solutions.tasks import maintenance
+
+    tables = maintenance.load_tables(blob_prefixes={'stage': 'standard', 'output': 'output'})
+    assert 'stage/raw_ledger' in tables and 'output/game_metrics' in tables
+
+    with pytest.raises(FileNotFoundError, match='MAINTENANCE_CONF'):
+        maintenance.load_tables(str(tmp_path / 'missing.yml'))
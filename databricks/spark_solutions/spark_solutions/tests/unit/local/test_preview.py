@@ -0,0 +1,54 @@
+import pytest
+
+@pytest.mark.local
+def test_preview_sample_predicate():
+    """
+    Test case for verifying preview samples keep a consistent fraction of the keys.
+
+    Raises:
+    - AssertionError: If the sampled fraction is off or a key sampled at a lower rate is dropped at a higher one.
+    """
+    duckdb = pytest.importorskip('duckdb')
+    pytest.importorskip('sqlglot')
+    from spark_solutions.common.local_backend import translate
+    from spark_solutions.common.spark_preview import sample_predicate
+
+    con = duckdb.connect()
+    con.execute("CREATE TABLE t AS SELECT 'game-' || i game_token FROM range(20000) r(i)")
+    sampled = {rate: {r[0] for r in con.sql(f'SELECT game_token FROM t WHERE {translate(sample_predicate("game_token", rate))}').fetchall()}
+               for rate in (0.05, 0.2)}
+
+    assert abs(len(sampled[0.05]) / 20000 - 0.05) < 0.01
+    assert abs(len(sampled[0.2]) / 20000 - 0.2) < 0.02
+    assert sampled[0.05] <= sampled[0.2]
+
+@pytest.mark.local
+def test_preview_estimates():
+    """
+    Test case for verifying preview estimates scale sampled totals within their error bounds.
+
+    Raises:
+    - AssertionError: If an exact run has a bound or a sampled estimate misses the exact total by more than its bound.
+    """
+    duckdb = pytest.importorskip('duckdb')
+    pytest.importorskip('sqlglot')
+    from spark_solutions.common.local_backend import translate
+    from spark_solutions.common.spark_preview import estimate_sql, sample_predicate
+
+    con = duckdb.connect()
+    con.execute("""
+        CREATE TABLE rows AS
+        SELECT 2024 AS year, 1 AS month, 2 AS day, 'game-' || (i // 2) game_token, (i * 7) % 13 turns
+        FROM range(40000) r(i)
+    """)
+    turns, count = con.sql('SELECT SUM(turns), COUNT(*) FROM rows').fetchone()
+    exact = {'turns': turns, 'rows': count}
+
+    full = {r[1]: r for r in con.sql(translate(estimate_sql('rows', 'game_metrics', 'game_token', ['turns'], 1.0))).fetchall()}
+    assert full['turns'][2] == exact['turns'] and full['turns'][3] == 0
+    assert full['rows'][2] == exact['rows'] and full['rows'][4] == 20000
+
+    con.execute(f'CREATE VIEW sampled AS SELECT * FROM rows WHERE {translate(sample_predicate("game_token", 0.1))}')
+    for _, metric, estimate, error_bound, *_ in con.sql(translate(estimate_sql('sampled', 'game_metrics', 'game_token', ['turns'], 0.1))).fetchall():
+        assert 0 < error_bound < 0.1 * exact[metric]
+        assert abs(estimate - exact[metric]) <= error_bound
@@ -0,0 +1,85 @@
+import datetime
+import pytest
+
+def _write(path, rows):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    pq.write_table(pa.table({'msg_id': [f'm{i}' for i in range(rows)]}), path)
+
+@pytest.mark.local
+def test_raw_ledger_pending(tmp_path):
+    """
+    Test case for verifying the RAW ledger narrows runs to the days with files not processed yet.
+
+    Raises:
+    - AssertionError: If a landed file isn't recorded with its rows, a processed day is read again, or a new or removed file is missed.
+    """
+    pytest.importorskip('deltalake')
+    from spark_solutions.common.local_backend import LocalBackend
+    from spark_solutions.common.raw_ledger import RAW_LEDGER_TABLE, RawLedger
+
+    raw = tmp_path / 'raw' / 'log_meta'
+    _write(raw / '2024' / '01' / '01' / 'a.parquet', 3)
+    _write(raw / '2024' / '01' / '02' / 'b.parquet', 2)
+    _write(raw / '2024' / '01' / '02' / '_SUCCESS.parquet', 1)
+
+    backend = LocalBackend()
+    ledger = RawLedger('log_meta', str(raw), str(tmp_path / 'stage'),
+                       lambda t: backend.load(t, str(tmp_path / 'stage' / RAW_LEDGER_TABLE), mode='append'))
+    d0, d1 = datetime.date(2024, 1, 3), datetime.date(2024, 1, 1)
+
+    files = ledger.files(d0, d1)
+    assert {f['path'].rsplit('/', 1)[-1]: f['num_rows'] for f in files} == {'a.parquet': 3, 'b.parquet': 2}
+
+    end, start, files = ledger.pending(d0, d1)
+    assert (end, start) == (datetime.date(2024, 1, 2), d1) and len(files) == 2
+    ledger.mark_processed(files, 'run-1')
+    assert ledger.pending(d0, d1) is None
+
+    _write(raw / '2024' / '01' / '02' / 'c.parquet', 4)
+    assert ledger.pending(d0, d1) is None, 'sealed days are not listed again'
+
+    ledger.open_days = (datetime.date.today() - d1).days + 1
+    end, start, files = ledger.pending(d0, d1)
+    assert (end, start) == (datetime.date(2024, 1, 2),) * 2
+    assert sorted(f['path'].rsplit('/', 1)[-1] for f in files) == ['b.parquet', 'c.parquet']
+    assert ledger.sizes(files) == {f['path']: f['size'] for f in files}
+
+    (raw / '2024' / '01' / '02' / 'b.parquet').unlink()
+    assert [f['path'].rsplit('/', 1)[-1] for f in ledger.pending(d0, d1)[2]] == ['c.parquet']
+
+@pytest.mark.local
+def test_raw_ledger_run_stage(tmp_path):
+    """
+    Test case for verifying local stage runs skip windows without new RAW files.
+
+    Raises:
+    - AssertionError: If a rerun without new files replaces the stage rows or records more processed files.
+    """
+    pytest.importorskip('duckdb')
+    pytest.importorskip('sqlglot')
+    pytest.importorskip('deltalake')
+    from spark_solutions.common.local_backend import LocalBackend
+    from spark_solutions.common.raw_ledger import RAW_LEDGER_TABLE
+    from spark_solutions.readers.delta_reader import DeltaReader
+    from deltalake import DeltaTable
+
+    raw = tmp_path / 'standard' / 'log_meta'
+    _write(raw / '2024' / '01' / '02' / 'a.parquet', 3)
+    sql = """
+        SELECT msg_id, date_array[0] year, date_array[1] month, date_array[2] day
+        FROM (SELECT SLICE(SPLIT(INPUT_FILE_NAME(), '/'), -4, 3) date_array, * FROM log_meta) tbl
+    """
+    d0, d1 = datetime.date(2024, 1, 3), datetime.date(2024, 1, 1)
+    versions = []
+    for _ in range(2):
+        LocalBackend().run_stage('log_meta', sql, None, str(raw), str(tmp_path / 'stage'), d0, d1)
+        versions.append(DeltaTable(str(tmp_path / 'stage' / 'log_meta')).version())
+
+    assert versions[0] == versions[1]
+    assert DeltaReader(str(tmp_path / 'stage' / 'log_meta'), refresh_seconds=0).read(d0, d1).num_rows == 3
+
+    events = [r['event'] for r in DeltaReader(str(tmp_path / 'stage' / RAW_LEDGER_TABLE), refresh_seconds=0).read(d0, d1).to_pylist()]
+    assert sorted(events) == ['landed', 'processed']
@@ -0,0 +1,62 @@
+from spark_solutions.common.raw_validator import validate_file, iter_json_array, TimestampParser
+
+import pytest
+import gzip
+import json
+import io
+
+@pytest.mark.local
+def test_iter_json_array_chunks():
+    """
+    Test case for verifying the incremental JSON array parser.
+
+    Rows spanning several read chunks must be decoded exactly as `json.load` would.
+
+    Raises:
+    - AssertionError: If the streamed rows differ from the source rows.
+    """
+    rows = [{'msg_id': str(i), 'payload': 'x' * (i % 41)} for i in range(500)]
+    data = json.dumps(rows, indent=2).encode('utf-8')
+
+    for chunk_size in (1, 7, 4096):
+        assert list(iter_json_array(io.BytesIO(data), chunk_size)) == rows
+
+@pytest.mark.local
+def test_timestamp_parser_cache():
+    """
+    Test case for verifying the timestamp format cache of each column.
+
+    Raises:
+    - AssertionError: If the matching format isn't cached or an invalid value is accepted.
+    """
+    parser = TimestampParser()
+    parser.parse('timestamp', '2024-01-31T10:11:12')
+    assert parser._cache['timestamp'] == '%Y-%m-%dT%H:%M:%S'
+
+    parser.parse('timestamp', '2024-01-31T10:11:12.123')
+    assert parser._cache['timestamp'] == '%Y-%m-%dT%H:%M:%S.%f'
+
+    with pytest.raises(ValueError):
+        parser.parse('timestamp', '31/01/2024')
+
+@pytest.mark.local
+def test_validate_file_violations(tmp_path):
+    """
+    Test case for verifying the per file violations report.
+
+    Raises:
+    - AssertionError: If the report doesn't count the rows and violations of the file.
+    """
+    rows = [
+        {'etl_id': 'a', 'service': 's', 'mode': 'm', 'timestamp_start': '2024-01-31', 'timestamp_end': '2024-01-31T00:00:01'},
+        {'etl_id': 'b', 'service': 1, 'mode': 'm', 'timestamp_start': 'never', 'timestamp_end': None},
+        {'etl_id': 'c', 'service': 's', 'timestamp_start': None, 'timestamp_end': None}
+    ]
+    path = tmp_path / 'etl_meta.json.gz'
+    path.write_bytes(gzip.compress(json.dumps(rows).encode('utf-8')))
+
+    report = validate_file(str(path), 'etl_meta')
+    assert report.rows == 3
+    assert report.violation_count == 3
+    assert [(v['row'], v['column']) for v in report.violations] == [(1, 'service'), (1, 'timestamp_start'), (2, 'mode')]
+    assert not report.valid
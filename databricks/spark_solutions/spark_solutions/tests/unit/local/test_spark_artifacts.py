@@ -0,0 +1,31 @@
+import json
+import os
+import pytest
+
+@pytest.mark.local
+def test_spark_artifacts_cache(tmp_path):
+    """
+    Test case for verifying warm artifact caches are found by fingerprint, and missing ones fail offline.
+
+    Parameters:
+    - tmp_path (pathlib.Path): The artifact cache directory.
+
+    Raises:
+    - AssertionError: If a warm cache isn't used, or a changed coordinate reuses it.
+    """
+    from spark_solutions.common.spark_artifacts import cached_jars, fingerprint
+
+    packages = ['io.delta:delta-core_2.12:1.1.0', 'org.apache.hadoop:hadoop-aws:3.3.4']
+    repository = 'https://repo.example/maven2/'
+    key = fingerprint(packages, [], repository)
+    os.makedirs(tmp_path / key / 'jars')
+    (tmp_path / key / 'jars' / 'hadoop-aws-3.3.4.jar').write_bytes(b'')
+    (tmp_path / key / 'manifest.json').write_text(json.dumps({'jars': ['hadoop-aws-3.3.4.jar']}))
+
+    assert cached_jars(list(reversed(packages)), [], repository, str(tmp_path)) == [str(tmp_path / key / 'jars' / 'hadoop-aws-3.3.4.jar')]
+
+    changed = packages[:1] + ['org.apache.hadoop:hadoop-aws:3.3.6']
+    assert fingerprint(changed, [], repository) != key
+    assert cached_jars(changed, [], repository, str(tmp_path), offline=False) is None
+    with pytest.raises(FileNotFoundError):
+        cached_jars(changed, [], repository, str(tmp_path), offline=True)
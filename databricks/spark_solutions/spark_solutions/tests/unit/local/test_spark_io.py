@@ -0,0 +1,44 @@
+from spark_solutions.common.spark_io import IO_CONF_DIR, SparkIO
+from pathlib import Path
+
+import pytest
+
+@pytest.mark.local
+@pytest.mark.parametrize('provider, prefix', [('AWS', 'fs.s3a.'), ('AZURE', 'fs.azure.'), ('GCP', 'fs.gs.')])
+def test_spark_io_profiles(provider, prefix):
+    """
+    Test case for verifying the packaged I/O profile of each cloud provider is merged over the default profile.
+
+    Parameters:
+    - provider (str): The cloud provider.
+    - prefix (str): The property prefix of the provider's connector.
+
+    Raises:
+    - AssertionError: If a profile isn't packaged, is empty, tunes another connector, or misses the default Spark properties.
+    """
+    assert (Path(IO_CONF_DIR) / f'{provider.lower()}.yml').is_relative_to(Path(__file__).resolve().parents[3] / 'conf')
+
+    io = SparkIO(provider, enabled=True)
+    properties = io.properties()
+
+    assert io.hadoop and all(k.startswith(prefix) for k in io.hadoop)
+    assert properties['spark.speculation'] == 'true'
+    assert all(properties[f'spark.hadoop.{k}'] == SparkIO._value(v) for k, v in io.hadoop.items())
+
+@pytest.mark.local
+def test_spark_io_local(tmp_path):
+    """
+    Test case for verifying LOCAL and disabled runs apply no I/O profile, and provider profiles override the default.
+
+    Parameters:
+    - tmp_path (pathlib.Path): The profile directory.
+
+    Raises:
+    - AssertionError: If a LOCAL or disabled run has properties, or a provider property doesn't override the default.
+    """
+    (tmp_path / 'default.yml').write_text('spark:\n  spark.speculation: true\nhadoop:\n  fs.s3a.block.size: 32M\n')
+    (tmp_path / 'aws.yml').write_text('spark:\n  spark.speculation: false\nhadoop:\n  fs.s3a.block.size: 128M\n')
+
+    assert SparkIO('LOCAL', str(tmp_path), enabled=True).properties() == {}
+    assert SparkIO('AWS', str(tmp_path), enabled=False).properties() == {}
+    assert SparkIO('AWS', str(tmp_path), enabled=True).properties() == {'spark.speculation': 'false', 'spark.hadoop.fs.s3a.block.size': '128M'}
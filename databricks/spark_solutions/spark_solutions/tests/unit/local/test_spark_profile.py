@@ -0,0 +1,54 @@
+import json
+import pytest
+
+def _bundle(seconds, plan_id, stage_ms):
+    from spark_solutions.common.spark_profile import DriverProfile
+
+    profile = DriverProfile('output_game_metrics').start()
+    sorted(str(i) for i in range(20000 * seconds))
+    members = profile.stop()
+    members['run.json'] = json.dumps({'run_id': f'run-{seconds}', 'seconds': seconds, 'phases': [{'phase': 'Transform', 'seconds': seconds}]}).encode()
+    members['stages.json'] = json.dumps([{'stage_id': plan_id, 'attempt': 0, 'name': 'save at Delta', 'phase': 'Load', 'executor_run_time_ms': stage_ms}]).encode()
+    members['explain/game_metrics.txt'] = f'== Physical Plan ==\nProject [user_token#{plan_id}]\n+- Scan parquet lib_server_game'.encode()
+    return members
+
+@pytest.mark.local
+def test_spark_profile_bundle(tmp_path):
+    """
+    Test case for verifying profiling bundles round trip with their driver profiles.
+
+    Parameters:
+    - tmp_path (pathlib.Path): The bundle directory.
+
+    Raises:
+    - AssertionError: If a member is missing or changed by the archive.
+    """
+    from spark_solutions.common.spark_profile import read_bundle, write_bundle
+
+    members = _bundle(1, 12, 100)
+    assert {'driver.pstats', 'driver_profile.txt', 'tracemalloc.snapshot', 'tracemalloc.txt'} <= set(members)
+    assert b'cumulative' in members['driver_profile.txt']
+
+    write_bundle(members, str(tmp_path / 'profiles' / 'bundle.tar.gz'))
+    assert read_bundle(str(tmp_path / 'profiles' / 'bundle.tar.gz')) == members
+
+@pytest.mark.local
+def test_spark_profile_diff():
+    """
+    Test case for verifying bundle diffs report metric changes and ignore plan ids.
+
+    Raises:
+    - AssertionError: If a phase or stage change is missed, or plans differing only by ids are reported.
+    """
+    from spark_solutions.common.spark_profile import diff_bundles
+
+    old, new = _bundle(1, 12, 100), _bundle(2, 57, 150)
+    report = diff_bundles(old, new)
+
+    assert 'Phase Transform | seconds 1 -> 2 (+100.0%)' in report
+    assert 'Stage Load | save at Delta | executor_run_time_ms 100 -> 150 (+50.0%)' in report
+    assert 'Driver ' in report
+    assert 'explain/game_metrics.txt' not in report
+
+    new['explain/game_metrics.txt'] = new['explain/game_metrics.txt'].replace(b'Scan parquet', b'BroadcastHashJoin')
+    assert '+- BroadcastHashJoin lib_server_game' in diff_bundles(old, new)
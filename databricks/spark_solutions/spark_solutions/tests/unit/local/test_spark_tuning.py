@@ -0,0 +1,62 @@
+from spark_solutions.common.spark_tuning import SparkTuning
+from pathlib import Path
+
+import pytest
+
+MB = 1024**2
+
+@pytest.mark.local
+def test_spark_tuning_profile_merge(tmp_path):
+    """
+    Test case for verifying task profiles are merged over the default profile.
+
+    Raises:
+    - AssertionError: If task properties don't override the defaults or `auto` isn't left for sizing.
+    """
+    (tmp_path / 'default.yml').write_text('spark:\n  spark.sql.adaptive.enabled: true\n  spark.sql.shuffle.partitions: auto\n')
+    (tmp_path / 'task.yml').write_text('spark:\n  spark.sql.adaptive.enabled: false\nsizing:\n  shuffle_expansion: 2.0\n')
+
+    tuning = SparkTuning('task', conf_dir=str(tmp_path))
+    assert tuning.spark['spark.sql.adaptive.enabled'] is False
+    assert tuning.spark['spark.sql.shuffle.partitions'] is None
+    assert tuning.sizing['shuffle_expansion'] == 2.0
+
+@pytest.mark.local
+def test_spark_tuning_sizing(tmp_path):
+    """
+    Test case for verifying sized properties scale from a small local day to a large backfill.
+
+    Raises:
+    - AssertionError: If the sized properties aren't bounded by the parallelism and sizing limits.
+    """
+    tuning = SparkTuning('missing', conf_dir=str(tmp_path))
+
+    small = tuning.sized_properties(50 * MB, 8)
+    assert small['spark.sql.shuffle.partitions'] == 8
+    assert 4 * MB <= small['spark.sql.files.maxPartitionBytes'] < 128 * MB
+    assert small['spark.sql.autoBroadcastJoinThreshold'] == 10 * MB
+
+    large = tuning.sized_properties(500 * 1024 * MB, 256)
+    assert large['spark.sql.shuffle.partitions'] == 4000
+    assert large['spark.sql.files.maxPartitionBytes'] == 128 * MB
+    assert large['spark.sql.autoBroadcastJoinThreshold'] == 100 * MB
+
+@pytest.mark.local
+def test_spark_tuning_packaged_profiles(caplog):
+    """
+    Test case for verifying the task profiles ship with the package and missing ones are reported.
+
+    Raises:
+    - AssertionError: If a task has no packaged profile, or a missing profile isn't logged.
+    """
+    from spark_solutions.common.spark_tuning import TASK_CONF_DIR
+    from spark_solutions.tasks.backfill import TASKS
+
+    for task in [*TASKS, 'delta_maintenance']:
+        assert (Path(TASK_CONF_DIR) / f'{task}.yml').exists(), task
+
+    assert SparkTuning('output_message_flow').spark['spark.sql.autoBroadcastJoinThreshold'] == 52428800
+
+    with caplog.at_level('WARNING', logger='py4j'):
+        SparkTuning('stage_unknown')
+    assert 'stage_unknown.yml Not Found' in caplog.text
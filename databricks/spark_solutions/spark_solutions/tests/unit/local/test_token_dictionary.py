@@ -0,0 +1,105 @@
+import datetime
+import pytest
+
+@pytest.mark.local
+def test_token_id_sql():
+    """
+    Test case for verifying the translated id SQL agrees with the Python token ids.
+
+    Raises:
+    - AssertionError: If an id differs, is negative or exceeds 60 bits.
+    """
+    duckdb = pytest.importorskip('duckdb')
+    pytest.importorskip('sqlglot')
+    from spark_solutions.common.local_backend import translate
+    from spark_solutions.readers.token_dictionary import token_id, token_id_sql
+
+    tokens = ['a', 'game-0f3c', 'user-9', '']
+    con = duckdb.connect()
+    con.execute('CREATE TABLE t AS SELECT UNNEST(?) token', [tokens])
+    ids = dict(con.sql(translate(f'SELECT token, {token_id_sql("token")} id FROM t')).fetchall())
+
+    assert ids == {t: token_id(t) for t in tokens}
+    assert all(0 <= i < 2**60 for i in ids.values())
+    assert token_id(None) is None
+
+@pytest.mark.local
+def test_token_dictionary_local(tmp_path):
+    """
+    Test case for verifying stage loads merge their new tokens into the dictionary once.
+
+    Raises:
+    - AssertionError: If a rerun duplicates tokens or an id isn't translated back.
+    """
+    pytest.importorskip('duckdb')
+    pytest.importorskip('sqlglot')
+    deltalake = pytest.importorskip('deltalake')
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from spark_solutions.common.local_backend import LocalBackend
+    from spark_solutions.readers.token_dictionary import read_tokens, token_id, token_id_sql
+
+    day = tmp_path / 'standard' / 'game' / '2024' / '01' / '02'
+    day.mkdir(parents=True)
+    pq.write_table(pa.table({'game_token': ['g1', 'g1'], 'user_token': ['u1', 'u2'], 'enemy_token': ['u2', 'u1']}), day / 'part-0.parquet')
+
+    sql = f"""
+        WITH unnamed_partitions AS (
+            SELECT date_array[0] year, date_array[1] month, date_array[2] day, *
+            FROM (SELECT SLICE(SPLIT(INPUT_FILE_NAME(), '/'), -4, 3) date_array, * FROM game) tbl
+        )
+        SELECT game_token, user_token, enemy_token,
+               {token_id_sql('game_token')} game_id,
+               {token_id_sql('user_token')} user_id,
+               {token_id_sql('enemy_token')} enemy_id,
+               MIN(year) year, MIN(month) month, MIN(day) day
+        FROM unnamed_partitions
+        GROUP BY game_token, user_token, enemy_token
+    """
+    d = datetime.date(2024, 1, 2)
+    columns = ['game_token', 'user_token', 'enemy_token']
+    for _ in range(2):
+        LocalBackend().run_stage('game', sql, [], str(tmp_path / 'standard' / 'game'), str(tmp_path / 'stage'), d, d, token_columns=columns)
+
+    rows = deltalake.DeltaTable(str(tmp_path / 'stage' / 'token_dictionary')).to_pyarrow_table().to_pylist()
+    assert sorted((r['token_type'], r['token']) for r in rows) == [('game', 'g1'), ('user', 'u1'), ('user', 'u2')]
+    assert all(r['token_id'] == token_id(r['token']) and r['day'] == '02' for r in rows)
+
+    assert read_tokens([token_id('u1'), token_id('g1')], 'user', stage_dir=str(tmp_path), blob_prefix='stage') == {token_id('u1'): 'u1'}
+
+@pytest.mark.local
+def test_token_dictionary_collision(tmp_path):
+    """
+    Test case for verifying tokens sharing an id fail the load instead of being merged.
+
+    Raises:
+    - AssertionError: If a token colliding within the window or with the dictionary is loaded.
+    """
+    pytest.importorskip('duckdb')
+    pytest.importorskip('sqlglot')
+    deltalake = pytest.importorskip('deltalake')
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from spark_solutions.common.local_backend import LocalBackend
+    from spark_solutions.readers.token_dictionary import TokenCollisionError, token_id
+
+    for day, users in (('02', ['u1']), ('03', ['u2']), ('04', ['u3', 'u4'])):
+        path = tmp_path / 'standard' / 'lobby' / '2024' / '01' / day
+        path.mkdir(parents=True)
+        pq.write_table(pa.table({'user_token': users}), path / 'part-0.parquet')
+
+    # u2 takes the id of u1, u3 and u4 share one
+    sql = f"""
+        SELECT user_token,
+               CASE WHEN user_token IN ('u1', 'u2') THEN {token_id('u1')} ELSE 7 END user_id,
+               date_array[0] year, date_array[1] month, date_array[2] day
+        FROM (SELECT SLICE(SPLIT(INPUT_FILE_NAME(), '/'), -4, 3) date_array, * FROM lobby) tbl
+    """
+    backend = LocalBackend()
+    backend.run_stage('lobby', sql, [], str(tmp_path / 'standard' / 'lobby'), str(tmp_path / 'stage'), datetime.date(2024, 1, 2), datetime.date(2024, 1, 2), token_columns=['user_token'])
+    for d in (datetime.date(2024, 1, 3), datetime.date(2024, 1, 4)):
+        with pytest.raises(TokenCollisionError):
+            backend.run_stage('lobby', sql, [], str(tmp_path / 'standard' / 'lobby'), str(tmp_path / 'stage'), d, d, token_columns=['user_token'])
+
+    rows = deltalake.DeltaTable(str(tmp_path / 'stage' / 'token_dictionary')).to_pyarrow_table().to_pylist()
+    assert [r['token'] for r in rows] == ['u1']